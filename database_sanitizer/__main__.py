@@ -3,19 +3,334 @@
 from __future__ import unicode_literals
 
 import argparse
-import codecs
+import io
+import json
 import os
+import signal
+import socket
 import sys
 
-import six
+from six.moves.urllib import parse as urlparse
 
+from .batch import DEFAULT_CONCURRENCY as DEFAULT_BATCH_CONCURRENCY
+from .batch import (
+    DEFAULT_DIRECTORY_NAME,
+    DEFAULT_OUTPUT_NAME,
+    DEFAULT_RETRIES,
+    DEFAULT_RETRY_DELAY,
+    BatchRunner,
+    expand_urls,
+    format_url,
+    get_outputs,
+)
+from .benchmarks import DEFAULT_MIN_TIME, DEFAULT_SAMPLES, save_results
+from .benchmarks.strategy import (
+    DEFAULT_VALUE_LENGTH as DEFAULT_BENCH_VALUE_LENGTH,
+)
+from .benchmarks.strategy import DEFAULT_VALUES as DEFAULT_BENCH_VALUES
+from .benchmarks.strategy import format_report as format_bench_report
+from .benchmarks.strategy import (
+    make_timing_results,
+    sample_values,
+    time_sanitizers,
+)
+from .cache import DEFAULT_MAX_ENTRIES as DEFAULT_VALUE_CACHE_SIZE
+from .cache import ValueCache
+from .compress import (
+    DEFAULT_LEVELS,
+    CompressedStream,
+    get_codec_for_filename,
+    get_compressor,
+)
 from .config import Configuration
-from .dump import run
+from .dump import get_database_module, run
+from .directory import DirectoryWriter, get_run_identity
+from .dump.files import FORMATS, INDEX_EXTENSION, build_index
+from .engine import SUPPORTED_ENGINES, get_engine
+from .governor import DEFAULT_PROBE_INTERVAL, IONICE_CLASSES, SourceGovernor
+from .governor import is_command_available
+from .loader import DEFAULT_JOBS as DEFAULT_TARGET_JOBS
+from .loader import PostgresLoader
+from .metrics import DEFAULT_INTERVAL as DEFAULT_METRICS_INTERVAL
+from .metrics import FORMATS as METRICS_FORMATS
+from .metrics import MetricsWriter
+from .profiling import DEFAULT_TOP as DEFAULT_PROFILE_TOP
+from .profiling import MODES as PROFILE_MODES
+from .profiling import SanitizerProfiler
+from .progress import DEFAULT_INTERVAL as DEFAULT_PROGRESS_INTERVAL
+from .progress import FORMATS as PROGRESS_FORMATS
+from .progress import ProgressReporter
+from .restore import DEFAULT_JOBS as DEFAULT_RESTORE_JOBS
+from .restore import restore
+from .scheduler import load_statistics
+from .serve import DEFAULT_CONCURRENCY as DEFAULT_SERVE_CONCURRENCY
+from .serve import ConfigurationCache, SanitizerServer, send_request
+from .session import load_secret_file
+from .stats import RunStatistics
+from .writer import DEFAULT_BUFFER_COUNT, DEFAULT_BUFFER_SIZE, BackgroundWriter
 
 
-def main(argv=sys.argv):
-    parser = argparse.ArgumentParser(
-        prog=(argv[0] if len(argv) else "database-sanitizer"),
+def main(argv=sys.argv, config=None):
+    """
+    :param config: Configuration loaded in advance from the file given with
+                   --config, used by the runs forked by the sanitizer
+                   daemon and the batch mode.
+    :type config: database_sanitizer.config.Configuration|None
+    """
+    if len(argv) > 1 and argv[1] in COMMANDS:
+        return COMMANDS[argv[1]](argv)
+
+    parser = _create_parser(argv[0] if len(argv) else "database-sanitizer")
+    args = parser.parse_args(args=argv[1:])
+    if (args.jobs is not None or args.plan or args.incremental) and \
+            args.engine != "serial":
+        parser.error(
+            "argument --engine: cannot be combined with --jobs, --plan or "
+            "--incremental")
+    if args.target:
+        if args.output or args.compress or args.plan:
+            parser.error(
+                "argument --target: cannot be combined with --output, "
+                "--compress or --plan")
+        if urlparse.urlparse(args.target).scheme not in TARGET_SCHEMES:
+            parser.error(
+                "argument --target: only PostgreSQL databases are supported")
+        if urlparse.urlparse(args.url).scheme == "mysql":
+            parser.error("argument --target: cannot load a MySQL dump")
+    if args.output_format == "tsv":
+        if not args.output:
+            parser.error("argument --output-format: tsv requires --output")
+        if args.compress or args.target or args.plan or args.incremental:
+            parser.error(
+                "argument --output-format: tsv cannot be combined with "
+                "--compress, --target, --plan or --incremental")
+        if urlparse.urlparse(args.url).scheme not in ("mysql", "file"):
+            parser.error(
+                "argument --output-format: tsv is supported only with MySQL")
+    if args.output_format == "dir":
+        if not args.output:
+            parser.error("argument --output-format: dir requires --output")
+        if args.compress or args.target or args.plan:
+            parser.error(
+                "argument --output-format: dir cannot be combined with "
+                "--compress, --target or --plan")
+    if args.shard_size is not None:
+        if args.output_format == "sql":
+            parser.error(
+                "argument --shard-size: requires --output-format dir or tsv")
+        if args.shard_size < 1:
+            parser.error("argument --shard-size: must be positive")
+    if args.resume:
+        if args.output_format == "sql":
+            parser.error(
+                "argument --resume: requires --output-format dir or tsv")
+        if not args.secret_file:
+            parser.error("argument --resume: requires --secret-file")
+        if args.jobs is None and urlparse.urlparse(args.url).scheme != "file":
+            parser.error("argument --resume: requires a file:// URL or --jobs")
+        if args.incremental:
+            parser.error(
+                "argument --resume: cannot be combined with --incremental")
+    if args.temp_dir is not None and not os.path.isdir(args.temp_dir):
+        parser.error("argument --temp-dir: not a directory")
+    if args.max_connections is not None and args.max_connections < 1:
+        parser.error("argument --max-connections: must be positive")
+    if args.max_rows_per_second is not None and args.max_rows_per_second <= 0:
+        parser.error("argument --max-rows-per-second: must be positive")
+    if (
+        args.max_bytes_per_second is not None
+        and args.max_bytes_per_second <= 0
+    ):
+        parser.error("argument --max-bytes-per-second: must be positive")
+    if args.nice is not None and not 0 <= args.nice <= 19:
+        parser.error("argument --nice: must be between 0 and 19")
+    for command in ("nice", "ionice"):
+        if getattr(args, command) is not None and \
+                not is_command_available(command):
+            parser.error("argument --%s: command not found" % (command,))
+    if args.probe:
+        if args.probe_threshold is None:
+            parser.error("argument --probe: requires --probe-threshold")
+        if not (args.max_rows_per_second or args.max_bytes_per_second):
+            parser.error(
+                "argument --probe: requires --max-rows-per-second or "
+                "--max-bytes-per-second")
+    elif args.probe_threshold is not None:
+        parser.error("argument --probe-threshold: requires --probe")
+    if args.probe_interval <= 0:
+        parser.error("argument --probe-interval: must be positive")
+    if args.target_jobs < 1:
+        parser.error("argument --target-jobs: must be positive")
+    if args.buffer_size < 1:
+        parser.error("argument --buffer-size: must be positive")
+    if args.buffer_count < 2:
+        parser.error("argument --buffers: at least two buffers are required")
+    if args.compress_threads is not None and args.compress_threads < 1:
+        parser.error("argument --compress-threads: must be positive")
+    if args.value_cache and not args.secret_file:
+        parser.error("argument --value-cache: requires --secret-file")
+    if args.value_cache_size < 1:
+        parser.error("argument --value-cache-size: must be positive")
+    if args.progress_interval <= 0:
+        parser.error("argument --progress-interval: must be positive")
+    if args.metrics_interval <= 0:
+        parser.error("argument --metrics-interval: must be positive")
+    if args.profile_top < 1:
+        parser.error("argument --profile-top: must be positive")
+    if args.profile_output and args.profile in (None, "timing"):
+        parser.error(
+            "argument --profile-output: requires --profile sample or cprofile")
+    # Path to the output file, unless the output is a directory.
+    output_path = args.output if args.output_format == "sql" else None
+    compression = args.compress or get_codec_for_filename(output_path)
+    if compression:
+        try:
+            get_compressor(compression, args.compress_level)
+        except (RuntimeError, ValueError) as error:
+            parser.error("argument --compress: %s" % (error,))
+    stream = getattr(sys.stdout, "buffer", sys.stdout)
+
+    if args.config and config is None:
+        config = load_configuration(args.config)
+    if config and config.subset_tables:
+        # Subsets are dumped in the parallel table mode.
+        if args.engine != "serial":
+            parser.error(
+                "argument --engine: cannot be combined with a subset of the "
+                "database")
+        if args.incremental:
+            parser.error(
+                "argument --incremental: cannot be combined with a subset of "
+                "the database")
+    engine = get_engine(args.engine, workers=args.workers)
+    secret_key = None
+    if args.secret_file:
+        secret_key = load_secret_file(args.secret_file)
+    value_cache = None
+    if args.value_cache:
+        value_cache = ValueCache(args.value_cache, args.value_cache_size)
+    profiler = SanitizerProfiler(mode=args.profile) if args.profile else None
+    governor = None
+    if any(value is not None for value in (
+        args.max_connections,
+        args.max_rows_per_second,
+        args.max_bytes_per_second,
+        args.nice,
+        args.ionice,
+        args.probe,
+    )):
+        governor = SourceGovernor(
+            max_connections=args.max_connections,
+            rows_per_second=args.max_rows_per_second,
+            bytes_per_second=args.max_bytes_per_second,
+            nice=args.nice,
+            ionice=args.ionice,
+            probe=args.probe,
+            probe_threshold=args.probe_threshold,
+            probe_interval=args.probe_interval,
+        )
+    stats = RunStatistics() if args.stats or args.metrics else None
+    progress = None
+    if args.progress:
+        progress = ProgressReporter(
+            # Progress needs only the row counts of the tables.
+            stats or RunStatistics(
+                sample_interval=None, profile_interval=None),
+            sys.stderr,
+            output_format=args.progress,
+            interval=args.progress_interval,
+        )
+    metrics = None
+    if args.metrics:
+        metrics = MetricsWriter(
+            stats,
+            args.metrics,
+            metrics_format=args.metrics_format,
+            interval=args.metrics_interval,
+        )
+    if output_path:
+        stream = open(output_path, "wb")
+
+    # Streams to close after the run, outermost first.
+    streams = [stream] if output_path else []
+    output = None
+    try:
+        if args.target:
+            output = PostgresLoader(
+                urlparse.urlparse(args.target),
+                jobs=args.target_jobs,
+                buffer_size=args.buffer_size,
+                buffer_count=args.buffer_count,
+            )
+        elif args.output_format in ("dir", "tsv"):
+            if args.output_format == "tsv":
+                # Requires the MySQL support, which is optional.
+                from .load_data import LoadDataWriter as writer_class
+            else:
+                writer_class = DirectoryWriter
+            output = writer_class(
+                args.output,
+                shard_size=args.shard_size,
+                identity=get_run_identity(args.url, config, secret_key),
+                resume=args.resume,
+            )
+        else:
+            if compression:
+                stream = CompressedStream(
+                    stream,
+                    compression,
+                    level=args.compress_level,
+                    threads=args.compress_threads,
+                )
+                streams.insert(0, stream)
+            output = BackgroundWriter(
+                stream,
+                buffer_size=args.buffer_size,
+                buffer_count=args.buffer_count,
+            )
+        streams.insert(0, output)
+        run(
+            url=args.url,
+            output=output,
+            config=config,
+            engine=engine,
+            jobs=args.jobs,
+            plan=args.plan,
+            previous_stats=args.previous_stats,
+            stats=stats,
+            progress=progress,
+            metrics=metrics,
+            profiler=profiler,
+            incremental=args.incremental,
+            secret_key=secret_key,
+            value_cache=value_cache,
+            governor=governor,
+            temp_dir=args.temp_dir,
+        )
+    except BaseException:
+        # Indexes and constraints are not created for partially loaded
+        # data, and partially written directories get no manifest.
+        if hasattr(output, "abort"):
+            output.abort()
+        raise
+    finally:
+        for stream in streams:
+            stream.close()
+    if args.stats:
+        stats.save(args.stats)
+    if profiler is not None:
+        for line in profiler.format_report(args.profile_top):
+            sys.stderr.write(line + "\n")
+        if args.profile_output:
+            profiler.save(args.profile_output)
+
+
+def _create_parser(prog, parser_class=argparse.ArgumentParser):
+    """
+    Creates the parser of the command line arguments of a sanitation run.
+    """
+    parser = parser_class(
+        prog=prog,
         description="Sanitizes contents of databases.",
     )
     parser.add_argument(
@@ -35,34 +350,968 @@ def main(argv=sys.argv):
             "into. If omitted, standard output will be used instead."
         ),
     )
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        dest="output_format",
+        choices=OUTPUT_FORMATS,
+        default="sql",
+        help=(
+            "Format of the output. With \"dir\" the output is a directory "
+            "containing pre-data and post-data files, data files of each "
+            "table and a manifest, restored in parallel with the \"restore\" "
+            "command. With \"tsv\" the data files are tab separated and "
+            "loaded with LOAD DATA, supported with MySQL. Defaults to "
+            "\"sql\"."
+        ),
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        dest="shard_size",
+        metavar="BYTES",
+        help=(
+            "Maximum size of a data file in bytes with --output-format dir "
+            "or tsv, after which the data of the table continues in a new "
+            "file. By default the data of each table is written into a "
+            "single file."
+        ),
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        dest="resume",
+        help=(
+            "Resume an interrupted run writing into the --output directory "
+            "with --output-format dir or tsv. Tables completed by it are "
+            "reused instead of being dumped again, which requires a dump "
+            "file or --jobs, and the same --secret-file and configuration."
+        ),
+    )
+    parser.add_argument(
+        "--target",
+        type=str,
+        dest="target",
+        metavar="URL",
+        help=(
+            "Load the sanitized dump straight into given PostgreSQL "
+            "database instead of writing it into the output. Indexes and "
+            "constraints are created after the table data has been loaded."
+        ),
+    )
+    parser.add_argument(
+        "--target-jobs",
+        type=int,
+        dest="target_jobs",
+        default=DEFAULT_TARGET_JOBS,
+        help=(
+            "Number of tables loaded into the target database concurrently, "
+            "each in its own connection. Defaults to %d." % (
+                DEFAULT_TARGET_JOBS,)
+        ),
+    )
+    parser.add_argument(
+        "--engine",
+        "-e",
+        type=str,
+        dest="engine",
+        choices=sorted(SUPPORTED_ENGINES),
+        default="serial",
+        help=(
+            "Engine used to sanitize the table data. With \"process\" the "
+            "data is sanitized in multiple worker processes, with "
+            "\"hybrid\" only the expensive columns are sanitized in worker "
+            "processes. Defaults to \"serial\"."
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        dest="workers",
+        help=(
+            "Number of worker processes used by the parallel engines. "
+            "Defaults to number of CPUs."
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        dest="jobs",
+        help=(
+            "Dump and sanitize the tables in parallel with given number of "
+            "worker processes, each using its own database connection. "
+            "Cannot be combined with --engine."
+        ),
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        dest="plan",
+        help=(
+            "Output the order in which the tables would be dumped in the "
+            "parallel table mode, and the estimated load of each job, "
+            "instead of the dump."
+        ),
+    )
+    parser.add_argument(
+        "--previous-stats",
+        type=str,
+        dest="previous_stats",
+        help=(
+            "Path to statistics file of a previous run, used instead of the "
+            "table size estimates of the database when planning the "
+            "parallel table mode."
+        ),
+    )
+    parser.add_argument(
+        "--incremental",
+        type=str,
+        dest="incremental",
+        metavar="DIRECTORY",
+        help=(
+            "Keep sanitized data of each table in given cache directory, "
+            "and reuse it on the next runs for the tables which have not "
+            "changed since. Implies the parallel table mode. The directory "
+            "also contains the session secret, which must be kept safe."
+        ),
+    )
+    parser.add_argument(
+        "--temp-dir",
+        type=str,
+        dest="temp_dir",
+        metavar="DIRECTORY",
+        help=(
+            "Directory where the parallel table mode writes the sanitized "
+            "data of the tables until it is copied into the output. "
+            "Defaults to the temporary directory of the system."
+        ),
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        dest="max_connections",
+        metavar="CONNECTIONS",
+        help=(
+            "Maximum number of worker processes of the parallel table mode "
+            "connected to the source database concurrently. Lowers --jobs "
+            "if necessary."
+        ),
+    )
+    parser.add_argument(
+        "--max-rows-per-second",
+        type=float,
+        dest="max_rows_per_second",
+        metavar="ROWS",
+        help=(
+            "Maximum number of rows read from the source database per "
+            "second, in total of all the worker processes."
+        ),
+    )
+    parser.add_argument(
+        "--max-bytes-per-second",
+        type=float,
+        dest="max_bytes_per_second",
+        metavar="BYTES",
+        help=(
+            "Maximum number of bytes of the dump read from the source "
+            "database per second, in total of all the worker processes."
+        ),
+    )
+    parser.add_argument(
+        "--nice",
+        type=int,
+        dest="nice",
+        help=(
+            "Run the dump commands with given niceness between 0 and 19, "
+            "lowering their CPU priority."
+        ),
+    )
+    parser.add_argument(
+        "--ionice",
+        type=str,
+        dest="ionice",
+        choices=list(IONICE_CLASSES),
+        help="Run the dump commands with given I/O scheduling class.",
+    )
+    parser.add_argument(
+        "--probe",
+        type=str,
+        dest="probe",
+        metavar="COMMAND",
+        help=(
+            "Shell command run periodically, which outputs a number such as "
+            "the replication lag or latency of the source database. When "
+            "it exceeds --probe-threshold or the command fails, the rate "
+            "limits are lowered until it recovers. Requires "
+            "--max-rows-per-second or --max-bytes-per-second."
+        ),
+    )
+    parser.add_argument(
+        "--probe-threshold",
+        type=float,
+        dest="probe_threshold",
+        metavar="VALUE",
+        help="Threshold of the number output by --probe.",
+    )
+    parser.add_argument(
+        "--probe-interval",
+        type=float,
+        dest="probe_interval",
+        metavar="SECONDS",
+        default=DEFAULT_PROBE_INTERVAL,
+        help="Interval between runs of --probe in seconds. Defaults to %s." % (
+            DEFAULT_PROBE_INTERVAL,),
+    )
+    parser.add_argument(
+        "--secret-file",
+        type=str,
+        dest="secret_file",
+        help=(
+            "Path to file containing a fixed session secret as hexadecimal "
+            "digits, so that values are hashed the same way in every run. "
+            "The file is generated if it does not exist."
+        ),
+    )
+    parser.add_argument(
+        "--value-cache",
+        type=str,
+        dest="value_cache",
+        help=(
+            "Path to file where sanitized values of the columns listed "
+            "under config.cached_columns are cached between runs. Requires "
+            "--secret-file."
+        ),
+    )
+    parser.add_argument(
+        "--value-cache-size",
+        type=int,
+        dest="value_cache_size",
+        default=DEFAULT_VALUE_CACHE_SIZE,
+        help=(
+            "Maximum number of values in the value cache, after which the "
+            "least recently used ones are evicted. Defaults to %d." % (
+                DEFAULT_VALUE_CACHE_SIZE,)
+        ),
+    )
+    parser.add_argument(
+        "--stats",
+        type=str,
+        dest="stats",
+        help=(
+            "Path to JSON file where statistics of the run will be written "
+            "into: rows, sizes and time of each table, calls, errors and "
+            "time of each sanitizer, and time spent on dumping, parsing, "
+            "sanitizing and writing."
+        ),
+    )
+    parser.add_argument(
+        "--progress",
+        type=str,
+        dest="progress",
+        nargs="?",
+        const="auto",
+        choices=PROGRESS_FORMATS,
+        help=(
+            "Report progress of the run into standard error, as a progress "
+            "bar or as JSON lines. Defaults to a progress bar when standard "
+            "error is a terminal, and JSON lines otherwise."
+        ),
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        dest="progress_interval",
+        default=DEFAULT_PROGRESS_INTERVAL,
+        help=(
+            "Interval between the progress reports in seconds. Defaults to "
+            "%s." % (DEFAULT_PROGRESS_INTERVAL,)
+        ),
+    )
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        dest="metrics",
+        help=(
+            "Path to file where metrics of the run will be written into "
+            "periodically and at the end of the run, e.g. for the textfile "
+            "collector of node_exporter."
+        ),
+    )
+    parser.add_argument(
+        "--metrics-format",
+        type=str,
+        dest="metrics_format",
+        choices=METRICS_FORMATS,
+        default="openmetrics",
+        help="Format of the metrics file. Defaults to \"openmetrics\".",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        dest="metrics_interval",
+        default=DEFAULT_METRICS_INTERVAL,
+        help=(
+            "Interval between writes of the metrics file in seconds. "
+            "Defaults to %s." % (DEFAULT_METRICS_INTERVAL,)
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        dest="profile",
+        nargs="?",
+        const="sample",
+        choices=PROFILE_MODES,
+        help=(
+            "Profile the sanitizers and report the slowest columns into "
+            "standard error at the end of the run. Every call is timed, and "
+            "in addition either the stacks are sampled (\"sample\", the "
+            "default) or the calls are profiled with cProfile "
+            "(\"cprofile\"). Use with the serial engine."
+        ),
+    )
+    parser.add_argument(
+        "--profile-top",
+        type=int,
+        dest="profile_top",
+        default=DEFAULT_PROFILE_TOP,
+        help="Number of the slowest columns to report. Defaults to %d." % (
+            DEFAULT_PROFILE_TOP,),
+    )
+    parser.add_argument(
+        "--profile-output",
+        type=str,
+        dest="profile_output",
+        help=(
+            "Path to file where collapsed stacks for flame graphs, or "
+            "cProfile statistics readable with pstats, will be written into."
+        ),
+    )
+    parser.add_argument(
+        "--buffer-size",
+        type=int,
+        dest="buffer_size",
+        default=DEFAULT_BUFFER_SIZE,
+        help=(
+            "Size of a single output buffer in bytes. Defaults to %d."
+            % (DEFAULT_BUFFER_SIZE,)
+        ),
+    )
+    parser.add_argument(
+        "--buffers",
+        type=int,
+        dest="buffer_count",
+        metavar="BUFFERS",
+        default=DEFAULT_BUFFER_COUNT,
+        help=(
+            "Number of output buffers, which are written into the output "
+            "in a background thread. Defaults to %d." % (DEFAULT_BUFFER_COUNT,)
+        ),
+    )
+    parser.add_argument(
+        "--compress",
+        type=str,
+        dest="compress",
+        choices=sorted(DEFAULT_LEVELS),
+        help=(
+            "Compress the output with given codec in multiple threads. If "
+            "omitted, the codec is selected by extension of the output "
+            "file (.gz, .zst or .lz4)."
+        ),
+    )
+    parser.add_argument(
+        "--compress-level",
+        type=int,
+        dest="compress_level",
+        help="Compression level. Defaults to the default level of the codec.",
+    )
+    parser.add_argument(
+        "--compress-threads",
+        type=int,
+        dest="compress_threads",
+        help="Number of compression threads. Defaults to number of CPUs.",
+    )
     parser.add_argument(
         "url",
-        help="Database URL to which to connect into and sanitize contents.",
+        help=(
+            "Database URL to which to connect into and sanitize contents, "
+            "or file:// URL of an existing dump file to sanitize."
+        ),
     )
+    return parser
 
-    args = parser.parse_args(args=argv[1:])
-    output = sys.stdout
-    if six.PY2:
-        output = codecs.getwriter("utf-8")(output)
-    config = None
 
-    if args.config:
-        conf_dir = os.path.realpath(os.path.dirname(args.config))
+def load_configuration(path):
+    """
+    Loads the configuration from given file, making the modules next to it
+    importable by the sanitizers.
+
+    :type path: str
+    :rtype: database_sanitizer.config.Configuration
+    """
+    conf_dir = os.path.realpath(os.path.dirname(path))
+    if conf_dir not in sys.path:
         sys.path.insert(0, conf_dir)
-        config = Configuration.from_file(args.config)
+    return Configuration.from_file(path)
+
+
+def main_index(argv):
+    parser = argparse.ArgumentParser(
+        prog="%s index" % (argv[0],),
+        description=(
+            "Scans a dump file for table data and saves the offsets into an "
+            "index file, used by later sanitations of the dump instead of "
+            "scanning it again."
+        ),
+    )
+    parser.add_argument(
+        "--format",
+        "-f",
+        type=str,
+        dest="format",
+        choices=sorted(FORMATS),
+        help="Format of the dump. If omitted, it is detected from the dump.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        dest="output",
+        help=(
+            "Path to the index file. Defaults to path of the dump file with "
+            "\"%s\" appended." % (INDEX_EXTENSION,)
+        ),
+    )
+    parser.add_argument("path", help="Path to the dump file.")
+
+    args = parser.parse_args(args=argv[2:])
+    build_index(args.path, dump_format=args.format, index_path=args.output)
+
+
+def main_bench(argv):
+    parser = argparse.ArgumentParser(
+        prog="%s bench" % (argv[0],),
+        description=(
+            "Times the sanitizers of a configuration over sampled or "
+            "generated values, projects the sanitation time of each table "
+            "from its row estimate and suggests optimizations."
+        ),
+    )
+    parser.add_argument(
+        "--config",
+        "-c",
+        type=str,
+        dest="config",
+        required=True,
+        help="Path to the sanitizer configuration file.",
+    )
+    parser.add_argument(
+        "--sample",
+        type=str,
+        dest="sample",
+        help=(
+            "file:// URL of a dump file from which the input values are "
+            "read. Values are generated for the columns missing from the "
+            "dump, or for all of the columns if omitted."
+        ),
+    )
+    parser.add_argument(
+        "--url",
+        type=str,
+        dest="url",
+        help=(
+            "Database URL from whose catalog the row estimates of the tables "
+            "are read."
+        ),
+    )
+    parser.add_argument(
+        "--previous-stats",
+        type=str,
+        dest="previous_stats",
+        help=(
+            "Path to statistics file of a previous run, whose row counts are "
+            "used instead of the estimates of the database."
+        ),
+    )
+    parser.add_argument(
+        "--values",
+        type=int,
+        dest="values",
+        default=DEFAULT_BENCH_VALUES,
+        help="Number of input values per sanitizer. Defaults to %d." % (
+            DEFAULT_BENCH_VALUES,),
+    )
+    parser.add_argument(
+        "--value-length",
+        type=int,
+        dest="value_length",
+        default=DEFAULT_BENCH_VALUE_LENGTH,
+        help=(
+            "Length of the generated text values, used for columns not "
+            "recognized from their names. Defaults to %d." % (
+                DEFAULT_BENCH_VALUE_LENGTH,)
+        ),
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        dest="samples",
+        default=DEFAULT_SAMPLES,
+        help="Number of samples per sanitizer. Defaults to %d." % (
+            DEFAULT_SAMPLES,),
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        dest="min_time",
+        default=DEFAULT_MIN_TIME,
+        help="Minimum duration of a sample in seconds. Defaults to %s." % (
+            DEFAULT_MIN_TIME,),
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        dest="output",
+        help=(
+            "Path to the JSON file where the results will be written into, "
+            "comparable with \"python -m database_sanitizer.benchmarks "
+            "compare\"."
+        ),
+    )
+
+    args = parser.parse_args(args=argv[2:])
+    if args.values < 1 or args.samples < 1:
+        parser.error("number of values and samples must be positive")
+    config = load_configuration(args.config)
+
+    estimates = {}
+    if args.url:
+        parsed_url = urlparse.urlparse(args.url)
+        db_module = get_database_module(parsed_url)
+        if not hasattr(db_module, "get_table_sizes"):
+            parser.error(
+                "argument --url: row estimates are not supported with '%s' "
+                "URLs" % (parsed_url.scheme,))
+        # Tables are reported by their names only, without the schema.
+        for table in db_module.get_table_sizes(parsed_url, config):
+            estimates[table.table] = estimates.get(table.table, 0) + table.rows
+    if args.previous_stats:
+        for (table, (_size, rows)) in load_statistics(
+                args.previous_stats).items():
+            estimates[table] = rows
+    sampled = None
+    if args.sample:
+        sampled = sample_values(args.sample, config, count=args.values)
+
+    timings = time_sanitizers(
+        config,
+        sampled=sampled,
+        count=args.values,
+        length=args.value_length,
+        samples=args.samples,
+        min_time=args.min_time,
+    )
+    for line in format_bench_report(timings, estimates):
+        sys.stdout.write(line + "\n")
     if args.output:
-        output = open(args.output, "w")
+        save_results(args.output, make_timing_results(timings))
+
 
+def main_restore(argv):
+    parser = argparse.ArgumentParser(
+        prog="%s restore" % (argv[0],),
+        description=(
+            "Restores a directory written with --output-format dir or tsv "
+            "into a database, loading the data files concurrently."
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        dest="jobs",
+        default=DEFAULT_RESTORE_JOBS,
+        help="Number of data files loaded concurrently. Defaults to %d." % (
+            DEFAULT_RESTORE_JOBS,),
+    )
+    parser.add_argument(
+        "--no-verify",
+        action="store_false",
+        dest="verify",
+        help="Skip verifying the checksums of the files before restoring.",
+    )
+    parser.add_argument("directory", help="Path to the directory.")
+    parser.add_argument("url", help="URL of the target database.")
+
+    args = parser.parse_args(args=argv[2:])
+    if args.jobs < 1:
+        parser.error("argument --jobs: must be positive")
+    restore(
+        args.directory,
+        urlparse.urlparse(args.url),
+        jobs=args.jobs,
+        verify=args.verify,
+    )
+
+
+def main_batch(argv):
+    parser = argparse.ArgumentParser(
+        prog="%s batch" % (argv[0],),
+        description=(
+            "Sanitizes many databases with the same configuration, each "
+            "into its own output, a bounded number of them concurrently. "
+            "Glob patterns in the names of the databases are matched "
+            "against the databases of the server. Writes the result of each "
+            "database into standard output as a JSON line, and exits with a "
+            "non-zero status if any of them failed. Arguments of the "
+            "sanitation runs, except --output, --target and the URL, are "
+            "given after \"--\"."
+        ),
+    )
+    parser.add_argument(
+        "--output-dir",
+        "-d",
+        type=str,
+        dest="output_dir",
+        required=True,
+        help="Path to the directory where the outputs will be written into.",
+    )
+    parser.add_argument(
+        "--output-name",
+        type=str,
+        dest="output_name",
+        help=(
+            "Name of the output of a database, in which {database} is "
+            "replaced by name of the database and {host} by host name of "
+            "the server. Defaults to \"%s\", or \"%s\" with --output-format "
+            "dir or tsv." % (DEFAULT_OUTPUT_NAME, DEFAULT_DIRECTORY_NAME)
+        ),
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        dest="concurrency",
+        default=DEFAULT_BATCH_CONCURRENCY,
+        help="Number of databases sanitized concurrently. Defaults to %d." % (
+            DEFAULT_BATCH_CONCURRENCY,),
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        dest="retries",
+        default=DEFAULT_RETRIES,
+        help=(
+            "Number of times a failed database is retried. Defaults to "
+            "%d." % (DEFAULT_RETRIES,)
+        ),
+    )
+    parser.add_argument(
+        "--retry-delay",
+        type=float,
+        dest="retry_delay",
+        default=DEFAULT_RETRY_DELAY,
+        help=(
+            "Delay before the first retry in seconds, doubled on each "
+            "retry. Defaults to %g." % (DEFAULT_RETRY_DELAY,)
+        ),
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        dest="report",
+        help=(
+            "Path to file where the report of the batch will be written "
+            "into as JSON, updated whenever a database has been finished."
+        ),
+    )
+    parser.add_argument(
+        "--urls-file",
+        type=str,
+        dest="urls_file",
+        help="Path to file listing URLs of the databases, one per line.",
+    )
+    parser.add_argument(
+        "urls",
+        nargs="*",
+        help=(
+            "URLs of the databases, or file:// URLs of dump files, which may "
+            "contain glob patterns."
+        ),
+    )
+
+    # Arguments of the sanitation runs follow "--", which argparse would
+    # otherwise take as URLs.
+    batch_args = argv[2:]
+    run_args = []
+    if "--" in batch_args:
+        separator = batch_args.index("--")
+        run_args = batch_args[separator + 1:]
+        batch_args = batch_args[:separator]
+    args = parser.parse_args(args=batch_args)
+    if args.concurrency < 1:
+        parser.error("argument --concurrency: must be positive")
+    if args.retries < 0:
+        parser.error("argument --retries: cannot be negative")
+    if args.retry_delay < 0:
+        parser.error("argument --retry-delay: cannot be negative")
+    urls = list(args.urls)
+    if args.urls_file:
+        with io.open(args.urls_file, "r", encoding="utf-8") as stream:
+            urls.extend(
+                line.strip() for line in stream
+                if line.strip() and not line.startswith("#"))
+    if not urls:
+        parser.error("URLs of the databases are required")
+    if run_args and run_args[0] in COMMANDS:
+        parser.error("cannot run the %s command" % (run_args[0],))
     try:
-        run(
-            url=args.url,
-            output=output,
-            config=config,
+        run_options = _create_parser(argv[0], _JobArgumentParser).parse_args(
+            run_args + [urls[0]])
+    except ValueError as error:
+        parser.error("invalid arguments of the sanitation runs: %s" % (error,))
+    if run_options.output or run_options.target:
+        parser.error(
+            "arguments of the sanitation runs cannot contain --output or "
+            "--target")
+    output_name = args.output_name
+    if output_name is None:
+        output_name = DEFAULT_OUTPUT_NAME
+        if run_options.output_format in ("dir", "tsv"):
+            output_name = DEFAULT_DIRECTORY_NAME
+    try:
+        urls = expand_urls(urls)
+        outputs = get_outputs(urls, args.output_dir, output_name)
+    except ValueError as error:
+        parser.error("%s" % (error,))
+    except (KeyError, IndexError) as error:
+        parser.error("invalid output name: %s" % (error,))
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    # The configuration is loaded once, and inherited by the forked runs.
+    config = None
+    if run_options.config:
+        try:
+            config = load_configuration(run_options.config)
+        except Exception as error:
+            parser.error("cannot load configuration %s: %s" % (
+                run_options.config, error))
+
+    def run_job(job_args):
+        return main([argv[0]] + job_args, config=config)
+
+    def write_result(result):
+        sys.stdout.write(json.dumps(result) + "\n")
+        sys.stdout.flush()
+
+    runner = BatchRunner(
+        run_job,
+        concurrency=args.concurrency,
+        retries=args.retries,
+        retry_delay=args.retry_delay,
+        report=args.report,
+        on_finished=write_result,
+    )
+    results = runner.run([
+        (
+            format_url(url),
+            run_args + ["--output", output, url],
+            # Retries continue from the journal of a resumed output.
+            None if run_options.resume else output,
         )
-    finally:
-        if args.output:
-            output.close()
+        for (url, output) in zip(urls, outputs)
+    ])
+    if any(result["state"] == "failed" for result in results):
+        sys.exit(1)
+
+
+def main_serve(argv):
+    parser = argparse.ArgumentParser(
+        prog="%s serve" % (argv[0],),
+        description=(
+            "Runs a daemon which accepts sanitation jobs through a Unix "
+            "socket and runs them concurrently, keeping the configurations "
+            "loaded between the jobs. Configuration files are reloaded when "
+            "they change, but the daemon must be restarted when sanitizer "
+            "modules change."
+        ),
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        dest="concurrency",
+        default=DEFAULT_SERVE_CONCURRENCY,
+        help="Number of jobs run concurrently. Defaults to %d." % (
+            DEFAULT_SERVE_CONCURRENCY,),
+    )
+    parser.add_argument("socket", help="Path of the Unix socket to listen on.")
+
+    args = parser.parse_args(args=argv[2:])
+    if args.concurrency < 1:
+        parser.error("argument --concurrency: must be positive")
+    configs = ConfigurationCache(load_configuration)
+
+    def prepare_job(job_args, cwd):
+        if job_args and job_args[0] in COMMANDS:
+            raise ValueError("Jobs cannot run the %s command" % (job_args[0],))
+        job = _create_parser(argv[0], _JobArgumentParser).parse_args(job_args)
+        if not (job.output or job.target):
+            raise ValueError("Jobs require --output or --target")
+        if not job.config:
+            return None
+        try:
+            return configs.get(os.path.join(cwd, job.config))
+        except Exception as error:
+            raise ValueError("Cannot load configuration %s: %s" % (
+                job.config, error))
+
+    def run_job(job_args, config):
+        return main([argv[0]] + job_args, config=config)
+
+    try:
+        server = SanitizerServer(
+            args.socket,
+            run_job,
+            prepare_job=prepare_job,
+            concurrency=args.concurrency,
+        )
+    except ValueError as error:
+        parser.error("%s" % (error,))
+    signal.signal(signal.SIGTERM, _exit_on_signal)
+    try:
+        server.serve_forever()
+    except ValueError as error:
+        parser.error("%s" % (error,))
+    except KeyboardInterrupt:
+        pass
+
+
+def main_submit(argv):
+    parser = argparse.ArgumentParser(
+        prog="%s submit" % (argv[0],),
+        description=(
+            "Submits a sanitation job to the daemon started with the serve "
+            "command, and writes its events into standard output as JSON "
+            "lines until it has finished. Exits with a non-zero status if "
+            "the job fails."
+        ),
+    )
+    parser.add_argument(
+        "--socket",
+        "-s",
+        type=str,
+        dest="socket",
+        required=True,
+        help="Path of the Unix socket of the daemon.",
+    )
+    parser.add_argument(
+        "--no-wait",
+        action="store_false",
+        dest="wait",
+        help="Exit once the job has been queued.",
+    )
+    parser.add_argument(
+        "args",
+        nargs=argparse.REMAINDER,
+        help=(
+            "Arguments of the sanitation run, after \"--\". Relative paths "
+            "are relative to the current directory, and the run requires "
+            "--output or --target."
+        ),
+    )
+
+    args = parser.parse_args(args=argv[2:])
+    job_args = args.args[1:] if args.args[:1] == ["--"] else args.args
+    if not job_args:
+        parser.error("arguments of the sanitation run are required")
+    failed = False
+    for event in _send_daemon_request(parser, args.socket, {
+        "command": "submit",
+        "args": job_args,
+        "cwd": os.getcwd(),
+        "wait": args.wait,
+    }):
+        sys.stdout.write(json.dumps(event) + "\n")
+        sys.stdout.flush()
+        if event["event"] in ("rejected", "error") or \
+                event.get("state") == "failed":
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+def main_status(argv):
+    parser = argparse.ArgumentParser(
+        prog="%s status" % (argv[0],),
+        description=(
+            "Writes the status of the daemon started with the serve "
+            "command and its jobs into standard output as JSON."
+        ),
+    )
+    parser.add_argument(
+        "--socket",
+        "-s",
+        type=str,
+        dest="socket",
+        required=True,
+        help="Path of the Unix socket of the daemon.",
+    )
+
+    args = parser.parse_args(args=argv[2:])
+    for event in _send_daemon_request(
+            parser, args.socket, {"command": "status"}):
+        sys.stdout.write(json.dumps(event) + "\n")
+
+
+def _send_daemon_request(parser, path, request):
+    try:
+        for event in send_request(path, request):
+            yield event
+    except socket.error as error:
+        parser.error("cannot connect to the daemon at %s: %s" % (path, error))
+
+
+def _exit_on_signal(signum, frame):
+    # Outputs of the runs are aborted cleanly, and the terminated jobs of
+    # the daemon are reported as failed.
+    sys.exit(128 + signum)
+
+
+class _JobArgumentParser(argparse.ArgumentParser):
+    """
+    Parser of the arguments of the daemon jobs, which raises ValueError
+    instead of writing into the standard streams of the daemon and exiting.
+    """
+    def error(self, message):
+        raise ValueError(message)
+
+    def exit(self, status=0, message=None):
+        raise ValueError(message or "Jobs cannot show the help")
+
+    def print_help(self, file=None):
+        pass
+
+
+#: Formats of the output.
+OUTPUT_FORMATS = ("sql", "dir", "tsv")
+
+#: Schemes of the database URLs supported by --target.
+TARGET_SCHEMES = ("postgres", "postgresql", "postgis")
 
+#: Subcommands, mapped by their names. Without a subcommand the database or
+#: dump file given as an URL is sanitized.
+COMMANDS = {
+    "batch": main_batch,
+    "bench": main_bench,
+    "index": main_index,
+    "restore": main_restore,
+    "serve": main_serve,
+    "status": main_status,
+    "submit": main_submit,
+}
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+"""
+Batch mode, which sanitizes many databases sharing the same schema and
+configuration, such as the databases of the tenants of a service.
+
+Glob patterns in the names of the databases are matched against the
+databases of the server, and those in the paths of `file://` URLs against
+the files. The configuration is loaded once, and each database is then
+sanitized into its own output in a process forked from the batch, a
+bounded number of them at a time. Failed runs are retried after a delay
+which doubles on each attempt, and a failure of one database does not
+affect the others.
+
+The outcome of each database is collected into a report, which is written
+as JSON whenever a database has been finished, so it can be followed
+while the batch is running.
+"""
+
+from __future__ import unicode_literals
+
+import fnmatch
+import glob
+import io
+import json
+import os
+import re
+import select
+import shutil
+import signal
+import time
+import timeit
+from collections import OrderedDict, deque
+
+from six.moves.urllib import parse as urlparse
+
+from .dump import get_database_module
+from .dump.files import get_path
+from .serve import LOG_TAIL_LINES, decode_log_line, fork_job, wait_for_job
+
+#: Default number of databases sanitized concurrently.
+DEFAULT_CONCURRENCY = 4
+
+#: Default number of times a failed database is retried.
+DEFAULT_RETRIES = 2
+
+#: Default delay before the first retry in seconds.
+DEFAULT_RETRY_DELAY = 5.0
+
+#: Number of bytes read from standard error of a job at once.
+READ_SIZE = 64 * 1024
+
+#: Default names of the outputs, for output files and output directories.
+DEFAULT_OUTPUT_NAME = "{database}.sql"
+DEFAULT_DIRECTORY_NAME = "{database}"
+
+#: Characters which make a name a glob pattern.
+GLOB_CHARACTERS = re.compile(r"[*?\[]")
+
+#: Extensions removed from the names of dump files to name the databases.
+DUMP_FILE_EXTENSION = re.compile(r"(\.(sql|dump|gz|zst|lz4))+$")
+
+
+def expand_urls(urls):
+    """
+    Expands glob patterns in names of the databases, or paths of `file://`
+    URLs, into URLs of the matching databases or files.
+
+    :type urls: list[str]
+
+    :return: URLs in the given order, the matches of each pattern sorted by
+             name, without duplicates.
+    :rtype: list[str]
+    """
+    expanded = []
+    for url in urls:
+        parsed_url = urlparse.urlparse(url)
+        if parsed_url.scheme == "file":
+            pattern = get_path(parsed_url)
+            if not GLOB_CHARACTERS.search(pattern):
+                expanded.append(url)
+                continue
+            matches = [
+                urlparse.urlunparse(parsed_url._replace(
+                    netloc="",
+                    path=urlparse.quote(os.path.abspath(path)),
+                ))
+                for path in sorted(glob.glob(pattern))
+            ]
+        else:
+            pattern = get_database_name(url)
+            if not GLOB_CHARACTERS.search(pattern):
+                expanded.append(url)
+                continue
+            db_module = get_database_module(parsed_url)
+            matches = [
+                parsed_url._replace(path="/" + urlparse.quote(name)).geturl()
+                for name in sorted(fnmatch.filter(
+                    db_module.list_databases(parsed_url), pattern))
+            ]
+        if not matches:
+            raise ValueError("No databases match %s" % (
+                format_url(url),))
+        expanded.extend(matches)
+    return list(OrderedDict.fromkeys(expanded))
+
+
+def get_database_name(url):
+    """
+    :return: Name of the database of given URL, or name of the dump file
+             without its extensions.
+    :rtype: str
+    """
+    parsed_url = urlparse.urlparse(url)
+    if parsed_url.scheme == "file":
+        return DUMP_FILE_EXTENSION.sub(
+            "", os.path.basename(get_path(parsed_url)))
+    return urlparse.unquote(parsed_url.path[1:])
+
+
+def format_url(url):
+    """
+    :return: Given URL without the credentials, for the reports.
+    :rtype: str
+    """
+    parsed_url = urlparse.urlparse(url)
+    return parsed_url._replace(
+        netloc=parsed_url.netloc.rpartition("@")[2]).geturl()
+
+
+def get_outputs(urls, directory, name=DEFAULT_OUTPUT_NAME):
+    """
+    Names the outputs of the databases.
+
+    :type urls: list[str]
+
+    :param directory: Directory of the outputs.
+    :type directory: str
+
+    :param name: Name of an output, in which "{database}" is replaced by
+                 name of the database and "{host}" by host name of the
+                 server.
+    :type name: str
+
+    :return: Paths of the outputs, in the order of the URLs.
+    :rtype: list[str]
+    """
+    outputs = []
+    for url in urls:
+        database = get_database_name(url)
+        if not database or database in (".", "..") or "/" in database:
+            raise ValueError("Cannot name the output of %s" % (
+                format_url(url),))
+        outputs.append(os.path.join(directory, name.format(
+            database=database,
+            host=urlparse.urlparse(url).hostname or "",
+        )))
+    duplicates = set(
+        output for output in outputs if outputs.count(output) > 1)
+    if duplicates:
+        raise ValueError("Several databases would be written into %s" % (
+            ", ".join(sorted(duplicates)),))
+    return outputs
+
+
+def remove_output(path):
+    """
+    Removes output of a failed run, which is either a file or a directory.
+
+    :type path: str
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class BatchRunner(object):
+    """
+    Sanitizes many databases concurrently, each in a forked process.
+
+    The processes are forked, read and waited for by the thread calling
+    `run` alone, since a process forked while other threads are running
+    would inherit the locks held by them, such as the import lock, in
+    their locked state.
+    """
+    def __init__(
+        self,
+        run_job,
+        concurrency=DEFAULT_CONCURRENCY,
+        retries=DEFAULT_RETRIES,
+        retry_delay=DEFAULT_RETRY_DELAY,
+        report=None,
+        on_finished=None,
+        sleep=time.sleep,
+        timer=timeit.default_timer,
+    ):
+        """
+        :param run_job: Function which sanitizes a database in the forked
+                        process, given the command line arguments of the
+                        run, and returns its exit status or None.
+        :type run_job: callable
+
+        :param concurrency: Number of databases sanitized concurrently.
+        :type concurrency: int
+
+        :param retries: Number of times a failed database is retried.
+        :type retries: int
+
+        :param retry_delay: Delay before the first retry in seconds, which
+                            is doubled on each retry.
+        :type retry_delay: float
+
+        :param report: Path to file where the report is written into.
+        :type report: str|None
+
+        :param on_finished: Function called with the result of each
+                            database once it has been finished.
+        :type on_finished: callable|None
+
+        :param sleep: Function sleeping given number of seconds.
+
+        :param timer: Function returning the current time in seconds, by
+                      which the retries are scheduled.
+        """
+        if concurrency < 1:
+            raise ValueError("Number of concurrent databases must be positive")
+        if retries < 0:
+            raise ValueError("Number of retries cannot be negative")
+        self.run_job = run_job
+        self.concurrency = concurrency
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.report = report
+        self.on_finished = on_finished
+        self.sleep = sleep
+        self.timer = timer
+        self.results = []
+        self.started = None
+
+    def run(self, jobs):
+        """
+        Sanitizes the databases.
+
+        :param jobs: URLs of the databases without credentials, command line
+                     arguments of their runs, and paths of their outputs,
+                     which are removed before retrying a failed run, or
+                     None if the retries resume the output.
+        :type jobs: list[tuple[str,list[str],str|None]]
+
+        :return: Results of the databases, in the given order.
+        :rtype: list[dict]
+        """
+        self.started = time.time()
+        self.results = [
+            OrderedDict([
+                ("url", url),
+                ("state", "queued"),
+                ("attempts", 0),
+                ("returncode", None),
+                ("started", None),
+                ("finished", None),
+                ("log", []),
+            ])
+            for (url, _args, _output) in jobs
+        ]
+        self._write_report()
+        queued = deque(
+            _BatchJob(result, args, output)
+            for (result, (_url, args, output)) in zip(self.results, jobs)
+        )
+        # Failed jobs waiting for their retries, and the running jobs
+        # mapped by the file descriptors of their standard error.
+        retrying = []
+        running = {}
+        try:
+            while queued or retrying or running:
+                now = self.timer()
+                while len(running) < self.concurrency:
+                    due = [job for job in retrying if job.retry_at <= now]
+                    if due:
+                        job = min(due, key=lambda job: job.retry_at)
+                        retrying.remove(job)
+                    elif queued:
+                        job = queued.popleft()
+                    else:
+                        break
+                    self._start_job(job)
+                    running[job.fd] = job
+                timeout = None
+                if retrying:
+                    timeout = max(
+                        min(job.retry_at for job in retrying) - now, 0)
+                if not running:
+                    self.sleep(timeout)
+                    continue
+                (readable, _writable, _errors) = select.select(
+                    list(running), [], [], timeout)
+                for fd in readable:
+                    job = running[fd]
+                    if self._read_log(job):
+                        continue
+                    del running[fd]
+                    returncode = self._wait_for_job(job)
+                    if returncode != 0 and job.attempts <= self.retries:
+                        job.retry_at = self.timer() + (
+                            self.retry_delay * 2 ** (job.attempts - 1))
+                        retrying.append(job)
+                    else:
+                        self._finish_job(job, returncode)
+        finally:
+            for job in running.values():
+                os.kill(job.pid, signal.SIGTERM)
+                os.close(job.fd)
+                wait_for_job(job.pid)
+        return self.results
+
+    def get_report(self):
+        """
+        :return: Results of the databases, together with their counts by
+                 state.
+        :rtype: dict
+        """
+        results = [OrderedDict(result) for result in self.results]
+        counts = OrderedDict(
+            (state, sum(1 for result in results if result["state"] == state))
+            for state in ("queued", "running", "succeeded", "failed")
+        )
+        return OrderedDict(
+            [("started", self.started), ("databases", len(results))]
+            + list(counts.items())
+            + [("results", results)]
+        )
+
+    def _start_job(self, job):
+        if job.attempts:
+            if job.output is not None:
+                remove_output(job.output)
+            job.log.append("Retrying, attempt %d" % (job.attempts + 1,))
+        else:
+            job.result["state"] = "running"
+            job.result["started"] = time.time()
+        job.attempts += 1
+        (job.pid, job.fd) = fork_job(self.run_job, job.args, os.getcwd())
+
+    def _read_log(self, job):
+        """
+        Reads the lines written into standard error by a job.
+
+        :return: False once the job has closed its standard error.
+        :rtype: bool
+        """
+        data = os.read(job.fd, READ_SIZE)
+        if not data:
+            # The last line may not have been terminated.
+            if job.partial_line:
+                job.log.append(decode_log_line(job.partial_line))
+            return False
+        lines = (job.partial_line + data).split(b"\n")
+        job.partial_line = lines.pop()
+        for line in lines:
+            job.log.append(decode_log_line(line))
+        return True
+
+    def _wait_for_job(self, job):
+        os.close(job.fd)
+        returncode = wait_for_job(job.pid)
+        job.result["attempts"] = job.attempts
+        job.result["returncode"] = returncode
+        return returncode
+
+    def _finish_job(self, job, returncode):
+        job.result["state"] = "succeeded" if returncode == 0 else "failed"
+        job.result["finished"] = time.time()
+        job.result["log"] = list(job.log)
+        self._write_report()
+        if self.on_finished is not None:
+            self.on_finished(OrderedDict(job.result))
+
+    def _write_report(self):
+        if self.report is None:
+            return
+        report = self.get_report()
+        temporary_path = self.report + ".tmp"
+        with io.open(temporary_path, "w", encoding="utf-8") as stream:
+            stream.write(json.dumps(report, indent=2) + "\n")
+        os.rename(temporary_path, self.report)
+
+
+class _BatchJob(object):
+    """
+    State of a database of a batch between its attempts.
+    """
+    def __init__(self, result, args, output):
+        self.result = result
+        self.args = args
+        self.output = output
+        self.attempts = 0
+        self.log = deque(maxlen=LOG_TAIL_LINES)
+        self.retry_at = None
+        self.pid = None
+        self.fd = None
+        self.partial_line = b""
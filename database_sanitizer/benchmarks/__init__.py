@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmarks of the hot paths of the sanitation.
+
+A benchmark is a function processing a fixed batch of items, e.g. values
+or lines of a dump. It is timed in samples, each of which calls the
+function enough times in a loop to make timer resolution insignificant,
+and the results are recorded as seconds per item. Results of two runs,
+saved as JSON, can be compared to catch performance regressions.
+
+Run the benchmarks with ``python -m database_sanitizer.benchmarks``.
+"""
+
+from __future__ import division, unicode_literals
+
+import json
+import platform
+import re
+import timeit
+from collections import namedtuple
+
+#: Benchmark which calls ``function`` to process ``items`` items at once.
+Benchmark = namedtuple("Benchmark", ("name", "function", "items"))
+
+#: Comparison of a benchmark between two runs, as median seconds per item.
+#: ``change`` is the relative change of the time, e.g. 0.1 when the new run
+#: is 10% slower.
+Comparison = namedtuple("Comparison", ("name", "old", "new", "change"))
+
+#: Version of the results file format.
+RESULTS_VERSION = 1
+
+#: Default number of samples recorded per benchmark.
+DEFAULT_SAMPLES = 5
+
+#: Default minimum duration of a single sample in seconds.
+DEFAULT_MIN_TIME = 0.1
+
+#: Default relative slowdown considered as a regression.
+DEFAULT_THRESHOLD = 0.1
+
+
+def time_benchmark(
+    benchmark,
+    samples=DEFAULT_SAMPLES,
+    min_time=DEFAULT_MIN_TIME,
+):
+    """
+    Times given benchmark.
+
+    :type benchmark: Benchmark
+
+    :param samples: Number of samples to record.
+    :type samples: int
+
+    :param min_time: Minimum duration of a single sample in seconds.
+    :type min_time: float
+
+    :return: Number of calls per sample, and seconds per item of each
+             sample.
+    :rtype: tuple[int,list[float]]
+    """
+    function = benchmark.function
+    timer = timeit.default_timer
+
+    def run(loops):
+        start = timer()
+        for _ in range(loops):
+            function()
+        return timer() - start
+
+    # Calibration, which also warms up the benchmark.
+    loops = 1
+    while run(loops) < min_time and loops < 2 ** 30:
+        loops *= 2
+
+    values = [
+        run(loops) / (loops * benchmark.items)
+        for _ in range(samples)
+    ]
+    return (loops, values)
+
+
+def run_benchmarks(
+    benchmarks,
+    samples=DEFAULT_SAMPLES,
+    min_time=DEFAULT_MIN_TIME,
+    callback=None,
+):
+    """
+    Times given benchmarks.
+
+    :type benchmarks: list[Benchmark]
+
+    :param samples: Number of samples to record per benchmark.
+    :type samples: int
+
+    :param min_time: Minimum duration of a single sample in seconds.
+    :type min_time: float
+
+    :param callback: Optional function called with name and median seconds
+                     per item of each benchmark when it has been timed.
+    :type callback: Callable[[str, float], None]|None
+
+    :return: Results, in the format written by `save_results`.
+    :rtype: dict
+    """
+    results = {}
+    for benchmark in benchmarks:
+        (loops, values) = time_benchmark(benchmark, samples, min_time)
+        results[benchmark.name] = {
+            "items": benchmark.items,
+            "loops": loops,
+            "values": values,
+        }
+        if callback:
+            callback(benchmark.name, median(values))
+    return make_results(results)
+
+
+def make_results(benchmarks):
+    """
+    Constructs results of a run in the format written by `save_results`.
+
+    :param benchmarks: Results of each benchmark, mapped by their names.
+                       Each should contain number of items processed per
+                       call ("items"), number of calls per sample ("loops")
+                       and seconds per item of each sample ("values").
+    :type benchmarks: dict[str,dict]
+
+    :rtype: dict
+    """
+    return {
+        "version": RESULTS_VERSION,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "benchmarks": benchmarks,
+    }
+
+
+def filter_benchmarks(benchmarks, pattern=None):
+    """
+    :type benchmarks: list[Benchmark]
+
+    :param pattern: Regular expression searched from the benchmark names,
+                    or None to select all of the benchmarks.
+    :type pattern: str|None
+
+    :rtype: list[Benchmark]
+    """
+    if not pattern:
+        return list(benchmarks)
+    regex = re.compile(pattern)
+    return [
+        benchmark for benchmark in benchmarks
+        if regex.search(benchmark.name)
+    ]
+
+
+def save_results(filename, results):
+    """
+    :param filename: Path to the results file.
+    :type filename: str
+
+    :param results: Results returned by `run_benchmarks`.
+    :type results: dict
+    """
+    with open(filename, "w") as stream:
+        json.dump(results, stream, indent=2, sort_keys=True)
+
+
+def load_results(filename):
+    """
+    :param filename: Path to a results file written by `save_results`.
+    :type filename: str
+
+    :rtype: dict
+    """
+    with open(filename, "r") as stream:
+        results = json.load(stream)
+    if not isinstance(results, dict) or \
+            results.get("version") != RESULTS_VERSION:
+        raise ValueError(
+            "Unsupported benchmark results file: '%s'" % (filename,))
+    return results
+
+
+def compare_results(old, new):
+    """
+    Compares median times of the benchmarks present in both of the given
+    results.
+
+    :type old: dict
+    :type new: dict
+    :rtype: list[Comparison]
+    """
+    comparisons = []
+    for name in sorted(old["benchmarks"]):
+        if name not in new["benchmarks"]:
+            continue
+        old_time = median(old["benchmarks"][name]["values"])
+        new_time = median(new["benchmarks"][name]["values"])
+        comparisons.append(Comparison(
+            name=name,
+            old=old_time,
+            new=new_time,
+            change=(new_time / old_time - 1.0) if old_time else 0.0,
+        ))
+    return comparisons
+
+
+def format_comparisons(comparisons, threshold=DEFAULT_THRESHOLD):
+    """
+    Formats given comparisons into human readable lines, marking the
+    regressions.
+
+    :type comparisons: list[Comparison]
+
+    :param threshold: Relative slowdown considered as a regression.
+    :type threshold: float
+
+    :rtype: list[str]
+    """
+    name_width = max([len("Benchmark")] + [len(c.name) for c in comparisons])
+    lines = ["%-*s  %10s  %10s  %8s" % (
+        name_width, "Benchmark", "Old", "New", "Change")]
+    for comparison in comparisons:
+        lines.append("%-*s  %10s  %10s  %+7.1f%%%s" % (
+            name_width,
+            comparison.name,
+            format_duration(comparison.old),
+            format_duration(comparison.new),
+            comparison.change * 100,
+            "  REGRESSION" if comparison.change > threshold else "",
+        ))
+    return lines
+
+
+def format_duration(seconds):
+    """
+    :type seconds: float
+    :rtype: str
+    """
+    for (unit, scale) in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return "%.3g %s" % (seconds / scale, unit)
+    return "%.3g ns" % (seconds / 1e-9,)
+
+
+def median(values):
+    """
+    :type values: list[float]
+    :rtype: float
+    """
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import sys
+
+from . import (
+    DEFAULT_MIN_TIME,
+    DEFAULT_SAMPLES,
+    DEFAULT_THRESHOLD,
+    compare_results,
+    filter_benchmarks,
+    format_comparisons,
+    format_duration,
+    load_results,
+    run_benchmarks,
+    save_results,
+)
+from ..engine import SUPPORTED_ENGINES
+from .micro import get_benchmarks
+from .throughput import (
+    DUMP_TOOLS,
+    format_measurement,
+    generate_dump,
+    get_table_specs,
+    run_throughput,
+)
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=(argv[0] if len(argv) else "database_sanitizer.benchmarks"),
+        description=(
+            "Runs microbenchmarks of the parsers, codecs and built-in "
+            "sanitizers or end-to-end throughput measurements, or compares "
+            "results of two runs."
+        ),
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks.")
+    run_parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        dest="output",
+        help="Path to the JSON file where the results will be written into.",
+    )
+    run_parser.add_argument(
+        "--filter",
+        "-k",
+        type=str,
+        dest="filter",
+        help="Run only benchmarks whose names match given regular expression.",
+    )
+    run_parser.add_argument(
+        "--samples",
+        type=int,
+        dest="samples",
+        default=DEFAULT_SAMPLES,
+        help="Number of samples per benchmark. Defaults to %d." % (
+            DEFAULT_SAMPLES,),
+    )
+    run_parser.add_argument(
+        "--min-time",
+        type=float,
+        dest="min_time",
+        default=DEFAULT_MIN_TIME,
+        help="Minimum duration of a sample in seconds. Defaults to %s." % (
+            DEFAULT_MIN_TIME,),
+    )
+
+    compare_parser = subparsers.add_parser(
+        "compare",
+        help=(
+            "Compare results of two runs. Exits with status 1 if any of the "
+            "benchmarks has regressed."
+        ),
+    )
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        dest="threshold",
+        default=DEFAULT_THRESHOLD * 100,
+        help=(
+            "Slowdown in percents considered as a regression. Defaults to "
+            "%d." % (DEFAULT_THRESHOLD * 100,)
+        ),
+    )
+    compare_parser.add_argument("old", help="Results of the baseline run.")
+    compare_parser.add_argument("new", help="Results of the new run.")
+
+    generate_parser = subparsers.add_parser(
+        "generate", help="Generate a synthetic dump.")
+    generate_parser.add_argument(
+        "--format",
+        "-f",
+        type=str,
+        dest="format",
+        choices=sorted(DUMP_TOOLS),
+        default="postgres",
+        help="Format of the dump. Defaults to \"postgres\".",
+    )
+    add_dump_arguments(generate_parser)
+    generate_parser.add_argument(
+        "output", help="Path to the file where the dump will be written into.")
+
+    throughput_parser = subparsers.add_parser(
+        "throughput",
+        help=(
+            "Measure end-to-end throughput against synthetic dumps, replayed "
+            "by stub dump utilities."
+        ),
+    )
+    throughput_parser.add_argument(
+        "--format",
+        "-f",
+        type=str,
+        dest="formats",
+        action="append",
+        choices=sorted(DUMP_TOOLS),
+        help="Format of the dumps. May be repeated. Defaults to all formats.",
+    )
+    throughput_parser.add_argument(
+        "--engine",
+        "-e",
+        type=str,
+        dest="engines",
+        action="append",
+        choices=sorted(SUPPORTED_ENGINES),
+        help="Engine to measure. May be repeated. Defaults to all engines.",
+    )
+    throughput_parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        dest="workers",
+        help="Number of worker processes of the parallel engines.",
+    )
+    throughput_parser.add_argument(
+        "--repeat",
+        type=int,
+        dest="repeat",
+        default=3,
+        help="Number of runs per format and engine. Defaults to 3.",
+    )
+    add_dump_arguments(throughput_parser)
+    throughput_parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        dest="output",
+        help="Path to the JSON file where the results will be written into.",
+    )
+    throughput_parser.add_argument(
+        "--baseline",
+        type=str,
+        dest="baseline",
+        help=(
+            "Results of a previous run to compare with. Exits with status 1 "
+            "if throughput has dropped more than the threshold."
+        ),
+    )
+    throughput_parser.add_argument(
+        "--threshold",
+        type=float,
+        dest="threshold",
+        default=DEFAULT_THRESHOLD * 100,
+        help=(
+            "Drop of throughput in percents considered as a regression. "
+            "Defaults to %d." % (DEFAULT_THRESHOLD * 100,)
+        ),
+    )
+
+    args = parser.parse_args(args=argv[1:])
+    if args.command in ("generate", "throughput"):
+        if args.tables < 1 or args.columns < 1 or args.rows < 1:
+            parser.error("number of tables, columns and rows must be positive")
+        tables = get_table_specs(
+            args.tables,
+            args.columns,
+            args.rows,
+            null_ratio=args.null_ratio,
+            escape_ratio=args.escape_ratio,
+        )
+
+    if args.command == "generate":
+        with open(args.output, "wb") as stream:
+            generate_dump(stream, args.format, tables, seed=args.seed)
+        return 0
+
+    if args.command == "throughput":
+        results = run_throughput(
+            dump_formats=args.formats or sorted(DUMP_TOOLS),
+            engines=args.engines or sorted(SUPPORTED_ENGINES),
+            tables=tables,
+            workers=args.workers,
+            repeat=args.repeat,
+            seed=args.seed,
+            callback=lambda measurement: print(
+                format_measurement(measurement)),
+        )
+        if args.output:
+            save_results(args.output, results)
+        if not args.baseline:
+            return 0
+        # Throughput is recorded as time per row, so a drop of throughput by
+        # the threshold equals an increase of time by this much.
+        threshold = 1 / (1 - args.threshold / 100) - 1
+        comparisons = compare_results(load_results(args.baseline), results)
+        print("")
+        for line in format_comparisons(comparisons, threshold):
+            print(line)
+        return int(any(c.change > threshold for c in comparisons))
+
+    if args.command == "compare":
+        threshold = args.threshold / 100
+        comparisons = compare_results(
+            load_results(args.old), load_results(args.new))
+        for line in format_comparisons(comparisons, threshold):
+            print(line)
+        return int(any(c.change > threshold for c in comparisons))
+
+    def report(name, seconds):
+        print("%-50s %10s per item" % (name, format_duration(seconds)))
+
+    benchmarks = filter_benchmarks(get_benchmarks(), args.filter)
+    results = run_benchmarks(
+        benchmarks,
+        samples=args.samples,
+        min_time=args.min_time,
+        callback=report,
+    )
+    if args.output:
+        save_results(args.output, results)
+    return 0
+
+
+def add_dump_arguments(parser):
+    """
+    Adds arguments describing a synthetic dump into given parser.
+
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument(
+        "--tables",
+        type=int,
+        dest="tables",
+        default=4,
+        help="Number of tables. Defaults to 4.",
+    )
+    parser.add_argument(
+        "--columns",
+        type=int,
+        dest="columns",
+        default=10,
+        help="Number of columns per table. Defaults to 10.",
+    )
+    parser.add_argument(
+        "--rows",
+        type=int,
+        dest="rows",
+        default=100000,
+        help="Number of rows per table. Defaults to 100000.",
+    )
+    parser.add_argument(
+        "--null-ratio",
+        type=float,
+        dest="null_ratio",
+        default=0.1,
+        help="Probability of a value being NULL. Defaults to 0.1.",
+    )
+    parser.add_argument(
+        "--escape-ratio",
+        type=float,
+        dest="escape_ratio",
+        default=0.05,
+        help=(
+            "Probability of a character of text values being one which has "
+            "to be escaped. Defaults to 0.05."
+        ),
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        dest="seed",
+        default=0,
+        help="Seed of the random values. Defaults to 0.",
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
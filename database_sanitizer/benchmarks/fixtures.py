@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Generators of realistic inputs for the benchmarks.
+
+All of the generators take a `random.Random` instance, so that the inputs
+are the same on every run when it has been seeded with the same value.
+"""
+
+from __future__ import unicode_literals
+
+import uuid
+
+from six.moves import range
+
+from ..utils.mysql import encode_mysql_literal
+from ..utils.postgres import encode_copy_value
+
+#: Names with characters outside of ASCII.
+UNICODE_NAMES = (
+    "Åsa Ström",
+    "Jürgen Müller-Lüdenscheidt",
+    "María José Núñez",
+    "Łukasz Żółkiewski",
+    "Øyvind Sæther",
+    "Ngô Bảo Châu",
+    "Дмитрий Иванов",
+    "Σωκράτης Παπαδόπουλος",
+    "山田 太郎",
+    "Siobhán O'Sullivan",
+)
+
+#: Characters which have to be escaped in dumps.
+ESCAPED_CHARACTERS = "\\\t\n\r'\"\x08\x0c\x0b"
+
+#: Characters which do not have to be escaped in dumps.
+PLAIN_CHARACTERS = "abcdefghijklmnopqrstuvwxyz ABCDEFGHIJ0123456789,.-äöü€"
+
+
+def generate_name(rng):
+    """
+    :type rng: random.Random
+    :rtype: str
+    """
+    return rng.choice(UNICODE_NAMES)
+
+
+def generate_email(rng):
+    """
+    :type rng: random.Random
+    :rtype: str
+    """
+    local = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz.") for _ in range(
+        rng.randint(5, 20))).strip(".") or "user"
+    return "%s%d@example.com" % (local, rng.randint(1, 9999))
+
+
+def generate_uuid(rng):
+    """
+    :type rng: random.Random
+    :rtype: str
+    """
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def generate_text(rng, length, escape_ratio=0.0):
+    """
+    Generates text, part of which consists from characters which have to be
+    escaped in dumps.
+
+    :type rng: random.Random
+
+    :param length: Length of the text.
+    :type length: int
+
+    :param escape_ratio: Probability of each character being one which has
+                         to be escaped.
+    :type escape_ratio: float
+
+    :rtype: str
+    """
+    text = "".join(
+        rng.choice(
+            ESCAPED_CHARACTERS if rng.random() < escape_ratio
+            else PLAIN_CHARACTERS)
+        for _ in range(length - 1)
+    )
+    # The text never ends with a backslash, since `decode_mysql_literal`
+    # does not recognize string literals ending with an escaped backslash.
+    return text + rng.choice(PLAIN_CHARACTERS) if length else text
+
+
+def generate_row(rng, columns, null_ratio=0.1, escape_ratio=0.05):
+    """
+    Generates values of a table row. The columns are of various types,
+    repeating in the order: integer, name, email, text and decimal.
+
+    :type rng: random.Random
+
+    :param columns: Number of columns.
+    :type columns: int
+
+    :param null_ratio: Probability of each value being NULL.
+    :type null_ratio: float
+
+    :param escape_ratio: Probability of each character of the text values
+                         being one which has to be escaped.
+    :type escape_ratio: float
+
+    :rtype: list[any]
+    """
+    values = []
+    for column in range(columns):
+        kind = column % 5
+        if column and rng.random() < null_ratio:
+            values.append(None)
+        elif kind == 0:
+            values.append(rng.randint(1, 2 ** 31))
+        elif kind == 1:
+            values.append(generate_name(rng))
+        elif kind == 2:
+            values.append(generate_email(rng))
+        elif kind == 3:
+            values.append(
+                generate_text(rng, rng.randint(10, 200), escape_ratio))
+        else:
+            values.append(round(rng.uniform(0, 10000), 2))
+    return values
+
+
+def get_column_names(columns):
+    """
+    :param columns: Number of columns.
+    :type columns: int
+
+    :return: Names of the columns of rows generated by `generate_row`.
+    :rtype: tuple[str]
+    """
+    kinds = ("id", "name", "email", "notes", "amount")
+    return tuple(
+        "%s_%d" % (kinds[column % 5], column) for column in range(columns))
+
+
+def generate_copy_line(rng, columns, null_ratio=0.1, escape_ratio=0.05):
+    """
+    Generates a data line following `COPY` statement of a `pg_dump` output.
+
+    :type rng: random.Random
+    :type columns: int
+    :type null_ratio: float
+    :type escape_ratio: float
+    :rtype: str
+    """
+    return "\t".join(
+        encode_copy_value(None if value is None else "%s" % (value,))
+        for value in generate_row(rng, columns, null_ratio, escape_ratio)
+    )
+
+
+def generate_values_text(
+    rng,
+    rows,
+    columns,
+    null_ratio=0.1,
+    escape_ratio=0.05,
+):
+    """
+    Generates values of an extended `INSERT INTO` statement of a
+    `mysqldump` output.
+
+    :type rng: random.Random
+
+    :param rows: Number of rows in the statement.
+    :type rows: int
+
+    :type columns: int
+    :type null_ratio: float
+    :type escape_ratio: float
+    :rtype: str
+    """
+    return ",".join(
+        "(" + ",".join(
+            encode_mysql_literal(value)
+            for value in generate_row(rng, columns, null_ratio, escape_ratio)
+        ) + ")"
+        for _ in range(rows)
+    )
+
+
+def generate_insert_line(
+    rng,
+    table,
+    rows,
+    columns,
+    null_ratio=0.1,
+    escape_ratio=0.05,
+):
+    """
+    Generates an extended `INSERT INTO` statement of a `mysqldump` output.
+
+    :type rng: random.Random
+    :type table: str
+    :type rows: int
+    :type columns: int
+    :type null_ratio: float
+    :type escape_ratio: float
+    :rtype: str
+    """
+    return "INSERT INTO `%s` (%s) VALUES %s;" % (
+        table,
+        ", ".join("`%s`" % (name,) for name in get_column_names(columns)),
+        generate_values_text(rng, rows, columns, null_ratio, escape_ratio),
+    )
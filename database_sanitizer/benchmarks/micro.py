@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmarks of the parsers, codecs and built-in sanitizers.
+"""
+
+from __future__ import unicode_literals
+
+import importlib
+import inspect
+import pkgutil
+import random
+
+from six.moves import range
+
+from . import Benchmark, fixtures
+from .. import sanitizers, session
+from ..config import Configuration
+from ..dump import mysql as dump_mysql
+from ..dump import postgres as dump_postgres
+from ..sanitizers import string as string_sanitizers
+from ..sanitizers import user as user_sanitizers
+from ..utils import mysql as utils_mysql
+from ..utils import postgres as utils_postgres
+
+#: Number of values processed by a single call of the value benchmarks.
+VALUE_BATCH_SIZE = 100
+
+#: Number of columns of the wide table fixtures.
+WIDE_TABLE_COLUMNS = 50
+
+#: Number of rows in the extended `INSERT INTO` statement fixtures.
+INSERT_ROWS = 500
+
+#: Secret key used by the benchmarks, so that the hashes are the same on
+#: every run.
+SECRET_KEY = b"benchmark-secret-key"
+
+
+def get_benchmarks(seed=0):
+    """
+    Constructs the microbenchmarks.
+
+    :param seed: Seed of the random inputs.
+    :type seed: int
+
+    :rtype: list[Benchmark]
+    """
+    session.reset(SECRET_KEY)
+    rng = random.Random(seed)
+    benchmarks = []
+    benchmarks.extend(get_codec_benchmarks(rng))
+    benchmarks.extend(get_parser_benchmarks(rng))
+    benchmarks.extend(get_session_benchmarks(rng))
+    benchmarks.extend(get_sanitizer_benchmarks(rng))
+    return benchmarks
+
+
+def map_values(function, values):
+    """
+    Constructs a benchmark function applying given function into each of
+    the given values.
+    """
+    def run():
+        for value in values:
+            function(value)
+    return run
+
+
+def get_codec_benchmarks(rng):
+    """
+    :type rng: random.Random
+    :rtype: list[Benchmark]
+    """
+    plain_text = [
+        fixtures.generate_text(rng, 100) for _ in range(VALUE_BATCH_SIZE)]
+    escaped_text = [
+        fixtures.generate_text(rng, 100, escape_ratio=0.2)
+        for _ in range(VALUE_BATCH_SIZE)
+    ]
+    encoded_plain_text = [
+        utils_postgres.encode_copy_value(value) for value in plain_text]
+    encoded_escaped_text = [
+        utils_postgres.encode_copy_value(value) for value in escaped_text]
+    mysql_literals = [
+        utils_mysql.encode_mysql_literal(value)
+        for value in fixtures.generate_row(rng, VALUE_BATCH_SIZE)
+    ]
+    mysql_escaped_literals = [
+        utils_mysql.encode_mysql_literal(value) for value in escaped_text]
+
+    return [
+        Benchmark(
+            "postgres.decode_copy_value.plain",
+            map_values(utils_postgres.decode_copy_value, encoded_plain_text),
+            VALUE_BATCH_SIZE,
+        ),
+        Benchmark(
+            "postgres.decode_copy_value.escaped",
+            map_values(utils_postgres.decode_copy_value, encoded_escaped_text),
+            VALUE_BATCH_SIZE,
+        ),
+        Benchmark(
+            "postgres.encode_copy_value.plain",
+            map_values(utils_postgres.encode_copy_value, plain_text),
+            VALUE_BATCH_SIZE,
+        ),
+        Benchmark(
+            "postgres.encode_copy_value.escaped",
+            map_values(utils_postgres.encode_copy_value, escaped_text),
+            VALUE_BATCH_SIZE,
+        ),
+        Benchmark(
+            "mysql.decode_mysql_literal.mixed",
+            map_values(utils_mysql.decode_mysql_literal, mysql_literals),
+            VALUE_BATCH_SIZE,
+        ),
+        Benchmark(
+            "mysql.decode_mysql_literal.escaped",
+            map_values(
+                utils_mysql.decode_mysql_literal, mysql_escaped_literals),
+            VALUE_BATCH_SIZE,
+        ),
+    ]
+
+
+def get_benchmark_config(table, columns):
+    """
+    Constructs configuration sanitizing the name, email and text columns of
+    given wide table fixture.
+
+    :type table: str
+    :type columns: tuple[str]
+    :rtype: Configuration
+    """
+    config = Configuration()
+    for column in columns:
+        if column.startswith("name_"):
+            sanitizer = user_sanitizers.sanitize_full_name_en_gb
+        elif column.startswith("email_"):
+            sanitizer = user_sanitizers.sanitize_email
+        elif column.startswith("notes_"):
+            sanitizer = string_sanitizers.sanitize_zfill
+        else:
+            continue
+        config.sanitizers["%s.%s" % (table, column)] = sanitizer
+    return config
+
+
+def get_parser_benchmarks(rng):
+    """
+    :type rng: random.Random
+    :rtype: list[Benchmark]
+    """
+    columns = fixtures.get_column_names(WIDE_TABLE_COLUMNS)
+    config = get_benchmark_config("wide", columns)
+
+    copy_lines = [
+        fixtures.generate_copy_line(rng, WIDE_TABLE_COLUMNS)
+        for _ in range(VALUE_BATCH_SIZE)
+    ]
+    copy_line_sanitizer = dump_postgres.get_value_line_sanitizer(
+        config, "wide", columns)
+
+    values_text = fixtures.generate_values_text(
+        rng, INSERT_ROWS, WIDE_TABLE_COLUMNS)
+    insert_line = fixtures.generate_insert_line(
+        rng, "wide", INSERT_ROWS, WIDE_TABLE_COLUMNS)
+    insert_line_sanitizer = dump_mysql.get_value_line_sanitizer(
+        config, "wide", columns)
+
+    def parse_values():
+        for _ in dump_mysql.parse_values(values_text):
+            pass
+
+    return [
+        Benchmark(
+            "postgres.parse_values.wide",
+            map_values(dump_postgres.parse_values, copy_lines),
+            VALUE_BATCH_SIZE,
+        ),
+        Benchmark(
+            "postgres.value_line_sanitizer.wide",
+            map_values(copy_line_sanitizer, copy_lines),
+            VALUE_BATCH_SIZE,
+        ),
+        Benchmark(
+            "mysql.parse_values.extended_insert",
+            parse_values,
+            INSERT_ROWS,
+        ),
+        Benchmark(
+            "mysql.value_line_sanitizer.extended_insert",
+            lambda: insert_line_sanitizer(insert_line),
+            INSERT_ROWS,
+        ),
+    ]
+
+
+def get_session_benchmarks(rng):
+    """
+    :type rng: random.Random
+    :rtype: list[Benchmark]
+    """
+    values = [
+        fixtures.generate_email(rng) for _ in range(VALUE_BATCH_SIZE)]
+    return [
+        Benchmark(
+            "session.hash_text",
+            map_values(session.hash_text, values),
+            VALUE_BATCH_SIZE,
+        ),
+        Benchmark(
+            "session.hash_text_to_int",
+            map_values(session.hash_text_to_int, values),
+            VALUE_BATCH_SIZE,
+        ),
+        Benchmark(
+            "session.hash_text_to_ints",
+            map_values(session.hash_text_to_ints, values),
+            VALUE_BATCH_SIZE,
+        ),
+    ]
+
+
+def iter_builtin_sanitizers():
+    """
+    Finds the built-in sanitizers, i.e. functions of the modules of
+    `database_sanitizer.sanitizers` whose names start with "sanitize_".
+
+    :return: Module names and names of the sanitizers, together with the
+             sanitizers.
+    :rtype: collections.Iterator[tuple[str,str,callable]]
+    """
+    for (_finder, module_name, _is_package) in sorted(
+            pkgutil.iter_modules(sanitizers.__path__), key=lambda m: m[1]):
+        module = importlib.import_module(
+            "%s.%s" % (sanitizers.__name__, module_name))
+        for (name, function) in sorted(inspect.getmembers(
+                module, inspect.isfunction)):
+            if name.startswith("sanitize_") and \
+                    function.__module__ == module.__name__:
+                yield (module_name, name, function)
+
+
+def get_sanitizer_benchmarks(rng):
+    """
+    :type rng: random.Random
+    :rtype: list[Benchmark]
+    """
+    # Inputs mixing the kinds of values the sanitizers are typically
+    # configured for.
+    generators = (
+        fixtures.generate_name,
+        fixtures.generate_email,
+        fixtures.generate_uuid,
+    )
+    values = [
+        generators[index % len(generators)](rng)
+        for index in range(VALUE_BATCH_SIZE)
+    ]
+    return [
+        Benchmark(
+            "sanitizers.%s.%s" % (module_name, name),
+            map_values(function, values),
+            VALUE_BATCH_SIZE,
+        )
+        for (module_name, name, function) in iter_builtin_sanitizers()
+    ]
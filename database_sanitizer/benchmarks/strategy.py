@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the sanitizers of a configuration.
+
+Each sanitizer of the strategy is timed over input values sampled from a
+dump file, or generated to resemble the values of its column, and the
+cost per row of each table is projected into total sanitation time with
+the row estimates of the database catalog or of a previous run.
+"""
+
+from __future__ import division, unicode_literals
+
+import random
+from collections import namedtuple
+
+import six
+from six.moves import range
+from six.moves.urllib import parse as urlparse
+
+from . import (
+    DEFAULT_MIN_TIME,
+    DEFAULT_SAMPLES,
+    Benchmark,
+    fixtures,
+    format_duration,
+    make_results,
+    median,
+    time_benchmark,
+)
+from .. import session
+from ..dump.files import get_backend, get_path, open_dump_file, scan
+from ..engine.hybrid import DEFAULT_COST_THRESHOLD
+from ..profiling import get_function_name
+from .micro import SECRET_KEY, map_values
+
+#: Timing of the sanitizer of a single column. ``seconds`` is the median
+#: time per value, ``deterministic`` tells whether the sanitizer returned
+#: the same values on a second pass and ``duplicate_ratio`` is the share of
+#: the input values which are repeated. ``hints`` are names of the
+#: optimizations the sanitizer would benefit from.
+SanitizerTiming = namedtuple("SanitizerTiming", (
+    "column",
+    "sanitizer",
+    "values",
+    "errors",
+    "loops",
+    "samples",
+    "seconds",
+    "deterministic",
+    "duplicate_ratio",
+    "hints",
+))
+
+#: Default number of input values per sanitizer.
+DEFAULT_VALUES = 1000
+
+#: Default length of the generated text values.
+DEFAULT_VALUE_LENGTH = 24
+
+#: Minimum share of repeated input values for which caching the sanitized
+#: values is suggested.
+CACHE_DUPLICATE_RATIO = 0.1
+
+#: Minimum time per value in seconds for which caching the sanitized values
+#: is suggested, as cheaper sanitizers are not much slower than a lookup.
+CACHE_MIN_TIME = 1e-6
+
+#: Generators of the input values, chosen by the first fragment found from
+#: name of the column.
+GENERATORS = (
+    ("email", fixtures.generate_email),
+    ("name", fixtures.generate_name),
+    ("uuid", fixtures.generate_uuid),
+    ("guid", fixtures.generate_uuid),
+)
+
+
+def generate_values(
+    rng,
+    column,
+    count=DEFAULT_VALUES,
+    length=DEFAULT_VALUE_LENGTH,
+):
+    """
+    Generates input values resembling those of given column.
+
+    :type rng: random.Random
+
+    :param column: Name of the column.
+    :type column: str
+
+    :param count: Number of values to generate.
+    :type count: int
+
+    :param length: Length of the values of columns not recognized from
+                   their names.
+    :type length: int
+
+    :rtype: list[str]
+    """
+    lowered = column.lower()
+    for (fragment, generator) in GENERATORS:
+        if fragment in lowered:
+            return [generator(rng) for _ in range(count)]
+    return [fixtures.generate_text(rng, length) for _ in range(count)]
+
+
+def sample_values(url, config, count=DEFAULT_VALUES):
+    """
+    Reads input values of the sanitized columns from a dump file.
+
+    :param url: `file://` URL of the dump file, which may contain format of
+                the dump as "format" parameter.
+    :type url: str
+
+    :type config: database_sanitizer.config.Configuration
+
+    :param count: Maximum number of values read per column.
+    :type count: int
+
+    :return: Values mapped by "table.column" keys. NULL values are left
+             out.
+    :rtype: dict[str,list[str]]
+    """
+    parsed_url = urlparse.urlparse(url)
+    if parsed_url.scheme != "file":
+        raise ValueError("Values can be sampled only from dump files")
+    dump_format = urlparse.parse_qs(parsed_url.query).get("format", [None])[0]
+
+    values = {}
+    with open_dump_file(get_path(parsed_url)) as (buffer, _mapped_path):
+        backend = get_backend(buffer, dump_format)
+        for section in scan(buffer, backend):
+            keys = [
+                "%s.%s" % (section.table, column)
+                if config.get_sanitizer_for(section.table, column) else None
+                for column in section.columns
+            ]
+            if not any(keys):
+                continue
+            text = buffer[section.data_start:section.data_end].decode("utf-8")
+            for line in text.splitlines():
+                if all(
+                    len(values.get(key, ())) >= count for key in keys if key
+                ):
+                    break
+                for row in backend.parse_value_line(line, section.columns):
+                    for (key, value) in zip(keys, row):
+                        if not key:
+                            continue
+                        value = backend.decode_value(value)
+                        column_values = values.setdefault(key, [])
+                        if value is not None and len(column_values) < count:
+                            column_values.append(value)
+    return values
+
+
+def time_sanitizers(
+    config,
+    sampled=None,
+    count=DEFAULT_VALUES,
+    length=DEFAULT_VALUE_LENGTH,
+    samples=DEFAULT_SAMPLES,
+    min_time=DEFAULT_MIN_TIME,
+    cost_threshold=DEFAULT_COST_THRESHOLD,
+    seed=0,
+    callback=None,
+):
+    """
+    Times the sanitizers of given configuration.
+
+    :type config: database_sanitizer.config.Configuration
+
+    :param sampled: Input values sampled from a dump, as returned by
+                    `sample_values`. Values are generated for the columns
+                    missing from it.
+    :type sampled: dict[str,list[str]]|None
+
+    :param count: Number of generated values per column.
+    :type count: int
+
+    :param length: Length of the generated text values.
+    :type length: int
+
+    :param samples: Number of samples to record per sanitizer.
+    :type samples: int
+
+    :param min_time: Minimum duration of a single sample in seconds.
+    :type min_time: float
+
+    :param cost_threshold: Time per value in seconds after which the
+                           sanitizer is considered expensive, and its column
+                           would benefit from being sanitized in batches by
+                           worker processes of the hybrid engine, unless it
+                           has been declared expensive already.
+    :type cost_threshold: float
+
+    :param seed: Seed of the generated values.
+    :type seed: int
+
+    :param callback: Optional function called with each timing when it has
+                     been recorded.
+    :type callback: Callable[[SanitizerTiming], None]|None
+
+    :rtype: list[SanitizerTiming]
+    """
+    session.reset(SECRET_KEY)
+    rng = random.Random(seed)
+    timings = []
+    for key in sorted(config.sanitizers):
+        sanitizer = config.sanitizers[key]
+        values = (sampled or {}).get(key)
+        if not values:
+            values = generate_values(
+                rng, key.partition(".")[2], count=count, length=length)
+
+        # Values which the sanitizer fails with are left out of the timing,
+        # since the sanitation would be aborted by them anyway.
+        valid_values = []
+        outputs = []
+        for value in values:
+            try:
+                outputs.append(sanitizer(value))
+            except Exception:
+                continue
+            valid_values.append(value)
+
+        loops = 0
+        sample_times = []
+        seconds = None
+        if valid_values:
+            (loops, sample_times) = time_benchmark(
+                Benchmark(
+                    key,
+                    map_values(sanitizer, valid_values),
+                    len(valid_values),
+                ),
+                samples=samples,
+                min_time=min_time,
+            )
+            seconds = median(sample_times)
+
+        deterministic = [sanitizer(value) for value in valid_values] == outputs
+        duplicate_ratio = (
+            1 - len(set(valid_values)) / len(valid_values)
+            if valid_values else 0.0
+        )
+        hints = []
+        if seconds is not None and seconds >= cost_threshold and \
+                key not in config.expensive_columns:
+            hints.append("batch")
+        if seconds is not None and seconds >= CACHE_MIN_TIME and \
+                deterministic and duplicate_ratio >= CACHE_DUPLICATE_RATIO:
+            hints.append("cache")
+
+        timing = SanitizerTiming(
+            column=key,
+            sanitizer=get_function_name(sanitizer),
+            values=len(valid_values),
+            errors=len(values) - len(valid_values),
+            loops=loops,
+            samples=sample_times,
+            seconds=seconds,
+            deterministic=deterministic,
+            duplicate_ratio=duplicate_ratio,
+            hints=tuple(hints),
+        )
+        timings.append(timing)
+        if callback:
+            callback(timing)
+    return timings
+
+
+def get_table_costs(timings):
+    """
+    Sums the times per value of the sanitizers of each table.
+
+    :type timings: list[SanitizerTiming]
+
+    :return: Time in seconds spent on sanitizing a row, mapped by table
+             names.
+    :rtype: dict[str,float]
+    """
+    costs = {}
+    for timing in timings:
+        table = timing.column.partition(".")[0]
+        costs[table] = costs.get(table, 0.0) + (timing.seconds or 0.0)
+    return costs
+
+
+def project_time(timings, estimates):
+    """
+    Projects time spent by the sanitizers on each table.
+
+    :type timings: list[SanitizerTiming]
+
+    :param estimates: Estimated row counts mapped by table names.
+    :type estimates: dict[str,int]
+
+    :return: Projected seconds mapped by table names, or None for the
+             tables without an estimate.
+    :rtype: dict[str,float|None]
+    """
+    return {
+        table: (cost * estimates[table] if table in estimates else None)
+        for (table, cost) in six.iteritems(get_table_costs(timings))
+    }
+
+
+def make_timing_results(timings):
+    """
+    Constructs results of the timings in the format written by
+    `database_sanitizer.benchmarks.save_results`, so that runs can be
+    compared with each other.
+
+    :type timings: list[SanitizerTiming]
+    :rtype: dict
+    """
+    return make_results({
+        "strategy.%s" % (timing.column,): {
+            "items": timing.values,
+            "loops": timing.loops,
+            "values": timing.samples,
+        }
+        for timing in timings
+        if timing.samples
+    })
+
+
+def format_report(timings, estimates=None):
+    """
+    Formats the timings of the sanitizers, the costs per table with their
+    projected sanitation times and the suggested optimizations into human
+    readable lines.
+
+    :type timings: list[SanitizerTiming]
+
+    :param estimates: Estimated row counts mapped by table names.
+    :type estimates: dict[str,int]|None
+
+    :rtype: list[str]
+    """
+    estimates = estimates or {}
+    column_width = max([len("Column")] + [len(t.column) for t in timings])
+    sanitizer_width = max(
+        [len("Sanitizer")] + [len(t.sanitizer) for t in timings])
+    lines = ["%-*s  %-*s  %12s  %12s  %s" % (
+        column_width, "Column", sanitizer_width, "Sanitizer", "Calls/s",
+        "ns/value", "Hints")]
+    for timing in timings:
+        if timing.seconds is None:
+            lines.append("%-*s  %-*s  failed with all of the %d values" % (
+                column_width, timing.column, sanitizer_width,
+                timing.sanitizer, timing.errors))
+            continue
+        lines.append(("%-*s  %-*s  %12.0f  %12.0f  %s" % (
+            column_width,
+            timing.column,
+            sanitizer_width,
+            timing.sanitizer,
+            1 / timing.seconds if timing.seconds else 0.0,
+            timing.seconds * 1e9,
+            ",".join(timing.hints),
+        )).rstrip())
+
+    costs = get_table_costs(timings)
+    projected = project_time(timings, estimates)
+    tables = sorted(costs)
+    table_width = max([len("Table")] + [len(table) for table in tables])
+    lines.append("")
+    lines.append("%-*s  %12s  %12s  %12s  %12s" % (
+        table_width, "Table", "Rows/s", "ns/row", "Rows", "Projected"))
+    for table in tables:
+        lines.append("%-*s  %12.0f  %12.0f  %12s  %12s" % (
+            table_width,
+            table,
+            1 / costs[table] if costs[table] else 0.0,
+            costs[table] * 1e9,
+            "%d" % (estimates[table],) if table in estimates else "-",
+            format_duration(projected[table])
+            if projected[table] is not None else "-",
+        ))
+    known = [seconds for seconds in projected.values() if seconds is not None]
+    if known:
+        lines.append("")
+        lines.append("Projected sanitation time: %s%s" % (
+            format_duration(sum(known)),
+            " (%d tables without estimates)" % (len(projected) - len(known),)
+            if len(known) < len(projected) else "",
+        ))
+
+    suggestions = []
+    for timing in timings:
+        if "batch" in timing.hints:
+            suggestions.append(
+                "%s: %s per value, list it in config.expensive_columns to "
+                "sanitize it in batches with the hybrid engine" % (
+                    timing.column, format_duration(timing.seconds)))
+        if "cache" in timing.hints:
+            suggestions.append(
+                "%s: deterministic with %.0f%% repeated values, list it in "
+                "config.cached_columns to cache the sanitized values" % (
+                    timing.column, timing.duplicate_ratio * 100))
+    if suggestions:
+        lines.append("")
+        lines.extend(suggestions)
+    return lines
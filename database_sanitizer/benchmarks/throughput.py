@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end throughput harness.
+
+Synthetic `pg_dump` and `mysqldump` outputs of configurable size are
+generated into files, and stub `pg_dump` and `mysqldump` executables which
+replay them are placed first on ``PATH``. The command line interface is
+then run against them exactly like against a real database, so the whole
+path from reading the dump subprocess to writing the output is measured
+without needing a database server.
+
+To keep generation of multi-gigabyte dumps fast, a limited number of
+distinct rows is generated per table and repeated until the requested row
+count is reached.
+"""
+
+from __future__ import division, unicode_literals
+
+import contextlib
+import os
+import random
+import shutil
+import stat
+import sys
+import tempfile
+import timeit
+from collections import namedtuple
+
+import yaml
+from six.moves import range
+
+from . import fixtures, make_results
+
+#: Table of a synthetic dump. Columns are of the kinds generated by
+#: `fixtures.generate_row`.
+TableSpec = namedtuple(
+    "TableSpec",
+    ("name", "columns", "rows", "null_ratio", "escape_ratio"),
+)
+
+#: Result of a single run of the command line interface.
+Measurement = namedtuple(
+    "Measurement",
+    ("name", "seconds", "input_bytes", "rows"),
+)
+
+#: Supported dump formats, mapped to the dump utilities producing them.
+DUMP_TOOLS = {
+    "postgres": "pg_dump",
+    "mysql": "mysqldump",
+}
+
+#: Database URLs used for running against the stub dump utilities.
+DATABASE_URLS = {
+    "postgres": "postgresql://localhost/benchmark",
+    "mysql": "mysql://localhost/benchmark",
+}
+
+#: Default number of distinct rows generated per table.
+DEFAULT_DISTINCT_ROWS = 1000
+
+#: Number of rows per extended `INSERT INTO` statement in synthetic
+#: `mysqldump` outputs.
+MYSQL_ROWS_PER_STATEMENT = 200
+
+#: Sanitizers configured for the synthetic tables, by column kind.
+SANITIZERS = {
+    "name": "user.full_name_en_gb",
+    "email": "user.email",
+    "notes": "string.zfill",
+}
+
+#: Script of the stub dump utilities, formatted with path of the dump file.
+STUB_SCRIPT = """#!%(python)s
+import shutil
+import sys
+
+with open(%(path)r, "rb") as stream:
+    shutil.copyfileobj(
+        stream, getattr(sys.stdout, "buffer", sys.stdout), 1024 * 1024)
+"""
+
+
+def get_table_specs(tables, columns, rows, null_ratio=0.1, escape_ratio=0.05):
+    """
+    Constructs specs of identically shaped synthetic tables.
+
+    :param tables: Number of tables.
+    :type tables: int
+
+    :param columns: Number of columns per table.
+    :type columns: int
+
+    :param rows: Number of rows per table.
+    :type rows: int
+
+    :param null_ratio: Probability of each value being NULL.
+    :type null_ratio: float
+
+    :param escape_ratio: Probability of each character of the text values
+                         being one which has to be escaped.
+    :type escape_ratio: float
+
+    :rtype: list[TableSpec]
+    """
+    return [
+        TableSpec(
+            name="table_%d" % (index,),
+            columns=columns,
+            rows=rows,
+            null_ratio=null_ratio,
+            escape_ratio=escape_ratio,
+        )
+        for index in range(tables)
+    ]
+
+
+def generate_dump(
+    stream,
+    dump_format,
+    tables,
+    seed=0,
+    distinct_rows=DEFAULT_DISTINCT_ROWS,
+):
+    """
+    Writes a synthetic dump into given binary stream.
+
+    :type stream: file
+
+    :param dump_format: One of `DUMP_TOOLS`.
+    :type dump_format: str
+
+    :type tables: list[TableSpec]
+
+    :param seed: Seed of the random values.
+    :type seed: int
+
+    :param distinct_rows: Number of distinct rows generated per table.
+    :type distinct_rows: int
+
+    :return: Total number of rows in the dump.
+    :rtype: int
+    """
+    if dump_format not in DUMP_TOOLS:
+        raise ValueError("Unsupported dump format: '%s'" % (dump_format,))
+    rng = random.Random(seed)
+    write_table = (
+        _write_postgres_table if dump_format == "postgres"
+        else _write_mysql_table)
+
+    stream.write(b"-- Synthetic %s database dump\n\n" % (
+        DUMP_TOOLS[dump_format].encode("ascii"),))
+    for table in tables:
+        write_table(stream, table, rng, min(distinct_rows, table.rows))
+    stream.write(b"-- Dump completed\n")
+    return sum(table.rows for table in tables)
+
+
+def _write_postgres_table(stream, table, rng, distinct_rows):
+    columns = fixtures.get_column_names(table.columns)
+    stream.write(('COPY "public"."%s" (%s) FROM stdin;\n' % (
+        table.name,
+        ", ".join('"%s"' % (column,) for column in columns),
+    )).encode("utf-8"))
+    lines = [
+        (fixtures.generate_copy_line(
+            rng, table.columns, table.null_ratio, table.escape_ratio,
+        ) + "\n").encode("utf-8")
+        for _ in range(distinct_rows)
+    ]
+    _write_repeated(stream, lines, table.rows)
+    stream.write(b"\\.\n\n")
+
+
+def _write_mysql_table(stream, table, rng, distinct_rows):
+    columns = fixtures.get_column_names(table.columns)
+    prefix = ("INSERT INTO `%s` (%s) VALUES " % (
+        table.name,
+        ", ".join("`%s`" % (column,) for column in columns),
+    )).encode("utf-8")
+    values = [
+        fixtures.generate_values_text(
+            rng, 1, table.columns, table.null_ratio, table.escape_ratio,
+        ).encode("utf-8")
+        for _ in range(distinct_rows)
+    ]
+    written = 0
+    while written < table.rows:
+        count = min(MYSQL_ROWS_PER_STATEMENT, table.rows - written)
+        stream.write(prefix + b",".join(
+            values[(written + index) % distinct_rows]
+            for index in range(count)
+        ) + b";\n")
+        written += count
+    stream.write(b"\n")
+
+
+def _write_repeated(stream, lines, count):
+    block = b"".join(lines)
+    (repeats, remainder) = divmod(count, len(lines))
+    for _ in range(repeats):
+        stream.write(block)
+    stream.write(b"".join(lines[:remainder]))
+
+
+def get_config_data(tables):
+    """
+    Constructs configuration sanitizing the name, email and text columns of
+    given synthetic tables.
+
+    :type tables: list[TableSpec]
+    :rtype: dict
+    """
+    strategy = {}
+    for table in tables:
+        strategy[table.name] = {
+            column: SANITIZERS[column.split("_")[0]]
+            for column in fixtures.get_column_names(table.columns)
+            if column.split("_")[0] in SANITIZERS
+        }
+    return {"strategy": strategy}
+
+
+@contextlib.contextmanager
+def stub_dump_tools(dumps):
+    """
+    Places stub dump utilities replaying given dump files first on
+    ``PATH`` for the duration of the context.
+
+    :param dumps: Paths of the dump files, mapped by names of the dump
+                  utilities.
+    :type dumps: dict[str,str]
+    """
+    directory = tempfile.mkdtemp(prefix="database-sanitizer-bin-")
+    original_path = os.environ.get("PATH")
+    try:
+        for (tool, path) in dumps.items():
+            script_path = os.path.join(directory, tool)
+            with open(script_path, "w") as stream:
+                stream.write(STUB_SCRIPT % {
+                    "python": sys.executable,
+                    "path": os.path.abspath(path),
+                })
+            os.chmod(script_path, os.stat(script_path).st_mode | stat.S_IXUSR)
+        os.environ["PATH"] = os.pathsep.join(
+            [directory] + ([original_path] if original_path else []))
+        yield directory
+    finally:
+        if original_path is None:
+            os.environ.pop("PATH", None)
+        else:
+            os.environ["PATH"] = original_path
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def measure(dump_format, engine, config_path, workers=None, extra_args=()):
+    """
+    Runs the command line interface once against the stub dump utility of
+    given format, discarding the output.
+
+    :param dump_format: One of `DUMP_TOOLS`.
+    :type dump_format: str
+
+    :param engine: Name of the engine.
+    :type engine: str
+
+    :param config_path: Path to the configuration file.
+    :type config_path: str
+
+    :param workers: Number of worker processes of the parallel engines.
+    :type workers: int|None
+
+    :param extra_args: Additional command line arguments.
+    :type extra_args: collections.Iterable[str]
+
+    :return: Wall time of the run in seconds.
+    :rtype: float
+    """
+    from ..__main__ import main
+
+    argv = ["database-sanitizer", "-c", config_path, "-e", engine]
+    if workers is not None:
+        argv.extend(["-w", "%d" % (workers,)])
+    argv.extend(extra_args)
+    argv.extend(["-o", os.devnull, DATABASE_URLS[dump_format]])
+
+    start = timeit.default_timer()
+    main(argv)
+    return timeit.default_timer() - start
+
+
+def run_throughput(
+    dump_formats,
+    engines,
+    tables,
+    workers=None,
+    repeat=3,
+    seed=0,
+    directory=None,
+    callback=None,
+):
+    """
+    Generates synthetic dumps and measures throughput of sanitizing them
+    with given engines.
+
+    :param dump_formats: Formats to measure, from `DUMP_TOOLS`.
+    :type dump_formats: list[str]
+
+    :param engines: Names of the engines to measure.
+    :type engines: list[str]
+
+    :type tables: list[TableSpec]
+
+    :param workers: Number of worker processes of the parallel engines.
+    :type workers: int|None
+
+    :param repeat: Number of runs per format and engine.
+    :type repeat: int
+
+    :type seed: int
+
+    :param directory: Directory for the generated dumps. Defaults to a
+                      temporary directory, removed afterwards.
+    :type directory: str|None
+
+    :param callback: Optional function called with each `Measurement`.
+    :type callback: Callable[[Measurement], None]|None
+
+    :return: Results, in the format of `database_sanitizer.benchmarks`,
+             with time per row as the values.
+    :rtype: dict
+    """
+    temporary_directory = None
+    if directory is None:
+        directory = temporary_directory = tempfile.mkdtemp(
+            prefix="database-sanitizer-bench-")
+    try:
+        config_path = os.path.join(directory, "config.yml")
+        with open(config_path, "w") as stream:
+            yaml.safe_dump(get_config_data(tables), stream)
+
+        dumps = {}
+        sizes = {}
+        rows = 0
+        for dump_format in dump_formats:
+            path = os.path.join(directory, "%s.sql" % (dump_format,))
+            with open(path, "wb") as stream:
+                rows = generate_dump(stream, dump_format, tables, seed)
+            dumps[DUMP_TOOLS[dump_format]] = path
+            sizes[dump_format] = os.path.getsize(path)
+
+        results = {}
+        with stub_dump_tools(dumps):
+            for dump_format in dump_formats:
+                for engine in engines:
+                    name = "throughput.%s.%s" % (dump_format, engine)
+                    values = []
+                    for _ in range(repeat):
+                        seconds = measure(
+                            dump_format, engine, config_path, workers)
+                        values.append(seconds / rows)
+                        if callback:
+                            callback(Measurement(
+                                name, seconds, sizes[dump_format], rows))
+                    results[name] = {
+                        "items": rows,
+                        "loops": 1,
+                        "values": values,
+                        "input_bytes": sizes[dump_format],
+                    }
+    finally:
+        if temporary_directory:
+            shutil.rmtree(temporary_directory, ignore_errors=True)
+
+    return make_results(results)
+
+
+def format_measurement(measurement):
+    """
+    :type measurement: Measurement
+    :rtype: str
+    """
+    return "%-30s %8.2f s %10.1f MB/s %12.0f rows/s" % (
+        measurement.name,
+        measurement.seconds,
+        measurement.input_bytes / measurement.seconds / (1024 * 1024),
+        measurement.rows / measurement.seconds,
+    )
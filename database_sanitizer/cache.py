@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of sanitized values.
+
+Sanitizers of the columns listed under "config.cached_columns" are assumed
+to be deterministic, i.e. to return the same sanitized value for the same
+input whenever the session secret stays the same. Their results are kept
+in an SQLite database file between the runs, and the sanitizer is not
+called at all for the inputs found from the cache.
+
+The inputs are not stored as such, but as HMACs keyed with the session
+secret, so the cache file does not reveal the original values. The
+entries of a different secret are discarded when the cache is opened.
+Entries used least recently are evicted when the cache has grown larger
+than its maximum size.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import hmac
+import os
+import sqlite3
+
+import six
+
+from . import session
+from .profiling import get_function_name
+
+#: Default maximum number of entries in the cache.
+DEFAULT_MAX_ENTRIES = 10000000
+
+#: Number of new entries kept in memory before they are written into the
+#: cache file.
+FLUSH_SIZE = 10000
+
+#: Statements creating the tables of the cache file.
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS entries "
+    "(key TEXT PRIMARY KEY, value TEXT, generation INTEGER)",
+    "CREATE INDEX IF NOT EXISTS entries_generation ON entries (generation)",
+)
+
+
+class ValueCache(object):
+    """
+    Cache of sanitized values, stored in an SQLite database file.
+    """
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        :param path: Path to the cache file, created if missing.
+        :type path: str
+
+        :param max_entries: Maximum number of entries kept in the cache.
+        :type max_entries: int
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Sanitizers are called directly in other processes, e.g. in the
+        # worker processes of the parallel engines.
+        self.pid = os.getpid()
+        self.connection = None
+        self.secret = None
+        self.generation = None
+        # Entries not yet written into the cache file, and keys of the
+        # entries used during this run whose generation has to be updated.
+        self.pending = {}
+        self.used = set()
+
+    def open(self):
+        """
+        Opens the cache file with the current session secret, discarding
+        the entries of a different secret.
+        """
+        self.secret = session.get_secret()
+        secret_fingerprint = hashlib.sha256(self.secret).hexdigest()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+            meta = dict(self.connection.execute(
+                "SELECT name, value FROM meta"))
+            if meta.get("secret") != secret_fingerprint:
+                self.connection.execute("DELETE FROM entries")
+            self.generation = int(meta.get("generation", 0)) + 1
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", [
+                    ("secret", secret_fingerprint),
+                    ("generation", six.text_type(self.generation)),
+                ])
+
+    def close(self):
+        """
+        Writes the pending entries into the cache file, evicts the least
+        recently used entries exceeding the maximum size and closes the
+        file.
+        """
+        if self.connection is None:
+            return
+        self.flush()
+        with self.connection:
+            (count,) = self.connection.execute(
+                "SELECT COUNT(*) FROM entries").fetchone()
+            if count > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM entries WHERE key IN ("
+                    "SELECT key FROM entries ORDER BY generation LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+        self.connection.close()
+        self.connection = None
+
+    def flush(self):
+        """
+        Writes the pending entries into the cache file.
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, generation) "
+                "VALUES (?, ?, ?)",
+                [
+                    (key, value, self.generation)
+                    for (key, value) in six.iteritems(self.pending)
+                ],
+            )
+            self.connection.executemany(
+                "UPDATE entries SET generation = ? WHERE key = ?",
+                [(self.generation, key) for key in self.used],
+            )
+        self.pending.clear()
+        self.used.clear()
+
+    def get(self, key):
+        """
+        :param key: Key of the entry.
+        :type key: str
+
+        :return: Whether the entry was found, and its value.
+        :rtype: tuple[bool,str|None]
+        """
+        if key in self.pending:
+            return (True, self.pending[key])
+        row = self.connection.execute(
+            "SELECT value, generation FROM entries WHERE key = ?",
+            (key,)).fetchone()
+        if row is None:
+            return (False, None)
+        if row[1] != self.generation:
+            self.used.add(key)
+        return (True, row[0])
+
+    def put(self, key, value):
+        """
+        :param key: Key of the entry.
+        :type key: str
+
+        :param value: Sanitized value.
+        :type value: str|None
+        """
+        self.pending[key] = value
+        if len(self.pending) + len(self.used) >= FLUSH_SIZE:
+            self.flush()
+
+    def instrument_config(self, config):
+        """
+        Replaces the sanitizers of the columns listed under
+        "config.cached_columns" of given configuration with ones which look
+        up the sanitized values from the cache first. The cache is opened if
+        it is not open yet.
+
+        :type config: database_sanitizer.config.Configuration|None
+        """
+        if not config or not config.cached_columns:
+            return
+        if self.connection is None:
+            self.open()
+        for (key, sanitizer) in list(config.sanitizers.items()):
+            if key in config.cached_columns:
+                config.sanitizers[key] = _cache_sanitizer(self, key, sanitizer)
+
+
+def _cache_sanitizer(cache, key, sanitizer):
+    # Results of a different sanitizer of the same column must not be used.
+    prefix = ("%s\0%s\0" % (key, get_function_name(sanitizer))).encode("utf-8")
+
+    @six.wraps(sanitizer)
+    def cached_sanitizer(value):
+        if not isinstance(value, six.text_type) or os.getpid() != cache.pid:
+            return sanitizer(value)
+        entry_key = hmac.new(
+            cache.secret, prefix + value.encode("utf-8"), hashlib.sha256,
+        ).hexdigest()
+        (found, result) = cache.get(entry_key)
+        if found:
+            cache.hits += 1
+            return result
+        cache.misses += 1
+        result = sanitizer(value)
+        if result is None or isinstance(result, six.text_type):
+            cache.put(entry_key, result)
+        return result
+
+    return cached_sanitizer
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Compression of the sanitized dump in multiple threads.
+
+The output is split into blocks which are compressed independently in a
+thread pool, and written out in order. Each block becomes a complete gzip
+member, zstd frame or lz4 frame, and a concatenation of those is a valid
+stream which the standard tools decompress as a whole. The compression
+libraries release the GIL while compressing, so the threads run in
+parallel.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import zlib
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+from .engine import get_worker_count
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover (optional dependency)
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover (optional dependency)
+    lz4_frame = None
+
+#: Default size of a block compressed at once, in bytes.
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+#: Default compression levels of the supported codecs.
+DEFAULT_LEVELS = {
+    "gzip": 6,
+    "zstd": 3,
+    "lz4": 0,
+}
+
+#: Supported codecs, mapped by file name extensions selecting them.
+EXTENSIONS = {
+    ".gz": "gzip",
+    ".zst": "zstd",
+    ".lz4": "lz4",
+}
+
+#: Number of blocks in flight per thread.
+PENDING_PER_THREAD = 2
+
+
+def get_codec_for_filename(filename):
+    """
+    Determines compression codec from extension of given file name.
+
+    :type filename: str|None
+
+    :return: Name of the codec or None if the extension does not select
+             any.
+    :rtype: str|None
+    """
+    if not filename:
+        return None
+    return EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+
+
+def get_compressor(codec, level=None):
+    """
+    Constructs function compressing a block of data into a complete gzip
+    member, zstd frame or lz4 frame.
+
+    :param codec: One of "gzip", "zstd" or "lz4".
+    :type codec: str
+
+    :param level: Compression level. Defaults to the default level of the
+                  codec.
+    :type level: int|None
+
+    :rtype: Callable[[bytes], bytes]
+    """
+    if codec not in DEFAULT_LEVELS:
+        raise ValueError("Unsupported compression codec: '%s'" % (codec,))
+    if level is None:
+        level = DEFAULT_LEVELS[codec]
+
+    if codec == "gzip":
+        if not -1 <= level <= 9:
+            raise ValueError("Invalid gzip compression level: %d" % (level,))
+
+        def compress_gzip(data):
+            # Window bits of 16 + 15 produce the gzip container.
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            return compressor.compress(data) + compressor.flush()
+        return compress_gzip
+
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError(
+                "zstd compression requires the zstandard package")
+        # Compressor objects may not be shared by threads.
+        return lambda data: (
+            zstandard.ZstdCompressor(level=level).compress(data))
+
+    if lz4_frame is None:
+        raise RuntimeError("lz4 compression requires the lz4 package")
+    return lambda data: lz4_frame.compress(data, compression_level=level)
+
+
+class CompressedStream(object):
+    """
+    Binary stream compressing data written into it in multiple threads.
+    """
+    def __init__(
+        self,
+        stream,
+        codec,
+        level=None,
+        threads=None,
+        block_size=DEFAULT_BLOCK_SIZE,
+    ):
+        """
+        :param stream: Binary stream where the compressed data is written.
+        :type stream: file
+
+        :param codec: One of "gzip", "zstd" or "lz4".
+        :type codec: str
+
+        :param level: Compression level. Defaults to the default level of
+                      the codec.
+        :type level: int|None
+
+        :param threads: Number of compression threads. Defaults to number
+                        of CPUs.
+        :type threads: int|None
+
+        :param block_size: Size of a block compressed at once, in bytes.
+        :type block_size: int
+        """
+        threads = get_worker_count(threads)
+        if block_size < 1:
+            raise ValueError("Block size must be positive")
+        self.stream = stream
+        self.compress = get_compressor(codec, level)
+        self.block_size = block_size
+        self.block = bytearray()
+        self.pool = ThreadPool(processes=threads)
+        self.max_pending = PENDING_PER_THREAD * threads
+        self.pending = deque()
+        self.closed = False
+
+    def write(self, data):
+        """
+        Writes given data, compressing it once a full block is available.
+
+        :type data: bytes
+        """
+        self.block += data
+        while len(self.block) >= self.block_size:
+            block = bytes(self.block[:self.block_size])
+            del self.block[:self.block_size]
+            self._submit(block)
+
+    def writelines(self, segments):
+        """
+        :type segments: collections.Iterable[bytes]
+        """
+        for segment in segments:
+            self.write(segment)
+
+    def _submit(self, block):
+        self.pending.append(self.pool.apply_async(self.compress, (block,)))
+        while len(self.pending) > self.max_pending:
+            self.stream.write(self.pending.popleft().get())
+
+    def flush(self):
+        """
+        Compresses the data written so far and writes it into the stream.
+        The compressed stream stays valid, since each block is complete.
+        """
+        if self.block:
+            self._submit(bytes(self.block))
+            self.block = bytearray()
+        while self.pending:
+            self.stream.write(self.pending.popleft().get())
+        self.stream.flush()
+
+    def fileno(self):
+        # Compressed data cannot be written into the file directly.
+        raise IOError("Compressed stream has no file descriptor")
+
+    def close(self):
+        """
+        Flushes the remaining data and stops the compression threads. The
+        underlying stream is left open.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.flush()
+        finally:
+            self.pool.terminate()
+            self.pool.join()
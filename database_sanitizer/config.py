@@ -31,6 +31,9 @@ class Configuration(object):
         self.addon_packages = []
         self.mysqldump_params = []
         self.pg_dump_params = []
+        self.expensive_columns = set()
+        self.cached_columns = set()
+        self.subset_tables = {}
 
     @classmethod
     def from_file(cls, filename):
@@ -72,6 +75,9 @@ class Configuration(object):
         self.load_addon_packages(config_data)
         self.load_sanitizers(config_data)
         self.load_dump_extra_parameters(config_data)
+        self.load_expensive_columns(config_data)
+        self.load_cached_columns(config_data)
+        self.load_subset(config_data)
 
     def load_dump_extra_parameters(self, config_data):
         """
@@ -117,6 +123,127 @@ class Configuration(object):
         self.mysqldump_params = mysqldump_params
         self.pg_dump_params = pg_dump_params
 
+    def load_expensive_columns(self, config_data):
+        """
+        Loads names of the columns which have been declared to be expensive to
+        sanitize, so that parallel engines can offload them into worker
+        processes. These must be stored as a list of "table.column" strings
+        under "config.expensive_columns" section of the configuration data.
+
+        :param config_data: Already parsed configuration data, as dictionary.
+        :type config_data: dict[str,any]
+        """
+        self.expensive_columns = self._load_column_keys(
+            config_data, "expensive_columns")
+
+    def load_cached_columns(self, config_data):
+        """
+        Loads names of the columns whose sanitizers are deterministic, so that
+        their sanitized values can be cached between runs. These must be
+        stored as a list of "table.column" strings under
+        "config.cached_columns" section of the configuration data.
+
+        :param config_data: Already parsed configuration data, as dictionary.
+        :type config_data: dict[str,any]
+        """
+        self.cached_columns = self._load_column_keys(
+            config_data, "cached_columns")
+
+    def load_subset(self, config_data):
+        """
+        Loads the rules selecting the rows of the root tables of a subset of
+        the database, stored under dictionary called "subset", which maps
+        names of the tables into dictionaries with "percent" of the rows to
+        keep and/or "where" condition selecting the rows to keep.
+
+        :param config_data: Already parsed configuration data, as dictionary.
+        :type config_data: dict[str,any]
+        """
+        section_subset = config_data.get("subset")
+        if section_subset is None:
+            return
+        if not isinstance(section_subset, dict):
+            raise ConfigurationError(
+                "'subset' is %s instead of dict" % (
+                    type(section_subset),
+                ),
+            )
+
+        subset_tables = {}
+        for table_name, rule in six.iteritems(section_subset):
+            if not isinstance(rule, dict):
+                raise ConfigurationError(
+                    "'subset.%s' is %s instead of dict" % (
+                        table_name,
+                        type(rule),
+                    ),
+                )
+            unknown = sorted(set(rule) - set(("percent", "where")))
+            if unknown:
+                raise ConfigurationError(
+                    "'subset.%s' contains unknown key '%s'" % (
+                        table_name,
+                        unknown[0],
+                    ),
+                )
+            if not rule:
+                raise ConfigurationError(
+                    "'subset.%s' has neither 'percent' nor 'where'" % (
+                        table_name,
+                    ),
+                )
+
+            percent = rule.get("percent")
+            if percent is not None and (
+                isinstance(percent, bool)
+                or not isinstance(percent, (int, float))
+                or not 0 <= percent <= 100
+            ):
+                raise ConfigurationError(
+                    "'subset.%s.percent' is not a number between 0 and "
+                    "100" % (table_name,),
+                )
+            where = rule.get("where")
+            if where is not None and not isinstance(where, six.string_types):
+                raise ConfigurationError(
+                    "'subset.%s.where' is %s instead of string" % (
+                        table_name,
+                        type(where),
+                    ),
+                )
+            subset_tables[table_name] = {"percent": percent, "where": where}
+
+        self.subset_tables = subset_tables
+
+    def _load_column_keys(self, config_data, name):
+        section_config = config_data.get("config")
+        if not isinstance(section_config, dict):
+            if section_config is None:
+                return set()
+            raise ConfigurationError(
+                "'config' is %s instead of dict" % (
+                    type(section_config),
+                ),
+            )
+
+        section_columns = section_config.get(name, [])
+        if not isinstance(section_columns, list):
+            raise ConfigurationError(
+                "'config.%s' is %s instead of list" % (
+                    name,
+                    type(section_columns),
+                ),
+            )
+
+        for index, column_key in enumerate(section_columns):
+            if not isinstance(column_key, str) or "." not in column_key:
+                raise ConfigurationError(
+                    "Item %d in 'config.%s' is not in format "
+                    "'table.column'" % (index, name),
+                )
+
+        return set(section_columns)
+
     def load_addon_packages(self, config_data):
         """
         Loads the module paths from which the configuration will attempt to
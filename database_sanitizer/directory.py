@@ -0,0 +1,743 @@
+# -*- coding: utf-8 -*-
+"""
+Writer which splits a sanitized dump into a directory of files, so that it
+can be restored in parallel.
+
+Statements preceding the table data are written into a pre-data file and
+the statements following it into a post-data file. For Postgres these are
+the indexes, constraints and triggers, which are cheaper to create once
+the data has been loaded. The table definitions of MySQL dumps are mixed
+with the data, so only the triggers are written into the post-data file.
+
+Data of each table is written into files of its own, optionally split
+into shards of a maximum size. Each file repeats the session settings of
+the dump, so that the files can be loaded independently of each other. A
+manifest listing the files with their row counts, sizes and checksums is
+written when the writer is closed, and read by
+`database_sanitizer.restore`.
+
+While the dump is written, each table whose data has been completely
+written is recorded into a journal together with its files. An
+interrupted run can be resumed, in which case the files of the completed
+tables are verified and kept, the rest of the directory is removed, and
+the tables are reused instead of being written again, as long as the
+source, the configuration and the secret of the run are the same.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+from collections import OrderedDict
+
+import six
+from six.moves.urllib import parse as urlparse
+
+from .dump.files import get_path
+from .dump.incremental import get_config_fingerprint
+from .dump.postgres import COPY_LINE_PATTERN
+from .dump.postgres import parse_column_names as parse_copy_column_names
+from .loader import SETTING_PATTERN
+
+#: Name of the manifest file.
+MANIFEST_FILENAME = "manifest.json"
+
+#: Version of the manifest, changed whenever its contents change
+#: incompatibly.
+MANIFEST_VERSION = 1
+
+#: Name of the journal of the completed tables, removed once the manifest
+#: has been written.
+JOURNAL_FILENAME = "journal.jsonl"
+
+#: Version of the journal, changed whenever its contents change
+#: incompatibly.
+JOURNAL_VERSION = 1
+
+#: Matches the statements of `mysqldump` which create triggers.
+TRIGGER_PATTERN = re.compile(r"\bTRIGGER\b")
+
+#: Session variables which `mysqldump` saves and restores around the
+#: triggers and routines. These are written into both of the files.
+SESSION_SETTING_PREFIX = "/*!50003 SET "
+
+#: Session settings in the header of a `mysqldump` dump, such as character
+#: set and foreign key checks, which are repeated in each data file.
+#: Settings restoring a saved value are left out.
+MYSQL_SETTING_PATTERN = re.compile(r"^/\*!40\d{3} SET (?!.*@saved).*\*/;$")
+
+#: Size of the blocks in which files are read when computing checksums.
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+class DirectoryWriter(object):
+    """
+    Writes lines of a Postgres or MySQL dump into a directory of files.
+    """
+    #: Format of the data files, recorded into the manifest.
+    data_format = "sql"
+
+    #: Dialects of the dumps which can be written.
+    dialects = ("postgres", "mysql")
+
+    #: Name of the file containing the statements preceding the data.
+    pre_data_filename = "pre-data.sql"
+
+    #: Name of the file containing the statements following the data.
+    post_data_filename = "post-data.sql"
+
+    #: Extension of the data files.
+    data_extension = ".sql"
+
+    def __init__(
+        self,
+        directory,
+        shard_size=None,
+        identity=None,
+        resume=False,
+    ):
+        """
+        :param directory: Path to the directory, which is created if it does
+                          not exist. Existing directory must be empty,
+                          unless resuming.
+        :type directory: str
+
+        :param shard_size: Size in bytes after which the data of a table
+                           continues in a new file, or None to write the
+                           data of each table into a single file.
+        :type shard_size: int|None
+
+        :param identity: Source, configuration and secret of the run, as
+                         returned by `get_run_identity`, recorded into the
+                         journal. If omitted, no journal is written.
+        :type identity: dict|None
+
+        :param resume: Whether to resume an interrupted run writing into
+                       the directory, which must have had the same
+                       identity and shard size.
+        :type resume: bool
+        """
+        if shard_size is not None and shard_size < 1:
+            raise ValueError("Shard size must be positive")
+        if resume:
+            if identity is None:
+                raise ValueError(
+                    "Identity of the run is required for resuming")
+            if not os.path.isdir(directory):
+                raise ValueError("Output directory does not exist: %s" % (
+                    directory,))
+        elif not os.path.isdir(directory):
+            os.makedirs(directory)
+        elif os.listdir(directory):
+            raise ValueError(
+                "Output directory is not empty: %s" % (directory,))
+
+        self.directory = directory
+        self.shard_size = shard_size
+        self.filenames = set([
+            self.pre_data_filename,
+            self.post_data_filename,
+            MANIFEST_FILENAME,
+            JOURNAL_FILENAME,
+        ])
+        # Journal records of the completed tables of the interrupted run
+        # which have not been reached yet, mapped by schema and name of the
+        # tables.
+        self.resumable = OrderedDict()
+        # Journal records of the tables written so far.
+        self.journal_records = []
+        self.journal = None
+        self.journal_header = None
+        if identity is not None:
+            self.journal_header = dict(
+                identity,
+                version=JOURNAL_VERSION,
+                format=self.data_format,
+                shard_size=shard_size,
+            )
+            if resume:
+                self.resumable = self._load_journal()
+            self._write_journal()
+        # Fingerprints of the tables, recorded into the journal.
+        self.fingerprints = {}
+        # Names of the tables which are copied from the source without
+        # sanitizing them, as they are resumed.
+        self.copied_tables = set()
+        self.pre_data = _File(self.directory, self.pre_data_filename)
+        self.post_data = None
+        # Dialect of the dump, detected from its first table data.
+        self.dialect = None
+        # Latest statement of each session setting preceding the data.
+        self.settings = OrderedDict()
+        # Tables in the order their data was written, with their files.
+        self.tables = []
+        self.table_key = None
+        # Whether the data of the current table is discarded, as the table
+        # is resumed.
+        self.skipping = False
+        self.shard = None
+        self.shard_header = None
+        self.shard_footer = None
+        self.copy_block = False
+        self.block = None
+        self.pending = ""
+        self.closed = False
+
+    def write(self, text):
+        """
+        Writes given text, which may end in the middle of a line.
+
+        :type text: str
+        """
+        lines = (self.pending + text).split("\n")
+        self.pending = lines.pop()
+        self.write_lines(lines)
+
+    def write_lines(self, lines):
+        """
+        Writes given lines, without trailing new lines.
+
+        :type lines: collections.Iterable[str]
+        """
+        for line in lines:
+            # Dump files are sanitized in blocks of multiple lines.
+            if "\n" in line:
+                self.write_lines(line.split("\n"))
+                continue
+            if self.copy_block:
+                if line == "\\.":
+                    self.copy_block = False
+                    self._close_shard()
+                else:
+                    self._write_data(line + "\n", 1)
+                continue
+
+            copy_line_match = COPY_LINE_PATTERN.match(line)
+            if copy_line_match:
+                self._start_data(
+                    "postgres",
+                    copy_line_match.group("schema"),
+                    copy_line_match.group("table"),
+                    parse_copy_column_names(copy_line_match.group("columns")),
+                    header=line,
+                    footer="\\.",
+                )
+                self.copy_block = True
+                continue
+
+            if line.startswith("INSERT INTO ") and self._write_insert(line):
+                continue
+            self._write_text(line)
+
+    def _write_insert(self, line):
+        # MySQL support is optional, so it is imported only for MySQL dumps.
+        from .dump import mysql
+        insert_into_match = mysql.INSERT_INTO_PATTERN.match(line)
+        if not insert_into_match:
+            return False
+        self._start_data(
+            "mysql",
+            None,
+            insert_into_match.group("table"),
+            mysql.parse_column_names(insert_into_match.group("columns")),
+        )
+        if not self.skipping:
+            self._write_data(line + "\n", mysql.count_rows([line]))
+        return True
+
+    def _write_text(self, line):
+        self._close_shard()
+        if self.block is not None:
+            # Blocks of triggers and routines, which may contain statements
+            # ending with semicolons, are written as whole.
+            self.block.append(line)
+            if line == "DELIMITER ;":
+                self._write_block()
+            return
+        if line == "DELIMITER ;;":
+            self.block = [line]
+            return
+        if self.dialect == "postgres":
+            self._write_post_data(line)
+            return
+        if self.dialect is None:
+            self._add_setting(line)
+        if line.startswith(SESSION_SETTING_PREFIX):
+            self._write_post_data(line)
+        self.pre_data.write(line + "\n")
+
+    def _write_block(self):
+        text = "".join(line + "\n" for line in self.block)
+        if any(TRIGGER_PATTERN.search(line) for line in self.block):
+            self._write_post_data(text[:-1])
+        else:
+            self.pre_data.write(text)
+        self.block = None
+
+    def _add_setting(self, line):
+        setting_match = SETTING_PATTERN.match(line)
+        if setting_match:
+            key = (
+                setting_match.group("name")
+                or setting_match.group("variable")
+            )
+        elif MYSQL_SETTING_PATTERN.match(line):
+            key = line
+        else:
+            return
+        self.settings.pop(key, None)
+        self.settings[key] = line
+
+    def _write_post_data(self, line):
+        if self.post_data is None:
+            self.post_data = self._open_file(self.post_data_filename)
+        self.post_data.write(line + "\n")
+
+    def _open_file(self, filename):
+        data_file = _File(self.directory, filename)
+        for line in self.get_header():
+            data_file.write(line + "\n")
+        return data_file
+
+    def get_header(self):
+        """
+        Returns the session settings written at the beginning of the data
+        files and the post-data file.
+
+        :rtype: list[str]
+        """
+        return list(self.settings.values())
+
+    def _start_data(
+        self,
+        dialect,
+        schema,
+        table,
+        columns,
+        header=None,
+        footer=None,
+    ):
+        if self.dialect is None:
+            if dialect not in self.dialects:
+                raise ValueError(
+                    "Dumps of %s cannot be written in %s format" % (
+                        dialect, self.data_format))
+            self.dialect = dialect
+        key = (schema, table, columns)
+        if key != self.table_key:
+            self._close_shard()
+            self._finish_table()
+            self.table_key = key
+            self.skipping = self._resume_table(schema, table, columns)
+            if not self.skipping:
+                if table in self.copied_tables:
+                    qualified_name = ".".join(
+                        name for name in (schema, table) if name)
+                    raise ValueError(
+                        "Data of table %s has not been sanitized, as a table "
+                        "of the same name was resumed" % (qualified_name,))
+                self.tables.append({
+                    "schema": schema,
+                    "table": table,
+                    "columns": list(columns),
+                    "files": [],
+                })
+        self.shard_header = header
+        self.shard_footer = footer
+
+    def _finish_table(self):
+        if self.table_key is None:
+            return
+        if not self.skipping and self.journal is not None:
+            (schema, table, _columns) = self.table_key
+            record = {
+                "dialect": self.dialect,
+                "fingerprint": self.fingerprints.get((schema, table)),
+                "table": self.tables[-1],
+            }
+            self.journal_records.append(record)
+            self.journal.write(
+                six.text_type(json.dumps(record, sort_keys=True)) + "\n")
+            self.journal.flush()
+        self.table_key = None
+        self.skipping = False
+
+    def _write_data(self, text, rows):
+        if self.skipping:
+            return
+        if self.shard is None:
+            table = self.tables[-1]
+            self.shard = self._open_file(self._get_data_filename(".".join(
+                name for name in (table["schema"], table["table"]) if name)))
+            if self.shard_header is not None:
+                self.shard.write(self.shard_header + "\n")
+        self.shard.write(text)
+        self.shard.rows += rows
+        if self.shard_size is not None and self.shard.size >= self.shard_size:
+            self._close_shard()
+
+    def _close_shard(self):
+        if self.shard is None:
+            return
+        if self.shard_footer is not None:
+            self.shard.write(self.shard_footer + "\n")
+        self.shard.close()
+        self._add_data_file(self.shard.describe(rows=True))
+        self.shard = None
+
+    def _add_data_file(self, description):
+        self.tables[-1]["files"].append(description)
+
+    def _get_data_filename(self, name):
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+        filename = name + self.data_extension
+        number = 1
+        while filename in self.filenames:
+            number += 1
+            filename = "%s.%d%s" % (name, number, self.data_extension)
+        self.filenames.add(filename)
+        return filename
+
+    def close(self):
+        """
+        Closes the files and writes the manifest.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.pending:
+            self.write_lines([self.pending])
+            self.pending = ""
+        if self.block is not None:
+            self._write_block()
+        self._close_shard()
+        self._finish_table()
+        # Tables of the interrupted run which were not reached again.
+        self._discard_resumable(list(self.resumable.values()))
+        if self.post_data is None:
+            self.post_data = self._open_file(self.post_data_filename)
+        self.pre_data.close()
+        self.post_data.close()
+        self.write_manifest()
+        if self.journal is not None:
+            self.journal.close()
+            os.remove(os.path.join(self.directory, JOURNAL_FILENAME))
+
+    def abort(self):
+        """
+        Closes the files without writing the manifest, so that the
+        incomplete directory is not restored. The journal is left in place
+        for resuming.
+        """
+        self.closed = True
+        data_files = (self.pre_data, self.post_data, self.shard, self.journal)
+        for data_file in data_files:
+            if data_file is not None:
+                data_file.close()
+        self.shard = None
+
+    def _load_journal(self):
+        path = os.path.join(self.directory, JOURNAL_FILENAME)
+        if not os.path.exists(path):
+            raise ValueError("No interrupted run to resume in %s" % (
+                self.directory,))
+        records = []
+        with io.open(path, "r", encoding="utf-8") as stream:
+            for line in stream:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Last record may have been written only partially.
+                    break
+        previous = records[0] if records else {}
+        for key in sorted(self.journal_header):
+            if previous.get(key) != self.journal_header[key]:
+                raise ValueError(
+                    "Cannot resume, %s differs from the interrupted run" % (
+                        key.replace("_", " "),))
+
+        resumable = OrderedDict()
+        for record in records[1:]:
+            if all(
+                _check_file(self.directory, description)
+                for description in record["table"]["files"]
+            ):
+                entry = record["table"]
+                resumable[(entry["schema"], entry["table"])] = record
+        # Everything else is written again.
+        kept = set(
+            description["file"]
+            for record in resumable.values()
+            for description in record["table"]["files"]
+        )
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if filename in kept or filename == JOURNAL_FILENAME:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        # Files of the completed tables keep their names.
+        self.filenames.update(kept)
+        return resumable
+
+    def _write_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+        path = os.path.join(self.directory, JOURNAL_FILENAME)
+        temporary_path = path + ".tmp"
+        records = (
+            [self.journal_header]
+            + self.journal_records
+            + list(self.resumable.values())
+        )
+        with io.open(temporary_path, "w", encoding="utf-8") as stream:
+            for record in records:
+                stream.write(
+                    six.text_type(json.dumps(record, sort_keys=True)) + "\n")
+        os.rename(temporary_path, path)
+        self.journal = io.open(path, "a", encoding="utf-8")
+
+    def _resume_table(self, schema, table, columns=None):
+        record = self.resumable.pop((schema, table), None)
+        if record is None:
+            return False
+        entry = record["table"]
+        if columns is not None and entry["columns"] != list(columns):
+            self._discard_resumable([record])
+            return False
+        if self.dialect is None:
+            self.dialect = record["dialect"]
+        self.tables.append(entry)
+        self.journal_records.append(record)
+        return True
+
+    def _discard_resumable(self, records):
+        if not records:
+            return
+        for record in records:
+            for description in record["table"]["files"]:
+                os.remove(os.path.join(self.directory, description["file"]))
+                self.filenames.discard(description["file"])
+            entry = record["table"]
+            self.resumable.pop((entry["schema"], entry["table"]), None)
+        if self.journal is not None and not self.closed:
+            self._write_journal()
+
+    def get_completed_tables(self, fingerprints):
+        """
+        Returns the tables completed by the interrupted run which are
+        resumed, and do not have to be dumped again.
+
+        :param fingerprints: Current fingerprints of the tables, mapped by
+                             schema and name of the tables, as returned by
+                             `get_table_fingerprints` of the dump backends.
+                             Tables which have changed since, or have no
+                             fingerprint, are dumped again. None if the
+                             source is a dump file, in which case the data
+                             of the returned tables is copied from the
+                             dump without sanitizing it, and discarded.
+        :type fingerprints: dict[tuple[str|None,str],str|None]|None
+
+        :rtype: list[tuple[str|None,str]]
+        """
+        self.fingerprints = fingerprints or {}
+        if fingerprints is not None:
+            self._discard_resumable([
+                record
+                for (key, record) in list(self.resumable.items())
+                if fingerprints.get(key) is None
+                or fingerprints[key] != record["fingerprint"]
+            ])
+        completed = list(self.resumable)
+        if fingerprints is None:
+            self.copied_tables = set(table for (_schema, table) in completed)
+        return completed
+
+    def add_completed_table(self, schema, table):
+        """
+        Reuses the files of a table returned by `get_completed_tables`, at
+        the position its data would have been written at.
+
+        :type schema: str|None
+        :type table: str
+        """
+        self._close_shard()
+        self._finish_table()
+        if not self._resume_table(schema, table):
+            raise ValueError("Table %s cannot be resumed" % (
+                ".".join(name for name in (schema, table) if name),))
+        self.table_key = (schema, table, tuple(self.tables[-1]["columns"]))
+        self.skipping = True
+
+    def get_manifest(self):
+        """
+        Constructs the manifest of the written files.
+
+        :rtype: dict
+        """
+        return {
+            "version": MANIFEST_VERSION,
+            "format": self.data_format,
+            "dialect": self.dialect,
+            "pre_data": self.pre_data.describe(),
+            "post_data": self.post_data.describe(),
+            "tables": self.tables,
+        }
+
+    def write_manifest(self):
+        data = json.dumps(self.get_manifest(), indent=2, sort_keys=True)
+        with io.open(
+            os.path.join(self.directory, MANIFEST_FILENAME),
+            "w",
+            encoding="utf-8",
+        ) as stream:
+            stream.write(data + "\n")
+
+
+class _File(object):
+    """
+    File of the directory, with the size and checksum of its contents.
+    """
+    def __init__(self, directory, filename):
+        self.filename = filename
+        self.stream = io.open(os.path.join(directory, filename), "wb")
+        self.checksum = hashlib.sha256()
+        self.size = 0
+        self.rows = 0
+
+    def write(self, text):
+        data = text.encode("utf-8")
+        self.stream.write(data)
+        self.checksum.update(data)
+        self.size += len(data)
+
+    def close(self):
+        self.stream.close()
+
+    def describe(self, rows=False):
+        description = {
+            "file": self.filename,
+            "bytes": self.size,
+            "sha256": self.checksum.hexdigest(),
+        }
+        if rows:
+            description["rows"] = self.rows
+        return description
+
+
+def _check_file(directory, description):
+    path = os.path.join(directory, description["file"])
+    if not os.path.isfile(path):
+        return False
+    (size, checksum, _lines) = get_checksum(path)
+    return (size, checksum) == (description["bytes"], description["sha256"])
+
+
+def get_run_identity(url, config, secret_key):
+    """
+    Describes the source, the configuration and the secret of a run, which
+    must be the same for resuming it.
+
+    :param url: URL of the database or the dump file.
+    :type url: str
+
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param secret_key: Fixed session secret of the run, or None if it is
+                       random.
+    :type secret_key: bytes|None
+
+    :rtype: dict
+    """
+    parsed_url = urlparse.urlparse(url)
+    if parsed_url.scheme == "file":
+        path = os.path.abspath(get_path(parsed_url))
+        stat = os.stat(path)
+        source = [path, stat.st_size, stat.st_mtime]
+    else:
+        # Credentials are left out of the journal.
+        source = "%s://%s%s" % (
+            parsed_url.scheme,
+            parsed_url.netloc.rpartition("@")[2],
+            parsed_url.path,
+        )
+    return {
+        "source": source,
+        "config": get_config_fingerprint(config),
+        "secret": (
+            hashlib.sha256(secret_key).hexdigest()[:16] if secret_key else None
+        ),
+    }
+
+
+def get_checksum(path):
+    """
+    Computes size and checksum of a file, as recorded into the manifest.
+
+    :type path: str
+
+    :return: Size of the file in bytes, SHA-256 checksum of its contents as
+             hexadecimal string and number of lines in it.
+    :rtype: tuple[int,str,int]
+    """
+    checksum = hashlib.sha256()
+    size = 0
+    lines = 0
+    with io.open(path, "rb") as stream:
+        while True:
+            block = stream.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            checksum.update(block)
+            size += len(block)
+            lines += block.count(b"\n")
+    return (size, checksum.hexdigest(), lines)
+
+
+def load_manifest(directory):
+    """
+    Reads the manifest of a directory written by `DirectoryWriter`.
+
+    :param directory: Path to the directory.
+    :type directory: str
+
+    :rtype: dict
+    """
+    path = os.path.join(directory, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        raise ValueError("Manifest is missing from the directory: %s" % (
+            directory,))
+    with io.open(path, "r", encoding="utf-8") as stream:
+        manifest = json.load(stream)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError("Unsupported manifest version: %s" % (
+            manifest.get("version"),))
+    return manifest
+
+
+def verify_directory(directory, manifest):
+    """
+    Checks that the sizes and checksums of the files of a directory match
+    its manifest.
+
+    :param directory: Path to the directory.
+    :type directory: str
+
+    :type manifest: dict
+
+    :raises ValueError: If a file is missing or differs from the manifest.
+    """
+    descriptions = [manifest["pre_data"], manifest["post_data"]]
+    for table in manifest["tables"]:
+        descriptions.extend(table["files"])
+    for description in descriptions:
+        if not os.path.isfile(os.path.join(directory, description["file"])):
+            raise ValueError("File is missing: %s" % (description["file"],))
+        if not _check_file(directory, description):
+            raise ValueError("Checksum mismatch: %s" % (description["file"],))
@@ -2,13 +2,18 @@
 
 from __future__ import unicode_literals
 
+import contextlib
+import functools
 import importlib
+from collections import namedtuple
 
 from six.moves.urllib import parse as urlparse
 
 from .. import session
+from ..writer import write_lines
 
 SUPPORTED_DATABASE_MODULES = {
+    "file": "database_sanitizer.dump.files",
     "mysql": "database_sanitizer.dump.mysql",
     "postgres": "database_sanitizer.dump.postgres",
     "postgresql": "database_sanitizer.dump.postgres",
@@ -21,7 +26,63 @@ for scheme in SUPPORTED_DATABASE_MODULES.keys():
     urlparse.uses_netloc.append(scheme)
 
 
-def run(url, output, config):
+#: Chunk containing lines which are not table data, such as schema
+#: definitions. These are passed through as-is.
+CHUNK_TEXT = "text"
+
+#: Chunk marking the beginning of data section of a table. With Postgres it
+#: contains the `COPY` statement, with MySQL it's empty.
+CHUNK_DATA_START = "start"
+
+#: Chunk containing data lines of a table which may need sanitation.
+CHUNK_DATA = "data"
+
+#: Chunk marking the end of data section of a table. With Postgres it
+#: contains the `\.` terminator, with MySQL it's empty.
+CHUNK_DATA_END = "end"
+
+#: Approximate maximum number of characters collected into a single data
+#: chunk by the dump parsers.
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+#: Piece of a database dump produced by the dump parsers. Table name and
+#: column names are None for chunks of kind `CHUNK_TEXT`.
+Chunk = namedtuple("Chunk", ("kind", "table", "columns", "lines"))
+
+
+def get_database_module(url):
+    """
+    Imports the dump backend module supporting scheme of given URL.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :rtype: module
+    """
+    db_module_path = SUPPORTED_DATABASE_MODULES.get(url.scheme)
+    if not db_module_path:
+        raise ValueError("Unsupported database scheme: '%s'" % (url.scheme,))
+    return importlib.import_module(db_module_path)
+
+
+def run(
+    url,
+    output,
+    config,
+    engine=None,
+    jobs=None,
+    plan=False,
+    previous_stats=None,
+    stats=None,
+    progress=None,
+    metrics=None,
+    profiler=None,
+    incremental=None,
+    secret_key=None,
+    value_cache=None,
+    governor=None,
+    temp_dir=None,
+):
     """
     Extracts database dump from given database URL and outputs sanitized
     copy of it into given stream.
@@ -29,19 +90,199 @@ def run(url, output, config):
     :param url: URL to the database which is to be sanitized.
     :type url: str
 
-    :param output: Stream where sanitized copy of the database dump will be
-                   written into.
-    :type output: file
+    :param output: Text stream, background writer or target loader where
+                   sanitized copy of the database dump will be written into.
+    :type output: file|database_sanitizer.writer.BackgroundWriter|
+                  database_sanitizer.loader.PostgresLoader
 
     :param config: Optional sanitizer configuration to be used for sanitation
                    of the values stored in the database.
     :type config: database_sanitizer.config.Configuration|None
+
+    :param engine: Optional engine used to execute the sanitation of table
+                   data. If omitted, the data is sanitized serially.
+    :type engine: database_sanitizer.engine.SerialEngine|None
+
+    :param jobs: Number of worker processes dumping the tables in parallel
+                 table mode. If omitted, the database is dumped with a single
+                 dump process, unless planning or the configuration has a
+                 subset of the database, which requires the parallel table
+                 mode, in which case it defaults to number of CPUs.
+    :type jobs: int|None
+
+    :param plan: If True, only the plan of the parallel table mode is written
+                 into the output.
+    :type plan: bool
+
+    :param previous_stats: Path to statistics file of a previous run, used
+                           for planning the parallel table mode.
+    :type previous_stats: str|None
+
+    :param stats: Optional collector of statistics of the run.
+    :type stats: database_sanitizer.stats.RunStatistics|None
+
+    :param progress: Optional reporter of progress of the run.
+    :type progress: database_sanitizer.progress.ProgressReporter|None
+
+    :param metrics: Optional writer of metrics of the run.
+    :type metrics: database_sanitizer.metrics.MetricsWriter|None
+
+    :param profiler: Optional profiler of the sanitizers.
+    :type profiler: database_sanitizer.profiling.SanitizerProfiler|None
+
+    :param incremental: Path to cache directory of sanitized table data
+                        from the previous runs, which is reused for the
+                        tables that have not changed since. Implies the
+                        parallel table mode.
+    :type incremental: str|None
+
+    :param secret_key: Fixed session secret. If omitted, a new random
+                       secret is used, unless persisted into the cache
+                       directory of the incremental mode.
+    :type secret_key: bytes|None
+
+    :param value_cache: Optional persistent cache of sanitized values, which
+                        is closed at the end of the run.
+    :type value_cache: database_sanitizer.cache.ValueCache|None
+
+    :param governor: Optional limits on the load caused to the source
+                     database.
+    :type governor: database_sanitizer.governor.SourceGovernor|None
+
+    :param temp_dir: Directory of the temporary files of the parallel table
+                     mode. If omitted, the default temporary directory is
+                     used.
+    :type temp_dir: str|None
+
+    The statistics collector of the progress reporter or the metrics writer
+    is used if `stats` is omitted.
     """
     parsed_url = urlparse.urlparse(url)
-    db_module_path = SUPPORTED_DATABASE_MODULES.get(parsed_url.scheme)
-    if not db_module_path:
-        raise ValueError("Unsupported database scheme: '%s'" % (parsed_url.scheme,))
-    db_module = importlib.import_module(db_module_path)
-    session.reset()
-    for line in db_module.sanitize(url=parsed_url, config=config):
-        output.write(line + "\n")
+    db_module = get_database_module(parsed_url)
+    session.reset(secret_key)
+    if value_cache is not None:
+        value_cache.instrument_config(config)
+    if profiler is not None:
+        profiler.instrument_config(config)
+    if stats is None:
+        stats = getattr(progress or metrics, "statistics", None)
+    run_dump = functools.partial(
+        _run, db_module, parsed_url, output, config, engine, jobs, plan,
+        previous_stats, stats, incremental, secret_key, temp_dir)
+    if stats is None:
+        with _closing(value_cache), _governing(governor), \
+                _reporting(profiler):
+            run_dump()
+        return
+    stats.instrument_config(config)
+    with _closing(value_cache), _governing(governor), stats.collect():
+        if progress is not None and hasattr(db_module, "get_table_sizes") \
+                and not plan:
+            progress.set_estimates(
+                _get_estimates(db_module, parsed_url, config, progress))
+        with _reporting(progress), _reporting(metrics), _reporting(profiler):
+            run_dump()
+
+
+def _get_estimates(db_module, parsed_url, config, progress):
+    """
+    Reads the row estimates of the tables for the progress reports.
+
+    The estimates are optional, so if they cannot be read from the catalog
+    of the database, a warning is written into the stream of the reports
+    and the progress is reported without totals.
+
+    :rtype: list[database_sanitizer.scheduler.TableSize]
+    """
+    try:
+        return db_module.get_table_sizes(parsed_url, config)
+    except Exception as error:
+        progress.stream.write(
+            "Warning: Cannot read the row estimates of the tables: %s\n" % (
+                error,))
+        return []
+
+
+@contextlib.contextmanager
+def _reporting(reporter):
+    if reporter is None:
+        yield
+    else:
+        with reporter.report():
+            yield
+
+
+@contextlib.contextmanager
+def _governing(governor):
+    if governor is None:
+        yield
+    else:
+        with governor.govern():
+            yield
+
+
+@contextlib.contextmanager
+def _closing(resource):
+    try:
+        yield
+    finally:
+        if resource is not None:
+            resource.close()
+
+
+def _run(
+    db_module,
+    parsed_url,
+    output,
+    config,
+    engine,
+    jobs,
+    plan,
+    previous_stats,
+    stats,
+    incremental,
+    secret_key,
+    temp_dir,
+):
+    subset = bool(config and config.subset_tables)
+    if jobs is not None or plan or incremental or subset:
+        if subset and not hasattr(db_module, "get_foreign_keys"):
+            raise ValueError(
+                "Subsetting is not supported with '%s' URLs" % (
+                    parsed_url.scheme,
+                ))
+        if not hasattr(db_module, "get_table_sizes"):
+            raise ValueError(
+                "Parallel table mode is not supported with '%s' URLs" % (
+                    parsed_url.scheme,
+                ))
+        from ..engine import get_worker_count
+        from .tables import run_tables
+        run_tables(
+            db_module=db_module,
+            url=parsed_url,
+            output=output,
+            config=config,
+            jobs=get_worker_count(jobs),
+            dry_run=plan,
+            previous_stats=previous_stats,
+            incremental=incremental,
+            secret_key=secret_key,
+            temp_dir=temp_dir,
+        )
+        return
+    kwargs = {}
+    if hasattr(output, "get_completed_tables"):
+        completed = output.get_completed_tables(None)
+        if completed:
+            if parsed_url.scheme != "file":
+                raise ValueError(
+                    "Resuming requires a dump file or the parallel table mode")
+            # Data of the completed tables is discarded by the output.
+            kwargs["copied_tables"] = set(
+                table for (_schema, table) in completed)
+    lines = db_module.sanitize(
+        url=parsed_url, config=config, engine=engine, **kwargs)
+    if stats is not None:
+        lines = stats.track_output(lines)
+    write_lines(output, lines)
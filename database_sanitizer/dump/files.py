@@ -0,0 +1,768 @@
+# -*- coding: utf-8 -*-
+"""
+Sanitation of existing dump files, given as `file://` URLs.
+
+The dump file is memory mapped and scanned for the sections containing
+table data, i.e. the data following `COPY` statements of a `pg_dump`
+output or runs of `INSERT INTO` statements of a `mysqldump` output. Only
+the data sections are parsed and sanitized; the rest of the file is
+copied from the mapped buffer as-is. When a parallel engine is selected,
+data sections are split into blocks which worker processes read and
+sanitize straight from their own mapping of the file.
+
+Compressed dump files (gzip, and zstd or lz4 if the respective packages
+are installed) are decompressed into a temporary file first, since
+compressed data cannot be mapped.
+
+The format of the dump is detected from its contents, or it can be given
+with `format` query parameter of the URL, e.g.
+``file:///path/to/dump.sql?format=mysql``.
+
+Scanning a large dump takes a while, so the sections found by the scan can
+be saved into an index file next to the dump (see `build_index`). When an
+up to date index exists, it is used instead of scanning the dump again.
+The path of the index can be given with `index` query parameter of the
+URL, in which case the index is also written during the sanitation if it
+does not exist yet.
+"""
+
+from __future__ import unicode_literals
+
+import contextlib
+import gzip
+import importlib
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from collections import deque, namedtuple
+
+import six
+from six.moves.urllib import parse as urlparse
+
+from .. import session
+from ..engine import (
+    LineSanitizerCache,
+    SerialEngine,
+    get_multiprocessing_context,
+    get_worker_count,
+    init_worker,
+    worker_state,
+)
+from ..stats import track_blocks, watch_queue
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover (optional dependency)
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover (optional dependency)
+    lz4_frame = None
+
+#: Dump backends which can parse dump files, mapped by format names.
+FORMATS = {
+    "mysql": "database_sanitizer.dump.mysql",
+    "postgres": "database_sanitizer.dump.postgres",
+}
+
+#: Default maximum size of a data block sanitized at once, in bytes.
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+
+#: Number of blocks in flight per worker process.
+PENDING_PER_WORKER = 2
+
+#: Number of bytes inspected when detecting the format of a dump.
+SNIFF_SIZE = 64 * 1024
+
+#: Section of a dump file containing data of a table, as byte offsets.
+#: With `pg_dump` output ``start`` is the beginning of the `COPY` statement,
+#: ``data_start`` and ``data_end`` surround the data lines and ``end`` is
+#: the end of the `\.` terminator. With `mysqldump` output the section
+#: consists from `INSERT INTO` statements only, so ``start`` equals
+#: ``data_start`` and ``end`` equals ``data_end``.
+Section = namedtuple(
+    "Section",
+    ("table", "columns", "start", "data_start", "data_end", "end"),
+)
+
+#: Block of a dump file to be output, as byte offsets. ``table`` and
+#: ``columns`` are None for blocks which are copied as-is.
+Block = namedtuple("Block", ("offset", "length", "table", "columns"))
+
+#: Index of a dump file, i.e. format of the dump and its sections
+#: containing table data. ``size`` and ``mtime`` are those of the dump file
+#: when it was indexed, and are used to detect outdated indexes.
+Index = namedtuple("Index", ("format", "size", "mtime", "sections"))
+
+#: Version of the index file format.
+INDEX_VERSION = 1
+
+#: Extension appended to path of a dump file to get path of its index.
+INDEX_EXTENSION = ".index"
+
+#: Magic bytes of the supported compression formats.
+COMPRESSION_MAGIC = (
+    (b"\x1f\x8b", "gzip"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+    (b"\x04\x22\x4d\x18", "lz4"),
+)
+
+
+def sanitize(url, config, engine=None, copied_tables=None):
+    """
+    Sanitizes a dump file.
+
+    :param url: `file://` URL of the dump file, parsed by Python's URL
+                parser.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :param config: Optional sanitizer configuration to be used for sanitation
+                   of the values stored in the dump.
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param engine: Optional engine. If it is a parallel engine, the data
+                   blocks are sanitized by its number of worker processes,
+                   otherwise in the calling process.
+    :type engine: database_sanitizer.engine.SerialEngine|None
+
+    :param copied_tables: Names of the tables whose data is copied without
+                          sanitizing it, as the output already has it.
+    :type copied_tables: collections.Container[str]|None
+
+    :return: Iterator of sanitized text, each of which is to be followed by
+             a new line in the output. Unlike with the other backends,
+             multiple lines are returned at once.
+    :rtype: collections.Iterator[str]
+    """
+    if url.scheme != "file":
+        raise ValueError("Unsupported database type: '%s'" % (url.scheme,))
+    path = get_path(url)
+    query = urlparse.parse_qs(url.query)
+    dump_format = query.get("format", [None])[0]
+    index_path = query.get("index", [None])[0]
+
+    with open_dump_file(path) as (buffer, mapped_path):
+        index = load_index(index_path or get_index_path(path), path)
+        if index and dump_format in (None, index.format):
+            backend = get_backend(buffer, index.format)
+            sections = index.sections
+        else:
+            backend = get_backend(buffer, dump_format)
+            sections = scan(buffer, backend)
+            if index_path:
+                sections = _save_scanned(
+                    sections, index_path, path, get_format(backend))
+        blocks = track_blocks(
+            iter_blocks(
+                buffer, sections, config, backend,
+                copied_tables=copied_tables or (),
+            ),
+            buffer,
+            backend.__name__,
+        )
+        for text in sanitize_blocks(
+                buffer, mapped_path, blocks, config, backend, engine):
+            yield text
+
+
+def get_path(url):
+    """
+    Extracts path of the dump file from a `file://` URL.
+
+    :type url: six.moves.urllib.parse.ParseResult
+    :rtype: str
+    """
+    path = urlparse.unquote(url.netloc + url.path)
+    if not path:
+        raise ValueError("Path of the dump file is missing from the URL")
+    return path
+
+
+def get_compression(path):
+    """
+    Detects compression of given file from its magic bytes.
+
+    :type path: str
+    :rtype: str|None
+    """
+    with open(path, "rb") as stream:
+        head = stream.read(4)
+    for (magic, compression) in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def open_decompressed(path, compression):
+    """
+    Opens given compressed file for reading decompressed data.
+
+    :type path: str
+    :type compression: str
+    :rtype: file
+    """
+    if compression == "gzip":
+        return gzip.open(path, "rb")
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError(
+                "Reading zstd compressed dumps requires the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(path, "rb"),
+            read_across_frames=True,
+            closefd=True,
+        )
+    if lz4_frame is None:
+        raise RuntimeError(
+            "Reading lz4 compressed dumps requires the lz4 package")
+    return lz4_frame.open(path, "rb")
+
+
+@contextlib.contextmanager
+def open_dump_file(path):
+    """
+    Memory maps given dump file, decompressing it into a temporary file
+    first if necessary.
+
+    :param path: Path to the dump file.
+    :type path: str
+
+    :return: The mapped buffer and path of the mapped file.
+    :rtype: tuple[mmap.mmap|bytes,str]
+    """
+    directory = None
+    compression = get_compression(path)
+    try:
+        if compression:
+            directory = tempfile.mkdtemp(prefix="database-sanitizer-")
+            mapped_path = os.path.join(directory, "dump.sql")
+            with open_decompressed(path, compression) as source:
+                with open(mapped_path, "wb") as target:
+                    shutil.copyfileobj(source, target, 1024 * 1024)
+        else:
+            mapped_path = path
+
+        with open(mapped_path, "rb") as stream:
+            if os.fstat(stream.fileno()).st_size == 0:
+                # Empty files cannot be mapped.
+                yield b"", mapped_path
+                return
+            buffer = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield buffer, mapped_path
+            finally:
+                buffer.close()
+    finally:
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def get_backend(buffer, dump_format=None):
+    """
+    Determines the dump backend module able to parse given dump.
+
+    :param buffer: Contents of the dump file.
+    :type buffer: mmap.mmap|bytes
+
+    :param dump_format: Format of the dump, one of `FORMATS`. If omitted,
+                        the format is detected from the contents.
+    :type dump_format: str|None
+
+    :rtype: module
+    """
+    if dump_format is None:
+        head = buffer[:SNIFF_SIZE]
+        if b"-- MySQL dump" in head or b"\nINSERT INTO `" in head:
+            dump_format = "mysql"
+        elif b"PostgreSQL database dump" in head or b"\nCOPY " in head:
+            dump_format = "postgres"
+        else:
+            raise ValueError(
+                "Unable to detect format of the dump file, use format "
+                "parameter of the URL")
+    if dump_format not in FORMATS:
+        raise ValueError("Unsupported dump format: '%s'" % (dump_format,))
+    return importlib.import_module(FORMATS[dump_format])
+
+
+def get_format(backend):
+    """
+    :param backend: Dump backend module.
+    :type backend: module
+
+    :return: Name of the format of the dumps produced by given backend.
+    :rtype: str
+    """
+    for (dump_format, module_name) in six.iteritems(FORMATS):
+        if module_name == backend.__name__:
+            return dump_format
+    raise ValueError("Unsupported dump backend: '%s'" % (backend.__name__,))
+
+
+def get_index_path(path):
+    """
+    :param path: Path to a dump file.
+    :type path: str
+
+    :return: Default path of the index of given dump file.
+    :rtype: str
+    """
+    return path + INDEX_EXTENSION
+
+
+def build_index(path, dump_format=None, index_path=None):
+    """
+    Scans a dump file and saves the found sections into an index file, so
+    that later sanitations of the dump do not have to scan it again.
+
+    :param path: Path to the dump file.
+    :type path: str
+
+    :param dump_format: Format of the dump, one of `FORMATS`. If omitted,
+                        the format is detected from the contents.
+    :type dump_format: str|None
+
+    :param index_path: Path of the index file. Defaults to path of the dump
+                       file with `INDEX_EXTENSION` appended.
+    :type index_path: str|None
+
+    :rtype: Index
+    """
+    with open_dump_file(path) as (buffer, _mapped_path):
+        backend = get_backend(buffer, dump_format)
+        sections = list(scan(buffer, backend))
+    return save_index(
+        index_path or get_index_path(path),
+        path,
+        get_format(backend),
+        sections,
+    )
+
+
+def save_index(index_path, path, dump_format, sections):
+    """
+    Writes an index of a dump file.
+
+    :param index_path: Path of the index file.
+    :type index_path: str
+
+    :param path: Path to the indexed dump file.
+    :type path: str
+
+    :type dump_format: str
+    :type sections: list[Section]
+    :rtype: Index
+    """
+    stat = os.stat(path)
+    index = Index(
+        format=dump_format,
+        size=stat.st_size,
+        mtime=stat.st_mtime,
+        sections=sections,
+    )
+    data = {
+        "version": INDEX_VERSION,
+        "format": index.format,
+        "size": index.size,
+        "mtime": index.mtime,
+        "sections": [
+            [section.table, list(section.columns)] + list(section[2:])
+            for section in sections
+        ],
+    }
+    # Written into a temporary file first, so that concurrent sanitations
+    # never see an incomplete index.
+    temporary_path = "%s.%d.tmp" % (index_path, os.getpid())
+    with open(temporary_path, "w") as stream:
+        json.dump(data, stream)
+    os.rename(temporary_path, index_path)
+    return index
+
+
+def load_index(index_path, path):
+    """
+    Reads an index of a dump file, if it exists and is up to date.
+
+    :param index_path: Path of the index file.
+    :type index_path: str
+
+    :param path: Path to the indexed dump file.
+    :type path: str
+
+    :return: The index, or None if there is no index or it is outdated.
+    :rtype: Index|None
+    """
+    try:
+        with open(index_path, "r") as stream:
+            data = json.load(stream)
+    except (IOError, OSError):
+        return None
+    except ValueError:
+        raise ValueError("Invalid index file: '%s'" % (index_path,))
+
+    if not isinstance(data, dict) or data.get("version") != INDEX_VERSION:
+        return None
+    stat = os.stat(path)
+    if data.get("size") != stat.st_size or data.get("mtime") != stat.st_mtime:
+        return None
+    return Index(
+        format=data["format"],
+        size=data["size"],
+        mtime=data["mtime"],
+        sections=[
+            Section(item[0], tuple(item[1]), *item[2:])
+            for item in data["sections"]
+        ],
+    )
+
+
+def _save_scanned(sections, index_path, path, dump_format):
+    """
+    Passes through sections found by a scan, saving them into an index
+    once the scan is complete.
+    """
+    scanned = []
+    for section in sections:
+        scanned.append(section)
+        yield section
+    save_index(index_path, path, dump_format, scanned)
+
+
+def find_line(buffer, prefix, position, end=None):
+    """
+    Finds the next line starting with given prefix.
+
+    :param buffer: Contents of the dump file.
+    :type buffer: mmap.mmap|bytes
+
+    :param prefix: The prefix to look for.
+    :type prefix: bytes
+
+    :param position: Offset to start looking from, at the beginning of a
+                     line.
+    :type position: int
+
+    :param end: Offset to stop looking at, defaults to the end of the
+                buffer.
+    :type end: int|None
+
+    :return: Offset of the line, or -1 if there is no such line.
+    :rtype: int
+    """
+    if end is None:
+        end = len(buffer)
+    if buffer[position:position + len(prefix)] == prefix:
+        return position
+    index = buffer.find(b"\n" + prefix, position, end)
+    return index + 1 if index >= 0 else -1
+
+
+def find_line_end(buffer, position):
+    """
+    Finds the end of the line at given offset, including the new line.
+
+    :type buffer: mmap.mmap|bytes
+    :type position: int
+    :rtype: int
+    """
+    index = buffer.find(b"\n", position)
+    return index + 1 if index >= 0 else len(buffer)
+
+
+def scan(buffer, backend):
+    """
+    Scans a dump for sections containing table data.
+
+    :param buffer: Contents of the dump file.
+    :type buffer: mmap.mmap|bytes
+
+    :param backend: Dump backend module which produced the dump.
+    :type backend: module
+
+    :rtype: collections.Iterator[Section]
+    """
+    if backend.__name__ == FORMATS["mysql"]:
+        return _scan_mysql(buffer, backend)
+    return _scan_postgres(buffer, backend)
+
+
+def _scan_postgres(buffer, backend):
+    size = len(buffer)
+    position = 0
+    while position < size:
+        start = find_line(buffer, b"COPY ", position)
+        if start < 0:
+            return
+        data_start = find_line_end(buffer, start)
+        header = buffer[start:data_start].decode("utf-8").rstrip("\n")
+        match = backend.COPY_LINE_PATTERN.match(header)
+        if not match:
+            position = data_start
+            continue
+
+        data_end = find_line(buffer, b"\\.\n", data_start)
+        if data_end < 0:
+            # The terminator may be on the last line, without a new line.
+            if buffer[size - 3:] == b"\n\\." or buffer[data_start:] == b"\\.":
+                data_end = size - 2
+            else:
+                raise ValueError(
+                    "Missing end of data of table '%s'" % (
+                        match.group("table"),
+                    ),
+                )
+        end = find_line_end(buffer, data_end)
+
+        yield Section(
+            table=match.group("table"),
+            columns=backend.parse_column_names(match.group("columns")),
+            start=start,
+            data_start=data_start,
+            data_end=data_end,
+            end=end,
+        )
+        position = end
+
+
+def _scan_mysql(buffer, backend):
+    size = len(buffer)
+    position = 0
+    current = None
+    while position < size:
+        start = find_line(buffer, b"INSERT INTO `", position)
+        if start < 0:
+            break
+        end = find_line_end(buffer, start)
+        values_start = buffer.find(b") VALUES (", start, end)
+        if values_start < 0:
+            position = end
+            continue
+        head = buffer[start:values_start + 1].decode("utf-8")
+        match = backend.INSERT_INTO_HEAD_PATTERN.match(head)
+        if not match:
+            # Statements without column names are passed through, like
+            # when sanitizing the output of `mysqldump`.
+            position = end
+            continue
+        table = match.group("table")
+        key = (table, match.group("columns"))
+
+        if (
+            current is not None
+            and current[0] == key
+            and current[1].end == start
+        ):
+            current = (key, current[1]._replace(data_end=end, end=end))
+        else:
+            if current is not None:
+                yield current[1]
+            current = (key, Section(
+                table=table,
+                columns=backend.parse_column_names(key[1]),
+                start=start,
+                data_start=start,
+                data_end=end,
+                end=end,
+            ))
+        position = end
+    if current is not None:
+        yield current[1]
+
+
+def iter_blocks(
+    buffer,
+    sections,
+    config,
+    backend,
+    block_size=DEFAULT_BLOCK_SIZE,
+    copied_tables=(),
+):
+    """
+    Divides a dump into blocks to be copied as-is or to be sanitized.
+
+    Data of tables configured to be skipped is left out completely, just
+    like when sanitizing the output of the dump utilities.
+
+    :param buffer: Contents of the dump file.
+    :type buffer: mmap.mmap|bytes
+
+    :param sections: Sections of the dump containing table data, as
+                     returned by `scan`.
+    :type sections: collections.Iterable[Section]
+
+    :param config: Sanitizer configuration.
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param backend: Dump backend module which produced the dump.
+    :type backend: module
+
+    :param block_size: Maximum size of a block, unless a single line is
+                       larger.
+    :type block_size: int
+
+    :param copied_tables: Names of the tables whose data is copied as-is.
+    :type copied_tables: collections.Container[str]
+
+    :rtype: collections.Iterator[Block]
+    """
+    skipped = config.skip_rows_for_tables if config else ()
+    position = 0
+    for section in sections:
+        if section.table in skipped:
+            for block in _split(
+                buffer, position, section.start, None, None, block_size,
+            ):
+                yield block
+            position = section.end
+            continue
+
+        if (
+            section.table in copied_tables
+            or not backend.get_value_line_sanitizer(
+                config, section.table, section.columns)
+        ):
+            # Nothing to sanitize, so the data is copied as well.
+            continue
+
+        for block in _split(
+                buffer, position, section.data_start, None, None, block_size):
+            yield block
+        for block in _split(
+                buffer, section.data_start, section.data_end,
+                section.table, section.columns, block_size):
+            yield block
+        position = section.data_end
+
+    for block in _split(buffer, position, len(buffer), None, None, block_size):
+        yield block
+
+
+def _split(buffer, start, end, table, columns, block_size):
+    """
+    Splits given range of a dump into blocks at line boundaries.
+    """
+    while start < end:
+        split = end
+        if end - start > block_size:
+            index = buffer.rfind(b"\n", start, start + block_size)
+            if index >= 0:
+                split = index + 1
+            else:
+                split = min(find_line_end(buffer, start + block_size), end)
+        yield Block(start, split - start, table, columns)
+        start = split
+
+
+def sanitize_blocks(buffer, path, blocks, config, backend, engine=None):
+    """
+    Sanitizes given blocks of a dump, in worker processes if a parallel
+    engine has been given.
+
+    :param buffer: Contents of the dump file.
+    :type buffer: mmap.mmap|bytes
+
+    :param path: Path of the file mapped into the buffer, which the worker
+                 processes map by themselves.
+    :type path: str
+
+    :type blocks: collections.Iterable[Block]
+    :type config: database_sanitizer.config.Configuration|None
+    :type backend: module
+    :type engine: database_sanitizer.engine.SerialEngine|None
+
+    :return: Iterator of sanitized text of the blocks, without the trailing
+             new lines.
+    :rtype: collections.Iterator[str]
+    """
+    if engine is None or isinstance(engine, SerialEngine):
+        line_sanitizers = LineSanitizerCache(backend.__name__, config)
+        for block in blocks:
+            yield process_block(buffer, block, line_sanitizers)
+        return
+
+    workers = get_worker_count(engine.workers)
+    max_pending = workers * PENDING_PER_WORKER
+    pool = get_multiprocessing_context().Pool(
+        processes=workers,
+        initializer=init_file_worker,
+        initargs=(config, session.get_secret(), path, backend.__name__),
+    )
+    try:
+        # Either text of the blocks which are copied as-is, or results of
+        # the blocks being sanitized by the workers, in the original order.
+        pending = deque()
+        watch_queue("files", pending)
+        for block in blocks:
+            if block.table is None:
+                pending.append(process_block(buffer, block, None))
+            else:
+                pending.append(pool.apply_async(sanitize_block, (block,)))
+            while pending and (
+                len(pending) > max_pending
+                or isinstance(pending[0], six.text_type)
+                or pending[0].ready()
+            ):
+                yield _get_text(pending.popleft())
+        while pending:
+            yield _get_text(pending.popleft())
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _get_text(entry):
+    if isinstance(entry, six.text_type):
+        return entry
+    return entry.get()
+
+
+def process_block(buffer, block, line_sanitizers):
+    """
+    Decodes a block of a dump and sanitizes its lines, if it contains table
+    data.
+
+    :type buffer: mmap.mmap|bytes
+    :type block: Block
+
+    :param line_sanitizers: Line sanitizers of the dump backend.
+    :type line_sanitizers: database_sanitizer.engine.LineSanitizerCache|None
+
+    :return: Text of the block, without the trailing new line.
+    :rtype: str
+    """
+    text = buffer[block.offset:block.offset + block.length].decode("utf-8")
+    if text.endswith("\n"):
+        text = text[:-1]
+    if block.table is None:
+        return text
+    line_sanitizer = line_sanitizers.get(block.table, block.columns)
+    return "\n".join(line_sanitizer(line) for line in text.split("\n"))
+
+
+def init_file_worker(config, secret_key, path, backend):
+    """
+    Initializes a worker process sanitizing blocks of a dump file.
+    """
+    init_worker(config, secret_key)
+    worker_state["path"] = path
+    worker_state["buffer"] = None
+    worker_state["line_sanitizers"] = LineSanitizerCache(backend, config)
+
+
+def sanitize_block(block):
+    """
+    Sanitizes a block of the dump file in a worker process.
+
+    :type block: Block
+    :rtype: str
+    """
+    if worker_state["buffer"] is None:
+        with open(worker_state["path"], "rb") as stream:
+            worker_state["buffer"] = mmap.mmap(
+                stream.fileno(), 0, access=mmap.ACCESS_READ)
+    return process_block(
+        worker_state["buffer"], block, worker_state["line_sanitizers"])
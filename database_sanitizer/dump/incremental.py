@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of sanitized table data for incremental runs of the parallel table
+mode.
+
+Sanitized data of each table is kept in a cache directory together with a
+fingerprint of the table, read from the statistics of the database before
+the tables are dumped. On the next run the tables whose fingerprints have
+not changed are copied from the cache instead of being dumped again.
+
+Unless a fixed secret is given, the session secret is persisted into the
+cache directory, so that values sanitized in different runs are hashed
+consistently. The cached data is discarded whenever the secret or the
+configuration changes.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import json
+import os
+import uuid
+
+import six
+
+from .. import session
+from ..profiling import get_function_name
+from ..scheduler import format_table_name
+
+#: Version of the manifest file format.
+MANIFEST_VERSION = 1
+
+#: Name of the manifest file listing the cached tables.
+MANIFEST_FILENAME = "manifest.json"
+
+#: Name of the file containing the persisted session secret.
+SECRET_FILENAME = "secret"
+
+#: Name of the directory containing the sanitized data of the tables.
+SEGMENTS_DIRECTORY = "segments"
+
+
+class TableCache(object):
+    """
+    Directory of sanitized table data from previous runs.
+    """
+    def __init__(self, directory, config, fingerprints, secret=None):
+        """
+        :param directory: Path to the cache directory, created if missing.
+        :type directory: str
+
+        :type config: database_sanitizer.config.Configuration|None
+
+        :param fingerprints: Fingerprints of the tables of the current run,
+                             mapped by schema and name of the tables, as
+                             returned by `get_table_fingerprints` of the
+                             dump backends.
+        :type fingerprints: dict[tuple[str|None,str],str|None]
+
+        :param secret: Session secret of the run. If omitted, the secret
+                       persisted into the cache directory is used.
+        :type secret: bytes|None
+        """
+        self.directory = directory
+        self.fingerprints = fingerprints
+        self.segments_directory = os.path.join(directory, SEGMENTS_DIRECTORY)
+        if not os.path.isdir(self.segments_directory):
+            os.makedirs(self.segments_directory)
+        self.secret = secret or session.load_secret_file(
+            os.path.join(directory, SECRET_FILENAME))
+        self.config_fingerprint = get_config_fingerprint(config)
+        self.secret_fingerprint = hashlib.sha256(self.secret).hexdigest()[:16]
+        self.entries = self._load_entries()
+        # Entries of the current run, written into the manifest by `save`.
+        self.new_entries = {}
+
+    def _load_entries(self):
+        path = os.path.join(self.directory, MANIFEST_FILENAME)
+        try:
+            with io.open(path, "r", encoding="utf-8") as stream:
+                manifest = json.load(stream)
+        except (IOError, OSError, ValueError):
+            return {}
+        if not isinstance(manifest, dict) or \
+                manifest.get("version") != MANIFEST_VERSION or \
+                manifest.get("config") != self.config_fingerprint or \
+                manifest.get("secret") != self.secret_fingerprint:
+            return {}
+        return manifest.get("tables", {})
+
+    def get_segments(self, table):
+        """
+        :type table: database_sanitizer.scheduler.TableSize
+
+        :return: Paths to the files containing the sanitized data of given
+                 table from a previous run, or None if the table has changed
+                 since.
+        :rtype: list[str]|None
+        """
+        fingerprint = self.fingerprints.get((table.schema, table.table))
+        entry = self.entries.get(format_table_name(table))
+        if fingerprint is None or not entry or \
+                entry.get("fingerprint") != fingerprint:
+            return None
+        paths = [
+            os.path.join(self.segments_directory, name)
+            for name in entry.get("segments", [])
+        ]
+        if not all(os.path.isfile(path) for path in paths):
+            return None
+        self.new_entries[format_table_name(table)] = entry
+        return paths
+
+    def add_segment(self, table, path):
+        """
+        Moves a file containing sanitized data of given table into the
+        cache. Data of the tables without a fingerprint is removed instead.
+
+        :type table: database_sanitizer.scheduler.TableSize
+
+        :param path: Path to the file, in the same file system as the cache
+                     directory.
+        :type path: str
+        """
+        fingerprint = self.fingerprints.get((table.schema, table.table))
+        if fingerprint is None:
+            os.remove(path)
+            return
+        name = "%s.sql" % (uuid.uuid4().hex,)
+        os.rename(path, os.path.join(self.segments_directory, name))
+        entry = self.new_entries.setdefault(format_table_name(table), {
+            "fingerprint": fingerprint,
+            "segments": [],
+        })
+        entry["segments"].append(name)
+
+    def save(self):
+        """
+        Replaces the manifest with the tables of the current run and removes
+        data of the tables which are no longer cached.
+        """
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "config": self.config_fingerprint,
+            "secret": self.secret_fingerprint,
+            "tables": self.new_entries,
+        }
+        path = os.path.join(self.directory, MANIFEST_FILENAME)
+        temporary_path = "%s.%d.tmp" % (path, os.getpid())
+        with io.open(temporary_path, "w", encoding="utf-8") as stream:
+            stream.write(six.text_type(
+                json.dumps(manifest, indent=2, sort_keys=True)))
+        os.rename(temporary_path, path)
+
+        referenced = set(
+            name
+            for entry in self.new_entries.values()
+            for name in entry["segments"]
+        )
+        for name in os.listdir(self.segments_directory):
+            if name not in referenced:
+                os.remove(os.path.join(self.segments_directory, name))
+
+
+def get_config_fingerprint(config):
+    """
+    Fingerprints the parts of given configuration which affect the sanitized
+    table data: the sanitizers of the columns, the tables whose rows are
+    skipped, the extra parameters of the dump utilities and the rules of
+    the subset. Changes in code of the sanitizers are not detected.
+
+    :type config: database_sanitizer.config.Configuration|None
+    :rtype: str
+    """
+    data = None
+    if config:
+        data = {
+            "sanitizers": sorted(
+                (key, get_function_name(sanitizer))
+                for (key, sanitizer) in six.iteritems(config.sanitizers)
+            ),
+            "skip_rows": sorted(config.skip_rows_for_tables),
+            "mysqldump_params": list(config.mysqldump_params),
+            "pg_dump_params": list(config.pg_dump_params),
+        }
+        if config.subset_tables:
+            data["subset"] = config.subset_tables
+    return hashlib.sha256(
+        json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
@@ -2,17 +2,34 @@
 
 from __future__ import unicode_literals
 
-import codecs
+import contextlib
+import io
 import re
 import subprocess
-import io
+from collections import OrderedDict
 
+from ..config import MYSQLDUMP_DEFAULT_PARAMETERS
+from ..engine import SerialEngine
+from ..governor import throttle_lines, wrap_command
+from ..scheduler import TableSize
+from ..stats import track_chunks
 from ..utils.mysql import (
+    connect,
     decode_mysql_literal,
+    encode_load_data_literal,
     encode_mysql_literal,
     get_mysqldump_args_and_env_from_url,
+    quote_identifier,
 )
-from ..config import MYSQLDUMP_DEFAULT_PARAMETERS
+from . import (
+    CHUNK_DATA,
+    CHUNK_DATA_END,
+    CHUNK_DATA_START,
+    CHUNK_TEXT,
+    DEFAULT_CHUNK_SIZE,
+    Chunk,
+)
+from .subset import ForeignKey
 
 #: Regular expression which matches `INSERT INTO` statements produced by the
 #: `mysqldump` utility, even when extended inserts have been enabled.
@@ -22,6 +39,13 @@ INSERT_INTO_PATTERN = re.compile(
     r" VALUES (?P<values>.*);$"
 )
 
+#: Regular expression which matches the beginning of an `INSERT INTO`
+#: statement up to its values, used when scanning dump files.
+INSERT_INTO_HEAD_PATTERN = re.compile(
+    r"^INSERT INTO `(?P<table>[^`]*)`"
+    r" \((?P<columns>.*)\)$"
+)
+
 
 #: Regular expression which matches various kinds of MySQL literals.
 VALUE_PATTERN = re.compile(
@@ -41,7 +65,7 @@ VALUE_PATTERN = re.compile(
 )
 
 
-def sanitize(url, config):
+def sanitize(url, config, engine=None):
     """
     Obtains dump of MySQL database by executing `mysqldump` command and
     sanitizes it output.
@@ -53,6 +77,36 @@ def sanitize(url, config):
     :param config: Optional sanitizer configuration to be used for sanitation
                    of the values stored in the database.
     :type config: database_sanitizer.config.Configuration|None
+
+    :param engine: Optional engine used to execute the sanitation of table
+                   data. If omitted, the data is sanitized serially.
+    :type engine: database_sanitizer.engine.SerialEngine|None
+    """
+    args, env = get_dump_command(url, config)
+    process = subprocess.Popen(
+        args=wrap_command(args),
+        env=env,
+        stdout=subprocess.PIPE,
+    )
+
+    return sanitize_from_stream(
+        stream=process.stdout,
+        config=config,
+        engine=engine,
+    )
+
+
+def get_dump_command(url, config):
+    """
+    Constructs the `mysqldump` command which obtains dump of the database.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :type config: database_sanitizer.config.Configuration|None
+
+    :return: Command line arguments, and environment variables to set.
+    :rtype: tuple[list[str],dict[str,str]]
     """
     if url.scheme != "mysql":
         raise ValueError("Unsupported database type: '%s'" % (url.scheme,))
@@ -63,16 +117,10 @@ def sanitize(url, config):
     if config:
         extra_params = config.mysqldump_params
 
-    process = subprocess.Popen(
-        args=["mysqldump"] + args + extra_params,
-        env=env,
-        stdout=subprocess.PIPE,
-    )
-
-    return sanitize_from_stream(stream=process.stdout, config=config)
+    return ["mysqldump"] + args + extra_params, env
 
 
-def sanitize_from_stream(stream, config):
+def sanitize_from_stream(stream, config, engine=None):
     """
     Reads dump of MySQL database from given stream and sanitizes it.
 
@@ -83,53 +131,222 @@ def sanitize_from_stream(stream, config):
     :param config: Optional sanitizer configuration to be used for sanitation
                    of the values stored in the database.
     :type config: database_sanitizer.config.Configuration|None
+
+    :param engine: Optional engine used to execute the sanitation of table
+                   data. If omitted, the data is sanitized serially.
+    :type engine: database_sanitizer.engine.SerialEngine|None
+
+    :return: Iterator of sanitized lines, without trailing new lines.
+    :rtype: collections.Iterator[str]
     """
-    for line in io.TextIOWrapper(stream, encoding="utf-8"):
+    lines = (
         # Eat the trailing new line.
-        line = line.rstrip("\n")
+        line.rstrip("\n")
+        for line in io.TextIOWrapper(stream, encoding="utf-8")
+    )
+    return sanitize_lines(
+        lines=throttle_lines(lines, __name__),
+        config=config,
+        engine=engine,
+    )
 
-        # If there is no configuration it means that there are no sanitizers
-        # available.
-        if not config:
-            yield line
-            continue
 
-        # Does the line contain `INSERT INTO` statement? If not, use the line
-        # as-is and continue into next one.
+def sanitize_lines(lines, config, engine=None):
+    """
+    Sanitizes lines of a `mysqldump` output.
+
+    :param lines: Lines of the dump, without trailing new lines.
+    :type lines: collections.Iterable[str]
+
+    :param config: Optional sanitizer configuration to be used for sanitation
+                   of the values stored in the database.
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param engine: Optional engine used to execute the sanitation of table
+                   data. If omitted, the data is sanitized serially.
+    :type engine: database_sanitizer.engine.SerialEngine|None
+
+    :return: Iterator of sanitized lines, without trailing new lines.
+    :rtype: collections.Iterator[str]
+    """
+    # If there is no configuration it means that there are no sanitizers
+    # available.
+    if not config:
+        return lines
+
+    if engine is None:
+        engine = SerialEngine()
+
+    return engine.sanitize(
+        backend=__name__,
+        chunks=track_chunks(iter_chunks(lines, config), __name__),
+        config=config,
+    )
+
+
+def iter_chunks(lines, config, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Splits lines of a `mysqldump` output into chunks, separating consecutive
+    `INSERT INTO` statements of a table from the rest of the dump. Statements
+    of tables configured to be skipped are left out completely.
+
+    :param lines: Lines of the dump, without trailing new lines.
+    :type lines: collections.Iterable[str]
+
+    :param config: Sanitizer configuration used to determine which tables
+                   should be skipped.
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param chunk_size: Approximate maximum number of characters to collect
+                       into a single data chunk.
+    :type chunk_size: int
+
+    :rtype: collections.Iterator[database_sanitizer.dump.Chunk]
+    """
+    text_lines = []
+    data_lines = []
+    data_size = 0
+    current_table = None
+    current_table_columns = None
+    current_columns_text = None
+
+    for line in lines:
+        # Does the line contain `INSERT INTO` statement? If not, it's
+        # passed through as-is.
         insert_into_match = INSERT_INTO_PATTERN.match(line)
+        if insert_into_match:
+            table_name = insert_into_match.group("table")
+            columns_text = insert_into_match.group("columns")
+        else:
+            table_name = columns_text = None
+
+        # Close data section of previous table, if the line does not
+        # continue it.
+        if current_table is not None and (
+            table_name != current_table
+            or columns_text != current_columns_text
+        ):
+            if data_lines:
+                yield Chunk(
+                    CHUNK_DATA,
+                    current_table,
+                    current_table_columns,
+                    data_lines,
+                )
+                data_lines = []
+                data_size = 0
+            yield Chunk(
+                CHUNK_DATA_END,
+                current_table,
+                current_table_columns,
+                [],
+            )
+            current_table = None
+            current_table_columns = None
+            current_columns_text = None
+
         if not insert_into_match:
-            yield line
+            text_lines.append(line)
             continue
 
-        table_name = insert_into_match.group("table")
-        column_names = parse_column_names(insert_into_match.group("columns"))
-
         # Skip `INSERT INTO` statement if table rows are configured
         # to be skipped.
-        if table_name in config.skip_rows_for_tables:
+        if config and table_name in config.skip_rows_for_tables:
             continue
 
-        # Collect sanitizers possibly used for this table and place them into
-        # a dictionary from which we can look them up by index later.
-        sanitizers = {}
-        for index, column_name in enumerate(column_names):
-            sanitizer = config.get_sanitizer_for(
-                table_name=table_name,
-                column_name=column_name,
+        if current_table is None:
+            if text_lines:
+                yield Chunk(CHUNK_TEXT, None, None, text_lines)
+                text_lines = []
+            current_table = table_name
+            current_table_columns = parse_column_names(columns_text)
+            current_columns_text = columns_text
+            yield Chunk(
+                CHUNK_DATA_START,
+                current_table,
+                current_table_columns,
+                [],
             )
-            if sanitizer:
-                sanitizers[index] = sanitizer
 
-        # If this table has no sanitizers available, use the line as-is and
-        # continue into next line.
-        if len(sanitizers) == 0:
-            yield line
-            continue
+        data_lines.append(line)
+        data_size += len(line)
+        if data_size >= chunk_size:
+            yield Chunk(
+                CHUNK_DATA,
+                current_table,
+                current_table_columns,
+                data_lines,
+            )
+            data_lines = []
+            data_size = 0
+
+    if current_table is not None:
+        if data_lines:
+            yield Chunk(
+                CHUNK_DATA,
+                current_table,
+                current_table_columns,
+                data_lines,
+            )
+        yield Chunk(
+            CHUNK_DATA_END,
+            current_table,
+            current_table_columns,
+            [],
+        )
+
+    if text_lines:
+        yield Chunk(CHUNK_TEXT, None, None, text_lines)
+
+
+def get_value_line_sanitizer(config, table, columns):
+    """
+    Constructs function which sanitizes a single `INSERT INTO` statement of
+    given table.
+
+    :param config: Sanitizer configuration.
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param table: Name of the table.
+    :type table: str
+
+    :param columns: Names of the columns in the `INSERT INTO` statement.
+    :type columns: tuple[str]
+
+    :return: Function sanitizing an `INSERT INTO` statement, or None if none
+             of the columns have sanitizers.
+    :rtype: Optional[Callable[[str], str]]
+    """
+    if not config:
+        return None
+
+    # Collect sanitizers possibly used for this table and place them into
+    # a dictionary from which we can look them up by index later.
+    sanitizers = {}
+    for index, column_name in enumerate(columns):
+        sanitizer = config.get_sanitizer_for(
+            table_name=table,
+            column_name=column_name,
+        )
+        if sanitizer:
+            sanitizers[index] = sanitizer
+
+    # If this table has no sanitizers available, the statements can be used
+    # as-is.
+    if len(sanitizers) == 0:
+        return None
+
+    statement_prefix = get_statement_prefix(table, columns)
+
+    def sanitize_line(line):
+        insert_into_match = INSERT_INTO_PATTERN.match(line)
+        if not insert_into_match:
+            raise ValueError("Line is not an `INSERT INTO` statement")
 
         # Constructs list of tuples containing sanitized column names.
         sanitized_value_tuples = []
         for values in parse_values(insert_into_match.group("values")):
-            if len(column_names) != len(values):
+            if len(columns) != len(values):
                 raise ValueError("Mismatch between column names and values")
             sanitized_values = []
             for index, value in enumerate(values):
@@ -140,14 +357,122 @@ def sanitize_from_stream(stream, config):
             sanitized_value_tuples.append(sanitized_values)
 
         # Finally create new `INSERT INTO` statement from the sanitized values.
-        yield "INSERT INTO `%s` (%s) VALUES %s;" % (
-            table_name,
-            ", ".join("`" + column_name + "`" for column_name in column_names),
-            ",".join(
-                "(" + ",".join(value_tuple) + ")"
-                for value_tuple in sanitized_value_tuples
-            ),
-        )
+        return statement_prefix + ",".join(
+            "(" + ",".join(value_tuple) + ")"
+            for value_tuple in sanitized_value_tuples
+        ) + ";"
+
+    return sanitize_line
+
+
+def get_statement_prefix(table, columns):
+    """
+    Constructs beginning of an `INSERT INTO` statement of given table, up to
+    the values.
+
+    :type table: str
+    :type columns: tuple[str]
+    :rtype: str
+    """
+    return "INSERT INTO `%s` (%s) VALUES " % (
+        table,
+        ", ".join("`" + column_name + "`" for column_name in columns),
+    )
+
+
+def parse_value_line(line, columns):
+    """
+    Parses rows of values from an `INSERT INTO` statement.
+
+    :param line: Line containing the `INSERT INTO` statement.
+    :type line: str
+
+    :param columns: Names of the columns in the statement.
+    :type columns: tuple[str]
+
+    :return: Rows of the statement, as lists of decoded values.
+    :rtype: list[list[any]]
+    """
+    insert_into_match = INSERT_INTO_PATTERN.match(line)
+    if not insert_into_match:
+        raise ValueError("Line is not an `INSERT INTO` statement")
+    rows = []
+    for values in parse_values(insert_into_match.group("values")):
+        if len(columns) != len(values):
+            raise ValueError("Mismatch between column names and values")
+        rows.append(list(values))
+    return rows
+
+
+def count_rows(lines):
+    """
+    Estimates number of rows in `INSERT INTO` statements without parsing
+    them, from the separators between the rows. Text values containing the
+    separator are counted as extra rows.
+
+    :type lines: list[str]
+    :rtype: int
+    """
+    return sum(line.count("),(") + 1 for line in lines)
+
+
+def count_block_rows(data):
+    """
+    Estimates number of rows in a block of `INSERT INTO` statements read
+    from a dump file like `count_rows`, without decoding the block.
+
+    :type data: bytes
+    :rtype: int
+    """
+    lines = data.count(b"\n") + (1 if data and not data.endswith(b"\n") else 0)
+    return data.count(b"),(") + lines
+
+
+def iter_line_rows(lines):
+    """
+    Pairs lines of a `mysqldump` output with the estimated number of rows
+    they contain, counted like in `count_rows`.
+
+    :type lines: collections.Iterable[str]
+    :rtype: collections.Iterator[tuple[str,int]]
+    """
+    for line in lines:
+        if line.startswith("INSERT INTO "):
+            yield (line, count_rows([line]))
+        else:
+            yield (line, 0)
+
+
+def format_value_line(rows, table, columns):
+    """
+    Constructs `INSERT INTO` statement from rows returned by
+    `parse_value_line`.
+
+    :type rows: list[list[any]]
+    :type table: str
+    :type columns: tuple[str]
+    :rtype: str
+    """
+    return get_statement_prefix(table, columns) + ",".join(
+        "(" + ",".join(encode_mysql_literal(value) for value in row) + ")"
+        for row in rows
+    ) + ";"
+
+
+def decode_value(value):
+    """
+    Decodes a value returned by `parse_value_line`. Values are already
+    decoded while parsing the statement, so this returns the value as-is.
+    """
+    return value
+
+
+def encode_value(value):
+    """
+    Encodes a value for `format_value_line`. Values are encoded while
+    formatting the statement, so this returns the value as-is.
+    """
+    return value
 
 
 def parse_column_names(text):
@@ -178,6 +503,21 @@ def parse_values(text):
                  quoted and comma separated column values.
     :type text: str
     """
+    for literals in parse_literals(text):
+        yield tuple(decode_mysql_literal(literal) for literal in literals)
+
+
+def parse_literals(text):
+    """
+    Splits values of an extended format `INSERT INTO` statement into rows
+    of MySQL literals, without decoding them.
+
+    :param text: Text extracted from MySQL's `INSERT INTO` statement containing
+                 quoted and comma separated column values.
+    :type text: str
+
+    :rtype: collections.Iterator[tuple[str]]
+    """
     assert text.startswith("(")
     pos = 1
     values = []
@@ -187,10 +527,520 @@ def parse_values(text):
         if not match:
             break
         value = match.group(1)
-        values.append(decode_mysql_literal(value.strip()))
+        values.append(value.strip())
         pos += len(value) + 1
         if match.group(2) == ")":
             # Skip comma and open parenthesis ",("
             pos += 2
             yield tuple(values)
             values = []
+
+
+def convert_load_data_line(line):
+    """
+    Converts an `INSERT INTO` statement into lines of a data file read with
+    `LOAD DATA`, using its default tab separated format.
+
+    :param line: Line of the dump.
+    :type line: str
+
+    :return: Name of the table, names of the columns and the converted
+             lines, each followed by a new line, or None if the line is not
+             an `INSERT INTO` statement.
+    :rtype: tuple[str,tuple[str],str]|None
+    """
+    insert_into_match = INSERT_INTO_PATTERN.match(line)
+    if not insert_into_match:
+        return None
+    columns = parse_column_names(insert_into_match.group("columns"))
+    rows = []
+    for literals in parse_literals(insert_into_match.group("values")):
+        if len(columns) != len(literals):
+            raise ValueError("Mismatch between column names and values")
+        rows.append("\t".join(
+            encode_load_data_literal(literal) for literal in literals))
+        rows.append("\n")
+    return (insert_into_match.group("table"), columns, "".join(rows))
+
+
+def get_load_data_statement(table, columns, path):
+    """
+    Constructs `LOAD DATA` statement loading a data file written from the
+    lines returned by `convert_load_data_line`.
+
+    :param table: Name of the table.
+    :type table: str
+
+    :param columns: Names of the columns, in the order of the data file.
+    :type columns: tuple[str]
+
+    :param path: Path to the data file, read by the client.
+    :type path: str
+
+    :rtype: str
+    """
+    return (
+        "LOAD DATA LOCAL INFILE '%s' INTO TABLE %s CHARACTER SET utf8mb4 "
+        "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+        "LINES TERMINATED BY '\\n' (%s);"
+    ) % (
+        path.replace("\\", "\\\\").replace("'", "\\'"),
+        quote_identifier(table),
+        ", ".join(quote_identifier(column) for column in columns),
+    )
+
+
+#: Query listing the base tables of the database with their sizes.
+TABLE_SIZES_QUERY = """
+SELECT TABLE_NAME, DATA_LENGTH, TABLE_ROWS FROM information_schema.TABLES
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE'
+ORDER BY TABLE_NAME
+"""
+
+#: Query listing primary key columns of the tables and their data types.
+PRIMARY_KEYS_QUERY = """
+SELECT k.TABLE_NAME, k.COLUMN_NAME, c.DATA_TYPE
+FROM information_schema.KEY_COLUMN_USAGE k
+JOIN information_schema.COLUMNS c
+  ON c.TABLE_SCHEMA = k.TABLE_SCHEMA AND c.TABLE_NAME = k.TABLE_NAME
+ AND c.COLUMN_NAME = k.COLUMN_NAME
+WHERE k.TABLE_SCHEMA = DATABASE() AND k.CONSTRAINT_NAME = 'PRIMARY'
+"""
+
+#: Query listing the columns of the foreign keys between the tables, one
+#: row per pair of referencing and referenced column.
+FOREIGN_KEYS_QUERY = """
+SELECT TABLE_NAME, CONSTRAINT_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME,
+       REFERENCED_COLUMN_NAME
+FROM information_schema.KEY_COLUMN_USAGE
+WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_SCHEMA = DATABASE()
+ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION
+"""
+
+#: Query listing the primary key columns of a table.
+PRIMARY_KEY_COLUMNS_QUERY = """
+SELECT COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+  AND CONSTRAINT_NAME = 'PRIMARY'
+ORDER BY ORDINAL_POSITION
+"""
+
+#: Query listing the times of the latest modifications of the tables,
+#: together with a hash of their column definitions.
+TABLE_FINGERPRINTS_QUERY = """
+SELECT t.TABLE_NAME, t.CREATE_TIME, t.UPDATE_TIME, NOW(),
+       MD5((SELECT GROUP_CONCAT(c.COLUMN_NAME, ' ', c.COLUMN_TYPE
+                                ORDER BY c.ORDINAL_POSITION)
+            FROM information_schema.COLUMNS c
+            WHERE c.TABLE_SCHEMA = t.TABLE_SCHEMA
+              AND c.TABLE_NAME = t.TABLE_NAME))
+FROM information_schema.TABLES t
+WHERE t.TABLE_SCHEMA = DATABASE() AND t.TABLE_TYPE = 'BASE TABLE'
+"""
+
+#: Query listing the databases of the server.
+DATABASES_QUERY = "SHOW DATABASES"
+
+#: Schemas of the server itself, which are not listed as its databases.
+SYSTEM_DATABASES = frozenset(
+    ("information_schema", "mysql", "performance_schema", "sys"))
+
+#: Number of seconds since the latest modification of a table after which
+#: the modification time is considered to be its fingerprint.
+FINGERPRINT_SETTLE_TIME = 2
+
+#: Data types of primary key columns which can be split into ranges.
+INTEGER_TYPES = frozenset(
+    ("tinyint", "smallint", "mediumint", "int", "integer", "bigint"))
+
+
+def get_table_sizes(url, config):
+    """
+    Lists tables of the database with their size estimates from the
+    database catalog. Tables ignored with `--ignore-table` option of the
+    extra `mysqldump` parameters are left out.
+
+    Tables with a single integer column as their primary key can be split
+    into ranges of the primary key.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :type config: database_sanitizer.config.Configuration|None
+
+    :rtype: list[database_sanitizer.scheduler.TableSize]
+    """
+    extra_params = MYSQLDUMP_DEFAULT_PARAMETERS
+    if config:
+        extra_params = config.mysqldump_params
+    ignored = get_ignored_tables(url, extra_params)
+
+    connection = connect(url)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(PRIMARY_KEYS_QUERY)
+            primary_keys = {}
+            for (table, column, data_type) in cursor.fetchall():
+                primary_keys.setdefault(table, []).append(
+                    (column, data_type.lower()))
+            cursor.execute(TABLE_SIZES_QUERY)
+            rows = cursor.fetchall()
+    finally:
+        connection.close()
+
+    tables = []
+    for (table, size, row_count) in rows:
+        if table in ignored:
+            continue
+        split = None
+        keys = primary_keys.get(table, [])
+        if len(keys) == 1 and keys[0][1] in INTEGER_TYPES:
+            split = keys[0][0]
+        tables.append(TableSize(
+            schema=None,
+            table=table,
+            size=int(size or 0),
+            rows=int(row_count or 0),
+            split=split,
+        ))
+    return tables
+
+
+def get_table_fingerprints(url):
+    """
+    Reads fingerprints of the tables from the times of their latest
+    modifications. The times are not known for tables which have not been
+    modified since the server was started, and they have a resolution of a
+    second, so tables modified during the last seconds have no
+    fingerprints either.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :return: Fingerprints mapped by schema and name of the tables, or None
+             for the tables whose changes cannot be detected.
+    :rtype: dict[tuple[None,str],str|None]
+    """
+    connection = connect(url)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SET SESSION group_concat_max_len = 1048576")
+            # MySQL 8 caches the modification times for a day by default.
+            cursor.execute(
+                "SHOW VARIABLES LIKE 'information_schema_stats_expiry'")
+            if cursor.fetchall():
+                cursor.execute(
+                    "SET SESSION information_schema_stats_expiry = 0")
+            cursor.execute(TABLE_FINGERPRINTS_QUERY)
+            rows = cursor.fetchall()
+    finally:
+        connection.close()
+
+    fingerprints = {}
+    for (table, create_time, update_time, now, columns) in rows:
+        fingerprint = None
+        if update_time is not None and \
+                (now - update_time).total_seconds() > FINGERPRINT_SETTLE_TIME:
+            fingerprint = "%s|%s|%s" % (create_time, update_time, columns)
+        fingerprints[(None, table)] = fingerprint
+    return fingerprints
+
+
+def get_foreign_keys(url):
+    """
+    Lists the foreign keys between the tables of the database.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :rtype: list[database_sanitizer.dump.subset.ForeignKey]
+    """
+    connection = connect(url)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(FOREIGN_KEYS_QUERY)
+            rows = cursor.fetchall()
+    finally:
+        connection.close()
+
+    foreign_keys = OrderedDict()
+    for row in rows:
+        (table, constraint, column, referenced_table, referenced_column) = row
+        key = (table, constraint)
+        if key not in foreign_keys:
+            foreign_keys[key] = ForeignKey(
+                None, table, (), None, referenced_table, ())
+        foreign_key = foreign_keys[key]
+        foreign_keys[key] = foreign_key._replace(
+            columns=foreign_key.columns + (column,),
+            referenced_columns=foreign_key.referenced_columns + (
+                referenced_column,),
+        )
+    return list(foreign_keys.values())
+
+
+def get_sample_condition(url, schema, table, percent):
+    """
+    Constructs a condition selecting given percentage of the rows of a
+    table by a checksum of their primary keys, so that the condition
+    selects the same rows in every query.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :param schema: Ignored.
+
+    :type table: str
+
+    :param percent: Percentage of the rows, from 0 to 100.
+    :type percent: float
+
+    :rtype: str
+    """
+    connection = connect(url)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(PRIMARY_KEY_COLUMNS_QUERY, (table,))
+            columns = [column for (column,) in cursor.fetchall()]
+    finally:
+        connection.close()
+
+    if not columns:
+        raise ValueError(
+            "Cannot take a sample of table %s, which has no primary key" % (
+                table,))
+    return "CRC32(CONCAT_WS(',', %s)) %% 10000 < %d" % (
+        ", ".join(quote_identifier(column) for column in columns),
+        int(round(percent * 100)),
+    )
+
+
+def get_semijoin_condition(columns, schema, table, table_columns, condition):
+    """
+    Constructs a condition selecting the rows whose columns match the
+    columns of the rows of another table selected by a condition.
+
+    :param columns: Names of the columns of the selected rows.
+    :type columns: tuple[str]
+
+    :param schema: Ignored.
+
+    :param table: Name of the other table.
+    :type table: str
+
+    :param table_columns: Names of the matching columns of the other table.
+    :type table_columns: tuple[str]
+
+    :param condition: Condition selecting the rows of the other table.
+    :type condition: str
+
+    :rtype: str
+    """
+    return "(%s) IN (SELECT %s FROM %s WHERE %s)" % (
+        ", ".join(quote_identifier(column) for column in columns),
+        ", ".join(quote_identifier(column) for column in table_columns),
+        quote_identifier(table),
+        condition,
+    )
+
+
+def list_databases(url):
+    """
+    Lists names of the databases of the server of given URL, leaving out
+    the system schemas.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :rtype: list[str]
+    """
+    connection = connect(url._replace(path="/information_schema"))
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(DATABASES_QUERY)
+            rows = cursor.fetchall()
+    finally:
+        connection.close()
+    return sorted(
+        row[0] for row in rows if row[0] not in SYSTEM_DATABASES)
+
+
+def get_ignored_tables(url, params):
+    """
+    Extracts names of the tables of given database ignored with
+    `--ignore-table` options of given `mysqldump` parameters.
+
+    :type url: six.moves.urllib.parse.ParseResult
+    :type params: list[str]
+    :rtype: set[str]
+    """
+    database = url.path[1:]
+    ignored = set()
+    params = iter(params)
+    for param in params:
+        if param == "--ignore-table":
+            name = next(params, "")
+        elif param.startswith("--ignore-table="):
+            name = param[len("--ignore-table="):]
+        else:
+            continue
+        if name.startswith(database + "."):
+            ignored.add(name[len(database) + 1:])
+    return ignored
+
+
+@contextlib.contextmanager
+def export_snapshot(url):
+    """
+    MySQL does not support sharing a snapshot between connections, so each
+    table is dumped consistently on its own only.
+
+    :return: Always None.
+    """
+    yield None
+
+
+def get_part_conditions(url, table, parts):
+    """
+    Constructs conditions selecting rows of given table into separate
+    ranges of its primary key.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :type table: database_sanitizer.scheduler.TableSize
+
+    :param parts: Number of ranges.
+    :type parts: int
+
+    :return: SQL conditions for each of the ranges. The first and last
+             ranges are open ended, so that rows inserted after the bounds
+             have been queried are included as well.
+    :rtype: list[str|None]
+    """
+    if parts == 1:
+        return [None]
+    column = quote_identifier(table.split)
+    connection = connect(url)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT MIN(%s), MAX(%s) FROM %s" % (
+                column,
+                column,
+                quote_identifier(table.table),
+            ))
+            (minimum, maximum) = cursor.fetchone()
+    finally:
+        connection.close()
+
+    if minimum is None:
+        # The table is empty, so the first range gets all of it.
+        return [None] + ["FALSE"] * (parts - 1)
+
+    step = -(-(maximum - minimum + 1) // parts)
+    conditions = []
+    for part in range(parts):
+        bounds = []
+        if part > 0:
+            bounds.append("%s >= %d" % (column, minimum + part * step))
+        if part < parts - 1:
+            bounds.append("%s < %d" % (column, minimum + (part + 1) * step))
+        conditions.append(" AND ".join(bounds))
+    return conditions
+
+
+#: Extra `mysqldump` parameters used for obtaining each of the sections.
+SECTION_PARAMETERS = {
+    "pre-data": ["--no-data", "--skip-triggers"],
+    "data": None,
+    "post-data": [
+        "--no-data",
+        "--no-create-info",
+        "--skip-routines",
+        "--skip-events",
+    ],
+}
+
+
+def sanitize_section(url, config, section, tables, snapshot):
+    """
+    Obtains a section of the dump with `mysqldump` and sanitizes it. All the
+    table data is dumped separately with `sanitize_table`, so the "data"
+    section is empty.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param section: One of "pre-data", "data" or "post-data".
+    :type section: str
+
+    :param tables: Tables which are dumped separately.
+    :type tables: list[database_sanitizer.scheduler.TableSize]
+
+    :param snapshot: Ignored.
+
+    :rtype: collections.Iterator[str]
+    """
+    section_params = SECTION_PARAMETERS[section]
+    if section_params is None:
+        return iter(())
+
+    args, env = get_mysqldump_args_and_env_from_url(url=url)
+    extra_params = MYSQLDUMP_DEFAULT_PARAMETERS
+    if config:
+        extra_params = config.mysqldump_params
+
+    return _run_mysqldump(
+        args=args + extra_params + section_params,
+        env=env,
+        config=config,
+    )
+
+
+def sanitize_table(url, config, task, snapshot):
+    """
+    Obtains data of a range of a table with `mysqldump` and sanitizes it.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param task: The range of the table to dump.
+    :type task: database_sanitizer.scheduler.Task
+
+    :param snapshot: Ignored.
+
+    :return: Iterator of sanitized lines containing `INSERT INTO`
+             statements of the range.
+    :rtype: collections.Iterator[str]
+    """
+    args, env = get_mysqldump_args_and_env_from_url(url=url)
+    extra_params = MYSQLDUMP_DEFAULT_PARAMETERS
+    if config:
+        extra_params = config.mysqldump_params
+
+    table_params = ["--no-create-info", "--skip-triggers"]
+    if task.condition:
+        table_params.append("--where=%s" % (task.condition,))
+
+    return _run_mysqldump(
+        args=args + [task.table.table] + extra_params + table_params,
+        env=env,
+        config=config,
+    )
+
+
+def _run_mysqldump(args, env, config):
+    process = subprocess.Popen(
+        args=wrap_command(["mysqldump"] + args),
+        env=env,
+        stdout=subprocess.PIPE,
+    )
+    for line in sanitize_from_stream(stream=process.stdout, config=config):
+        yield line
+    returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, "mysqldump")
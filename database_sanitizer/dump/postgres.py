@@ -3,11 +3,40 @@
 from __future__ import unicode_literals
 
 import codecs
+import contextlib
+import fnmatch
+import itertools
+import os
 import re
+import shutil
 import subprocess
+import tempfile
+import time
+from collections import OrderedDict
 
-from ..utils.postgres import decode_copy_value, encode_copy_value
 from ..config import PG_DUMP_DEFAULT_PARAMETERS
+from ..engine import SerialEngine
+from ..governor import throttle_lines, wrap_command
+from ..scheduler import TableSize
+from ..stats import track_chunks
+from ..utils.postgres import (
+    decode_copy_value,
+    encode_copy_value,
+    get_psql_args,
+    get_psql_env,
+    quote_identifier,
+    quote_literal,
+    run_psql_query,
+)
+from . import (
+    CHUNK_DATA,
+    CHUNK_DATA_END,
+    CHUNK_DATA_START,
+    CHUNK_TEXT,
+    DEFAULT_CHUNK_SIZE,
+    Chunk,
+)
+from .subset import ForeignKey
 
 COPY_LINE_PATTERN = re.compile(
     r"^COPY \"(?P<schema>[^\"]*)\".\"(?P<table>[^\"]*)\" "
@@ -16,7 +45,7 @@ COPY_LINE_PATTERN = re.compile(
 )
 
 
-def sanitize(url, config):
+def sanitize(url, config, engine=None):
     """
     Obtains dump of an Postgres database by executing `pg_dump` command and
     sanitizes it's output.
@@ -28,6 +57,33 @@ def sanitize(url, config):
     :param config: Optional sanitizer configuration to be used for sanitation
                    of the values stored in the database.
     :type config: database_sanitizer.config.Configuration|None
+
+    :param engine: Optional engine used to execute the sanitation of table
+                   data. If omitted, the data is sanitized serially.
+    :type engine: database_sanitizer.engine.SerialEngine|None
+    """
+    args, env = get_dump_command(url, config)
+    process = subprocess.Popen(wrap_command(args), stdout=subprocess.PIPE)
+
+    return sanitize_from_stream(
+        stream=process.stdout,
+        config=config,
+        engine=engine,
+    )
+
+
+def get_dump_command(url, config):
+    """
+    Constructs the `pg_dump` command which obtains dump of the database.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :type config: database_sanitizer.config.Configuration|None
+
+    :return: Command line arguments, and environment variables to set or
+             None if the current environment can be used as-is.
+    :rtype: tuple[tuple[str],dict[str,str]|None]
     """
     if url.scheme not in ("postgres", "postgresql", "postgis"):
         raise ValueError("Unsupported database type: '%s'" % (url.scheme,))
@@ -36,57 +92,174 @@ def sanitize(url, config):
     if config:
         extra_params = config.pg_dump_params
 
-    process = subprocess.Popen(
-        (
-            "pg_dump",
-            # Force output to be UTF-8 encoded.
-            "--encoding=utf-8",
-            # Quote all table and column names, just in case.
-            "--quote-all-identifiers",
-            # Luckily `pg_dump` supports DB URLs, so we can just pass it the
-            # URL as argument to the command.
-            "--dbname",
-            url.geturl().replace('postgis://', 'postgresql://'),
-         ) + tuple(extra_params),
-        stdout=subprocess.PIPE,
+    return get_pg_dump_args(url) + tuple(extra_params), None
+
+
+def get_pg_dump_args(url):
+    """
+    Constructs command line arguments for `pg_dump` to obtain dump of the
+    database described in given URL.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :rtype: tuple[str]
+    """
+    return (
+        "pg_dump",
+        # Force output to be UTF-8 encoded.
+        "--encoding=utf-8",
+        # Quote all table and column names, just in case.
+        "--quote-all-identifiers",
+        # Luckily `pg_dump` supports DB URLs, so we can just pass it the
+        # URL as argument to the command.
+        "--dbname",
+        url.geturl().replace('postgis://', 'postgresql://'),
+    )
+
+
+def sanitize_from_stream(stream, config, engine=None):
+    """
+    Reads dump of Postgres database from given stream and sanitizes it.
+
+    :param stream: Stream where the database dump is expected to be available
+                   from, such as stdout of `pg_dump` process.
+    :type stream: file
+
+    :param config: Optional sanitizer configuration to be used for sanitation
+                   of the values stored in the database.
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param engine: Optional engine used to execute the sanitation of table
+                   data. If omitted, the data is sanitized serially.
+    :type engine: database_sanitizer.engine.SerialEngine|None
+
+    :return: Iterator of sanitized lines, without trailing new lines.
+    :rtype: collections.Iterator[str]
+    """
+    lines = (
+        # Eat the trailing new line.
+        line.rstrip("\n")
+        for line in codecs.getreader("utf-8")(stream)
+    )
+    return sanitize_lines(
+        lines=throttle_lines(lines, __name__),
+        config=config,
+        engine=engine,
+    )
+
+
+def sanitize_lines(lines, config, engine=None):
+    """
+    Sanitizes lines of a `pg_dump` output.
+
+    :param lines: Lines of the dump, without trailing new lines.
+    :type lines: collections.Iterable[str]
+
+    :param config: Optional sanitizer configuration to be used for sanitation
+                   of the values stored in the database.
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param engine: Optional engine used to execute the sanitation of table
+                   data. If omitted, the data is sanitized serially.
+    :type engine: database_sanitizer.engine.SerialEngine|None
+
+    :return: Iterator of sanitized lines.
+    :rtype: collections.Iterator[str]
+    """
+    # If there is no configuration it means that there are no sanitizers
+    # available.
+    if not config:
+        return lines
+
+    if engine is None:
+        engine = SerialEngine()
+
+    return engine.sanitize(
+        backend=__name__,
+        chunks=track_chunks(iter_chunks(lines, config), __name__),
+        config=config,
     )
 
-    sanitize_value_line = None
+
+def iter_chunks(lines, config, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Splits lines of a `pg_dump` output into chunks, separating the data
+    lines following `COPY` statements from the rest of the dump. Data of
+    tables configured to be skipped is left out completely.
+
+    :param lines: Lines of the dump, without trailing new lines.
+    :type lines: collections.Iterable[str]
+
+    :param config: Sanitizer configuration used to determine which tables
+                   should be skipped.
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param chunk_size: Approximate maximum number of characters to collect
+                       into a single data chunk.
+    :type chunk_size: int
+
+    :rtype: collections.Iterator[database_sanitizer.dump.Chunk]
+    """
+    text_lines = []
+    data_lines = []
+    data_size = 0
     current_table = None
     current_table_columns = None
     skip_table = False
 
-    for line in codecs.getreader("utf-8")(process.stdout):
-        # Eat the trailing new line.
-        line = line.rstrip("\n")
-
+    for line in lines:
         # Are we currently in middle of `COPY` statement?
         if current_table:
             # Backslash following a dot marks end of an `COPY` statement.
             if line == "\\.":
+                if not skip_table:
+                    if data_lines:
+                        yield Chunk(
+                            CHUNK_DATA,
+                            current_table,
+                            current_table_columns,
+                            data_lines,
+                        )
+                        data_lines = []
+                        data_size = 0
+                    yield Chunk(
+                        CHUNK_DATA_END,
+                        current_table,
+                        current_table_columns,
+                        [line],
+                    )
                 current_table = None
                 current_table_columns = None
-                if not skip_table:
-                    yield "\\."
                 skip_table = False
                 continue
 
             if skip_table:
                 continue
 
-            if not sanitize_value_line:
-                yield line
-                continue
-
-            yield sanitize_value_line(line)
+            data_lines.append(line)
+            data_size += len(line)
+            if data_size >= chunk_size:
+                yield Chunk(
+                    CHUNK_DATA,
+                    current_table,
+                    current_table_columns,
+                    data_lines,
+                )
+                data_lines = []
+                data_size = 0
             continue
 
         # Is the line beginning of `COPY` statement?
         copy_line_match = COPY_LINE_PATTERN.match(line)
         if not copy_line_match:
-            yield line
+            text_lines.append(line)
             continue
 
+        if text_lines:
+            yield Chunk(CHUNK_TEXT, None, None, text_lines)
+            text_lines = []
+
         current_table = copy_line_match.group("table")
         current_table_columns = parse_column_names(copy_line_match.group("columns"))
 
@@ -96,13 +269,43 @@ def sanitize(url, config):
             skip_table = True
             continue
 
-        sanitize_value_line = get_value_line_sanitizer(
-            config, current_table, current_table_columns)
+        yield Chunk(
+            CHUNK_DATA_START,
+            current_table,
+            current_table_columns,
+            [line],
+        )
 
-        yield line
+    if data_lines:
+        yield Chunk(
+            CHUNK_DATA,
+            current_table,
+            current_table_columns,
+            data_lines,
+        )
+
+    if text_lines:
+        yield Chunk(CHUNK_TEXT, None, None, text_lines)
 
 
 def get_value_line_sanitizer(config, table, columns):
+    """
+    Constructs function which sanitizes a single data line following `COPY`
+    statement of given table.
+
+    :param config: Sanitizer configuration.
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param table: Name of the table.
+    :type table: str
+
+    :param columns: Names of the columns in the `COPY` statement.
+    :type columns: tuple[str]
+
+    :return: Function sanitizing a data line, or None if none of the columns
+             have sanitizers.
+    :rtype: Optional[Callable[[str], str]]
+    """
     if not config:
         return None
 
@@ -137,6 +340,88 @@ def _identity(x):
     return x
 
 
+def parse_value_line(line, columns):
+    """
+    Splits data line following `COPY` statement into rows of raw values.
+
+    :param line: Data line following `COPY` statement.
+    :type line: str
+
+    :param columns: Names of the columns in the `COPY` statement.
+    :type columns: tuple[str]
+
+    :return: List containing the single row of the line, as list of values
+             still in the format used by `COPY`.
+    :rtype: list[list[str]]
+    """
+    values = line.split("\t")
+    if len(values) != len(columns):
+        raise ValueError("Mismatch between column names and values.")
+    return [values]
+
+
+def count_rows(lines):
+    """
+    Counts rows in data lines following `COPY` statement.
+
+    :type lines: list[str]
+    :rtype: int
+    """
+    return len(lines)
+
+
+def count_block_rows(data):
+    """
+    Counts rows in a block of data lines following `COPY` statement, read
+    from a dump file, without decoding the block.
+
+    :type data: bytes
+    :rtype: int
+    """
+    return data.count(b"\n") + (1 if data and not data.endswith(b"\n") else 0)
+
+
+def iter_line_rows(lines):
+    """
+    Pairs lines of a `pg_dump` output with the number of rows they contain,
+    which is one for the data lines following `COPY` statements.
+
+    :type lines: collections.Iterable[str]
+    :rtype: collections.Iterator[tuple[str,int]]
+    """
+    in_data = False
+    for line in lines:
+        if in_data:
+            if line == "\\.":
+                in_data = False
+                yield (line, 0)
+            else:
+                yield (line, 1)
+            continue
+        in_data = line.startswith("COPY ") and line.endswith(" FROM stdin;")
+        yield (line, 0)
+
+
+def format_value_line(rows, table, columns):
+    """
+    Constructs data line following `COPY` statement from rows returned by
+    `parse_value_line`.
+
+    :type rows: list[list[str]]
+    :type table: str
+    :type columns: tuple[str]
+    :rtype: str
+    """
+    return "\t".join(rows[0])
+
+
+#: Decodes a raw value returned by `parse_value_line`.
+decode_value = decode_copy_value
+
+#: Encodes a value back into raw format used by `format_value_line`.
+encode_value = encode_copy_value
+
+
 def parse_column_names(text):
     """
     Extracts column names from a string containing quoted and comma separated
@@ -167,3 +452,521 @@ def parse_values(text):
     :rtype: tuple[str|None]
     """
     return tuple(decode_copy_value(value) for value in text.split("\t"))
+
+
+#: Query listing the tables whose data is dumped, with their sizes. Tables
+#: belonging to extensions are left out, since `pg_dump` does not dump them.
+#: Ranges of pages can be read without scanning the whole table only with
+#: the TID range scans of PostgreSQL 14, so the number of pages to split
+#: the tables by is zero on older servers.
+TABLE_SIZES_QUERY = """
+SELECT n.nspname, c.relname,
+       c.relpages::bigint * current_setting('block_size')::bigint,
+       c.reltuples::bigint,
+       CASE WHEN current_setting('server_version_num')::integer >= 140000
+            THEN c.relpages ELSE 0 END
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind = 'r'
+  AND n.nspname <> 'information_schema'
+  AND n.nspname NOT LIKE 'pg\\_%'
+  AND NOT EXISTS (
+    SELECT 1 FROM pg_catalog.pg_depend d
+    WHERE d.classid = 'pg_catalog.pg_class'::pg_catalog.regclass
+      AND d.objid = c.oid AND d.deptype = 'e'
+  )
+ORDER BY n.nspname, c.relname
+"""
+
+#: Query listing names of the columns of a table included in `COPY`.
+COLUMN_NAMES_QUERY = """
+SELECT column_name FROM information_schema.columns
+WHERE table_schema = %s AND table_name = %s AND is_generated = 'NEVER'
+ORDER BY ordinal_position
+"""
+
+#: Query listing fingerprints of the tables, which change whenever rows of
+#: the table are modified, the table is truncated or rewritten, or its
+#: columns are altered. Standby servers do not count the modifications
+#: replayed from the primary, so they have no fingerprints.
+TABLE_FINGERPRINTS_QUERY = """
+SELECT n.nspname, c.relname,
+       CASE WHEN pg_catalog.pg_is_in_recovery() THEN NULL ELSE concat_ws(':',
+         c.relfilenode,
+         coalesce(s.n_tup_ins, 0),
+         coalesce(s.n_tup_upd, 0),
+         coalesce(s.n_tup_del, 0),
+         (SELECT extract(epoch FROM d.stats_reset)::bigint
+          FROM pg_catalog.pg_stat_database d
+          WHERE d.datname = pg_catalog.current_database()),
+         md5((SELECT string_agg(
+                  a.attname || ' ' || a.atttypid::regtype::text, ','
+                  ORDER BY a.attnum)
+              FROM pg_catalog.pg_attribute a
+              WHERE a.attrelid = c.oid AND a.attnum > 0
+                AND NOT a.attisdropped))
+       ) END
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN pg_catalog.pg_stat_user_tables s ON s.relid = c.oid
+WHERE c.relkind = 'r'
+  AND n.nspname <> 'information_schema'
+  AND n.nspname NOT LIKE 'pg\\_%'
+"""
+
+#: Query listing the columns of the foreign keys between the tables, one
+#: row per pair of referencing and referenced column.
+FOREIGN_KEYS_QUERY = """
+SELECT co.oid, cn.nspname, c.relname, a.attname,
+       rn.nspname, r.relname, ra.attname
+FROM pg_catalog.pg_constraint co
+CROSS JOIN LATERAL unnest(co.conkey, co.confkey)
+  WITH ORDINALITY AS k(attnum, referenced_attnum, position)
+JOIN pg_catalog.pg_class c ON c.oid = co.conrelid
+JOIN pg_catalog.pg_namespace cn ON cn.oid = c.relnamespace
+JOIN pg_catalog.pg_attribute a
+  ON a.attrelid = co.conrelid AND a.attnum = k.attnum
+JOIN pg_catalog.pg_class r ON r.oid = co.confrelid
+JOIN pg_catalog.pg_namespace rn ON rn.oid = r.relnamespace
+JOIN pg_catalog.pg_attribute ra
+  ON ra.attrelid = co.confrelid AND ra.attnum = k.referenced_attnum
+WHERE co.contype = 'f'
+ORDER BY co.oid, k.position
+"""
+
+#: Query listing the databases of the server which can be dumped.
+DATABASES_QUERY = """
+SELECT datname FROM pg_catalog.pg_database
+WHERE datallowconn AND NOT datistemplate
+ORDER BY datname
+"""
+
+#: Database which is connected into when listing the databases.
+MAINTENANCE_DATABASE = "postgres"
+
+#: Options of `pg_dump` which exclude data of tables from the dump.
+PG_DUMP_EXCLUDE_OPTIONS = ("--exclude-table", "--exclude-table-data", "-T")
+
+#: Number of seconds to wait for a snapshot to be exported.
+SNAPSHOT_TIMEOUT = 60.0
+
+
+def get_table_sizes(url, config):
+    """
+    Lists tables of the database with their size estimates from the
+    database catalog. Tables excluded with `--exclude-table` or
+    `--exclude-table-data` options of the extra `pg_dump` parameters are
+    left out.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :type config: database_sanitizer.config.Configuration|None
+
+    :rtype: list[database_sanitizer.scheduler.TableSize]
+    """
+    extra_params = (
+        config.pg_dump_params if config else PG_DUMP_DEFAULT_PARAMETERS)
+    exclude_patterns = get_exclude_patterns(extra_params)
+    tables = []
+    table_sizes = run_psql_query(url, TABLE_SIZES_QUERY)
+    for (schema, table, size, rows, pages) in table_sizes:
+        if is_excluded(schema, table, exclude_patterns):
+            continue
+        tables.append(TableSize(
+            schema=schema,
+            table=table,
+            size=int(size),
+            # Tables which have never been analyzed have -1 rows.
+            rows=max(int(rows), 0),
+            split=(int(pages) or None),
+        ))
+    return tables
+
+
+def get_table_fingerprints(url):
+    """
+    Reads cheap fingerprints of the tables from the statistics of the
+    database, which change whenever data of the table changes.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :return: Fingerprints mapped by schema and name of the tables, or None
+             for the tables whose changes cannot be detected.
+    :rtype: dict[tuple[str,str],str|None]
+    """
+    return {
+        (schema, table): fingerprint or None
+        for (schema, table, fingerprint) in run_psql_query(
+            url, TABLE_FINGERPRINTS_QUERY)
+    }
+
+
+def get_foreign_keys(url):
+    """
+    Lists the foreign keys between the tables from the database catalog.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :rtype: list[database_sanitizer.dump.subset.ForeignKey]
+    """
+    foreign_keys = OrderedDict()
+    for row in run_psql_query(url, FOREIGN_KEYS_QUERY):
+        (oid, schema, table, column, referenced_schema, referenced_table,
+         referenced_column) = row
+        if oid not in foreign_keys:
+            foreign_keys[oid] = ForeignKey(
+                schema, table, (), referenced_schema, referenced_table, ())
+        foreign_key = foreign_keys[oid]
+        foreign_keys[oid] = foreign_key._replace(
+            columns=foreign_key.columns + (column,),
+            referenced_columns=foreign_key.referenced_columns + (
+                referenced_column,),
+        )
+    return list(foreign_keys.values())
+
+
+def get_sample_condition(url, schema, table, percent):
+    """
+    Constructs a condition selecting given percentage of the rows of a
+    table. The rows are selected by a hash of their physical locations,
+    which do not change within the exported snapshot, so that the
+    condition selects the same rows in every query.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :type schema: str
+    :type table: str
+
+    :param percent: Percentage of the rows, from 0 to 100.
+    :type percent: float
+
+    :rtype: str
+    """
+    return "(pg_catalog.hashtext(ctid::text) & 2147483647) %% 10000 < %d" % (
+        int(round(percent * 100)),)
+
+
+def get_semijoin_condition(columns, schema, table, table_columns, condition):
+    """
+    Constructs a condition selecting the rows whose columns match the
+    columns of the rows of another table selected by a condition.
+
+    :param columns: Names of the columns of the selected rows.
+    :type columns: tuple[str]
+
+    :param schema: Schema of the other table.
+    :type schema: str
+
+    :param table: Name of the other table.
+    :type table: str
+
+    :param table_columns: Names of the matching columns of the other table.
+    :type table_columns: tuple[str]
+
+    :param condition: Condition selecting the rows of the other table.
+    :type condition: str
+
+    :rtype: str
+    """
+    return "(%s) IN (SELECT %s FROM %s.%s WHERE %s)" % (
+        ", ".join(quote_identifier(column) for column in columns),
+        ", ".join(quote_identifier(column) for column in table_columns),
+        quote_identifier(schema),
+        quote_identifier(table),
+        condition,
+    )
+
+
+def list_databases(url):
+    """
+    Lists names of the databases of the server of given URL, connecting
+    into its maintenance database.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :rtype: list[str]
+    """
+    maintenance_url = url._replace(path="/" + MAINTENANCE_DATABASE)
+    return [row[0] for row in run_psql_query(maintenance_url, DATABASES_QUERY)]
+
+
+def get_exclude_patterns(params):
+    """
+    Extracts patterns of tables whose data is excluded with given `pg_dump`
+    parameters.
+
+    Only the common subset of the `pg_dump` pattern syntax is supported:
+    optional schema name separated with a dot, wildcards "*" and "?" and
+    double quotes preserving the case.
+
+    :type params: list[str]
+    :rtype: list[tuple[str|None,str]]
+    """
+    patterns = []
+    params = iter(params)
+    for param in params:
+        for option in PG_DUMP_EXCLUDE_OPTIONS:
+            if param == option:
+                pattern = next(params, "")
+            elif param.startswith(option + "=") and option.startswith("--"):
+                pattern = param[len(option) + 1:]
+            elif param.startswith(option) and not option.startswith("--"):
+                pattern = param[len(option):]
+            else:
+                continue
+            patterns.append(_parse_name_pattern(pattern))
+            break
+    return patterns
+
+
+def _parse_name_pattern(pattern):
+    parts = []
+    current = ""
+    in_quotes = False
+    for char in pattern:
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == "." and not in_quotes:
+            parts.append(current)
+            current = ""
+        else:
+            current += char if in_quotes else char.lower()
+    parts.append(current)
+    if len(parts) == 1:
+        return (None, parts[0])
+    return (parts[-2], parts[-1])
+
+
+def is_excluded(schema, table, patterns):
+    """
+    Tells whether given table matches any of the patterns returned by
+    `get_exclude_patterns`.
+
+    :type schema: str
+    :type table: str
+    :type patterns: list[tuple[str|None,str]]
+    :rtype: bool
+    """
+    for (schema_pattern, table_pattern) in patterns:
+        if schema_pattern is not None and not fnmatch.fnmatchcase(
+                schema, schema_pattern):
+            continue
+        if fnmatch.fnmatchcase(table, table_pattern):
+            return True
+    return False
+
+
+@contextlib.contextmanager
+def export_snapshot(url):
+    """
+    Exports a snapshot of the database, so that all the tables can be dumped
+    consistently in separate connections. The snapshot stays valid until
+    the context is exited.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :return: Identifier of the snapshot.
+    :rtype: str
+    """
+    directory = tempfile.mkdtemp(prefix="database-sanitizer-")
+    path = os.path.join(directory, "snapshot")
+    process = subprocess.Popen(
+        get_psql_args(url), stdin=subprocess.PIPE, env=get_psql_env())
+    try:
+        # `psql` buffers its output, so the snapshot identifier is written
+        # into a file which is closed after the query.
+        process.stdin.write((
+            "BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY;\n"
+            "\\o %s\n"
+            "SELECT pg_catalog.pg_export_snapshot();\n"
+            "\\o\n"
+        ) % (quote_literal(path),)).encode("utf-8")
+        process.stdin.flush()
+        yield _wait_for_snapshot(path, process)
+    finally:
+        if process.poll() is None:
+            process.stdin.write(b"COMMIT;\n")
+            process.stdin.close()
+            process.wait()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _wait_for_snapshot(path, process):
+    deadline = time.time() + SNAPSHOT_TIMEOUT
+    while time.time() < deadline:
+        if os.path.exists(path):
+            with open(path, "rb") as stream:
+                content = stream.read().decode("utf-8")
+            if content.endswith("\n"):
+                return content.strip()
+        if process.poll() is not None:
+            break
+        time.sleep(0.05)
+    raise RuntimeError("Unable to export snapshot of the database")
+
+
+def get_part_conditions(url, table, parts):
+    """
+    Constructs conditions selecting rows of given table into separate
+    ranges, using ranges of physical pages of the table, which are read
+    with TID range scans.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :type table: database_sanitizer.scheduler.TableSize
+
+    :param parts: Number of ranges.
+    :type parts: int
+
+    :return: SQL conditions for each of the ranges. The first and last
+             ranges are open ended, so that rows outside of the estimated
+             pages are included as well.
+    :rtype: list[str|None]
+    """
+    if parts == 1:
+        return [None]
+    step = -(-table.split // parts)
+    conditions = []
+    for part in range(parts):
+        bounds = []
+        if part > 0:
+            bounds.append("ctid >= '(%d,0)'::tid" % (part * step,))
+        if part < parts - 1:
+            bounds.append("ctid < '(%d,0)'::tid" % ((part + 1) * step,))
+        conditions.append(" AND ".join(bounds))
+    return conditions
+
+
+def sanitize_section(url, config, section, tables, snapshot):
+    """
+    Obtains a section of the dump with `pg_dump` and sanitizes it. Data of
+    the given tables is left out from the "data" section, since it is
+    dumped separately with `sanitize_table`.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param section: One of "pre-data", "data" or "post-data".
+    :type section: str
+
+    :param tables: Tables which are dumped separately.
+    :type tables: list[database_sanitizer.scheduler.TableSize]
+
+    :param snapshot: Identifier of an exported snapshot, or None.
+    :type snapshot: str|None
+
+    :rtype: collections.Iterator[str]
+    """
+    extra_params = PG_DUMP_DEFAULT_PARAMETERS
+    if config:
+        extra_params = config.pg_dump_params
+
+    section_params = ["--section=%s" % (section,)]
+    if snapshot:
+        section_params.append("--snapshot=%s" % (snapshot,))
+    if section == "data":
+        section_params.extend(
+            "--exclude-table-data=%s.%s" % (
+                quote_identifier(table.schema),
+                quote_identifier(table.table),
+            )
+            for table in tables
+        )
+
+    process = subprocess.Popen(
+        wrap_command(
+            get_pg_dump_args(url) +
+            tuple(extra_params) +
+            tuple(section_params)
+        ),
+        stdout=subprocess.PIPE,
+    )
+    for line in sanitize_from_stream(stream=process.stdout, config=config):
+        yield line
+    _check_exit_status(process, "pg_dump")
+
+
+def sanitize_table(url, config, task, snapshot):
+    """
+    Obtains data of a range of a table with `psql` and sanitizes it.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param task: The range of the table to dump.
+    :type task: database_sanitizer.scheduler.Task
+
+    :param snapshot: Identifier of an exported snapshot, or None.
+    :type snapshot: str|None
+
+    :return: Iterator of sanitized lines containing `COPY` statement of the
+             range.
+    :rtype: collections.Iterator[str]
+    """
+    table = task.table
+    columns = [row[0] for row in run_psql_query(url, COLUMN_NAMES_QUERY % (
+        quote_literal(table.schema),
+        quote_literal(table.table),
+    ))]
+    if not columns:
+        return
+
+    table_name = "%s.%s" % (
+        quote_identifier(table.schema),
+        quote_identifier(table.table),
+    )
+    column_list = ", ".join(quote_identifier(column) for column in columns)
+    if task.condition:
+        query = "COPY (SELECT %s FROM %s WHERE %s) TO STDOUT" % (
+            column_list,
+            table_name,
+            task.condition,
+        )
+    else:
+        query = "COPY %s (%s) TO STDOUT" % (table_name, column_list)
+
+    commands = ["BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY"]
+    if snapshot:
+        commands.append(
+            "SET TRANSACTION SNAPSHOT %s" % (quote_literal(snapshot),))
+    commands.extend([query, "COMMIT"])
+
+    args = get_psql_args(url)
+    for command in commands:
+        args.extend(("--command", command))
+    process = subprocess.Popen(
+        wrap_command(args),
+        stdout=subprocess.PIPE,
+        # The output is decoded as UTF-8 like the output of `pg_dump`.
+        env=get_psql_env(),
+    )
+
+    lines = itertools.chain(
+        ["COPY %s (%s) FROM stdin;" % (table_name, column_list)],
+        (
+            line.rstrip("\n")
+            for line in codecs.getreader("utf-8")(process.stdout)
+        ),
+        ["\\."],
+    )
+    lines = throttle_lines(lines, __name__)
+    for line in sanitize_lines(lines=lines, config=config):
+        yield line
+    _check_exit_status(process, "psql")
+
+
+def _check_exit_status(process, command):
+    returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Subsetting of the database in the parallel table mode, where only some of
+the rows of the tables are dumped while the foreign keys between the rows
+are kept intact.
+
+The rows of the root tables are selected by a percentage or a condition
+given in the configuration. Next, the rows of the related tables which
+reference the selected rows through their foreign keys are selected, and
+finally every row referenced by a selected row, so that the foreign keys
+can be restored. The selections are SQL conditions containing subqueries
+of the related tables, which the database evaluates when the rows are
+extracted, so the rows which are left out are never read by the
+sanitizer.
+
+Tables which are part of a cycle of foreign keys, including those which
+reference themselves, cannot be subsetted this way. Their rows are dumped
+as a whole, and so are the rows of the tables they reference.
+"""
+
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+#: Foreign key from ``columns`` of a table into ``referenced_columns`` of
+#: the referenced table.
+ForeignKey = namedtuple("ForeignKey", (
+    "schema",
+    "table",
+    "columns",
+    "referenced_schema",
+    "referenced_table",
+    "referenced_columns",
+))
+
+
+def get_subset_conditions(db_module, url, config, tables):
+    """
+    Constructs conditions selecting the rows of the subset of the database
+    configured in the "subset" section of the configuration.
+
+    :param db_module: The dump backend module.
+    :type db_module: module
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param tables: Tables of the database whose data is dumped.
+    :type tables: list[database_sanitizer.scheduler.TableSize]
+
+    :return: SQL conditions selecting the rows of the subsetted tables,
+             mapped by schema and name of the tables. Tables which are not
+             included are dumped as a whole.
+    :rtype: dict[tuple[str|None,str],str]
+    """
+    roots = config.subset_tables if config else {}
+    if not roots:
+        return {}
+    skipped = set(config.skip_rows_for_tables)
+    keys = [
+        (table.schema, table.table) for table in tables
+        if table.table not in skipped
+    ]
+    dumped = set(keys)
+    references = {}
+    referenced_by = {}
+    for foreign_key in db_module.get_foreign_keys(url):
+        key = (foreign_key.schema, foreign_key.table)
+        referenced_key = (
+            foreign_key.referenced_schema, foreign_key.referenced_table)
+        if key in dumped and referenced_key in dumped:
+            references.setdefault(key, []).append(foreign_key)
+            referenced_by.setdefault(referenced_key, []).append(foreign_key)
+    (order, cyclic) = _sort_tables(keys, references)
+
+    # Rows of the root tables, and the rows referencing them.
+    selections = {}
+    sources = {}
+    for key in order:
+        rule = roots.get(key[1])
+        if rule is not None:
+            if key in cyclic:
+                raise ValueError(
+                    "Cannot take a subset of table %s, which is part of a "
+                    "cycle of foreign keys" % (_format_key(key),))
+            selections[key] = _get_root_condition(db_module, url, key, rule)
+            continue
+        if key in cyclic:
+            continue
+        foreign_keys = [
+            foreign_key for foreign_key in references.get(key, [])
+            if _get_referenced_key(foreign_key) in selections
+        ]
+        if foreign_keys:
+            selections[key] = _any([
+                db_module.get_semijoin_condition(
+                    foreign_key.columns,
+                    foreign_key.referenced_schema,
+                    foreign_key.referenced_table,
+                    foreign_key.referenced_columns,
+                    selections[_get_referenced_key(foreign_key)],
+                )
+                for foreign_key in foreign_keys
+            ])
+            sources[key] = foreign_keys
+
+    # Rows referenced by the selected rows, starting from the tables which
+    # are not referenced by the others.
+    conditions = {}
+    for key in reversed(order):
+        if key in cyclic:
+            continue
+        terms = [selections[key]] if key in selections else []
+        for foreign_key in referenced_by.get(key, []):
+            referencing_key = (foreign_key.schema, foreign_key.table)
+            if referencing_key not in conditions:
+                # All of the rows are dumped, and so are the rows they
+                # reference.
+                terms = None
+                break
+            if sources.get(referencing_key) == [foreign_key] and \
+                    conditions[referencing_key] == selections[referencing_key]:
+                # The rows were selected by the rows they reference.
+                continue
+            terms.append(db_module.get_semijoin_condition(
+                foreign_key.referenced_columns,
+                foreign_key.schema,
+                foreign_key.table,
+                foreign_key.columns,
+                conditions[referencing_key],
+            ))
+        if terms:
+            conditions[key] = _any(terms)
+    return conditions
+
+
+def _get_root_condition(db_module, url, key, rule):
+    terms = []
+    if rule["where"] is not None:
+        terms.append("(%s)" % (rule["where"],))
+    if rule["percent"] is not None:
+        terms.append(db_module.get_sample_condition(
+            url, key[0], key[1], rule["percent"]))
+    return " AND ".join(terms)
+
+
+def _get_referenced_key(foreign_key):
+    return (foreign_key.referenced_schema, foreign_key.referenced_table)
+
+
+def _any(terms):
+    if len(terms) == 1:
+        return terms[0]
+    return " OR ".join("(%s)" % (term,) for term in terms)
+
+
+def _format_key(key):
+    return ".".join(name for name in key if name)
+
+
+def _sort_tables(keys, references):
+    """
+    Sorts the tables so that the tables referenced by a table precede it,
+    by finding the strongly connected components of the foreign keys with
+    Tarjan's algorithm, which are found in that order.
+
+    :return: The sorted tables, and the tables which are part of cycles.
+    :rtype: tuple[list[tuple[str|None,str]],set[tuple[str|None,str]]]
+    """
+    order = []
+    cyclic = set()
+    indexes = {}
+    lowlinks = {}
+    stack = []
+    on_stack = set()
+    for root in keys:
+        if root in indexes:
+            continue
+        # Iterators of the referenced tables of the tables being visited.
+        visits = [(root, iter(references.get(root, [])))]
+        indexes[root] = lowlinks[root] = len(indexes)
+        stack.append(root)
+        on_stack.add(root)
+        while visits:
+            (key, foreign_keys) = visits[-1]
+            foreign_key = next(foreign_keys, None)
+            if foreign_key is not None:
+                referenced_key = _get_referenced_key(foreign_key)
+                if referenced_key == key:
+                    cyclic.add(key)
+                elif referenced_key not in indexes:
+                    index = len(indexes)
+                    indexes[referenced_key] = lowlinks[referenced_key] = index
+                    stack.append(referenced_key)
+                    on_stack.add(referenced_key)
+                    visits.append((
+                        referenced_key,
+                        iter(references.get(referenced_key, [])),
+                    ))
+                elif referenced_key in on_stack:
+                    lowlinks[key] = min(lowlinks[key], indexes[referenced_key])
+                continue
+            visits.pop()
+            if visits:
+                parent = visits[-1][0]
+                lowlinks[parent] = min(lowlinks[parent], lowlinks[key])
+            if lowlinks[key] == indexes[key]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == key:
+                        break
+                if len(component) > 1:
+                    cyclic.update(component)
+                order.extend(reversed(component))
+    return (order, cyclic)
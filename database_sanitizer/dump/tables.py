@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel table mode, where data of each table is dumped and sanitized by a
+pool of worker processes in separate database connections.
+
+The schema is dumped first and the table data is written in the order of
+the database catalog, so the output can be restored just like a dump
+obtained in the serial mode. The workers take the tasks largest first as
+planned by `database_sanitizer.scheduler`, and write their output into
+temporary files from which it is copied into the output once all the
+preceding tasks have been written.
+
+In the incremental mode the temporary files are kept in a cache directory
+afterwards, and tables which have not changed since are copied from there
+on the next run instead of being dumped. Likewise, when resuming an
+interrupted run writing into an output directory, the tables completed by
+it which have not changed since are not dumped again.
+
+When a subset of the database is configured, the conditions selecting its
+rows are added to the extraction queries of the tasks.
+
+Limits of the source load governor are shared by the workers, and the
+number of workers is capped by its limit of connections.
+
+When writing data files for `LOAD DATA`, the workers convert the table
+data themselves and the files are moved into the output directory as they
+are, instead of being copied.
+
+When statistics of the run are collected, the workers collect the
+statistics of their tasks and return them along with their results, and
+the statistics of each table are summed from its tasks. Wall and CPU
+times of a table are thus the total times spent on it by the workers.
+"""
+
+from __future__ import unicode_literals
+
+import contextlib
+import importlib
+import io
+import os
+import shutil
+import tempfile
+
+import six
+
+from .. import session
+from ..engine import get_multiprocessing_context, init_worker, worker_state
+from ..governor import get_governor, limit_connections
+from ..scheduler import apply_statistics, format_plan, load_statistics, plan
+from ..stats import RunStatistics, is_collecting, merge_tables
+from ..writer import write_lines
+from .incremental import TableCache
+from .subset import get_subset_conditions
+
+
+def run_tables(
+    db_module,
+    url,
+    output,
+    config,
+    jobs,
+    dry_run=False,
+    previous_stats=None,
+    incremental=None,
+    secret_key=None,
+    temp_dir=None,
+):
+    """
+    Dumps and sanitizes the database table by table in worker processes.
+
+    :param db_module: The dump backend module.
+    :type db_module: module
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :param output: Text stream or background writer where sanitized copy of
+                   the database dump will be written into.
+    :type output: file|database_sanitizer.writer.BackgroundWriter
+
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param jobs: Number of worker processes.
+    :type jobs: int
+
+    :param dry_run: If True, only the plan is written into the output.
+    :type dry_run: bool
+
+    :param previous_stats: Path to statistics file of a previous run, used
+                           instead of the size estimates of the database.
+    :type previous_stats: str|None
+
+    :param incremental: Path to cache directory of sanitized table data
+                        from the previous runs, which is reused for the
+                        tables that have not changed since.
+    :type incremental: str|None
+
+    :param secret_key: Fixed session secret, used instead of the secret
+                       persisted into the cache directory.
+    :type secret_key: bytes|None
+
+    :param temp_dir: Directory of the temporary files of the tasks. If
+                     omitted, the default temporary directory is used.
+    :type temp_dir: str|None
+    """
+    # Each worker uses its own database connection.
+    jobs = limit_connections(jobs)
+    skipped = config.skip_rows_for_tables if config else set()
+    subset = bool(config and config.subset_tables)
+    if subset and incremental:
+        raise ValueError(
+            "Subsetting cannot be combined with the incremental mode")
+
+    journaled = hasattr(output, "get_completed_tables")
+    fingerprints = None
+    if (incremental or journaled) and not dry_run:
+        # Fingerprints are read before the snapshot is taken, so that
+        # changes made in between are detected again on the next run.
+        fingerprints = db_module.get_table_fingerprints(url)
+
+    cache = None
+    if incremental and not dry_run:
+        cache = TableCache(
+            incremental, config, fingerprints, secret=secret_key)
+        session.reset(cache.secret)
+
+    with db_module.export_snapshot(url) as snapshot:
+        tables = db_module.get_table_sizes(url, config)
+        if previous_stats:
+            tables = apply_statistics(tables, load_statistics(previous_stats))
+        subset_conditions = {}
+        if subset and not dry_run:
+            subset_conditions = get_subset_conditions(
+                db_module, url, config, tables)
+        completed = set()
+        if journaled and not dry_run:
+            # Subsets depend on the rows of the other tables as well, so
+            # the subsetted tables are never reused.
+            completed = set(output.get_completed_tables({
+                key: fingerprint
+                for (key, fingerprint) in six.iteritems(fingerprints)
+                if key not in subset_conditions
+            }))
+        cached = {}
+        if cache:
+            for table in tables:
+                segments = cache.get_segments(table)
+                if segments is not None and table.table not in skipped:
+                    cached[(table.schema, table.table)] = segments
+        table_plan = plan(
+            [
+                table for table in tables
+                if table.table not in skipped
+                and (table.schema, table.table) not in cached
+                and (table.schema, table.table) not in completed
+            ],
+            jobs,
+        )
+
+        if dry_run:
+            write_lines(output, format_plan(table_plan))
+            return
+
+        tasks = assign_conditions(
+            db_module, url, table_plan.tasks, subset_conditions)
+
+        write_lines(output, db_module.sanitize_section(
+            url, config, "pre-data", tables, snapshot))
+
+        write_tasks(
+            db_module=db_module,
+            url=url,
+            output=output,
+            config=config,
+            jobs=jobs,
+            tables=tables,
+            tasks=tasks,
+            snapshot=snapshot,
+            cached=cached,
+            cache=cache,
+            completed=completed,
+            temp_dir=temp_dir,
+        )
+
+        for section in ("data", "post-data"):
+            write_lines(output, db_module.sanitize_section(
+                url, config, section, tables, snapshot))
+
+    if cache:
+        cache.save()
+
+
+def assign_conditions(db_module, url, tasks, subset_conditions=None):
+    """
+    Fills in conditions selecting the rows of the tasks of split tables,
+    and the rows of the subsetted tables.
+
+    :type db_module: module
+    :type url: six.moves.urllib.parse.ParseResult
+    :type tasks: list[database_sanitizer.scheduler.Task]
+
+    :param subset_conditions: Conditions selecting the rows of the subset of
+                              the database, mapped by schema and name of
+                              the tables.
+    :type subset_conditions: dict[tuple[str|None,str],str]|None
+
+    :rtype: list[database_sanitizer.scheduler.Task]
+    """
+    conditions = {}
+    result = []
+    for task in tasks:
+        key = (task.table.schema, task.table.table)
+        if task.parts > 1:
+            if key not in conditions:
+                conditions[key] = db_module.get_part_conditions(
+                    url, task.table, task.parts)
+            task = task._replace(condition=conditions[key][task.part])
+        subset_condition = (subset_conditions or {}).get(key)
+        if subset_condition is not None:
+            task = task._replace(condition=(
+                "(%s) AND (%s)" % (task.condition, subset_condition)
+                if task.condition else subset_condition
+            ))
+        result.append(task)
+    return result
+
+
+def write_tasks(
+    db_module,
+    url,
+    output,
+    config,
+    jobs,
+    tables,
+    tasks,
+    snapshot,
+    cached=None,
+    cache=None,
+    completed=None,
+    temp_dir=None,
+):
+    """
+    Runs given tasks in worker processes and writes their output in the
+    catalog order of the tables as soon as it is available, together with
+    the data of the cached tables.
+
+    :type db_module: module
+    :type url: six.moves.urllib.parse.ParseResult
+    :type output: file
+    :type config: database_sanitizer.config.Configuration|None
+    :type jobs: int
+
+    :param tables: Tables of the database, in the catalog order.
+    :type tables: list[database_sanitizer.scheduler.TableSize]
+
+    :param tasks: Tasks in the order they are handed out to the workers.
+    :type tasks: list[database_sanitizer.scheduler.Task]
+
+    :type snapshot: str|None
+
+    :param cached: Paths to the cached data of the tables which are not
+                   dumped, mapped by schema and name of the tables.
+    :type cached: dict[tuple[str|None,str],list[str]]|None
+
+    :param cache: Cache into which the output of the tasks is moved after
+                  it has been written.
+    :type cache: database_sanitizer.dump.incremental.TableCache|None
+
+    :param completed: Schemas and names of the tables completed by an
+                      interrupted run, whose files are reused by the
+                      output directory.
+    :type completed: set[tuple[str|None,str]]|None
+
+    :param temp_dir: Directory of the temporary files of the tasks, unless
+                     they are moved into the cache or the output directory.
+    :type temp_dir: str|None
+
+    If the output accepts data files, i.e. is a
+    `database_sanitizer.load_data.LoadDataWriter`, the tasks write data
+    files which are handed over to it.
+    """
+    catalog_order = {
+        (table.schema, table.table): position
+        for (position, table) in enumerate(tables)
+    }
+    # Indexes of the tasks, lists of paths to the cached data, or schemas
+    # and names of the completed tables, in the order they are written
+    # into the output.
+    output_order = [item for (_key, item) in sorted(
+        [
+            (
+                (
+                    catalog_order[(task.table.schema, task.table.table)],
+                    task.part,
+                ),
+                index,
+            )
+            for (index, task) in enumerate(tasks)
+        ] + [
+            ((catalog_order[key], 0), segments)
+            for (key, segments) in six.iteritems(cached or {})
+        ] + [
+            ((catalog_order[key], 0), key)
+            for key in (completed or ())
+            if key in catalog_order
+        ],
+        key=lambda entry: entry[0],
+    )]
+    load_data = hasattr(output, "add_data_file")
+    # The output is moved into the cache or the output directory, so it
+    # must reside in the same file system.
+    directory = tempfile.mkdtemp(
+        prefix="database-sanitizer-",
+        dir=(
+            cache.directory if cache
+            else output.directory if load_data
+            else temp_dir
+        ),
+    )
+    pool = get_multiprocessing_context().Pool(
+        processes=jobs,
+        initializer=init_worker,
+        initargs=(config, session.get_secret(), get_governor()),
+    )
+    try:
+        paths = [
+            os.path.join(directory, "%d.sql" % (index,))
+            for index in range(len(tasks))
+        ]
+        collect_stats = is_collecting()
+        arguments = [
+            (
+                index, db_module.__name__, url, task, snapshot, paths[index],
+                load_data, collect_stats,
+            )
+            for (index, task) in enumerate(tasks)
+        ]
+        results = pool.imap_unordered(dump_task, arguments, chunksize=1)
+        # Columns of the data files of the finished tasks.
+        finished = {}
+        for item in output_order:
+            if isinstance(item, list):
+                for path in item:
+                    _copy_file(path, output)
+                continue
+            if isinstance(item, tuple):
+                output.add_completed_table(*item)
+                continue
+            while item not in finished:
+                (index, columns, table_stats) = next(results)
+                finished[index] = columns
+                if table_stats:
+                    merge_tables(table_stats)
+            if load_data:
+                output.add_data_file(
+                    tasks[item].table.table, finished[item], paths[item])
+                continue
+            _copy_file(paths[item], output)
+            if cache:
+                cache.add_segment(tasks[item].table, paths[item])
+            else:
+                os.remove(paths[item])
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def dump_task(arguments):
+    """
+    Dumps and sanitizes a single task in a worker process, writing the
+    result into a file.
+
+    :param arguments: Index of the task, name of the backend module, parsed
+                      database URL, the task, snapshot identifier, path of
+                      the file, whether to write a data file for
+                      `LOAD DATA` instead of SQL and whether to collect
+                      statistics of the tables.
+    :type arguments: tuple
+
+    :return: Index of the task, names of the columns of the data file or
+             None if no rows were written into it, and statistics of the
+             tables mapped by their names or None if not collected.
+    :rtype: tuple[int,tuple[str]|None,dict[str,dict]|None]
+    """
+    (index, backend, url, task, snapshot, path, load_data, collect_stats) = \
+        arguments
+    db_module = importlib.import_module(backend)
+    columns = None
+    statistics = None
+    if collect_stats:
+        # Only the tables are collected, as the sanitizers and the phases
+        # are those of the worker process.
+        statistics = RunStatistics(sample_interval=None, profile_interval=None)
+    with io.open(path, "w", encoding="utf-8", newline="") as stream, \
+            _collecting(statistics):
+        lines = db_module.sanitize_table(
+            url, worker_state["config"], task, snapshot)
+        if statistics is not None:
+            lines = statistics.track_output(lines)
+        for line in lines:
+            if not load_data:
+                stream.write(line + "\n")
+                continue
+            # Statements other than the table data are left out.
+            converted = db_module.convert_load_data_line(line)
+            if converted is not None:
+                (_table, columns, rows) = converted
+                stream.write(rows)
+    if statistics is None:
+        return (index, columns, None)
+    return (index, columns, statistics.get_tables())
+
+
+@contextlib.contextmanager
+def _collecting(statistics):
+    if statistics is None:
+        yield
+    else:
+        with statistics.collect():
+            yield
+
+
+def _copy_file(path, output):
+    with io.open(path, "r", encoding="utf-8", newline="") as stream:
+        for line in stream:
+            output.write(line)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Engines executing the sanitation of table data found from database dumps.
+
+The dump parsers split the dump into chunks (see
+`database_sanitizer.dump.Chunk`) and hand them over to an engine, which
+sanitizes the data chunks with line sanitizers provided by the dump
+backend and returns the resulting lines in the original order.
+"""
+
+from __future__ import unicode_literals
+
+import importlib
+import multiprocessing
+import random
+
+from .. import session
+from ..dump import CHUNK_DATA
+
+#: Engines which can be selected by name, mapped to the classes
+#: implementing them.
+SUPPORTED_ENGINES = {
+    "serial": "database_sanitizer.engine.SerialEngine",
+    "hybrid": "database_sanitizer.engine.hybrid.HybridEngine",
+    "process": "database_sanitizer.engine.process.ProcessEngine",
+}
+
+
+def get_engine(name, workers=None):
+    """
+    Constructs sanitation engine with given name.
+
+    :param name: Name of the engine, one of `SUPPORTED_ENGINES`.
+    :type name: str
+
+    :param workers: Number of worker processes to use, if the engine supports
+                    them. Defaults to number of CPUs.
+    :type workers: int|None
+
+    :rtype: SerialEngine
+    """
+    class_path = SUPPORTED_ENGINES.get(name)
+    if not class_path:
+        raise ValueError("Unsupported engine: '%s'" % (name,))
+    module_name, class_name = class_path.rsplit(".", 1)
+    engine_class = getattr(importlib.import_module(module_name), class_name)
+    return engine_class(workers=workers)
+
+
+def get_worker_count(workers=None):
+    """
+    Determines number of worker processes to use.
+
+    :param workers: Requested number of workers or None to use the number of
+                    CPUs available.
+    :type workers: int|None
+
+    :rtype: int
+    """
+    if workers is None:
+        return multiprocessing.cpu_count()
+    if workers < 1:
+        raise ValueError("Number of workers must be positive")
+    return workers
+
+
+def get_multiprocessing_context():
+    """
+    Returns multiprocessing context to use for the worker processes.
+
+    Forking is preferred when available, since it allows the workers to
+    inherit the configuration, including sanitizers which cannot be pickled.
+    """
+    if not hasattr(multiprocessing, "get_context"):  # pragma: no cover (Py2)
+        return multiprocessing
+    try:
+        return multiprocessing.get_context("fork")
+    except ValueError:  # pragma: no cover (platforms without fork)
+        return multiprocessing.get_context()
+
+
+#: State of a worker process, set up by `init_worker`.
+worker_state = {}
+
+
+def init_worker(config, secret_key, governor=None):
+    """
+    Initializes a worker process with the configuration, the session
+    secret and the source load governor of the main process.
+
+    :type config: database_sanitizer.config.Configuration|None
+    :type secret_key: bytes
+    :type governor: database_sanitizer.governor.SourceGovernor|None
+    """
+    worker_state["config"] = config
+    if governor is not None:
+        from ..governor import use_governor
+        use_governor(governor)
+    # Workers must use the same secret as the main process, otherwise values
+    # would be hashed differently depending on the worker.
+    session.reset(secret_key)
+    # Forked workers would otherwise share the state of the random number
+    # generator, producing identical "random" values.
+    random.seed()
+
+
+class LineSanitizerCache(object):
+    """
+    Looks up line sanitizers of a dump backend and caches them per table.
+    """
+    def __init__(self, backend, config):
+        """
+        :param backend: Name of the dump backend module, such as
+                        "database_sanitizer.dump.postgres".
+        :type backend: str
+
+        :param config: Sanitizer configuration.
+        :type config: database_sanitizer.config.Configuration|None
+        """
+        self.backend_module = importlib.import_module(backend)
+        self.config = config
+        self.line_sanitizers = {}
+
+    def get(self, table, columns):
+        """
+        Returns line sanitizer for given table and columns, or None if none of
+        the columns have sanitizers.
+
+        :type table: str
+        :type columns: tuple[str]
+        :rtype: Optional[Callable[[str], str]]
+        """
+        key = (table, columns)
+        try:
+            return self.line_sanitizers[key]
+        except KeyError:
+            line_sanitizer = self.backend_module.get_value_line_sanitizer(
+                self.config, table, columns)
+            self.line_sanitizers[key] = line_sanitizer
+            return line_sanitizer
+
+
+class SerialEngine(object):
+    """
+    Engine which sanitizes all data in the calling thread.
+    """
+    def __init__(self, workers=None):
+        """
+        :param workers: Ignored, accepted for compatibility with the parallel
+                        engines.
+        :type workers: int|None
+        """
+
+    def sanitize(self, backend, chunks, config):
+        """
+        Sanitizes data chunks of a database dump.
+
+        :param backend: Name of the dump backend module which produced the
+                        chunks.
+        :type backend: str
+
+        :param chunks: Chunks of the database dump.
+        :type chunks: collections.Iterable[database_sanitizer.dump.Chunk]
+
+        :param config: Sanitizer configuration.
+        :type config: database_sanitizer.config.Configuration|None
+
+        :return: Iterator of sanitized lines, in the original order.
+        :rtype: collections.Iterator[str]
+        """
+        line_sanitizers = LineSanitizerCache(backend, config)
+        for chunk in chunks:
+            line_sanitizer = None
+            if chunk.kind == CHUNK_DATA:
+                line_sanitizer = line_sanitizers.get(
+                    chunk.table, chunk.columns)
+            if not line_sanitizer:
+                for line in chunk.lines:
+                    yield line
+                continue
+            for line in chunk.lines:
+                yield line_sanitizer(line)
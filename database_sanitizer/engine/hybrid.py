@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+Engine which parses the dump in the calling process and offloads only the
+expensive columns into worker processes.
+
+Most of the sanitizers are so cheap that shipping their values into another
+process costs more than running them. This engine applies such sanitizers
+inline and sends only batches of values of the expensive columns into a
+pool of worker processes, merging the results back into the rows by their
+index. Columns are considered expensive when they have been declared so in
+the configuration, or when sanitizing the first values of the column has
+been measured to take longer than a threshold.
+"""
+
+from __future__ import unicode_literals
+
+import importlib
+from collections import deque
+from timeit import default_timer
+
+from .. import session
+from ..dump import CHUNK_DATA
+from ..stats import watch_queue
+from . import (
+    get_multiprocessing_context,
+    get_worker_count,
+    init_worker,
+    worker_state,
+)
+
+#: Default average time in seconds per value after which a column is
+#: considered expensive to sanitize.
+DEFAULT_COST_THRESHOLD = 2e-6
+
+#: Default number of values to measure before deciding whether a column is
+#: expensive to sanitize.
+DEFAULT_SAMPLE_SIZE = 1000
+
+#: Default number of chunks in flight per worker process.
+DEFAULT_PENDING_PER_WORKER = 2
+
+
+class HybridEngine(object):
+    """
+    Engine which sanitizes cheap columns inline and offloads expensive
+    columns into worker processes.
+    """
+    def __init__(
+        self,
+        workers=None,
+        cost_threshold=DEFAULT_COST_THRESHOLD,
+        sample_size=DEFAULT_SAMPLE_SIZE,
+    ):
+        """
+        :param workers: Number of worker processes. Defaults to number of
+                        CPUs.
+        :type workers: int|None
+
+        :param cost_threshold: Average time in seconds per value after which
+                               a column is considered expensive.
+        :type cost_threshold: float
+
+        :param sample_size: Number of values to measure before deciding
+                            whether a column is expensive.
+        :type sample_size: int
+        """
+        self.workers = workers
+        self.cost_threshold = cost_threshold
+        self.sample_size = sample_size
+
+    def sanitize(self, backend, chunks, config):
+        """
+        Sanitizes data chunks of a database dump, offloading the expensive
+        columns into worker processes.
+
+        :param backend: Name of the dump backend module which produced the
+                        chunks.
+        :type backend: str
+
+        :param chunks: Chunks of the database dump.
+        :type chunks: collections.Iterable[database_sanitizer.dump.Chunk]
+
+        :param config: Sanitizer configuration.
+        :type config: database_sanitizer.config.Configuration|None
+
+        :return: Iterator of sanitized lines, in the original order.
+        :rtype: collections.Iterator[str]
+        """
+        backend_module = importlib.import_module(backend)
+        workers = get_worker_count(self.workers)
+        max_pending = workers * DEFAULT_PENDING_PER_WORKER
+        classifier = CostClassifier(
+            declared=(config.expensive_columns if config else ()),
+            threshold=self.cost_threshold,
+            sample_size=self.sample_size,
+        )
+        column_sanitizers = {}
+
+        pool = get_multiprocessing_context().Pool(
+            processes=workers,
+            initializer=init_worker,
+            initargs=(config, session.get_secret()),
+        )
+
+        # Either lists of lines ready to be returned, or chunks waiting for
+        # results from the workers, in the original order.
+        pending = deque()
+        watch_queue("hybrid", pending)
+
+        try:
+            for chunk in chunks:
+                sanitizers = None
+                if chunk.kind == CHUNK_DATA:
+                    key = (chunk.table, chunk.columns)
+                    if key not in column_sanitizers:
+                        column_sanitizers[key] = get_column_sanitizers(
+                            config, chunk.table, chunk.columns)
+                    sanitizers = column_sanitizers[key]
+
+                if not sanitizers:
+                    pending.append(chunk.lines)
+                else:
+                    pending.append(PendingChunk(
+                        backend_module=backend_module,
+                        chunk=chunk,
+                        sanitizers=sanitizers,
+                        classifier=classifier,
+                        pool=pool,
+                    ))
+
+                for line in _pop_ready(pending, block=False):
+                    yield line
+
+                # Wait for the oldest chunk if there are too many of them in
+                # flight.
+                while len(pending) > max_pending:
+                    for line in _pop_ready(pending, block=True):
+                        yield line
+
+            while pending:
+                for line in _pop_ready(pending, block=True):
+                    yield line
+
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+def _pop_ready(pending, block):
+    """
+    Pops lines from the beginning of the pending queue for as long as they
+    are available. If blocking, waits for the first chunk to be finished.
+    """
+    while pending:
+        entry = pending[0]
+        if isinstance(entry, PendingChunk):
+            if not block and not entry.ready():
+                return
+            entry = entry.get_lines()
+            block = False
+        pending.popleft()
+        for line in entry:
+            yield line
+
+
+def get_column_sanitizers(config, table, columns):
+    """
+    Finds sanitizers for given columns of a table.
+
+    :type config: database_sanitizer.config.Configuration|None
+    :type table: str
+    :type columns: tuple[str]
+
+    :return: List of column indexes, names and sanitizers of the columns
+             which have sanitizers.
+    :rtype: list[tuple[int,str,callable]]
+    """
+    if not config:
+        return []
+    sanitizers = []
+    for index, column in enumerate(columns):
+        sanitizer = config.get_sanitizer_for(table, column)
+        if sanitizer:
+            sanitizers.append((index, column, sanitizer))
+    return sanitizers
+
+
+class CostClassifier(object):
+    """
+    Decides which columns are expensive to sanitize, either by declaration
+    or by measuring the time it takes to sanitize the first values.
+    """
+    def __init__(self, declared, threshold, sample_size):
+        """
+        :param declared: Columns declared to be expensive, as "table.column"
+                         strings.
+        :type declared: collections.Iterable[str]
+
+        :param threshold: Average time in seconds per value after which a
+                          column is considered expensive.
+        :type threshold: float
+
+        :param sample_size: Number of values to measure before deciding.
+        :type sample_size: int
+        """
+        self.declared = set(declared)
+        self.threshold = threshold
+        self.sample_size = sample_size
+        self.samples = {}
+        self.decisions = {}
+
+    def is_expensive(self, key):
+        """
+        Tells whether given column is expensive to sanitize.
+
+        :param key: Column as "table.column" string.
+        :type key: str
+
+        :return: True or False, or None if the column is still being
+                 measured.
+        :rtype: bool|None
+        """
+        if key in self.declared:
+            return True
+        return self.decisions.get(key)
+
+    def record(self, key, count, elapsed):
+        """
+        Records time it took to sanitize values of given column.
+
+        :param key: Column as "table.column" string.
+        :type key: str
+
+        :param count: Number of values sanitized.
+        :type count: int
+
+        :param elapsed: Time it took in seconds.
+        :type elapsed: float
+        """
+        sample = self.samples.setdefault(key, [0, 0.0])
+        sample[0] += count
+        sample[1] += elapsed
+        if sample[0] >= self.sample_size:
+            self.decisions[key] = (sample[1] / sample[0]) > self.threshold
+            del self.samples[key]
+
+
+class PendingChunk(object):
+    """
+    Data chunk whose cheap columns have been sanitized and whose expensive
+    columns are being sanitized by the worker processes.
+    """
+    def __init__(self, backend_module, chunk, sanitizers, classifier, pool):
+        self.backend_module = backend_module
+        self.table = chunk.table
+        self.columns = chunk.columns
+        self.line_rows = [
+            backend_module.parse_value_line(line, chunk.columns)
+            for line in chunk.lines
+        ]
+        self.batches = []
+
+        decode_value = backend_module.decode_value
+        encode_value = backend_module.encode_value
+
+        for (index, column, sanitizer) in sanitizers:
+            key = "%s.%s" % (chunk.table, column)
+            expensive = classifier.is_expensive(key)
+
+            if expensive:
+                values = [
+                    decode_value(row[index])
+                    for rows in self.line_rows
+                    for row in rows
+                ]
+                self.batches.append((index, pool.apply_async(
+                    sanitize_values,
+                    (chunk.table, column, values),
+                )))
+                continue
+
+            count = 0
+            start = default_timer()
+            for rows in self.line_rows:
+                for row in rows:
+                    row[index] = encode_value(
+                        sanitizer(decode_value(row[index])))
+                    count += 1
+            if expensive is None:
+                classifier.record(key, count, default_timer() - start)
+
+    def ready(self):
+        """
+        Tells whether results of all the offloaded columns are available.
+
+        :rtype: bool
+        """
+        return all(result.ready() for (index, result) in self.batches)
+
+    def get_lines(self):
+        """
+        Waits for the results of the offloaded columns, merges them into the
+        rows and returns the sanitized lines.
+
+        :rtype: list[str]
+        """
+        encode_value = self.backend_module.encode_value
+        for (index, result) in self.batches:
+            values = iter(result.get())
+            for rows in self.line_rows:
+                for row in rows:
+                    row[index] = encode_value(next(values))
+        format_value_line = self.backend_module.format_value_line
+        return [
+            format_value_line(rows, self.table, self.columns)
+            for rows in self.line_rows
+        ]
+
+
+def sanitize_values(table, column, values):
+    """
+    Sanitizes a batch of values of given column in a worker process.
+
+    :type table: str
+    :type column: str
+    :type values: list[any]
+    :rtype: list[any]
+    """
+    sanitizer = worker_state["config"].get_sanitizer_for(table, column)
+    return [sanitizer(value) for value in values]
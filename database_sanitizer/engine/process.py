@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Engine which sanitizes table data in multiple worker processes.
+
+Data chunks are encoded and written into slots of a ring buffer residing
+in shared memory, from which the worker processes read them, sanitize the
+lines and write the results into the same slot of another ring buffer.
+Only slot indexes and lengths travel through the control queues, so the
+dump data itself is never pickled. The results are collected in the
+original order of the chunks.
+"""
+
+from __future__ import unicode_literals
+
+import itertools
+import multiprocessing
+import pickle
+from collections import deque
+
+from six.moves import queue
+
+from .. import session
+from ..dump import CHUNK_DATA
+from ..stats import watch_queue
+from . import (
+    LineSanitizerCache,
+    get_multiprocessing_context,
+    get_worker_count,
+    init_worker,
+)
+from .shm import SharedRing
+
+#: Default size of a single input slot in bytes. The size of an output slot
+#: is `OUTPUT_SLOT_SIZE_FACTOR` times this.
+DEFAULT_SLOT_SIZE = 1024 * 1024
+
+#: Default number of slots in the ring buffers per worker process.
+DEFAULT_SLOTS_PER_WORKER = 4
+
+#: Size of output slots in relation to input slots, leaving room for the
+#: sanitized data to grow.
+OUTPUT_SLOT_SIZE_FACTOR = 2
+
+#: Number of seconds to wait for results before checking that the worker
+#: processes are still alive.
+WORKER_POLL_INTERVAL = 1.0
+
+
+class ProcessEngine(object):
+    """
+    Engine which sanitizes table data in worker processes communicating
+    through shared memory ring buffers.
+    """
+    def __init__(
+        self,
+        workers=None,
+        slot_size=DEFAULT_SLOT_SIZE,
+        slots_per_worker=DEFAULT_SLOTS_PER_WORKER,
+    ):
+        """
+        :param workers: Number of worker processes. Defaults to number of
+                        CPUs.
+        :type workers: int|None
+
+        :param slot_size: Size of a single input slot in bytes.
+        :type slot_size: int
+
+        :param slots_per_worker: Number of slots in the ring buffers per
+                                 worker process.
+        :type slots_per_worker: int
+        """
+        self.workers = workers
+        self.slot_size = slot_size
+        self.slots_per_worker = slots_per_worker
+
+    def sanitize(self, backend, chunks, config):
+        """
+        Sanitizes data chunks of a database dump in worker processes.
+
+        Lines which are too large to fit into a slot are sanitized in the
+        calling process instead.
+
+        :param backend: Name of the dump backend module which produced the
+                        chunks.
+        :type backend: str
+
+        :param chunks: Chunks of the database dump.
+        :type chunks: collections.Iterable[database_sanitizer.dump.Chunk]
+
+        :param config: Sanitizer configuration.
+        :type config: database_sanitizer.config.Configuration|None
+
+        :return: Iterator of sanitized lines, in the original order.
+        :rtype: collections.Iterator[str]
+        """
+        line_sanitizers = LineSanitizerCache(backend, config)
+        pool = WorkerPool(
+            backend=backend,
+            config=config,
+            workers=get_worker_count(self.workers),
+            slot_size=self.slot_size,
+            slots_per_worker=self.slots_per_worker,
+        )
+
+        # Either lists of lines ready to be returned, or sequence numbers of
+        # tasks being processed by the workers, in the original order.
+        pending = deque()
+        finished = {}
+        watch_queue("process", pending)
+
+        try:
+            for chunk in chunks:
+                line_sanitizer = None
+                if chunk.kind == CHUNK_DATA:
+                    line_sanitizer = line_sanitizers.get(
+                        chunk.table, chunk.columns)
+
+                if not line_sanitizer:
+                    pending.append(chunk.lines)
+                else:
+                    for lines, data in self._pack(chunk.lines):
+                        if data is None:
+                            pending.append(
+                                [line_sanitizer(line) for line in lines])
+                            continue
+                        while not pool.free_slots:
+                            sequence, result = pool.collect()
+                            finished[sequence] = result
+                        pending.append(
+                            pool.submit(data, chunk.table, chunk.columns))
+
+                for line in _pop_ready(pending, finished):
+                    yield line
+
+            while pending:
+                if not isinstance(pending[0], list):
+                    sequence, result = pool.collect()
+                    finished[sequence] = result
+                for line in _pop_ready(pending, finished):
+                    yield line
+
+            pool.close()
+        finally:
+            pool.terminate()
+
+    def _pack(self, lines):
+        """
+        Encodes given lines into blocks which fit into a slot. Lines which do
+        not fit into a slot even on their own are returned without encoded
+        data. Nothing is returned for an empty list of lines, as its encoded
+        form would be indistinguishable from a single empty line.
+
+        :type lines: list[str]
+        :rtype: collections.Iterator[tuple[list[str],bytes|None]]
+        """
+        if not lines:
+            return
+        data = "\n".join(lines).encode("utf-8")
+        if len(data) <= self.slot_size:
+            yield lines, data
+        elif len(lines) == 1:
+            yield lines, None
+        else:
+            middle = len(lines) // 2
+            for item in self._pack(lines[:middle]):
+                yield item
+            for item in self._pack(lines[middle:]):
+                yield item
+
+
+def _pop_ready(pending, finished):
+    """
+    Pops lines from the beginning of the pending queue for as long as they
+    are available.
+    """
+    while pending:
+        entry = pending[0]
+        if not isinstance(entry, list):
+            if entry not in finished:
+                return
+            entry = finished.pop(entry)
+        pending.popleft()
+        for line in entry:
+            yield line
+
+
+class WorkerPool(object):
+    """
+    Worker processes together with the shared memory ring buffers and
+    control queues used for communicating with them.
+    """
+    def __init__(self, backend, config, workers, slot_size, slots_per_worker):
+        slot_count = workers * slots_per_worker
+        context = get_multiprocessing_context()
+        self.input_ring = SharedRing(slot_count, slot_size)
+        try:
+            self.output_ring = SharedRing(
+                slot_count, slot_size * OUTPUT_SLOT_SIZE_FACTOR)
+        except Exception:
+            self.input_ring.close()
+            raise
+        self.free_slots = list(range(slot_count))
+        self.sequence = itertools.count()
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.processes = []
+        self.closed = False
+
+        secret_key = session.get_secret()
+
+        for _ in range(workers):
+            process = context.Process(
+                target=run_worker,
+                args=(
+                    backend,
+                    config,
+                    secret_key,
+                    self.input_ring,
+                    self.output_ring,
+                    self.tasks,
+                    self.results,
+                ),
+            )
+            process.daemon = True
+            self.processes.append(process)
+            process.start()
+
+    def submit(self, data, table, columns):
+        """
+        Writes given data into a free slot and queues it for sanitation.
+
+        :param data: Encoded data lines separated by new lines.
+        :type data: bytes
+
+        :type table: str
+        :type columns: tuple[str]
+
+        :return: Sequence number of the submitted task.
+        :rtype: int
+        """
+        slot = self.free_slots.pop()
+        length = self.input_ring.write(slot, data)
+        sequence = next(self.sequence)
+        self.tasks.put((sequence, slot, length, table, columns))
+        return sequence
+
+    def collect(self):
+        """
+        Waits for the next finished task and frees its slot.
+
+        :return: Sequence number of the task and the sanitized lines.
+        :rtype: tuple[int,list[str]]
+        """
+        while True:
+            try:
+                result = self.results.get(timeout=WORKER_POLL_INTERVAL)
+                break
+            except queue.Empty:
+                for process in self.processes:
+                    if not process.is_alive():
+                        raise RuntimeError(
+                            "Worker process exited with code %s" % (
+                                process.exitcode,
+                            ),
+                        )
+
+        (sequence, slot, length, data, error) = result
+        if error is None and data is None:
+            data = self.output_ring.read(slot, length)
+        self.free_slots.append(slot)
+        if error is not None:
+            raise error
+        return sequence, data.decode("utf-8").split("\n")
+
+    def close(self):
+        """
+        Tells the worker processes to exit and waits for them.
+        """
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join()
+        self.closed = True
+
+    def terminate(self):
+        """
+        Terminates the worker processes, if they are still running, and
+        releases the ring buffers.
+        """
+        if not self.closed:
+            for process in self.processes:
+                process.terminate()
+            for process in self.processes:
+                process.join()
+            self.closed = True
+        for control_queue in (self.tasks, self.results):
+            control_queue.close()
+            control_queue.cancel_join_thread()
+        self.input_ring.close()
+        self.output_ring.close()
+
+
+def run_worker(
+    backend,
+    config,
+    secret_key,
+    input_ring,
+    output_ring,
+    tasks,
+    results,
+):
+    """
+    Main loop of a worker process. Sanitizes data from slots of the input
+    ring into the same slots of the output ring, until None is received from
+    the task queue. Results which do not fit into a slot are sent through
+    the result queue instead.
+    """
+    init_worker(config, secret_key)
+    line_sanitizers = LineSanitizerCache(backend, config)
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        (sequence, slot, length, table, columns) = task
+        try:
+            line_sanitizer = line_sanitizers.get(table, columns)
+            lines = input_ring.read(slot, length).decode("utf-8").split("\n")
+            data = "\n".join(
+                line_sanitizer(line) for line in lines
+            ).encode("utf-8")
+            if len(data) <= output_ring.slot_size:
+                output_ring.write(slot, data)
+                results.put((sequence, slot, len(data), None, None))
+            else:
+                results.put((sequence, slot, len(data), data, None))
+        except Exception as error:
+            results.put((sequence, slot, None, None, _picklable(error)))
+
+
+def _picklable(error):
+    """
+    Returns given exception if it can be pickled, otherwise a RuntimeError
+    describing it.
+    """
+    try:
+        pickle.loads(pickle.dumps(error))
+    except Exception:
+        return RuntimeError("%s: %s" % (type(error).__name__, error))
+    return error
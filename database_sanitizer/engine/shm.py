@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Ring buffers in shared memory, used for passing chunks of dump data
+between processes without pickling them.
+
+A ring consists from a fixed number of equally sized slots residing in a
+single shared memory block. Ownership of the slots is coordinated by the
+users of the ring by passing slot indexes through a separate control queue,
+so the ring itself does not need any locking.
+"""
+
+from __future__ import unicode_literals
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # pragma: no cover (Python < 3.8)
+    shared_memory = None
+
+
+class SharedRing(object):
+    """
+    Fixed number of equally sized slots in a shared memory block.
+
+    The ring should be created before the worker processes are started, so
+    that they inherit it. When pickled, the ring is attached into by the name
+    of the shared memory block instead.
+    """
+    def __init__(self, slot_count, slot_size, name=None):
+        """
+        :param slot_count: Number of slots in the ring.
+        :type slot_count: int
+
+        :param slot_size: Size of a single slot in bytes.
+        :type slot_size: int
+
+        :param name: Name of an existing shared memory block to attach into.
+                     If omitted, a new block will be created.
+        :type name: str|None
+        """
+        if shared_memory is None:
+            raise RuntimeError(
+                "Shared memory ring buffers require Python 3.8 or newer")
+        if slot_count < 1 or slot_size < 1:
+            raise ValueError("Slot count and size must be positive")
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.owner = name is None
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(
+                create=True,
+                size=slot_count * slot_size,
+            )
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+
+    def __reduce__(self):
+        return (
+            self.__class__,
+            (self.slot_count, self.slot_size, self.memory.name),
+        )
+
+    def _get_offset(self, slot):
+        if not 0 <= slot < self.slot_count:
+            raise IndexError("Slot index out of range: %d" % (slot,))
+        return slot * self.slot_size
+
+    def write(self, slot, data):
+        """
+        Writes given data into a slot.
+
+        :param slot: Index of the slot.
+        :type slot: int
+
+        :param data: Data to write, at most size of a slot in length.
+        :type data: bytes
+
+        :return: Number of bytes written.
+        :rtype: int
+        """
+        length = len(data)
+        if length > self.slot_size:
+            raise ValueError(
+                "Data of %d bytes does not fit into a slot of %d" % (
+                    length,
+                    self.slot_size,
+                ),
+            )
+        offset = self._get_offset(slot)
+        self.memory.buf[offset:offset + length] = data
+        return length
+
+    def read(self, slot, length):
+        """
+        Reads data from a slot.
+
+        :param slot: Index of the slot.
+        :type slot: int
+
+        :param length: Number of bytes to read.
+        :type length: int
+
+        :rtype: bytes
+        """
+        if not 0 <= length <= self.slot_size:
+            raise ValueError("Invalid length: %d" % (length,))
+        offset = self._get_offset(slot)
+        return bytes(self.memory.buf[offset:offset + length])
+
+    def close(self):
+        """
+        Detaches from the shared memory block, releasing it if this ring
+        created it.
+        """
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
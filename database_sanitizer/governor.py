@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+"""
+Limits on the load caused to the source database by a sanitation run.
+
+The governor is enforced where the dumps are extracted from the database:
+
+* Rows and characters read from the outputs of the dump commands are
+  charged from token buckets, which are shared by the worker processes of
+  the parallel table mode, so the limits apply to the whole run. Rows are
+  counted like in the statistics, i.e. estimated from the separators of
+  the rows of `mysqldump` outputs.
+* Dump commands are run with lower CPU and I/O priority with `nice` and
+  `ionice`. These affect only the client processes on the local machine,
+  whose reading paces the database server.
+* Number of concurrent database connections is capped by limiting the
+  worker processes of the parallel table mode, which each use their own
+  connection. With PostgreSQL one more connection holds the snapshot
+  shared by the workers.
+
+In the adaptive mode a probe command is run periodically in a background
+thread, which outputs a number such as the replication lag or latency of a
+query. Whenever it exceeds the threshold, or the probe fails, the rate
+limits are halved, down to `MIN_RATE_FACTOR` of the configured limits, and
+otherwise they are raised back gradually by `RECOVERY_STEP`.
+"""
+
+from __future__ import division, unicode_literals
+
+import contextlib
+import importlib
+import os
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+from .engine import get_multiprocessing_context
+
+#: Default interval between runs of the probe command in seconds.
+DEFAULT_PROBE_INTERVAL = 5.0
+
+#: Factor by which the rate limits are multiplied when the probe exceeds
+#: the threshold.
+BACKOFF_FACTOR = 0.5
+
+#: Amount by which the factor of the rate limits is raised back when the
+#: probe is below the threshold.
+RECOVERY_STEP = 0.1
+
+#: Minimum factor of the rate limits in the adaptive mode.
+MIN_RATE_FACTOR = 0.05
+
+#: Approximate number of characters read before they are charged from the
+#: token buckets.
+THROTTLE_BATCH_SIZE = 64 * 1024
+
+#: Arguments of `ionice` for the supported scheduling classes.
+IONICE_CLASSES = OrderedDict([
+    ("idle", ["-c", "3"]),
+    ("best-effort", ["-c", "2", "-n", "7"]),
+])
+
+#: Governor of the current run, set by `SourceGovernor.govern`.
+_governor = None
+
+
+class TokenBucket(object):
+    """
+    Token bucket refilled at a fixed rate, whose state resides in shared
+    memory so that it can be shared with forked worker processes.
+
+    Tokens are consumed before waiting for them, so the bucket may go into
+    debt, which the consumer then waits out. Concurrent consumers queue up
+    behind the debt, keeping the total rate at the limit.
+    """
+    def __init__(self, rate, burst=1.0, clock=time.time, sleep=time.sleep):
+        """
+        :param rate: Number of tokens added per second.
+        :type rate: float
+
+        :param burst: Capacity of the bucket in seconds of the rate.
+        :type burst: float
+
+        :param clock: Function returning the current time in seconds.
+        :param sleep: Function sleeping given number of seconds.
+        """
+        if rate <= 0:
+            raise ValueError("Rate must be positive")
+        context = get_multiprocessing_context()
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        # Number of tokens, and the time they were counted.
+        self.state = context.RawArray("d", [rate * burst, clock()])
+        self.lock = context.Lock()
+
+    @property
+    def tokens(self):
+        return self.state[0]
+
+    def consume(self, amount, factor=1.0):
+        """
+        Takes given amount of tokens from the bucket, waiting until they
+        have been refilled if necessary.
+
+        :type amount: float
+
+        :param factor: Factor of the rate, used by the adaptive mode.
+        :type factor: float
+
+        :return: Number of seconds waited.
+        :rtype: float
+        """
+        rate = self.rate * factor
+        with self.lock:
+            now = self.clock()
+            tokens = min(
+                rate * self.burst,
+                self.state[0] + max(0.0, now - self.state[1]) * rate,
+            )
+            tokens -= amount
+            self.state[0] = tokens
+            self.state[1] = now
+        if tokens >= 0:
+            return 0.0
+        delay = -tokens / rate
+        self.sleep(delay)
+        return delay
+
+
+class SourceGovernor(object):
+    """
+    Limits the load caused to the source database by a sanitation run.
+    """
+    def __init__(
+        self,
+        max_connections=None,
+        rows_per_second=None,
+        bytes_per_second=None,
+        nice=None,
+        ionice=None,
+        probe=None,
+        probe_threshold=None,
+        probe_interval=DEFAULT_PROBE_INTERVAL,
+        clock=time.time,
+        sleep=time.sleep,
+    ):
+        """
+        :param max_connections: Maximum number of worker processes dumping
+                                tables concurrently.
+        :type max_connections: int|None
+
+        :param rows_per_second: Maximum number of rows read per second.
+        :type rows_per_second: float|None
+
+        :param bytes_per_second: Maximum number of characters read per
+                                 second.
+        :type bytes_per_second: float|None
+
+        :param nice: Niceness of the dump commands.
+        :type nice: int|None
+
+        :param ionice: Scheduling class of the dump commands, one of
+                       `IONICE_CLASSES`.
+        :type ionice: str|None
+
+        :param probe: Shell command whose output ends with a number, which
+                      is compared against `probe_threshold`.
+        :type probe: str|None
+
+        :type probe_threshold: float|None
+
+        :param probe_interval: Interval between runs of the probe command
+                               in seconds.
+        :type probe_interval: float
+
+        :param clock: Function returning the current time in seconds.
+        :param sleep: Function sleeping given number of seconds.
+        """
+        if max_connections is not None and max_connections < 1:
+            raise ValueError("Maximum number of connections must be positive")
+        if ionice is not None and ionice not in IONICE_CLASSES:
+            raise ValueError(
+                "Unsupported I/O scheduling class: %s" % (ionice,))
+        if probe and probe_threshold is None:
+            raise ValueError("Probe requires a threshold")
+        if probe and not (rows_per_second or bytes_per_second):
+            raise ValueError(
+                "Probe requires a limit of rows or bytes per second")
+        if probe_interval <= 0:
+            raise ValueError("Probe interval must be positive")
+        self.max_connections = max_connections
+        self.nice = nice
+        self.ionice = ionice
+        self.probe = probe
+        self.probe_threshold = probe_threshold
+        self.probe_interval = probe_interval
+        self.row_bucket = None
+        if rows_per_second:
+            self.row_bucket = TokenBucket(
+                rows_per_second, clock=clock, sleep=sleep)
+        self.byte_bucket = None
+        if bytes_per_second:
+            self.byte_bucket = TokenBucket(
+                bytes_per_second, clock=clock, sleep=sleep)
+        # Factor of the rate limits, lowered by the adaptive mode.
+        self.factor = get_multiprocessing_context().RawValue("d", 1.0)
+
+    def throttle(self, rows, size):
+        """
+        Charges given number of rows and characters read from the rate
+        limits, waiting if they have been exceeded.
+
+        :type rows: int
+        :type size: int
+        """
+        factor = self.factor.value
+        if self.row_bucket is not None and rows:
+            self.row_bucket.consume(rows, factor)
+        if self.byte_bucket is not None and size:
+            self.byte_bucket.consume(size, factor)
+
+    def throttle_lines(self, lines, backend):
+        """
+        Passes lines read from a dump command through the rate limits.
+
+        :type lines: collections.Iterable[str]
+
+        :param backend: Name of the dump backend module which produced the
+                        lines.
+        :type backend: str
+
+        :rtype: collections.Iterator[str]
+        """
+        if self.row_bucket is None and self.byte_bucket is None:
+            for line in lines:
+                yield line
+            return
+        iter_line_rows = importlib.import_module(backend).iter_line_rows
+        rows = 0
+        size = 0
+        for (line, line_rows) in iter_line_rows(lines):
+            rows += line_rows
+            size += len(line) + 1
+            if size >= THROTTLE_BATCH_SIZE:
+                self.throttle(rows, size)
+                rows = 0
+                size = 0
+            yield line
+        self.throttle(rows, size)
+
+    def wrap_command(self, args):
+        """
+        Prefixes command line arguments of a dump command with `nice` and
+        `ionice` as configured.
+
+        :type args: collections.Sequence[str]
+        :rtype: collections.Sequence[str]
+        """
+        prefix = []
+        if self.ionice is not None:
+            prefix.extend(["ionice"] + IONICE_CLASSES[self.ionice])
+        if self.nice is not None:
+            prefix.extend(["nice", "-n", "%d" % (self.nice,)])
+        if not prefix:
+            return args
+        return prefix + list(args)
+
+    def limit_connections(self, jobs):
+        """
+        :param jobs: Requested number of worker processes.
+        :type jobs: int
+
+        :return: Number of worker processes within the connection limit.
+        :rtype: int
+        """
+        if self.max_connections is None:
+            return jobs
+        return min(jobs, self.max_connections)
+
+    def probe_once(self):
+        """
+        Runs the probe command and adjusts the rate limits by its result.
+
+        :return: Number output by the probe, or None if it failed.
+        :rtype: float|None
+        """
+        try:
+            output = subprocess.check_output(self.probe, shell=True)
+            value = float(output.decode("utf-8").split()[-1])
+        except (
+            OSError,
+            subprocess.CalledProcessError,
+            ValueError,
+            IndexError,
+        ):
+            value = None
+        factor = self.factor.value
+        if value is None or value > self.probe_threshold:
+            factor = max(MIN_RATE_FACTOR, factor * BACKOFF_FACTOR)
+        else:
+            factor = min(1.0, factor + RECOVERY_STEP)
+        self.factor.value = factor
+        return value
+
+    def _run_probe(self, stopped):
+        while True:
+            self.probe_once()
+            if stopped.wait(self.probe_interval):
+                break
+
+    @contextlib.contextmanager
+    def govern(self):
+        """
+        Context manager which applies the limits to the dumps obtained
+        within it, and runs the probe command in a background thread.
+        """
+        global _governor
+
+        stopped = threading.Event()
+        thread = None
+        if self.probe:
+            thread = threading.Thread(
+                target=self._run_probe,
+                args=(stopped,),
+                name="database-sanitizer-probe",
+            )
+            thread.daemon = True
+            thread.start()
+        previous_governor = _governor
+        _governor = self
+        try:
+            yield self
+        finally:
+            _governor = previous_governor
+            stopped.set()
+            if thread is not None:
+                thread.join()
+
+
+def is_command_available(command):
+    """
+    Tells whether given command is found in the search path.
+
+    :type command: str
+    :rtype: bool
+    """
+    for directory in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        path = os.path.join(directory, command)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return True
+    return False
+
+
+def get_governor():
+    """
+    :return: Governor of the current run, if any.
+    :rtype: SourceGovernor|None
+    """
+    return _governor
+
+
+def use_governor(governor):
+    """
+    Sets the governor of a worker process, which inherits it from the run.
+
+    :type governor: SourceGovernor|None
+    """
+    global _governor
+    _governor = governor
+
+
+def throttle_lines(lines, backend):
+    """
+    Passes lines read from a dump command through the rate limits of the
+    current run, if there are any.
+
+    :type lines: collections.Iterable[str]
+    :type backend: str
+    :rtype: collections.Iterable[str]
+    """
+    governor = _governor
+    if governor is None:
+        return lines
+    return governor.throttle_lines(lines, backend)
+
+
+def wrap_command(args):
+    """
+    Prefixes command line arguments of a dump command with `nice` and
+    `ionice` as configured for the current run.
+
+    :type args: collections.Sequence[str]
+    :rtype: collections.Sequence[str]
+    """
+    governor = _governor
+    if governor is None:
+        return args
+    return governor.wrap_command(args)
+
+
+def limit_connections(jobs):
+    """
+    Limits number of worker processes of the parallel table mode to the
+    maximum number of connections of the current run.
+
+    :type jobs: int
+    :rtype: int
+    """
+    governor = _governor
+    if governor is None:
+        return jobs
+    return governor.limit_connections(jobs)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Writer which splits a sanitized MySQL dump into a directory of files that
+can be restored with `LOAD DATA`, which is several times faster than
+executing the `INSERT INTO` statements of the dump.
+
+Table data is converted into tab separated data files, one per table, and
+the rest of the dump is written into a schema file. Triggers are written
+into a separate file, so that they are created only after the data has
+been loaded, just like `mysqldump` does. A load script executing the files
+in the right order is written along with the manifest of
+`database_sanitizer.directory.DirectoryWriter` when the writer is closed,
+so the directory can also be restored in parallel with
+`database_sanitizer.restore`.
+"""
+
+from __future__ import unicode_literals
+
+import io
+import os
+
+from .directory import DirectoryWriter, get_checksum
+from .dump.mysql import (
+    INSERT_INTO_PATTERN, convert_load_data_line, get_load_data_statement,
+    parse_column_names)
+
+#: Name of the file containing the schema and other statements of the dump.
+SCHEMA_FILENAME = "schema.sql"
+
+#: Name of the file containing the triggers.
+POST_DATA_FILENAME = "post-data.sql"
+
+#: Name of the generated load script.
+LOAD_SCRIPT_FILENAME = "load.sql"
+
+#: Extension of the data files.
+DATA_EXTENSION = ".tsv"
+
+
+class LoadDataWriter(DirectoryWriter):
+    """
+    Writes lines of a MySQL dump into a directory of files for `LOAD DATA`.
+    """
+    data_format = "tsv"
+    dialects = ("mysql",)
+    pre_data_filename = SCHEMA_FILENAME
+    post_data_filename = POST_DATA_FILENAME
+    data_extension = DATA_EXTENSION
+
+    def __init__(
+        self,
+        directory,
+        shard_size=None,
+        identity=None,
+        resume=False,
+    ):
+        """
+        :param directory: Path to the directory, which is created if it does
+                          not exist. Existing directory must be empty,
+                          unless resuming.
+        :type directory: str
+
+        :param shard_size: Size in bytes after which the data of a table
+                           continues in a new file, or None to write the
+                           data of each table into a single file.
+        :type shard_size: int|None
+
+        :param identity: Identity of the run recorded into the journal, as
+                         in `DirectoryWriter`.
+        :type identity: dict|None
+
+        :param resume: Whether to resume an interrupted run.
+        :type resume: bool
+        """
+        super(LoadDataWriter, self).__init__(
+            directory, shard_size=shard_size, identity=identity, resume=resume)
+        self.filenames.add(LOAD_SCRIPT_FILENAME)
+
+    def _write_insert(self, line):
+        insert_into_match = INSERT_INTO_PATTERN.match(line)
+        if not insert_into_match:
+            return False
+        self._start_data(
+            "mysql",
+            None,
+            insert_into_match.group("table"),
+            parse_column_names(insert_into_match.group("columns")),
+        )
+        if not self.skipping:
+            (_table, _columns, rows) = convert_load_data_line(line)
+            self._write_data(rows, rows.count("\n"))
+        return True
+
+    def get_header(self):
+        # The data files contain only the rows, and the files are executed
+        # in the same session by the load script.
+        return []
+
+    def add_data_file(self, table, columns, path):
+        """
+        Moves a data file written elsewhere into the directory, e.g. by a
+        worker of the parallel table mode.
+
+        :param table: Name of the table.
+        :type table: str
+
+        :param columns: Names of the columns in the data file, or None if
+                        the table had no rows, in which case the file is
+                        removed.
+        :type columns: tuple[str]|None
+
+        :param path: Path to the file, in the same file system as the
+                     directory.
+        :type path: str
+        """
+        self._close_shard()
+        if columns is None:
+            os.remove(path)
+            return
+        self._start_data("mysql", None, table, columns)
+        filename = self._get_data_filename(table)
+        (size, checksum, rows) = get_checksum(path)
+        os.rename(path, os.path.join(self.directory, filename))
+        self._add_data_file({
+            "file": filename,
+            "bytes": size,
+            "sha256": checksum,
+            "rows": rows,
+        })
+
+    def close(self):
+        """
+        Closes the files and writes the manifest and the load script.
+        """
+        if self.closed:
+            return
+        super(LoadDataWriter, self).close()
+        with io.open(
+            os.path.join(self.directory, LOAD_SCRIPT_FILENAME),
+            "w",
+            encoding="utf-8",
+            newline="",
+        ) as stream:
+            for line in self.get_load_script():
+                stream.write(line + "\n")
+
+    def get_load_script(self):
+        """
+        Constructs the load script, which is executed with the `mysql`
+        client in the directory.
+
+        :rtype: list[str]
+        """
+        lines = [
+            "-- Restore with: mysql --local-infile=1 DATABASE < %s" % (
+                LOAD_SCRIPT_FILENAME,),
+            "SET NAMES utf8mb4;",
+            "SOURCE %s;" % (SCHEMA_FILENAME,),
+            "SET FOREIGN_KEY_CHECKS = 0;",
+            "SET UNIQUE_CHECKS = 0;",
+        ]
+        lines.extend(
+            get_load_data_statement(
+                table["table"], table["columns"], data_file["file"])
+            for table in self.tables
+            for data_file in table["files"]
+        )
+        lines.extend([
+            "SET UNIQUE_CHECKS = 1;",
+            "SET FOREIGN_KEY_CHECKS = 1;",
+            "SOURCE %s;" % (POST_DATA_FILENAME,),
+        ])
+        return lines
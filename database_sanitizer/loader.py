@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Loader which restores the sanitized dump straight into a target Postgres
+database instead of writing it into a file.
+
+Schema statements preceding the table data are executed with a `psql`
+process as they arrive. Each `COPY` block is streamed into its own `psql`
+process, so several tables are loaded concurrently while the source goes
+on with the next ones. Statements following the table data, such as
+indexes, constraints and triggers, are executed only after all of the
+data has been loaded, as building them is cheaper afterwards.
+
+Each `COPY` block is handed over to its loader in batches through a
+bounded queue, and only a limited number of loaders run at once, so a slow
+target throttles the source instead of the dump piling up in memory.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import re
+import subprocess
+import threading
+from collections import OrderedDict
+
+from six.moves import queue
+
+from .dump.postgres import COPY_LINE_PATTERN
+from .utils.postgres import get_psql_args
+from .writer import DEFAULT_BUFFER_COUNT, DEFAULT_BUFFER_SIZE
+
+#: Default number of `COPY` blocks loaded concurrently.
+DEFAULT_JOBS = 4
+
+#: Statements of the dump configuring the session, such as encoding and
+#: search path, which are repeated in each connection of the loader.
+SETTING_PATTERN = re.compile(
+    r"^(?:SET (?P<name>[a-z_.]+) = .*"
+    r"|SELECT pg_catalog\.set_config\('(?P<variable>[a-z_.]+)', .*\));$"
+)
+
+
+class PostgresLoader(object):
+    """
+    Loads lines of a Postgres dump into a database.
+    """
+    def __init__(
+        self,
+        url,
+        jobs=DEFAULT_JOBS,
+        buffer_size=DEFAULT_BUFFER_SIZE,
+        buffer_count=DEFAULT_BUFFER_COUNT,
+    ):
+        """
+        :param url: Parsed URL of the target database.
+        :type url: six.moves.urllib.parse.ParseResult
+
+        :param jobs: Maximum number of `COPY` blocks loaded concurrently.
+        :type jobs: int
+
+        :param buffer_size: Size of a batch of table data in bytes.
+        :type buffer_size: int
+
+        :param buffer_count: Number of batches queued per `COPY` block
+                             before the source has to wait for the target.
+        :type buffer_count: int
+        """
+        if jobs < 1:
+            raise ValueError("Number of jobs must be positive")
+        if buffer_size < 1:
+            raise ValueError("Buffer size must be positive")
+        if buffer_count < 1:
+            raise ValueError("Number of buffers must be positive")
+
+        self.url = url
+        self.buffer_size = buffer_size
+        self.buffer_count = buffer_count
+        self.slots = threading.BoundedSemaphore(jobs)
+        self.lock = threading.Lock()
+        # Latest statement of each setting, in the order they were set.
+        self.settings = OrderedDict()
+        # Statements following the first `COPY` block, executed once all of
+        # the data has been loaded.
+        self.deferred = []
+        self.data_started = False
+        self.schema_process = None
+        self.current = None
+        self.loads = []
+        self.pending = ""
+        self.error = None
+        self.closed = False
+
+    def write(self, text):
+        """
+        Writes given text, which may end in the middle of a line.
+
+        :type text: str
+        """
+        lines = (self.pending + text).split("\n")
+        self.pending = lines.pop()
+        self.write_lines(lines)
+
+    def write_lines(self, lines):
+        """
+        Writes given lines, without trailing new lines.
+
+        :type lines: collections.Iterable[str]
+        """
+        for line in lines:
+            # Dump files are sanitized in blocks of multiple lines.
+            if "\n" in line:
+                self.write_lines(line.split("\n"))
+                continue
+            if self.current is not None:
+                if line == "\\.":
+                    self.current.finish()
+                    self.current = None
+                else:
+                    self.current.add(line)
+                continue
+
+            if COPY_LINE_PATTERN.match(line):
+                self._start_load(line)
+                continue
+
+            setting_match = SETTING_PATTERN.match(line)
+            if setting_match:
+                name = (
+                    setting_match.group("name")
+                    or setting_match.group("variable")
+                )
+                self.settings.pop(name, None)
+                self.settings[name] = line
+            if self.data_started:
+                self.deferred.append(line)
+            else:
+                self._execute_schema(line)
+
+    def _execute_schema(self, line):
+        if self.schema_process is None:
+            self.schema_process = self._start_psql(settings=False)
+        self.schema_process.stdin.write((line + "\n").encode("utf-8"))
+
+    def _start_load(self, copy_line):
+        self._check_error()
+        if not self.data_started:
+            # Tables must exist before the loaders connect.
+            self.data_started = True
+            if self.schema_process is not None:
+                self._finish_process(self.schema_process)
+                self._check_error()
+        # Waits for a free loader, throttling the source.
+        self.slots.acquire()
+        load = _TableLoad(self, copy_line)
+        self.loads.append(load)
+        self.current = load
+        load.start()
+
+    def _start_psql(self, settings=True):
+        devnull = open(os.devnull, "wb")
+        try:
+            process = subprocess.Popen(
+                get_psql_args(self.url),
+                stdin=subprocess.PIPE,
+                # Results of statements such as `setval` are not needed.
+                stdout=devnull,
+            )
+        finally:
+            devnull.close()
+        if settings:
+            header = "".join(line + "\n" for line in self.settings.values())
+            process.stdin.write(header.encode("utf-8"))
+        return process
+
+    def _finish_process(self, process):
+        try:
+            process.stdin.close()
+        except (IOError, OSError):
+            pass
+        returncode = process.wait()
+        if returncode != 0:
+            self._set_error(subprocess.CalledProcessError(returncode, "psql"))
+
+    def _set_error(self, error):
+        with self.lock:
+            if self.error is None:
+                self.error = error
+
+    def _check_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """
+        Waits for the table data to be loaded and executes the deferred
+        statements.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.pending:
+                self.write_lines([self.pending])
+                self.pending = ""
+            if self.current is not None:
+                self._set_error(
+                    ValueError("Dump ended in middle of table data"))
+                self.current.finish()
+                self.current = None
+            for load in self.loads:
+                load.join()
+            if self.schema_process is not None and not self.data_started:
+                self._finish_process(self.schema_process)
+            self._check_error()
+            if self.deferred:
+                process = self._start_psql()
+                try:
+                    for line in self.deferred:
+                        process.stdin.write((line + "\n").encode("utf-8"))
+                finally:
+                    self._finish_process(process)
+                self._check_error()
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self):
+        """
+        Stops loading, leaving the target database as it is.
+        """
+        self.closed = True
+        self._set_error(RuntimeError("Loading was aborted"))
+        processes = [self.schema_process] + [
+            load.process for load in self.loads]
+        for process in processes:
+            if process is not None and process.poll() is None:
+                process.kill()
+        if self.current is not None:
+            self.current.finish()
+            self.current = None
+        for load in self.loads:
+            load.join()
+        for process in processes:
+            if process is not None:
+                process.wait()
+
+
+class _TableLoad(object):
+    """
+    Single `COPY` block loaded in a background thread.
+    """
+    def __init__(self, loader, copy_line):
+        self.loader = loader
+        self.copy_line = copy_line
+        self.batches = queue.Queue(maxsize=loader.buffer_count)
+        self.batch = []
+        self.batch_size = 0
+        self.process = None
+        self.thread = threading.Thread(
+            target=self._run,
+            name="database-sanitizer-loader",
+        )
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def add(self, line):
+        data = line.encode("utf-8")
+        self.batch.append(data)
+        self.batch.append(b"\n")
+        self.batch_size += len(data) + 1
+        if self.batch_size >= self.loader.buffer_size:
+            self.loader._check_error()
+            self._submit()
+
+    def _submit(self):
+        if self.batch:
+            self.batches.put(b"".join(self.batch))
+            self.batch = []
+            self.batch_size = 0
+
+    def finish(self):
+        self._submit()
+        self.batches.put(None)
+
+    def join(self):
+        self.thread.join()
+
+    def _run(self):
+        finished = False
+        try:
+            try:
+                self.loader._check_error()
+                self.process = self.loader._start_psql()
+                self.process.stdin.write(
+                    (self.copy_line + "\n").encode("utf-8"))
+                while True:
+                    batch = self.batches.get()
+                    if batch is None:
+                        finished = True
+                        break
+                    self.process.stdin.write(batch)
+                # The data is committed by the terminator, so it must not be
+                # written if the loading has failed or has been aborted.
+                self.loader._check_error()
+                self.process.stdin.write(b"\\.\n")
+            except Exception as error:
+                # Reported to the main thread, which then stops writing.
+                # The remaining batches are just discarded.
+                self.loader._set_error(error)
+                if self.process is not None and self.process.poll() is None:
+                    self.process.kill()
+                while not finished:
+                    finished = self.batches.get() is None
+            if self.process is not None:
+                self.loader._finish_process(self.process)
+        finally:
+            self.loader.slots.release()
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Export of run metrics as text files for Prometheus.
+
+The run statistics are written in OpenMetrics text format, or in the
+older Prometheus text format, into a file at fixed intervals and once
+more at the end of the run. The file is replaced atomically so that the
+textfile collector of `node_exporter` never reads a partially written
+file. Nothing is sent over the network.
+"""
+
+from __future__ import division, unicode_literals
+
+import contextlib
+import io
+import os
+import threading
+import time
+
+import six
+
+from .stats import LATENCY_BUCKETS
+
+#: Supported formats of the metrics file.
+FORMATS = ("openmetrics", "prometheus")
+
+#: Default interval between writes of the metrics file in seconds.
+DEFAULT_INTERVAL = 15.0
+
+#: Prefix of the names of the metrics.
+PREFIX = "database_sanitizer_"
+
+
+class MetricsWriter(object):
+    """
+    Writes metrics of a run into a file periodically.
+    """
+    def __init__(
+        self,
+        statistics,
+        path,
+        metrics_format="openmetrics",
+        interval=DEFAULT_INTERVAL,
+    ):
+        """
+        :param statistics: Statistics collector of the run.
+        :type statistics: database_sanitizer.stats.RunStatistics
+
+        :param path: Path to the metrics file.
+        :type path: str
+
+        :param metrics_format: One of `FORMATS`.
+        :type metrics_format: str
+
+        :param interval: Interval between the writes in seconds.
+        :type interval: float
+        """
+        if metrics_format not in FORMATS:
+            raise ValueError(
+                "Unsupported metrics format: '%s'" % (metrics_format,))
+        self.statistics = statistics
+        self.path = path
+        self.metrics_format = metrics_format
+        self.interval = interval
+
+    def write(self):
+        """
+        Replaces the metrics file with the current metrics.
+        """
+        text = format_metrics(self.statistics, self.metrics_format)
+        temporary_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with io.open(temporary_path, "w", encoding="utf-8") as stream:
+            stream.write(text)
+        os.rename(temporary_path, self.path)
+
+    @contextlib.contextmanager
+    def report(self):
+        """
+        Writes the metrics periodically within the context, and once more at
+        the end of it.
+        """
+        stop = threading.Event()
+        writer = threading.Thread(
+            target=self._report,
+            args=(stop,),
+            name="database-sanitizer-metrics",
+        )
+        writer.daemon = True
+        writer.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            writer.join()
+            self.write()
+
+    def _report(self, stop):
+        while not stop.wait(self.interval):
+            self.write()
+
+
+def format_metrics(statistics, metrics_format="openmetrics"):
+    """
+    Formats statistics of a run as metrics.
+
+    :type statistics: database_sanitizer.stats.RunStatistics
+
+    :param metrics_format: One of `FORMATS`.
+    :type metrics_format: str
+
+    :rtype: str
+    """
+    data = statistics.as_dict()
+    # Copying the values is atomic, unlike iterating over the dictionary
+    # which is being updated by the sanitizing thread.
+    columns = sorted(six.iteritems(statistics.columns))
+    lines = []
+
+    def add_family(name, metric_type, help_text, samples):
+        # Counters are declared with the "_total" suffix only in the
+        # Prometheus format.
+        family = name
+        if metric_type == "counter" and metrics_format == "openmetrics":
+            family = name[:-len("_total")]
+        lines.append("# HELP %s%s %s" % (PREFIX, family, help_text))
+        lines.append("# TYPE %s%s %s" % (PREFIX, family, metric_type))
+        for (suffix, labels, value) in samples:
+            lines.append("%s%s%s%s %s" % (
+                PREFIX, name, suffix, format_labels(labels),
+                format_value(value)))
+
+    tables = sorted(six.iteritems(data["tables"]))
+    for (name, key, help_text) in (
+        ("rows_total", "rows", "Rows of table data read from the dump."),
+        ("input_bytes_total", "input_bytes",
+         "Size of table data read from the dump."),
+        ("output_bytes_total", "output_bytes",
+         "Size of sanitized table data written."),
+        ("table_seconds_total", "wall_time", "Wall time spent on table data."),
+    ):
+        add_family(name, "counter", help_text, [
+            ("", [("table", table)], table_stats[key])
+            for (table, table_stats) in tables
+        ])
+
+    add_family(
+        "sanitizer_calls_total", "counter", "Calls of the sanitizers.", [
+            ("", _get_column_labels(key), column.calls)
+            for (key, column) in columns
+        ])
+    add_family(
+        "sanitizer_errors_total", "counter",
+        "Calls of the sanitizers which raised an exception.", [
+            ("", _get_column_labels(key), column.errors)
+            for (key, column) in columns
+        ])
+    histogram = []
+    for (key, column) in columns:
+        labels = _get_column_labels(key)
+        count = 0
+        for (bound, bucket) in zip(LATENCY_BUCKETS + (None,), column.buckets):
+            count += bucket
+            histogram.append((
+                "_bucket",
+                labels + [("le", "+Inf" if bound is None else repr(bound))],
+                count,
+            ))
+        histogram.append(("_count", labels, count))
+        histogram.append(("_sum", labels, column.timed_time))
+    add_family(
+        "sanitizer_latency_seconds", "histogram",
+        "Latency of the sampled calls of the sanitizers.", histogram)
+
+    add_family(
+        "phase_seconds_total", "counter",
+        "Estimated wall time spent waiting for the dump utility, parsing, "
+        "sanitizing and writing.", [
+            ("", [("phase", phase)], seconds)
+            for (phase, seconds) in sorted(six.iteritems(data["phases"]))
+        ])
+
+    queues = sorted(six.iteritems(statistics.queues))
+    add_family(
+        "queue_depth", "gauge",
+        "Chunks in flight in the queue of a parallel engine.", [
+            ("", [("queue", name)], len(queue.queue))
+            for (name, queue) in queues
+        ])
+    add_family(
+        "queue_depth_max", "gauge",
+        "Maximum sampled depth of the queue of a parallel engine.", [
+            ("", [("queue", name)], queue.max_depth)
+            for (name, queue) in queues
+        ])
+
+    add_family("run_seconds", "gauge", "Wall time of the run so far.", [
+        ("", [], data["wall_time"])])
+    add_family("cpu_seconds", "gauge", "CPU time of the run so far.", [
+        ("", [], data["cpu_time"])])
+    add_family(
+        "last_update_timestamp_seconds", "gauge",
+        "Time when the metrics were written.", [("", [], time.time())])
+
+    if metrics_format == "openmetrics":
+        lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def _get_column_labels(key):
+    (table, _dot, column) = key.partition(".")
+    return [("table", table), ("column", column)]
+
+
+def format_labels(labels):
+    """
+    :type labels: list[tuple[str,str]]
+    :rtype: str
+    """
+    if not labels:
+        return ""
+    return "{%s}" % (",".join(
+        '%s="%s"' % (name, escape_label_value(value))
+        for (name, value) in labels
+    ),)
+
+
+def escape_label_value(value):
+    """
+    :type value: str
+    :rtype: str
+    """
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace(
+        "\n", "\\n")
+
+
+def format_value(value):
+    """
+    :type value: int|float
+    :rtype: str
+    """
+    if isinstance(value, six.integer_types):
+        return "%d" % (value,)
+    return repr(float(value))
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio based pipeline which overlaps reading of the dump, sanitation of
+the table data and writing of the sanitized dump.
+
+A pipeline consists from three stages connected with bounded queues:
+
+* The reader stage reads output of the dump subprocess, started with
+  `asyncio.create_subprocess_exec`, and splits it into batches of lines.
+* The sanitizer stage parses the batches into chunks and sanitizes them
+  with an engine (see `database_sanitizer.engine`) in an executor thread,
+  so the event loop is free to read and write meanwhile.
+* The writer stage writes the sanitized lines into the output, also in an
+  executor thread.
+
+When a stage falls behind, the queue feeding it fills up and the previous
+stage waits for room, so memory usage stays bounded. Several pipelines,
+for example for different databases, can be driven concurrently by a
+single event loop with `run_pipelines`.
+"""
+
+from __future__ import unicode_literals
+
+import asyncio
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from six.moves.urllib import parse as urlparse
+
+from . import session
+from .dump import DEFAULT_CHUNK_SIZE, get_database_module
+
+#: Default maximum number of batches waiting in a queue between two stages.
+DEFAULT_QUEUE_SIZE = 8
+
+#: Number of bytes to read from the dump subprocess at once.
+READ_SIZE = 64 * 1024
+
+
+class PipelineAborted(Exception):
+    """
+    Raised in the stages of a pipeline when another stage has failed.
+    """
+
+
+class Stage(object):
+    """
+    Bounded queue feeding a stage of a pipeline.
+    """
+    def __init__(self, name, maxsize):
+        """
+        :param name: Name of the stage, for diagnostics.
+        :type name: str
+
+        :param maxsize: Maximum number of batches waiting in the queue.
+        :type maxsize: int
+        """
+        self.name = name
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    @property
+    def depth(self):
+        """
+        Number of batches waiting for the stage.
+
+        :rtype: int
+        """
+        return self.queue.qsize()
+
+
+class Pipeline(object):
+    """
+    Pipeline which dumps a database with a subprocess, sanitizes the dump
+    and writes it into an output stream.
+    """
+    def __init__(
+        self,
+        url,
+        output,
+        config,
+        engine=None,
+        queue_size=DEFAULT_QUEUE_SIZE,
+        batch_size=DEFAULT_CHUNK_SIZE,
+        secret_key=None,
+    ):
+        """
+        :param url: URL to the database which is to be sanitized.
+        :type url: str
+
+        :param output: Stream where sanitized copy of the database dump will
+                       be written into.
+        :type output: file
+
+        :param config: Optional sanitizer configuration.
+        :type config: database_sanitizer.config.Configuration|None
+
+        :param engine: Optional engine used to execute the sanitation of
+                       table data. If omitted, the data is sanitized
+                       serially in the executor thread.
+        :type engine: database_sanitizer.engine.SerialEngine|None
+
+        :param queue_size: Maximum number of batches waiting in a queue
+                           between two stages.
+        :type queue_size: int
+
+        :param batch_size: Approximate number of characters collected into
+                           a single batch of lines.
+        :type batch_size: int
+
+        :param secret_key: Fixed session secret. If omitted, a new random
+                           secret is used.
+        :type secret_key: bytes|None
+        """
+        self.url = urlparse.urlparse(url)
+        self.db_module = get_database_module(self.url)
+        self.output = output
+        self.config = config
+        self.engine = engine
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.secret_key = secret_key
+        self.stages = []
+        self.command = None
+        self.process = None
+
+    def get_queue_depths(self):
+        """
+        Returns number of batches waiting for each of the stages.
+
+        :rtype: dict[str,int]
+        """
+        return {stage.name: stage.depth for stage in self.stages}
+
+    async def run(self):
+        """
+        Runs the pipeline until the whole dump has been written into the
+        output. If any of the stages fails, the others are stopped and the
+        error is raised.
+        """
+        loop = asyncio.get_event_loop()
+        sanitize_stage = Stage("sanitize", self.queue_size)
+        write_stage = Stage("write", self.queue_size)
+        self.stages = [sanitize_stage, write_stage]
+        abort = asyncio.Event()
+
+        args, env = self.db_module.get_dump_command(self.url, self.config)
+        self.command = args
+        self.process = await asyncio.create_subprocess_exec(
+            *args,
+            env=env,
+            stdout=asyncio.subprocess.PIPE
+        )
+
+        executor = ThreadPoolExecutor(max_workers=2)
+        sanitizing = asyncio.ensure_future(loop.run_in_executor(
+            executor,
+            self._sanitize,
+            loop,
+            abort,
+            sanitize_stage.queue,
+            write_stage.queue,
+        ))
+        tasks = [
+            asyncio.ensure_future(self._read(sanitize_stage.queue)),
+            sanitizing,
+            asyncio.ensure_future(
+                self._write(loop, executor, write_stage.queue)),
+        ]
+        try:
+            (done, pending) = await asyncio.wait(
+                tasks,
+                return_when=asyncio.FIRST_EXCEPTION,
+            )
+            failed = [task for task in done if task.exception() is not None]
+            if failed:
+                abort.set()
+                # The sanitizer thread cannot be cancelled, so it is waited
+                # for until it notices the abort, instead of leaving it
+                # waiting for a loop which has been closed.
+                for task in pending:
+                    if task is not sanitizing:
+                        task.cancel()
+                await asyncio.wait(tasks)
+                raise failed[0].exception()
+        finally:
+            if self.process.returncode is None:
+                self.process.kill()
+                await self.process.wait()
+            executor.shutdown(wait=False)
+
+    async def _read(self, queue):
+        """
+        Reader stage: reads the dump from the subprocess into batches of
+        lines.
+        """
+        stream = self.process.stdout
+        batch = []
+        batch_size = 0
+        # Pieces of a line which has not been terminated yet.
+        pieces = []
+        while True:
+            data = await stream.read(READ_SIZE)
+            if not data:
+                break
+            parts = data.split(b"\n")
+            if len(parts) == 1:
+                pieces.append(data)
+                continue
+            parts[0] = b"".join(pieces + [parts[0]])
+            pieces = [parts.pop()]
+            for part in parts:
+                line = part.decode("utf-8")
+                batch.append(line)
+                batch_size += len(line)
+            if batch_size >= self.batch_size:
+                await queue.put(batch)
+                batch = []
+                batch_size = 0
+        remainder = b"".join(pieces)
+        if remainder:
+            batch.append(remainder.decode("utf-8"))
+        if batch:
+            await queue.put(batch)
+        await queue.put(None)
+
+        returncode = await self.process.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.command[0])
+
+    def _sanitize(self, loop, abort, input_queue, output_queue):
+        """
+        Sanitizer stage: runs in an executor thread, parsing and sanitizing
+        the lines from the input queue and passing the results into the
+        output queue in batches.
+        """
+        # The session is local to the thread, which sanitizes the values.
+        session.reset(self.secret_key)
+
+        def call(coroutine):
+            return asyncio.run_coroutine_threadsafe(
+                _unless_aborted(coroutine, abort),
+                loop,
+            ).result()
+
+        def iter_lines():
+            while True:
+                batch = call(input_queue.get())
+                if batch is None:
+                    return
+                for line in batch:
+                    yield line
+
+        batch = []
+        batch_size = 0
+        for line in self.db_module.sanitize_lines(
+            lines=iter_lines(),
+            config=self.config,
+            engine=self.engine,
+        ):
+            batch.append(line)
+            batch_size += len(line)
+            if batch_size >= self.batch_size:
+                call(output_queue.put(batch))
+                batch = []
+                batch_size = 0
+        if batch:
+            call(output_queue.put(batch))
+        call(output_queue.put(None))
+
+    async def _write(self, loop, executor, queue):
+        """
+        Writer stage: writes the sanitized lines into the output.
+        """
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                break
+            await loop.run_in_executor(
+                executor,
+                self.output.write,
+                "".join(line + "\n" for line in batch),
+            )
+
+
+async def _unless_aborted(coroutine, abort):
+    """
+    Awaits given coroutine, unless the pipeline is aborted before it
+    completes.
+    """
+    task = asyncio.ensure_future(coroutine)
+    aborted = asyncio.ensure_future(abort.wait())
+    await asyncio.wait([task, aborted], return_when=asyncio.FIRST_COMPLETED)
+    if not task.done():
+        task.cancel()
+        raise PipelineAborted()
+    aborted.cancel()
+    return task.result()
+
+
+async def run_pipelines(pipelines):
+    """
+    Runs given pipelines concurrently.
+
+    :type pipelines: list[Pipeline]
+    """
+    await asyncio.gather(*(pipeline.run() for pipeline in pipelines))
+
+
+def run(url, output, config, engine=None, secret_key=None):
+    """
+    Extracts database dump from given database URL and outputs sanitized
+    copy of it into given stream, using the asyncio pipeline.
+
+    :param url: URL to the database which is to be sanitized.
+    :type url: str
+
+    :param output: Stream where sanitized copy of the database dump will be
+                   written into.
+    :type output: file
+
+    :param config: Optional sanitizer configuration to be used for sanitation
+                   of the values stored in the database.
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param engine: Optional engine used to execute the sanitation of table
+                   data. If omitted, the data is sanitized serially.
+    :type engine: database_sanitizer.engine.SerialEngine|None
+
+    :param secret_key: Fixed session secret. If omitted, a new random
+                       secret is used.
+    :type secret_key: bytes|None
+    """
+    pipeline = Pipeline(
+        url=url,
+        output=output,
+        config=config,
+        engine=engine,
+        secret_key=secret_key,
+    )
+    _run_until_complete(pipeline.run())
+
+
+def run_many(targets, config, engine=None, secret_key=None):
+    """
+    Sanitizes several databases concurrently in a single event loop.
+
+    :param targets: Database URLs mapped to output streams.
+    :type targets: dict[str,file]
+
+    :param config: Optional sanitizer configuration to be used for sanitation
+                   of the values stored in the databases.
+    :type config: database_sanitizer.config.Configuration|None
+
+    :param engine: Optional engine used to execute the sanitation of table
+                   data. If omitted, the data is sanitized serially.
+    :type engine: database_sanitizer.engine.SerialEngine|None
+
+    :param secret_key: Fixed session secret. If omitted, a new random
+                       secret is used.
+    :type secret_key: bytes|None
+    """
+    if secret_key is None:
+        # The databases share the secret, so that the same values are
+        # hashed the same way in all of them.
+        session.reset()
+        secret_key = session.get_secret()
+    pipelines = [
+        Pipeline(
+            url=url,
+            output=output,
+            config=config,
+            engine=engine,
+            secret_key=secret_key,
+        )
+        for (url, output) in sorted(targets.items())
+    ]
+    _run_until_complete(run_pipelines(pipelines))
+
+
+def _run_until_complete(coroutine):
+    loop = asyncio.new_event_loop()
+    if sys.version_info < (3, 8):  # pragma: no cover
+        # The default child watcher of older versions waits for the dump
+        # subprocesses only within the loop it has been attached into.
+        asyncio.get_child_watcher().attach_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Profiling of the configured sanitizers.
+
+Every call of the sanitizers is timed and attributed to the sanitized
+column and to the sanitizer function. Optionally the sanitizer calls are
+also profiled with `cProfile`, or stacks of the sanitizing thread are
+sampled at fixed intervals into collapsed stacks, the input format of
+`flamegraph.pl` and compatible tools, with the column being sanitized
+marked as a frame of its own.
+
+Sanitizers run in the worker processes of the parallel engines are not
+profiled, so the serial engine should be used when profiling.
+"""
+
+from __future__ import division, unicode_literals
+
+import cProfile
+import contextlib
+import io
+import sys
+import threading
+import timeit
+from collections import Counter
+
+import six
+
+from .benchmarks import format_duration
+
+#: Supported profiling modes. "timing" only times the sanitizer calls,
+#: "sample" also samples the stacks and "cprofile" profiles the sanitizer
+#: calls with `cProfile`.
+MODES = ("timing", "sample", "cprofile")
+
+#: Default number of the slowest columns reported.
+DEFAULT_TOP = 10
+
+#: Interval of sampling the stacks in seconds.
+SAMPLE_INTERVAL = 0.002
+
+
+class ColumnProfile(object):
+    """
+    Timing of the sanitizer of a single column.
+    """
+    __slots__ = ("sanitizer", "calls", "errors", "time")
+
+    def __init__(self, sanitizer):
+        """
+        :param sanitizer: Name of the sanitizer function.
+        :type sanitizer: str
+        """
+        self.sanitizer = sanitizer
+        self.calls = 0
+        self.errors = 0
+        self.time = 0.0
+
+
+class SanitizerProfiler(object):
+    """
+    Profiles the sanitizers of a configuration.
+    """
+    def __init__(self, mode="sample", interval=SAMPLE_INTERVAL):
+        """
+        :param mode: One of `MODES`.
+        :type mode: str
+
+        :param interval: Interval of sampling the stacks in seconds, with
+                         the "sample" mode.
+        :type interval: float
+        """
+        if mode not in MODES:
+            raise ValueError("Unsupported profiling mode: '%s'" % (mode,))
+        self.mode = mode
+        self.interval = interval
+        self.columns = {}
+        self.stacks = Counter()
+        self.profile = cProfile.Profile() if mode == "cprofile" else None
+        # Column whose sanitizer is being called by the sanitizing thread.
+        self.current_column = None
+
+    def instrument_config(self, config):
+        """
+        Replaces the sanitizers of given configuration with profiled ones.
+
+        :type config: database_sanitizer.config.Configuration|None
+        """
+        if not config:
+            return
+        for (key, sanitizer) in list(config.sanitizers.items()):
+            column = self.columns.setdefault(
+                key, ColumnProfile(get_function_name(sanitizer)))
+            config.sanitizers[key] = _profile_sanitizer(
+                self, key, sanitizer, column)
+
+    @contextlib.contextmanager
+    def report(self):
+        """
+        Samples the stacks of the thread entering the context, with the
+        "sample" mode.
+        """
+        if self.mode != "sample":
+            yield self
+            return
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample,
+            args=(threading.current_thread().ident, stop),
+            name="database-sanitizer-profile",
+        )
+        sampler.daemon = True
+        sampler.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            sampler.join()
+
+    def _sample(self, thread_id, stop):
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                self.stacks[self._get_stack(frame)] += 1
+            # Frames must not be kept alive between the samples.
+            del frame
+
+    def _get_stack(self, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            if code.co_name == "profiled_sanitizer":
+                # The column may have changed since the frame was taken.
+                names.append("[%s]" % (self.current_column or "sanitizer",))
+            else:
+                names.append("%s.%s" % (
+                    frame.f_globals.get("__name__", "?"), code.co_name))
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def get_top_columns(self, count=DEFAULT_TOP):
+        """
+        :param count: Number of columns to return.
+        :type count: int
+
+        :return: Keys and profiles of the columns whose sanitizers took the
+                 most time, slowest first.
+        :rtype: list[tuple[str,ColumnProfile]]
+        """
+        columns = [
+            (key, column) for (key, column) in six.iteritems(self.columns)
+            if column.calls
+        ]
+        columns.sort(key=lambda item: (-item[1].time, item[0]))
+        return columns[:count]
+
+    def format_report(self, count=DEFAULT_TOP):
+        """
+        Formats the slowest columns into human readable lines.
+
+        :param count: Number of columns to report.
+        :type count: int
+
+        :rtype: list[str]
+        """
+        top = self.get_top_columns(count)
+        column_width = max([len("Column")] + [len(key) for (key, _c) in top])
+        sanitizer_width = max(
+            [len("Sanitizer")] + [len(c.sanitizer) for (_k, c) in top])
+        lines = ["%-*s  %-*s  %10s  %7s  %10s  %10s" % (
+            column_width, "Column", sanitizer_width, "Sanitizer", "Calls",
+            "Errors", "Total", "Per call")]
+        for (key, column) in top:
+            lines.append("%-*s  %-*s  %10d  %7d  %10s  %10s" % (
+                column_width,
+                key,
+                sanitizer_width,
+                column.sanitizer,
+                column.calls,
+                column.errors,
+                format_duration(column.time),
+                format_duration(column.time / column.calls),
+            ))
+        return lines
+
+    def save(self, filename):
+        """
+        Writes the collapsed stacks of the "sample" mode, or the `cProfile`
+        statistics of the "cprofile" mode, which can be read with
+        `pstats`, into given file.
+
+        :type filename: str
+        """
+        if self.profile is not None:
+            self.profile.dump_stats(filename)
+            return
+        with io.open(filename, "w", encoding="utf-8") as stream:
+            for (stack, count) in sorted(six.iteritems(self.stacks)):
+                stream.write("%s %d\n" % (stack, count))
+
+
+def _profile_sanitizer(profiler, key, sanitizer, column):
+    timer = timeit.default_timer
+    profile = profiler.profile
+
+    @six.wraps(sanitizer)
+    def profiled_sanitizer(value):
+        profiler.current_column = key
+        start = timer()
+        try:
+            if profile is not None:
+                return profile.runcall(sanitizer, value)
+            return sanitizer(value)
+        except Exception:
+            column.errors += 1
+            raise
+        finally:
+            column.time += timer() - start
+            column.calls += 1
+            profiler.current_column = None
+
+    return profiled_sanitizer
+
+
+def get_function_name(function):
+    """
+    :type function: callable
+    :return: Name of given function, including its module.
+    :rtype: str
+    """
+    name = getattr(function, "__qualname__", None) or getattr(
+        function, "__name__", None) or repr(function)
+    module = getattr(function, "__module__", None)
+    return "%s.%s" % (module, name) if module else name
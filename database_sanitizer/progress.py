@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Live progress reporting of a sanitation run.
+
+Progress is derived from the row counts of the run statistics, compared
+against the row estimates of the database catalog. The reports are
+written by a background thread at fixed intervals, so reporting adds no
+work per row on top of collecting the statistics.
+"""
+
+from __future__ import division, unicode_literals
+
+import contextlib
+import json
+import threading
+import timeit
+from collections import namedtuple
+
+import six
+
+#: Progress of a run at a point of time. ``estimated_rows`` and ``eta``
+#: are None when there are no row estimates.
+Progress = namedtuple("Progress", (
+    "table",
+    "rows",
+    "estimated_rows",
+    "input_bytes",
+    "elapsed",
+    "rows_per_second",
+    "eta",
+))
+
+#: Supported output formats of the reports.
+FORMATS = ("auto", "bar", "json")
+
+#: Default interval between the reports in seconds.
+DEFAULT_INTERVAL = 1.0
+
+#: Width of the progress bar in characters.
+BAR_WIDTH = 30
+
+
+class ProgressReporter(object):
+    """
+    Reports progress of a run into a text stream.
+    """
+    def __init__(
+        self,
+        statistics,
+        stream,
+        output_format="auto",
+        interval=DEFAULT_INTERVAL,
+    ):
+        """
+        :param statistics: Statistics collector of the run.
+        :type statistics: database_sanitizer.stats.RunStatistics
+
+        :param stream: Text stream where the reports are written into,
+                       usually standard error.
+        :type stream: file
+
+        :param output_format: One of `FORMATS`. With "auto" a progress bar
+                              is drawn if the stream is a terminal, and JSON
+                              lines are written otherwise.
+        :type output_format: str
+
+        :param interval: Interval between the reports in seconds.
+        :type interval: float
+        """
+        if output_format not in FORMATS:
+            raise ValueError(
+                "Unsupported progress format: '%s'" % (output_format,))
+        if output_format == "auto":
+            isatty = getattr(stream, "isatty", None)
+            output_format = "bar" if isatty and isatty() else "json"
+        self.statistics = statistics
+        self.stream = stream
+        self.output_format = output_format
+        self.interval = interval
+        self.estimates = {}
+        self._start = None
+
+    def set_estimates(self, tables):
+        """
+        Sets estimated row counts of the tables to be sanitized.
+
+        :type tables: list[database_sanitizer.scheduler.TableSize]
+        """
+        self.estimates = {}
+        for table in tables:
+            # Tables are tracked by their names only, without the schema.
+            self.estimates[table.table] = (
+                self.estimates.get(table.table, 0) + table.rows)
+
+    def get_progress(self):
+        """
+        :rtype: Progress
+        """
+        elapsed = timeit.default_timer() - self._start
+        # Copying the values is atomic, unlike iterating over the dictionary
+        # which is being updated by the sanitizing thread.
+        tables = list(six.iteritems(self.statistics.tables))
+        rows = sum(table.rows for (_name, table) in tables)
+        rows_per_second = rows / elapsed if elapsed > 0 else 0.0
+
+        estimated_rows = None
+        eta = None
+        if self.estimates:
+            done = {name: table.rows for (name, table) in tables}
+            remaining = sum(
+                max(estimate - done.get(name, 0), 0)
+                for (name, estimate) in six.iteritems(self.estimates)
+            )
+            estimated_rows = rows + remaining
+            if rows_per_second > 0:
+                eta = remaining / rows_per_second
+
+        return Progress(
+            table=self.statistics.current_table_name,
+            rows=rows,
+            estimated_rows=estimated_rows,
+            input_bytes=sum(table.input_bytes for (_name, table) in tables),
+            elapsed=elapsed,
+            rows_per_second=rows_per_second,
+            eta=eta,
+        )
+
+    def write_report(self, final=False):
+        """
+        Writes a report of the current progress into the stream.
+
+        :param final: Whether this is the last report of the run.
+        :type final: bool
+        """
+        progress = self.get_progress()
+        if self.output_format == "json":
+            self.stream.write(format_json(progress) + "\n")
+        else:
+            self.stream.write("\r" + format_bar(progress))
+            if final:
+                self.stream.write("\n")
+        self.stream.flush()
+
+    @contextlib.contextmanager
+    def report(self):
+        """
+        Reports progress periodically within the context, and once more at
+        the end of it.
+        """
+        self._start = timeit.default_timer()
+        stop = threading.Event()
+        reporter = threading.Thread(
+            target=self._report,
+            args=(stop,),
+            name="database-sanitizer-progress",
+        )
+        reporter.daemon = True
+        reporter.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            reporter.join()
+            self.write_report(final=True)
+
+    def _report(self, stop):
+        while not stop.wait(self.interval):
+            self.write_report()
+
+
+def format_json(progress):
+    """
+    :type progress: Progress
+    :rtype: str
+    """
+    return json.dumps(progress._asdict(), sort_keys=True)
+
+
+def format_bar(progress):
+    """
+    Formats a single line progress bar, padded to a fixed width so that it
+    overwrites the previous one.
+
+    :type progress: Progress
+    :rtype: str
+    """
+    if progress.estimated_rows:
+        ratio = min(progress.rows / progress.estimated_rows, 1.0)
+        filled = int(ratio * BAR_WIDTH)
+        bar = "[%s%s] %5.1f%%" % (
+            "#" * filled, "." * (BAR_WIDTH - filled), ratio * 100)
+        rows = "%d/%d rows" % (progress.rows, progress.estimated_rows)
+    else:
+        bar = "[%s]" % ("?" * BAR_WIDTH,)
+        rows = "%d rows" % (progress.rows,)
+    return "%s %s %.0f rows/s ETA %s %-30.30s" % (
+        bar,
+        rows,
+        progress.rows_per_second,
+        format_time(progress.eta),
+        progress.table or "",
+    )
+
+
+def format_time(seconds):
+    """
+    :param seconds: Duration in seconds, or None if unknown.
+    :type seconds: float|None
+    :rtype: str
+    """
+    if seconds is None:
+        return "--:--:--"
+    (minutes, seconds) = divmod(int(seconds), 60)
+    (hours, minutes) = divmod(minutes, 60)
+    return "%d:%02d:%02d" % (hours, minutes, seconds)
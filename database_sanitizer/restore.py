@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Restores a directory written by `database_sanitizer.directory` into a
+database.
+
+Sizes and checksums of the files are verified against the manifest before
+anything is executed. The pre-data file is executed first, then the data
+files are loaded concurrently, each in its own client process and the
+largest ones first, and the post-data file is executed once all of the
+data has been loaded.
+"""
+
+from __future__ import unicode_literals
+
+import io
+import os
+import subprocess
+import threading
+from multiprocessing.pool import ThreadPool
+
+from .directory import load_manifest, verify_directory
+from .utils.postgres import get_psql_args
+
+#: Default number of data files loaded concurrently.
+DEFAULT_JOBS = 4
+
+#: Dialects of the dumps, mapped by the schemes of the database URLs they
+#: can be restored into.
+DIALECTS = {
+    "mysql": "mysql",
+    "postgres": "postgres",
+    "postgresql": "postgres",
+    "postgis": "postgres",
+}
+
+#: Statements executed before loading a tab separated data file, matching
+#: the load script written by `database_sanitizer.load_data`.
+LOAD_DATA_SETTINGS = (
+    "SET NAMES utf8mb4; SET FOREIGN_KEY_CHECKS = 0; SET UNIQUE_CHECKS = 0;")
+
+
+def restore(directory, url, jobs=DEFAULT_JOBS, verify=True):
+    """
+    Restores a directory into a database.
+
+    :param directory: Path to the directory.
+    :type directory: str
+
+    :param url: Parsed URL of the target database.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :param jobs: Number of data files loaded concurrently.
+    :type jobs: int
+
+    :param verify: Whether to verify the checksums of the files before
+                   restoring them.
+    :type verify: bool
+    """
+    if jobs < 1:
+        raise ValueError("Number of jobs must be positive")
+    manifest = load_manifest(directory)
+    dialect = DIALECTS.get(url.scheme)
+    if dialect is None:
+        raise ValueError("Unsupported database URL scheme: %s" % (url.scheme,))
+    if manifest["dialect"] not in (None, dialect):
+        raise ValueError("Cannot restore a %s dump into a %s database" % (
+            manifest["dialect"], dialect))
+    if verify:
+        verify_directory(directory, manifest)
+
+    client = _Client(url, dialect)
+    client.execute_file(os.path.join(directory, manifest["pre_data"]["file"]))
+    data_files = sorted(
+        (
+            (table, data_file)
+            for table in manifest["tables"]
+            for data_file in table["files"]
+        ),
+        key=lambda item: item[1]["bytes"],
+        reverse=True,
+    )
+
+    def load(item):
+        (table, data_file) = item
+        path = os.path.join(directory, data_file["file"])
+        if manifest["format"] == "tsv":
+            client.load_data(table, path)
+        else:
+            client.execute_file(path)
+
+    pool = ThreadPool(jobs)
+    try:
+        for _ in pool.imap_unordered(load, data_files):
+            pass
+        pool.close()
+    except BaseException:
+        # Loads still running would otherwise go on after the failure.
+        client.kill()
+        raise
+    finally:
+        pool.terminate()
+        pool.join()
+    client.execute_file(os.path.join(directory, manifest["post_data"]["file"]))
+
+
+class _Client(object):
+    """
+    Runs client processes of the target database.
+    """
+    def __init__(self, url, dialect):
+        self.dialect = dialect
+        if dialect == "postgres":
+            self.args = get_psql_args(url)
+            self.env = None
+        else:
+            # MySQL support is optional, so it is imported only when needed.
+            from .utils.mysql import get_mysql_args_and_env_from_url
+            (args, self.env) = get_mysql_args_and_env_from_url(url)
+            self.args = ["mysql", "--local-infile=1"] + args
+        self.lock = threading.Lock()
+        self.processes = []
+        self.killed = False
+
+    def execute_file(self, path):
+        """
+        Executes the statements of given file.
+
+        :type path: str
+        """
+        with io.open(path, "rb") as stream:
+            self._run(self.args, stdin=stream)
+
+    def load_data(self, table, path):
+        """
+        Loads a tab separated data file with `LOAD DATA`.
+
+        :param table: Entry of the table in the manifest.
+        :type table: dict
+
+        :type path: str
+        """
+        from .dump.mysql import get_load_data_statement
+        statement = "%s %s" % (
+            LOAD_DATA_SETTINGS,
+            get_load_data_statement(
+                table["table"], table["columns"], os.path.abspath(path)),
+        )
+        # Options must precede name of the database.
+        self._run(self.args[:-1] + ["--execute", statement] + self.args[-1:])
+
+    def _run(self, args, stdin=None):
+        devnull = open(os.devnull, "wb")
+        try:
+            with self.lock:
+                if self.killed:
+                    raise RuntimeError("Restoring was aborted")
+                process = subprocess.Popen(
+                    args, stdin=stdin, stdout=devnull, env=self.env)
+                self.processes.append(process)
+            returncode = process.wait()
+        finally:
+            devnull.close()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, args[0])
+
+    def kill(self):
+        """
+        Kills the running processes and prevents starting new ones.
+        """
+        with self.lock:
+            self.killed = True
+            for process in self.processes:
+                if process.poll() is None:
+                    process.kill()
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Scheduling of table dumps for the parallel table mode.
+
+Tables are dumped by a pool of worker processes, which take the next task
+from a shared queue whenever they have finished the previous one. To
+minimize the total wall time the tasks are handed out largest first (LPT
+scheduling), and large tables are split into ranges so that the workers
+which finish early can pick up the remaining ranges of the largest tables
+instead of idling while a single worker dumps them.
+"""
+
+from __future__ import division, unicode_literals
+
+import json
+from collections import namedtuple
+
+import six
+
+#: Size estimate of a table. ``split`` contains backend specific
+#: information needed for splitting the table into ranges, or None if the
+#: table cannot be split.
+TableSize = namedtuple(
+    "TableSize",
+    ("schema", "table", "size", "rows", "split"),
+)
+
+#: Range of a table to be dumped by a worker. ``part`` is zero based index
+#: of the range out of ``parts`` ranges, and ``condition`` is a backend
+#: specific SQL condition selecting the rows of the range, or None if the
+#: whole table is dumped at once.
+Task = namedtuple("Task", ("table", "part", "parts", "size", "condition"))
+
+#: Tasks in the order they are handed out to the workers, together with
+#: the tasks each worker is expected to end up with.
+Plan = namedtuple("Plan", ("jobs", "tasks", "assignments"))
+
+#: Default number of ranges per worker the total size is divided into when
+#: determining the size of a single range.
+DEFAULT_PARTS_PER_JOB = 4
+
+#: Default minimum size of a single range in bytes. Tables smaller than this
+#: are never split.
+DEFAULT_MIN_PART_SIZE = 256 * 1024 * 1024
+
+
+def load_statistics(filename):
+    """
+    Reads table sizes from statistics file of a previous run.
+
+    The file should contain JSON object with "tables" object, mapping table
+    names into objects with "input_bytes" and "rows" counts.
+
+    :param filename: Path to the statistics file.
+    :type filename: str
+
+    :return: Input bytes and row counts mapped by table names.
+    :rtype: dict[str,tuple[int,int]]
+    """
+    with open(filename, "r") as stream:
+        data = json.load(stream)
+
+    tables = data.get("tables") if isinstance(data, dict) else None
+    if not isinstance(tables, dict):
+        raise ValueError(
+            "Statistics file '%s' does not contain tables" % (filename,))
+
+    return {
+        table: (
+            int(table_stats.get("input_bytes", 0)),
+            int(table_stats.get("rows", 0)),
+        )
+        for (table, table_stats) in six.iteritems(tables)
+    }
+
+
+def apply_statistics(tables, statistics):
+    """
+    Replaces estimated table sizes with the ones recorded by a previous run.
+
+    :type tables: list[TableSize]
+
+    :param statistics: Input bytes and row counts mapped by table names, as
+                       returned by `load_statistics`.
+    :type statistics: dict[str,tuple[int,int]]
+
+    :rtype: list[TableSize]
+    """
+    result = []
+    for table in tables:
+        if table.table in statistics:
+            (size, rows) = statistics[table.table]
+            table = table._replace(size=size, rows=rows)
+        result.append(table)
+    return result
+
+
+def plan(
+    tables,
+    jobs,
+    min_part_size=DEFAULT_MIN_PART_SIZE,
+    parts_per_job=DEFAULT_PARTS_PER_JOB,
+):
+    """
+    Splits given tables into tasks and orders them largest first.
+
+    :param tables: Tables to dump.
+    :type tables: list[TableSize]
+
+    :param jobs: Number of workers dumping the tables.
+    :type jobs: int
+
+    :param min_part_size: Minimum size of a single range in bytes.
+    :type min_part_size: int
+
+    :param parts_per_job: Number of ranges per worker the total size is
+                          divided into when determining the range size.
+    :type parts_per_job: int
+
+    :rtype: Plan
+    """
+    if jobs < 1:
+        raise ValueError("Number of jobs must be positive")
+
+    total_size = sum(table.size for table in tables)
+    part_size = max(total_size // (jobs * parts_per_job), min_part_size, 1)
+
+    tasks = []
+    for table in tables:
+        parts = 1
+        if table.split is not None and table.size > part_size:
+            parts = -(-table.size // part_size)
+        for part in range(parts):
+            tasks.append(Task(
+                table=table,
+                part=part,
+                parts=parts,
+                size=(table.size // parts) + (part < table.size % parts),
+                condition=None,
+            ))
+
+    # Sorting is stable, so tasks of equal size stay in catalog order.
+    tasks.sort(key=lambda task: -task.size)
+
+    # Simulate the workers taking the next task whenever they are done.
+    assignments = [[] for _ in range(jobs)]
+    loads = [0] * jobs
+    for task in tasks:
+        job = loads.index(min(loads))
+        loads[job] += task.size
+        assignments[job].append(task)
+
+    return Plan(jobs=jobs, tasks=tasks, assignments=assignments)
+
+
+def format_plan(plan):
+    """
+    Formats given plan into human readable lines.
+
+    :type plan: Plan
+    :rtype: list[str]
+    """
+    table_names = [format_table_name(task.table) for task in plan.tasks]
+    name_width = max([len("Table")] + [len(name) for name in table_names])
+
+    lines = [
+        "Plan for %d tasks with %d jobs, largest first:" % (
+            len(plan.tasks),
+            plan.jobs,
+        ),
+        "",
+        "  %5s  %-*s  %7s  %10s  %12s" % (
+            "Order", name_width, "Table", "Part", "Size", "Rows"),
+    ]
+    for (order, (task, name)) in enumerate(zip(plan.tasks, table_names)):
+        lines.append("  %5d  %-*s  %7s  %10s  %12d" % (
+            order + 1,
+            name_width,
+            name,
+            "%d/%d" % (task.part + 1, task.parts),
+            format_size(task.size),
+            task.table.rows // task.parts,
+        ))
+
+    lines.extend(["", "Estimated load per job:"])
+    for (job, tasks) in enumerate(plan.assignments):
+        lines.append("  Job %d: %s in %d tasks" % (
+            job + 1,
+            format_size(sum(task.size for task in tasks)),
+            len(tasks),
+        ))
+    return lines
+
+
+def format_table_name(table):
+    """
+    :type table: TableSize
+    :rtype: str
+    """
+    if table.schema:
+        return "%s.%s" % (table.schema, table.table)
+    return table.table
+
+
+def format_size(size):
+    """
+    Formats given number of bytes into human readable form.
+
+    :type size: int
+    :rtype: str
+    """
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "TiB"
+    if unit == "B":
+        return "%d B" % (size,)
+    return "%.1f %s" % (size, unit)
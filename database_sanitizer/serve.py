@@ -0,0 +1,657 @@
+# -*- coding: utf-8 -*-
+"""
+Long-running sanitizer daemon, which accepts sanitation jobs through a
+Unix socket.
+
+Each job consists of the command line arguments of a sanitation run, and
+is run in a process forked from the daemon, so that it starts with the
+modules and the sanitizer configurations already loaded. Configurations
+are loaded when the jobs are submitted and kept until their files change,
+and handed over to the job processes when they are forked. Sanitizer
+modules are not reloaded, though, so the daemon must be restarted when
+they change.
+The worker processes of the parallel engines and the parallel table mode
+are bound to the configuration and the session secret of a single run, so
+they are started by the job processes, by forking them as well.
+
+Jobs are queued and run by a fixed number of concurrent job slots. The
+requests and responses are JSON objects, one per line:
+
+* ``{"command": "submit", "args": [...], "cwd": "...", "wait": true}``
+  queues a job, and unless ``wait`` is false, streams its events until it
+  has finished: "queued", "started", "log" for each line written into
+  standard error by the job, such as its progress reports, and "finished".
+* ``{"command": "watch", "job": 1}`` streams the events of a job, starting
+  with its current "state".
+* ``{"command": "status"}`` describes the jobs, queued and running ones
+  along with the most recently finished ones.
+
+Failing jobs are reported as such and do not affect the other jobs.
+"""
+
+from __future__ import unicode_literals
+
+import errno
+import itertools
+import json
+import os
+import signal
+import socket
+import stat
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+
+import six
+from six.moves import queue, socketserver
+
+#: Default number of jobs run concurrently.
+DEFAULT_CONCURRENCY = 2
+
+#: Number of the most recently finished jobs described by the status.
+MAX_FINISHED_JOBS = 100
+
+#: Number of the last lines written into standard error by a job which are
+#: included in its description once it has finished.
+LOG_TAIL_LINES = 20
+
+#: File mode creation mask of the socket, which leaves it readable and
+#: writable only by the user.
+SOCKET_UMASK = 0o177
+
+#: States of the jobs.
+STATE_QUEUED = "queued"
+STATE_RUNNING = "running"
+STATE_SUCCEEDED = "succeeded"
+STATE_FAILED = "failed"
+
+
+class ConfigurationCache(object):
+    """
+    Loaded sanitizer configurations, mapped by their paths and reloaded when
+    the files change.
+
+    Only the configuration files are reloaded. The sanitizer modules stay
+    imported, so changes to them take effect only after a restart, and
+    modules of the same name next to different configurations are
+    imported only once.
+    """
+    def __init__(self, loader):
+        """
+        :param loader: Function loading the configuration from given path.
+        :type loader: callable
+        """
+        self.loader = loader
+        self.configs = {}
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """
+        :type path: str
+        :rtype: database_sanitizer.config.Configuration
+        """
+        path = os.path.realpath(path)
+        status = os.stat(path)
+        version = (status.st_mtime, status.st_size)
+        with self.lock:
+            entry = self.configs.get(path)
+        if entry is None or entry[0] != version:
+            # The lock is not held while loading, which may take a while,
+            # and a job may be forked while another thread is loading.
+            entry = (version, self.loader(path))
+            with self.lock:
+                self.configs[path] = entry
+        return entry[1]
+
+
+class Job(object):
+    """
+    Sanitation job submitted to the daemon.
+    """
+    def __init__(self, job_id, args, cwd):
+        """
+        :type job_id: int
+
+        :param args: Command line arguments of the sanitation run.
+        :type args: list[str]
+
+        :param cwd: Working directory of the run.
+        :type cwd: str
+        """
+        self.id = job_id
+        self.args = args
+        self.cwd = cwd
+        self.state = STATE_QUEUED
+        self.returncode = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.pid = None
+        self.log = deque(maxlen=LOG_TAIL_LINES)
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def describe(self, event=None):
+        """
+        :param event: Name of the event, if the description is one.
+        :type event: str|None
+
+        :rtype: dict
+        """
+        description = OrderedDict()
+        if event is not None:
+            description["event"] = event
+        description["job"] = self.id
+        description["state"] = self.state
+        description["args"] = self.args
+        description["submitted"] = self.submitted
+        description["started"] = self.started
+        description["finished"] = self.finished
+        description["returncode"] = self.returncode
+        if self.finished is not None:
+            description["log"] = list(self.log)
+        return description
+
+    def subscribe(self, event="state"):
+        """
+        :param event: Name of the first event, describing the current
+                      state of the job.
+        :type event: str
+
+        :return: Queue receiving the events of the job.
+        :rtype: queue.Queue
+        """
+        events = queue.Queue()
+        with self.lock:
+            events.put(self.describe(event))
+            if self.finished is None:
+                self.subscribers.append(events)
+        return events
+
+    def unsubscribe(self, events):
+        with self.lock:
+            if events in self.subscribers:
+                self.subscribers.remove(events)
+
+    def publish(self, event):
+        """
+        Sends an event to the subscribers of the job.
+
+        :type event: dict
+        """
+        with self.lock:
+            for events in self.subscribers:
+                events.put(event)
+            if event.get("event") == "finished":
+                self.subscribers = []
+
+    def start(self, pid):
+        self.pid = pid
+        self.started = time.time()
+        self.state = STATE_RUNNING
+        self.publish(self.describe("started"))
+
+    def add_log_line(self, line):
+        self.log.append(line)
+        self.publish(OrderedDict([
+            ("event", "log"),
+            ("job", self.id),
+            ("line", line),
+        ]))
+
+    def finish(self, returncode):
+        self.pid = None
+        self.returncode = returncode
+        self.finished = time.time()
+        self.state = STATE_SUCCEEDED if returncode == 0 else STATE_FAILED
+        self.publish(self.describe("finished"))
+
+
+class SanitizerServer(object):
+    """
+    Daemon accepting sanitation jobs through a Unix socket and running them
+    in forked processes.
+    """
+    def __init__(
+        self,
+        path,
+        run_job,
+        prepare_job=None,
+        concurrency=DEFAULT_CONCURRENCY,
+    ):
+        """
+        :param path: Path of the Unix socket.
+        :type path: str
+
+        :param run_job: Function which runs a job in the forked process,
+                        given the command line arguments of the job and the
+                        resources returned by `prepare_job`, and returns
+                        its exit status or None.
+        :type run_job: callable
+
+        :param prepare_job: Function which validates the command line
+                            arguments and working directory of a job,
+                            raising ValueError if they are invalid, and
+                            returns the resources used by it. It is called
+                            when the job is submitted, and again before the
+                            job is forked.
+        :type prepare_job: callable|None
+
+        :param concurrency: Number of jobs run concurrently.
+        :type concurrency: int
+        """
+        if concurrency < 1:
+            raise ValueError("Number of concurrent jobs must be positive")
+        if not hasattr(os, "fork") or not hasattr(socket, "AF_UNIX"):
+            raise ValueError("Sanitizer daemon requires a Unix platform")
+        self.path = path
+        self.run_job = run_job
+        self.prepare_job = prepare_job
+        self.concurrency = concurrency
+        self.jobs = OrderedDict()
+        self.job_ids = itertools.count(1)
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.server = None
+
+    def serve_forever(self):
+        """
+        Listens on the socket and runs the jobs until `shutdown` is called
+        or the process is interrupted. Queued jobs are cancelled and the
+        running ones terminated at the end.
+        """
+        _remove_stale_socket(self.path)
+        self.server = _UnixServer(self.path, _RequestHandler)
+        self.server.sanitizer = self
+        dispatchers = []
+        try:
+            for _slot in range(self.concurrency):
+                dispatcher = threading.Thread(target=self._dispatch)
+                dispatcher.daemon = True
+                dispatcher.start()
+                dispatchers.append(dispatcher)
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.remove(self.path)
+            self._close()
+            for dispatcher in dispatchers:
+                dispatcher.join()
+
+    def shutdown(self):
+        """
+        Stops `serve_forever` from another thread.
+        """
+        self.server.shutdown()
+
+    def submit(self, args, cwd):
+        """
+        Queues a job.
+
+        :type args: list[str]
+        :type cwd: str
+        :rtype: Job
+        """
+        if not isinstance(args, list) or not all(
+                isinstance(arg, six.string_types) for arg in args):
+            raise ValueError("Arguments of a job must be a list of strings")
+        if not cwd or not os.path.isabs(cwd):
+            raise ValueError("Working directory of a job must be absolute")
+        if self.prepare_job is not None:
+            self.prepare_job(args, cwd)
+        with self.lock:
+            if self.closed:
+                raise ValueError("Sanitizer daemon is shutting down")
+            job = Job(next(self.job_ids), args, cwd)
+            self.jobs[job.id] = job
+        return job
+
+    def enqueue(self, job):
+        self.queue.put(job)
+
+    def get_job(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def get_status(self):
+        """
+        :return: Description of the daemon and its jobs.
+        :rtype: dict
+        """
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return OrderedDict([
+            ("event", "status"),
+            ("concurrency", self.concurrency),
+            ("queued", sum(1 for job in jobs if job.state == STATE_QUEUED)),
+            ("running", sum(1 for job in jobs if job.state == STATE_RUNNING)),
+            ("jobs", [job.describe() for job in jobs]),
+        ])
+
+    def handle_request(self, request):
+        """
+        Handles a request received through the socket.
+
+        :type request: dict
+
+        :return: Iterator of events sent as the response.
+        :rtype: collections.Iterator[dict]
+        """
+        command = request.get("command") if isinstance(request, dict) else None
+        if command == "status":
+            yield self.get_status()
+            return
+        if command == "submit":
+            try:
+                job = self.submit(request.get("args"), request.get("cwd"))
+            except (ValueError, EnvironmentError) as error:
+                yield OrderedDict([
+                    ("event", "rejected"),
+                    ("message", "%s" % (error,)),
+                ])
+                return
+            if not request.get("wait", True):
+                self.enqueue(job)
+                yield job.describe("queued")
+                return
+            # Subscribed before the job is queued, so that no events are
+            # missed.
+            events = job.subscribe("queued")
+            self.enqueue(job)
+            for event in _stream_events(job, events):
+                yield event
+            return
+        if command == "watch":
+            job = self.get_job(request.get("job"))
+            if job is None:
+                yield OrderedDict([
+                    ("event", "error"),
+                    ("message", "Unknown job: %s" % (request.get("job"),)),
+                ])
+                return
+            for event in _stream_events(job, job.subscribe()):
+                yield event
+            return
+        yield OrderedDict([
+            ("event", "error"),
+            ("message", "Unknown command: %s" % (command,)),
+        ])
+
+    def _dispatch(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            if job.state != STATE_QUEUED:
+                # Cancelled.
+                continue
+            try:
+                self._run(job)
+            except Exception:
+                job.add_log_line(traceback.format_exc().rstrip("\n"))
+                if job.finished is None:
+                    job.finish(1)
+            self._prune_jobs()
+
+    def _run(self, job):
+        # Resources are obtained before forking, so that the job never uses
+        # the locks of the daemon, which other threads may be holding at
+        # the time of the fork.
+        resources = None
+        if self.prepare_job is not None:
+            resources = self.prepare_job(job.args, job.cwd)
+
+        def run_job(args):
+            return self.run_job(args, resources)
+
+        job.finish(run_forked(
+            run_job,
+            job.args,
+            job.cwd,
+            started=job.start,
+            log_line=job.add_log_line,
+        ))
+
+    def _prune_jobs(self):
+        with self.lock:
+            finished = [
+                job_id for (job_id, job) in self.jobs.items()
+                if job.finished is not None
+            ]
+            for job_id in finished[:-MAX_FINISHED_JOBS]:
+                del self.jobs[job_id]
+
+    def _close(self):
+        with self.lock:
+            self.closed = True
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            if job.state == STATE_QUEUED:
+                job.add_log_line("Cancelled, as the sanitizer daemon stopped")
+                job.finish(1)
+            elif job.pid is not None:
+                try:
+                    os.kill(job.pid, signal.SIGTERM)
+                except OSError as error:
+                    if error.errno != errno.ESRCH:
+                        raise
+        for _slot in range(self.concurrency):
+            self.queue.put(None)
+
+
+def run_forked(run_job, args, cwd, started=None, log_line=None):
+    """
+    Runs a job in a process forked from the current one, so that it starts
+    with everything loaded by the current process, but cannot affect it.
+
+    :param run_job: Function which runs the job, given its arguments, and
+                    returns its exit status or None.
+    :type run_job: callable
+
+    :type args: list[str]
+
+    :param cwd: Working directory of the job.
+    :type cwd: str
+
+    :param started: Function called with the process identifier of the job
+                    once it has been started.
+    :type started: callable|None
+
+    :param log_line: Function called with each line written into standard
+                     error by the job.
+    :type log_line: callable|None
+
+    :return: Exit status of the job, or negated number of the signal which
+             terminated it.
+    :rtype: int
+    """
+    (pid, read_fd) = fork_job(run_job, args, cwd)
+    if started is not None:
+        started(pid)
+    with os.fdopen(read_fd, "rb") as stream:
+        for line in stream:
+            if log_line is not None:
+                log_line(decode_log_line(line))
+    return wait_for_job(pid)
+
+
+def fork_job(run_job, args, cwd):
+    """
+    Starts a job in a process forked from the current one, like
+    `run_forked`, without waiting for it.
+
+    :type run_job: callable
+    :type args: list[str]
+    :type cwd: str
+
+    :return: Process identifier of the job, and file descriptor from which
+             the lines written into standard error by the job are read.
+    :rtype: tuple[int,int]
+    """
+    (read_fd, write_fd) = os.pipe()
+    # Buffered output would otherwise be written by the job as well.
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover (the forked job process)
+        os.close(read_fd)
+        _run_forked_job(run_job, args, cwd, write_fd)
+    os.close(write_fd)
+    return (pid, read_fd)
+
+
+def wait_for_job(pid):
+    """
+    Waits for a job started with `fork_job` to exit.
+
+    :type pid: int
+
+    :return: Exit status of the job, or negated number of the signal which
+             terminated it.
+    :rtype: int
+    """
+    (_pid, status) = os.waitpid(pid, 0)
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def decode_log_line(line):
+    """
+    Decodes a line written into standard error by a job.
+
+    :type line: bytes
+    :rtype: str
+    """
+    return line.decode("utf-8", "replace").rstrip("\r\n")
+
+
+def _run_forked_job(run_job, args, cwd, log_fd):  # pragma: no cover (forked)
+    status = 1
+    try:
+        # Standard error goes to the parent process, and the job must not
+        # read or write its standard streams otherwise.
+        devnull = os.open(os.devnull, os.O_RDWR)
+        os.dup2(devnull, 0)
+        os.dup2(devnull, 1)
+        os.dup2(log_fd, 2)
+        # Copies of the sockets and pipes of the parent process would keep
+        # them open.
+        os.closerange(3, _get_max_fd())
+        os.chdir(cwd)
+        result = run_job(args)
+        status = 0 if result is None else result
+    except SystemExit as error:
+        if error.code is None:
+            status = 0
+        elif isinstance(error.code, int):
+            status = error.code
+        else:
+            sys.stderr.write("%s\n" % (error.code,))
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stderr.flush()
+        finally:
+            os._exit(status)
+
+
+def _get_max_fd():  # pragma: no cover (forked)
+    try:
+        return os.sysconf("SC_OPEN_MAX")
+    except (AttributeError, ValueError):
+        return 256
+
+
+def _stream_events(job, events):
+    try:
+        while True:
+            event = events.get()
+            yield event
+            # Descriptions of finished jobs are the last events.
+            if event.get("finished") is not None:
+                return
+    finally:
+        job.unsubscribe(events)
+
+
+def _remove_stale_socket(path):
+    """
+    Removes a socket left behind by a daemon which did not stop cleanly,
+    refusing to replace a daemon which is still listening.
+    """
+    if not os.path.exists(path):
+        return
+    if not stat.S_ISSOCK(os.stat(path).st_mode):
+        raise ValueError("%s exists and is not a socket" % (path,))
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except socket.error:
+        os.remove(path)
+        return
+    finally:
+        client.close()
+    raise ValueError("Sanitizer daemon is already listening on %s" % (path,))
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # The socket is created accessible only by the user, instead of
+        # changing its mode afterwards, so other users can never connect.
+        umask = os.umask(SOCKET_UMASK)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+        except ValueError:
+            request = None
+        events = self.server.sanitizer.handle_request(request)
+        try:
+            for event in events:
+                self.wfile.write(
+                    (json.dumps(event) + "\n").encode("utf-8"))
+                self.wfile.flush()
+        except socket.error:
+            # The client has gone, but the job is still run.
+            pass
+        finally:
+            events.close()
+
+
+def send_request(path, request):
+    """
+    Sends a request to the daemon listening on given socket.
+
+    :param path: Path of the Unix socket.
+    :type path: str
+
+    :type request: dict
+
+    :return: Iterator of the events sent as the response.
+    :rtype: collections.Iterator[dict]
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+        client.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        stream = client.makefile("rb")
+        try:
+            for line in stream:
+                yield json.loads(line.decode("utf-8"))
+        finally:
+            stream.close()
+    finally:
+        client.close()
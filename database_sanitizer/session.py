@@ -14,8 +14,10 @@ it is not possible to check if H is the hashed value of C after the
 sanitation session has ended.
 """
 
+import binascii
 import hashlib
 import hmac
+import os
 import random
 import sys
 import threading
@@ -135,6 +137,28 @@ def reset(secret_key=None):
     _thread_local_storage.secret_key = secret_key
 
 
+def load_secret_file(path):
+    # type: (str) -> bytes
+    """
+    Load a secret key persisted into a file.
+
+    The secret is stored as hexadecimal digits.  If the file does not
+    exist, a new random secret is generated and written into it, with
+    permissions allowing only the owner to read it.
+
+    :param path: Path to the file
+    :return: The secret key as bytes
+    """
+    if os.path.exists(path):
+        with open(path, 'rb') as stream:
+            return bytes(bytearray.fromhex(stream.read().decode('ascii')))
+    secret = os.urandom(SECRET_KEY_BITS // 8)
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(descriptor, 'wb') as stream:
+        stream.write(binascii.hexlify(secret))
+    return secret
+
+
 def _initialize_session():
     # type: () -> None
     """
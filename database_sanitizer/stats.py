@@ -0,0 +1,599 @@
+# -*- coding: utf-8 -*-
+"""
+Statistics of a sanitation run.
+
+The statistics are collected cheaply enough to be left on in production:
+
+* Rows and sizes of the tables are counted per chunk of the dump, or per
+  block of a dump file, and the time spent on each table is measured when
+  its data section starts and ends.
+* Calls and errors of the configured sanitizers are counted for every
+  call, but only every `SAMPLE_INTERVAL`th call is timed. The total time
+  of a column is estimated from the timed calls, which are also counted
+  into a latency histogram.
+* Time spent on reading the dump, parsing it, sanitizing values and
+  writing the output is estimated by a background thread which samples
+  the stack of the sanitizing thread every `PROFILE_INTERVAL` seconds,
+  along with depths of the queues of the parallel engines.
+
+Sizes are counted in characters, which equals bytes for ASCII data, except
+that input sizes of dump files are counted in bytes. Rows
+of `mysqldump` outputs are estimated from the separators of the rows in
+extended `INSERT INTO` statements. Sanitizers which are run in worker
+processes of the parallel engines are not included in the column
+statistics, and output sizes are attributed to the table whose data is
+being read at the time, which is exact only with the serial engine.
+
+The statistics file is written as JSON, containing a "tables" object in
+the format read by `database_sanitizer.scheduler.load_statistics`.
+"""
+
+from __future__ import division, unicode_literals
+
+import bisect
+import contextlib
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+import timeit
+
+import six
+
+from .dump import CHUNK_DATA, CHUNK_DATA_END, CHUNK_DATA_START
+
+#: Version of the statistics file format.
+STATISTICS_VERSION = 1
+
+#: Every this many calls of each sanitizer are timed.
+SAMPLE_INTERVAL = 16
+
+#: Interval of sampling the stack of the sanitizing thread, in seconds.
+PROFILE_INTERVAL = 0.005
+
+#: Upper bounds of the buckets of the sanitizer latency histograms, in
+#: seconds. Only the timed calls are counted into the histograms.
+LATENCY_BUCKETS = (
+    0.000001, 0.000005, 0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.01, 0.1,
+)
+
+#: Phases of a run, as estimated by the stack sampling.
+PHASES = ("dump", "parse", "sanitize", "write", "other")
+
+#: Modules of this package, relative to its directory, which determine the
+#: phase of a stack sample. Other modules of the package are parsing.
+PACKAGE_PHASES = (
+    ("writer.py", "write"),
+    ("compress.py", "write"),
+    ("sanitizers" + os.sep, "sanitize"),
+    ("profiling.py", "sanitize"),
+    ("cache.py", "sanitize"),
+    ("session.py", "sanitize"),
+    (os.path.join("engine", "process.py"), "sanitize"),
+    (os.path.join("engine", "hybrid.py"), "sanitize"),
+)
+
+#: Standard library modules reading output of the dump utilities, by file
+#: name. Time spent in these is waiting for or decoding the dump.
+DUMP_MODULES = ("codecs.py", "<frozen codecs>", "subprocess.py")
+
+#: Directory of the package, for telling its own functions apart.
+PACKAGE_DIRECTORY = os.path.normcase(
+    os.path.dirname(os.path.abspath(__file__)))
+
+# Measures CPU time of the process.
+get_cpu_time = getattr(time, "process_time", None) or time.clock
+
+#: Collector of the current run, set by `RunStatistics.collect`.
+_collector = None
+
+
+class TableStatistics(object):
+    """
+    Statistics of a single table.
+    """
+    __slots__ = (
+        "rows", "input_bytes", "output_bytes", "wall_time", "cpu_time")
+
+    def __init__(self):
+        self.rows = 0
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+
+    def as_dict(self):
+        """
+        :rtype: dict[str,int|float]
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ColumnStatistics(object):
+    """
+    Statistics of the sanitizer of a single column.
+    """
+    __slots__ = ("calls", "errors", "timed_calls", "timed_time", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.timed_calls = 0
+        self.timed_time = 0.0
+        # Counts of the timed calls per `LATENCY_BUCKETS`, and above them.
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    @property
+    def time(self):
+        """
+        Estimated total time spent in the sanitizer, in seconds.
+
+        :rtype: float
+        """
+        if not self.timed_calls:
+            return 0.0
+        return self.timed_time * self.calls / self.timed_calls
+
+    def as_dict(self):
+        """
+        :rtype: dict[str,int|float]
+        """
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "time": self.time,
+            "timed_calls": self.timed_calls,
+        }
+
+
+class QueueStatistics(object):
+    """
+    Depth of a queue of a parallel engine, sampled along with the phases.
+    """
+    __slots__ = ("queue", "samples", "depth_sum", "max_depth")
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.samples = 0
+        self.depth_sum = 0
+        self.max_depth = 0
+
+    def sample(self):
+        depth = len(self.queue)
+        self.samples += 1
+        self.depth_sum += depth
+        self.max_depth = max(self.max_depth, depth)
+
+    def as_dict(self):
+        """
+        :rtype: dict[str,int|float]
+        """
+        return {
+            "max_depth": self.max_depth,
+            "mean_depth": (
+                self.depth_sum / self.samples if self.samples else 0.0),
+        }
+
+
+class RunStatistics(object):
+    """
+    Collects statistics of a sanitation run.
+    """
+    def __init__(
+        self,
+        sample_interval=SAMPLE_INTERVAL,
+        profile_interval=PROFILE_INTERVAL,
+    ):
+        """
+        :param sample_interval: Every this many calls of each sanitizer are
+                                timed, or None to not instrument the
+                                sanitizers at all.
+        :type sample_interval: int|None
+
+        :param profile_interval: Interval of sampling the stack of the
+                                 sanitizing thread in seconds, or None to
+                                 not estimate the phases.
+        :type profile_interval: float|None
+        """
+        self.sample_interval = sample_interval
+        self.profile_interval = profile_interval
+        self.tables = {}
+        self.columns = {}
+        self.queues = {}
+        self.phase_samples = dict.fromkeys(PHASES, 0)
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.current_table = None
+        self.current_table_name = None
+        self._table_start = None
+        self._start = None
+        self._phases = {}
+
+    def instrument_config(self, config):
+        """
+        Replaces the sanitizers of given configuration with ones counting
+        their calls and errors and timing part of the calls.
+
+        :type config: database_sanitizer.config.Configuration|None
+        """
+        if not config or not self.sample_interval:
+            return
+        for (key, sanitizer) in list(config.sanitizers.items()):
+            column = self.columns.setdefault(key, ColumnStatistics())
+            config.sanitizers[key] = _instrument_sanitizer(
+                sanitizer, column, self.sample_interval)
+
+    def get_table(self, table):
+        """
+        :type table: str
+        :rtype: TableStatistics
+        """
+        try:
+            return self.tables[table]
+        except KeyError:
+            statistics = self.tables[table] = TableStatistics()
+            return statistics
+
+    def merge_tables(self, tables):
+        """
+        Adds statistics of tables collected by another collector, such as
+        one of a worker process of the parallel table mode.
+
+        :param tables: Statistics mapped by table names, in the format of
+                       the "tables" object of `as_dict`.
+        :type tables: dict[str,dict[str,int|float]]
+        """
+        for (name, values) in six.iteritems(tables):
+            table = self.get_table(name)
+            for field in TableStatistics.__slots__:
+                setattr(table, field, getattr(table, field) + values[field])
+
+    def get_tables(self):
+        """
+        :return: Statistics of the tables, mapped by their names.
+        :rtype: dict[str,dict[str,int|float]]
+        """
+        return {
+            name: table.as_dict()
+            for (name, table) in list(six.iteritems(self.tables))
+        }
+
+    def track_chunks(self, chunks, backend):
+        """
+        Passes through chunks of a dump, counting the rows and sizes of the
+        tables and measuring the time spent on them.
+
+        :type chunks: collections.Iterable[database_sanitizer.dump.Chunk]
+
+        :param backend: Name of the dump backend module which produced the
+                        chunks.
+        :type backend: str
+
+        :rtype: collections.Iterator[database_sanitizer.dump.Chunk]
+        """
+        count_rows = importlib.import_module(backend).count_rows
+        for chunk in chunks:
+            if chunk.kind == CHUNK_DATA:
+                table = self.get_table(chunk.table)
+                table.rows += count_rows(chunk.lines)
+                table.input_bytes += sum(
+                    len(line) for line in chunk.lines) + len(chunk.lines)
+            elif chunk.kind == CHUNK_DATA_START:
+                self._start_table(chunk.table)
+            yield chunk
+            # The table ends only once lines of the end chunk are output.
+            if chunk.kind == CHUNK_DATA_END:
+                self._end_table()
+        self._end_table()
+
+    def track_blocks(self, blocks, buffer, backend):
+        """
+        Passes through blocks of a dump file, counting the rows and sizes of
+        the tables and measuring the time spent on them.
+
+        :type blocks: collections.Iterable[database_sanitizer.dump.files.Block]
+
+        :param buffer: Contents of the dump file.
+        :type buffer: mmap.mmap|bytes
+
+        :param backend: Name of the dump backend module of the dump format.
+        :type backend: str
+
+        :rtype: collections.Iterator[database_sanitizer.dump.files.Block]
+        """
+        count_block_rows = importlib.import_module(backend).count_block_rows
+        for block in blocks:
+            if block.table is None:
+                self._end_table()
+            else:
+                if self.current_table is not self.get_table(block.table):
+                    self._start_table(block.table)
+                # The rows are counted from the bytes, without decoding them.
+                self.current_table.rows += count_block_rows(
+                    buffer[block.offset:block.offset + block.length])
+                self.current_table.input_bytes += block.length
+            yield block
+        self._end_table()
+
+    def _start_table(self, table):
+        self._end_table()
+        self.current_table = self.get_table(table)
+        self.current_table_name = table
+        self._table_start = (timeit.default_timer(), get_cpu_time())
+
+    def _end_table(self):
+        if self.current_table is None:
+            return
+        (wall_time, cpu_time) = self._table_start
+        self.current_table.wall_time += timeit.default_timer() - wall_time
+        self.current_table.cpu_time += get_cpu_time() - cpu_time
+        self.current_table = None
+        self.current_table_name = None
+
+    def track_output(self, lines):
+        """
+        Passes through sanitized lines, counting their sizes into the table
+        currently being sanitized.
+
+        :type lines: collections.Iterable[str]
+        :rtype: collections.Iterator[str]
+        """
+        for line in lines:
+            table = self.current_table
+            if table is not None:
+                table.output_bytes += len(line) + 1
+            yield line
+
+    @contextlib.contextmanager
+    def collect(self):
+        """
+        Collects statistics of the run within the context. The phases are
+        estimated for the thread entering the context.
+        """
+        global _collector
+
+        sampler = None
+        stop = threading.Event()
+        if self.profile_interval:
+            sampler = threading.Thread(
+                target=self._sample,
+                args=(threading.current_thread().ident, stop),
+                name="database-sanitizer-stats",
+            )
+            sampler.daemon = True
+            sampler.start()
+
+        previous_collector = _collector
+        _collector = self
+        self._start = (timeit.default_timer(), get_cpu_time())
+        try:
+            yield self
+        finally:
+            _collector = previous_collector
+            self._end_table()
+            self.wall_time = self.get_wall_time()
+            self.cpu_time = self.get_cpu_time()
+            self._start = None
+            if sampler:
+                stop.set()
+                sampler.join()
+
+    def get_wall_time(self):
+        """
+        :return: Wall time of the run so far, in seconds.
+        :rtype: float
+        """
+        if self._start is None:
+            return self.wall_time
+        return self.wall_time + timeit.default_timer() - self._start[0]
+
+    def get_cpu_time(self):
+        """
+        :return: CPU time of the process during the run so far, in seconds.
+        :rtype: float
+        """
+        if self._start is None:
+            return self.cpu_time
+        return self.cpu_time + get_cpu_time() - self._start[1]
+
+    def watch_queue(self, name, queue):
+        """
+        Samples depth of given queue along with the phases of the run.
+
+        :param name: Name of the queue, e.g. name of the engine.
+        :type name: str
+
+        :type queue: collections.Sized
+        """
+        statistics = self.queues.get(name)
+        if statistics is None:
+            self.queues[name] = QueueStatistics(queue)
+        else:
+            statistics.queue = queue
+
+    def _sample(self, thread_id, stop):
+        while not stop.wait(self.profile_interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                self.phase_samples[self._get_phase(frame)] += 1
+            # Frames must not be kept alive between the samples.
+            del frame
+            for queue in list(self.queues.values()):
+                queue.sample()
+
+    def _get_phase(self, frame):
+        """
+        Determines the phase of a stack sample from the innermost frame
+        which is not in a third party or standard library module, except
+        that reading through `codecs` means waiting for the dump utility.
+        """
+        while frame is not None:
+            code = frame.f_code
+            try:
+                phase = self._phases[code]
+            except KeyError:
+                phase = self._phases[code] = _get_code_phase(code)
+            if phase:
+                return phase
+            frame = frame.f_back
+        return "other"
+
+    def get_phase_times(self):
+        """
+        Estimates time spent in each phase of the run from the stack
+        samples.
+
+        :return: Seconds mapped by the phases.
+        :rtype: dict[str,float]
+        """
+        total = sum(self.phase_samples.values())
+        wall_time = self.get_wall_time()
+        return {
+            phase: (wall_time * samples / total) if total else 0.0
+            for (phase, samples) in six.iteritems(self.phase_samples)
+        }
+
+    def as_dict(self):
+        """
+        :return: The statistics, in the format written by `save`.
+        :rtype: dict
+        """
+        # The dictionaries are copied first, as they may be updated by the
+        # sanitizing thread while being reported by another thread.
+        return {
+            "version": STATISTICS_VERSION,
+            "wall_time": self.get_wall_time(),
+            "cpu_time": self.get_cpu_time(),
+            "phases": self.get_phase_times(),
+            "tables": self.get_tables(),
+            "columns": {
+                key: column.as_dict()
+                for (key, column) in list(six.iteritems(self.columns))
+            },
+            "queues": {
+                name: queue.as_dict()
+                for (name, queue) in list(six.iteritems(self.queues))
+            },
+        }
+
+    def save(self, filename):
+        """
+        Writes the statistics into a JSON file.
+
+        :type filename: str
+        """
+        with open(filename, "w") as stream:
+            json.dump(self.as_dict(), stream, indent=2, sort_keys=True)
+
+
+def _instrument_sanitizer(sanitizer, column, sample_interval):
+    timer = timeit.default_timer
+
+    @six.wraps(sanitizer)
+    def instrumented_sanitizer(value):
+        column.calls += 1
+        try:
+            if column.calls % sample_interval:
+                return sanitizer(value)
+            start = timer()
+            try:
+                return sanitizer(value)
+            finally:
+                elapsed = timer() - start
+                column.timed_calls += 1
+                column.timed_time += elapsed
+                column.buckets[bisect.bisect_left(
+                    LATENCY_BUCKETS, elapsed)] += 1
+        except Exception:
+            column.errors += 1
+            raise
+
+    return instrumented_sanitizer
+
+
+def _get_code_phase(code):
+    if code.co_name == "instrumented_sanitizer":
+        return "sanitize"
+    filename = os.path.normcase(os.path.abspath(code.co_filename))
+    if filename.startswith(PACKAGE_DIRECTORY + os.sep):
+        relative = filename[len(PACKAGE_DIRECTORY) + 1:]
+        for (prefix, phase) in PACKAGE_PHASES:
+            if relative.startswith(prefix):
+                return phase
+        return "parse"
+    if os.path.basename(filename) in DUMP_MODULES:
+        return "dump"
+    if "multiprocessing" + os.sep in filename:
+        # Waiting for the worker processes of the parallel engines.
+        return "sanitize"
+    return None
+
+
+def is_collecting():
+    """
+    :return: Whether statistics of the current run are being collected.
+    :rtype: bool
+    """
+    return _collector is not None
+
+
+def merge_tables(tables):
+    """
+    Adds statistics of tables collected by a worker process into the
+    statistics of the current run, if statistics are being collected.
+
+    :type tables: dict[str,dict[str,int|float]]
+    """
+    collector = _collector
+    if collector is not None:
+        collector.merge_tables(tables)
+
+
+def track_chunks(chunks, backend):
+    """
+    Passes chunks of a dump through the statistics collector of the current
+    run, if statistics are being collected.
+
+    :type chunks: collections.Iterable[database_sanitizer.dump.Chunk]
+
+    :param backend: Name of the dump backend module which produced the
+                    chunks.
+    :type backend: str
+
+    :rtype: collections.Iterable[database_sanitizer.dump.Chunk]
+    """
+    collector = _collector
+    if collector is None:
+        return chunks
+    return collector.track_chunks(chunks, backend)
+
+
+def track_blocks(blocks, buffer, backend):
+    """
+    Passes blocks of a dump file through the statistics collector of the
+    current run, if statistics are being collected.
+
+    :type blocks: collections.Iterable[database_sanitizer.dump.files.Block]
+    :type buffer: mmap.mmap|bytes
+    :type backend: str
+    :rtype: collections.Iterable[database_sanitizer.dump.files.Block]
+    """
+    collector = _collector
+    if collector is None:
+        return blocks
+    return collector.track_blocks(blocks, buffer, backend)
+
+
+def watch_queue(name, queue):
+    """
+    Samples depth of given queue of a parallel engine, if statistics are
+    being collected.
+
+    :type name: str
+    :type queue: collections.Sized
+    """
+    collector = _collector
+    if collector is not None:
+        collector.watch_queue(name, queue)
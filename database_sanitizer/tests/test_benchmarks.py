@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+import os
+import random
+import subprocess
+
+import pytest
+
+from .. import benchmarks
+from ..benchmarks import Benchmark, fixtures, throughput
+from ..benchmarks import __main__ as benchmarks_main
+from ..benchmarks.micro import get_benchmarks, iter_builtin_sanitizers
+from ..config import Configuration
+from ..dump import CHUNK_DATA
+from ..dump import mysql as dump_mysql
+from ..dump import postgres as dump_postgres
+from ..utils.postgres import decode_copy_value
+
+
+def get_results(times):
+    return {
+        "version": benchmarks.RESULTS_VERSION,
+        "benchmarks": {
+            name: {"items": 1, "loops": 1, "values": values}
+            for (name, values) in times.items()
+        },
+    }
+
+
+def test_get_benchmarks():
+    all_benchmarks = get_benchmarks()
+    names = [benchmark.name for benchmark in all_benchmarks]
+    assert len(names) == len(set(names))
+    assert "sanitizers.user.sanitize_email" in names
+    assert "mysql.parse_values.extended_insert" in names
+
+    # Every benchmark should run with its fixtures.
+    for benchmark in all_benchmarks:
+        benchmark.function()
+
+
+def test_iter_builtin_sanitizers():
+    names = {
+        "%s.%s" % (module_name, name)
+        for (module_name, name, _function) in iter_builtin_sanitizers()
+    }
+    assert "constant.sanitize_null" in names
+    assert "derived.sanitize_uuid4" in names
+    # Imported helpers are not sanitizers of the module importing them.
+    assert "user.hash_text_to_int" not in names
+
+
+def test_fixtures_round_trip():
+    rng = random.Random(1)
+    columns = fixtures.get_column_names(12)
+    line = fixtures.generate_copy_line(rng, 12, escape_ratio=0.5)
+    assert len(dump_postgres.parse_values(line)) == 12
+    assert all(
+        decode_copy_value(value) is None or "\n" not in value
+        for value in line.split("\t")
+    )
+
+    insert_line = fixtures.generate_insert_line(rng, "test", 3, 12)
+    rows = dump_mysql.parse_value_line(insert_line, columns)
+    assert len(rows) == 3
+
+
+def test_time_benchmark():
+    calls = []
+    benchmark = Benchmark("test", lambda: calls.append(None), 10)
+    (loops, values) = benchmarks.time_benchmark(
+        benchmark, samples=3, min_time=0.001)
+    assert loops >= 1
+    assert len(values) == 3
+    assert all(value > 0 for value in values)
+    assert len(calls) >= 3 * loops
+
+
+def test_run_and_save_results(tmpdir):
+    reported = []
+    results = benchmarks.run_benchmarks(
+        [Benchmark("noop", lambda: None, 1)],
+        samples=2,
+        min_time=0.001,
+        callback=lambda name, seconds: reported.append(name),
+    )
+    assert reported == ["noop"]
+    path = str(tmpdir.join("results.json"))
+    benchmarks.save_results(path, results)
+    assert benchmarks.load_results(path) == results
+
+
+def test_load_results_invalid(tmpdir):
+    path = tmpdir.join("results.json")
+    path.write('{"benchmarks": {}}')
+    with pytest.raises(ValueError):
+        benchmarks.load_results(str(path))
+
+
+def test_compare_results():
+    old = get_results({"a": [1.0, 2.0, 3.0], "b": [1.0], "removed": [1.0]})
+    new = get_results({"a": [2.0, 3.0, 4.0], "b": [0.5], "added": [1.0]})
+    comparisons = benchmarks.compare_results(old, new)
+    assert [(c.name, c.old, c.new, c.change) for c in comparisons] == [
+        ("a", 2.0, 3.0, 0.5),
+        ("b", 1.0, 0.5, -0.5),
+    ]
+
+    lines = benchmarks.format_comparisons(comparisons, threshold=0.1)
+    assert lines[1].endswith("REGRESSION")
+    assert not lines[2].endswith("REGRESSION")
+
+
+@pytest.mark.parametrize("seconds,expected", [
+    (2.5, "2.5 s"),
+    (0.0125, "12.5 ms"),
+    (3e-6, "3 us"),
+    (4.2e-7, "420 ns"),
+])
+def test_format_duration(seconds, expected):
+    assert benchmarks.format_duration(seconds) == expected
+
+
+@pytest.mark.parametrize("new_time,expected_status", [(1.05, 0), (1.5, 1)])
+def test_main_compare(tmpdir, capsys, new_time, expected_status):
+    old = str(tmpdir.join("old.json"))
+    new = str(tmpdir.join("new.json"))
+    benchmarks.save_results(old, get_results({"a": [1.0]}))
+    benchmarks.save_results(new, get_results({"a": [new_time]}))
+
+    status = benchmarks_main.main(["bench", "compare", old, new])
+    assert status == expected_status
+    assert capsys.readouterr().out.splitlines()[1].startswith("a ")
+
+
+def test_main_run(tmpdir, capsys):
+    output = str(tmpdir.join("results.json"))
+    status = benchmarks_main.main([
+        "bench", "run", "-k", "^session.hash_text$", "--samples", "1",
+        "--min-time", "0.001", "-o", output,
+    ])
+    assert status == 0
+    assert list(benchmarks.load_results(output)["benchmarks"]) == [
+        "session.hash_text"]
+    assert capsys.readouterr().out.startswith("session.hash_text ")
+
+
+@pytest.mark.parametrize("dump_format", sorted(throughput.DUMP_TOOLS))
+def test_generate_dump(dump_format):
+    tables = throughput.get_table_specs(2, 7, 25)
+    stream = io.BytesIO()
+    rows = throughput.generate_dump(
+        stream, dump_format, tables, distinct_rows=10)
+    assert rows == 50
+
+    backend = dump_postgres if dump_format == "postgres" else dump_mysql
+    config = Configuration()
+    config.load(throughput.get_config_data(tables))
+    data_rows = {}
+    for chunk in backend.iter_chunks(
+            stream.getvalue().decode("utf-8").split("\n"), config):
+        if chunk.kind == CHUNK_DATA:
+            assert chunk.columns == fixtures.get_column_names(7)
+            data_rows[chunk.table] = data_rows.get(chunk.table, 0) + sum(
+                len(backend.parse_value_line(line, chunk.columns))
+                for line in chunk.lines
+            )
+    assert data_rows == {"table_0": 25, "table_1": 25}
+
+
+def test_get_config_data():
+    (table,) = throughput.get_table_specs(1, 4, 1)
+    assert throughput.get_config_data([table]) == {"strategy": {"table_0": {
+        "name_1": "user.full_name_en_gb",
+        "email_2": "user.email",
+        "notes_3": "string.zfill",
+    }}}
+
+
+def test_stub_dump_tools(tmpdir):
+    path = tmpdir.join("dump.sql")
+    path.write_binary(b"replayed\n")
+    original_path = os.environ.get("PATH")
+    with throughput.stub_dump_tools({"pg_dump": str(path)}):
+        output = subprocess.check_output(["pg_dump", "--any", "arguments"])
+    assert output == b"replayed\n"
+    assert os.environ.get("PATH") == original_path
+
+
+def test_main_throughput(tmpdir, capsys):
+    output = str(tmpdir.join("results.json"))
+    args = [
+        "bench", "throughput", "-e", "serial", "--repeat", "1",
+        "--tables", "1", "--rows", "20", "-o", output,
+    ]
+    assert benchmarks_main.main(args) == 0
+    results = benchmarks.load_results(output)
+    assert sorted(results["benchmarks"]) == [
+        "throughput.mysql.serial", "throughput.postgres.serial"]
+    assert results["benchmarks"]["throughput.mysql.serial"]["items"] == 20
+    assert "rows/s" in capsys.readouterr().out
+
+    # A baseline which was several times faster fails the gate.
+    for result in results["benchmarks"].values():
+        result["values"] = [value / 10 for value in result["values"]]
+    baseline = str(tmpdir.join("baseline.json"))
+    benchmarks.save_results(baseline, results)
+    assert benchmarks_main.main(args + ["--baseline", baseline]) == 1
+    assert "REGRESSION" in capsys.readouterr().out
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import itertools
+import json
+import os
+import random
+import sys
+
+import mock
+import pytest
+
+from .. import __main__
+from ..benchmarks import load_results
+from ..benchmarks.strategy import (
+    SanitizerTiming,
+    format_report,
+    generate_values,
+    get_table_costs,
+    project_time,
+    sample_values,
+    time_sanitizers,
+)
+from ..config import Configuration
+
+PG_DUMP = b"""
+--
+-- PostgreSQL database dump
+--
+
+COPY "public"."test" ("id", "email", "notes") FROM stdin;
+1\tjohn@example.com\tline 1\\nline 2
+2\t\\N\tsecond
+3\tjane@example.com\tthird
+\\.
+
+COPY "public"."other" ("id") FROM stdin;
+1
+\\.
+""".lstrip()
+
+CONFIG = """
+strategy:
+  test:
+    email: string.empty
+    notes: string.zfill
+"""
+
+
+def get_timing(column, seconds, hints=()):
+    return SanitizerTiming(
+        column=column,
+        sanitizer="sanitizer",
+        values=10,
+        errors=0,
+        loops=1,
+        samples=[seconds],
+        seconds=seconds,
+        deterministic=True,
+        duplicate_ratio=0.0,
+        hints=hints,
+    )
+
+
+def test_generate_values():
+    rng = random.Random(0)
+    emails = generate_values(rng, "Email", count=5)
+    assert all("@" in value for value in emails)
+    values = generate_values(rng, "notes", count=5, length=12)
+    assert len(values) == 5
+    assert all(len(value) == 12 for value in values)
+
+
+def test_sample_values(tmpdir):
+    path = tmpdir.join("dump.sql")
+    path.write_binary(PG_DUMP)
+    config = Configuration()
+    config.sanitizers["test.email"] = lambda value: value
+    config.sanitizers["test.notes"] = lambda value: value
+
+    values = sample_values("file://%s" % (path,), config, count=2)
+    # NULL values are left out and the values are decoded.
+    assert values == {
+        "test.email": ["john@example.com", "jane@example.com"],
+        "test.notes": ["line 1\nline 2", "second"],
+    }
+
+    with pytest.raises(ValueError):
+        sample_values("postgres://localhost/test", config)
+
+
+def test_time_sanitizers():
+    config = Configuration()
+    counter = itertools.count()
+    config.sanitizers["test.name"] = lambda value: value.upper()
+    config.sanitizers["test.notes"] = (
+        lambda value: "%s%d" % (value, next(counter)))
+    config.sanitizers["test.broken"] = lambda value: int(value)
+    config.sanitizers["test.email"] = lambda value: value
+    config.expensive_columns.add("test.email")
+
+    timings = time_sanitizers(
+        config,
+        sampled={"test.email": ["a@example.com"] * 4 + ["1", "2"]},
+        count=20,
+        samples=2,
+        min_time=0.001,
+        cost_threshold=0.0,
+    )
+    timings = {timing.column: timing for timing in timings}
+    assert sorted(timings) == [
+        "test.broken", "test.email", "test.name", "test.notes"]
+
+    # The generated values cannot be parsed as integers.
+    assert timings["test.broken"].seconds is None
+    assert timings["test.broken"].errors == 20
+
+    # Sampled values are used when available.
+    assert timings["test.email"].values == 6
+    assert timings["test.email"].duplicate_ratio == pytest.approx(0.5)
+    assert "batch" not in timings["test.email"].hints
+
+    assert len(timings["test.name"].samples) == 2
+    assert timings["test.name"].deterministic
+    assert timings["test.name"].hints[0] == "batch"
+    assert not timings["test.notes"].deterministic
+    assert "cache" not in timings["test.notes"].hints
+
+
+def test_project_time():
+    timings = [
+        get_timing("test.email", 2e-6),
+        get_timing("test.notes", 3e-6),
+        get_timing("other.name", 1e-6),
+    ]
+    assert get_table_costs(timings) == {
+        "test": pytest.approx(5e-6), "other": pytest.approx(1e-6)}
+    assert project_time(timings, {"test": 1000}) == {
+        "test": pytest.approx(5e-3), "other": None}
+
+
+def test_format_report():
+    timings = [
+        get_timing("test.email", 2e-6, hints=("batch",)),
+        get_timing("test.notes", 3e-6),
+        get_timing("other.name", 1e-6),
+    ]
+    lines = format_report(timings, {"test": 1000})
+    assert (
+        "Projected sanitation time: 5 ms (1 tables without estimates)"
+    ) in lines
+    assert any(line.startswith("test.email: 2 us per value") for line in lines)
+    assert not any(line.startswith("test.notes:") for line in lines)
+
+
+def test_main_bench(tmpdir, capsys):
+    config_path = tmpdir.join("config.yml")
+    config_path.write(CONFIG)
+    dump_path = tmpdir.join("dump.sql")
+    dump_path.write_binary(PG_DUMP)
+    stats_path = tmpdir.join("stats.json")
+    stats_path.write(json.dumps({"tables": {"test": {"rows": 1000000}}}))
+    output_path = tmpdir.join("results.json")
+
+    __main__.main([
+        "SANI", "bench", "-c", str(config_path),
+        "--sample", "file://%s" % (dump_path,),
+        "--previous-stats", str(stats_path),
+        "--values", "10", "--samples", "1", "--min-time", "0.001",
+        "--output", str(output_path),
+    ])
+    out = capsys.readouterr().out
+    assert "database_sanitizer.sanitizers.string.sanitize_empty" in out
+    assert "Projected sanitation time: " in out
+    results = load_results(str(output_path))
+    assert sorted(results["benchmarks"]) == [
+        "strategy.test.email", "strategy.test.notes"]
+    assert results["benchmarks"]["strategy.test.email"]["items"] == 2
+
+
+def test_main_bench_invalid_values(tmpdir, capsys):
+    config_path = tmpdir.join("config.yml")
+    config_path.write(CONFIG)
+    with pytest.raises(SystemExit):
+        __main__.main([
+            "SANI", "bench", "-c", str(config_path), "--values", "0"])
+    assert "must be positive" in capsys.readouterr().err
+
+
+def test_main_bench_loads_configuration(tmpdir):
+    config_path = tmpdir.join("config.yml")
+    config_path.write(CONFIG)
+    args = [
+        "SANI", "bench", "-c", str(config_path),
+        "--values", "1", "--samples", "1", "--min-time", "0.001",
+    ]
+    load_configuration = __main__.load_configuration
+    with mock.patch.object(
+        __main__, "load_configuration", wraps=load_configuration,
+    ) as load, mock.patch("sys.path", list(sys.path)):
+        __main__.main(args)
+        __main__.main(args)
+        assert sys.path.count(os.path.realpath(str(tmpdir))) == 1
+    assert load.call_count == 2
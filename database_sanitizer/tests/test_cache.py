@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+import os
+import sqlite3
+import stat
+
+import mock
+import pytest
+
+from .. import __main__, session
+from ..cache import ValueCache
+from ..config import Configuration
+from ..dump import run
+
+SECRET_KEY = b"0123456789abcdef"
+
+PG_DUMP_OUTPUT = b"""
+COPY "public"."test" ("id", "notes") FROM stdin;
+1\tsame
+2\tsame
+3\t\\N
+4\tother
+\\.
+""".strip()
+
+
+def get_config(calls):
+    def sanitize_notes(value):
+        calls.append(value)
+        return value.upper() if value is not None else None
+
+    config = Configuration()
+    config.sanitizers["test.notes"] = sanitize_notes
+    config.sanitizers["test.id"] = lambda value: value
+    config.cached_columns.add("test.notes")
+    return config
+
+
+def test_cached_sanitizer(tmpdir):
+    path = str(tmpdir.join("values.db"))
+    session.reset(SECRET_KEY)
+    calls = []
+    config = get_config(calls)
+    cache = ValueCache(path)
+    cache.instrument_config(config)
+    sanitizer = config.get_sanitizer_for("test", "notes")
+    assert sanitizer.__name__ == "sanitize_notes"
+    assert config.get_sanitizer_for("test", "id") is (
+        config.sanitizers["test.id"])
+
+    assert [sanitizer(value) for value in ("a", "a", None, "b")] == [
+        "A", "A", None, "B"]
+    # NULL values are not cached.
+    assert calls == ["a", None, "b"]
+    assert (cache.hits, cache.misses) == (1, 2)
+    cache.close()
+
+    # The values are found from the cache file in the next run.
+    calls = []
+    config = get_config(calls)
+    cache = ValueCache(path)
+    cache.instrument_config(config)
+    sanitizer = config.get_sanitizer_for("test", "notes")
+    assert [sanitizer(value) for value in ("a", "b", "c")] == ["A", "B", "C"]
+    assert calls == ["c"]
+    cache.close()
+
+    # The inputs are not stored as such.
+    with open(path, "rb") as stream:
+        assert b"\x00a\x00" not in stream.read()
+
+    # A different secret discards the values.
+    session.reset(b"fedcba9876543210")
+    calls = []
+    config = get_config(calls)
+    cache = ValueCache(path)
+    cache.instrument_config(config)
+    config.get_sanitizer_for("test", "notes")("a")
+    assert calls == ["a"]
+    cache.close()
+
+
+def test_eviction(tmpdir):
+    path = str(tmpdir.join("values.db"))
+    session.reset(SECRET_KEY)
+    for values in (["a", "b"], ["c"], ["a", "d"]):
+        config = get_config([])
+        cache = ValueCache(path, max_entries=3)
+        cache.instrument_config(config)
+        for value in values:
+            config.get_sanitizer_for("test", "notes")(value)
+        cache.close()
+
+    # "b" was used least recently.
+    calls = []
+    config = get_config(calls)
+    cache = ValueCache(path)
+    cache.instrument_config(config)
+    for value in ("a", "b", "c", "d"):
+        config.get_sanitizer_for("test", "notes")(value)
+    cache.close()
+    assert calls == ["b"]
+    connection = sqlite3.connect(path)
+    assert connection.execute(
+        "SELECT COUNT(*) FROM entries").fetchone() == (4,)
+    connection.close()
+
+
+def test_other_process(tmpdir):
+    session.reset(SECRET_KEY)
+    calls = []
+    config = get_config(calls)
+    cache = ValueCache(str(tmpdir.join("values.db")))
+    cache.instrument_config(config)
+    cache.pid = -1
+    sanitizer = config.get_sanitizer_for("test", "notes")
+    assert [sanitizer("a"), sanitizer("a")] == ["A", "A"]
+    assert calls == ["a", "a"]
+    cache.close()
+
+
+def test_run_with_value_cache(tmpdir):
+    path = str(tmpdir.join("values.db"))
+    for expected_calls in (["same", None, "other"], [None]):
+        calls = []
+        output = io.StringIO()
+        process = mock.Mock(stdout=io.BytesIO(PG_DUMP_OUTPUT))
+        with mock.patch("subprocess.Popen", return_value=process):
+            run(
+                "postgres://localhost/test",
+                output,
+                get_config(calls),
+                secret_key=SECRET_KEY,
+                value_cache=ValueCache(path),
+            )
+        assert calls == expected_calls
+        assert "2\tSAME\n" in output.getvalue()
+    assert session.get_secret() == SECRET_KEY
+
+
+def test_load_secret_file(tmpdir):
+    path = str(tmpdir.join("secret"))
+    secret = session.load_secret_file(path)
+    assert len(secret) == session.SECRET_KEY_BITS // 8
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert session.load_secret_file(path) == secret
+
+
+@mock.patch.object(__main__, "run")
+def test_main_with_value_cache(mocked_run, tmpdir):
+    secret_path = tmpdir.join("secret")
+    secret_path.write("30313233343536373839616263646566")
+    __main__.main([
+        "SANI", "--secret-file", str(secret_path),
+        "--value-cache", "values.db", "--value-cache-size", "100",
+        "some://url",
+    ])
+    kwargs = mocked_run.call_args[1]
+    assert kwargs["secret_key"] == SECRET_KEY
+    assert isinstance(kwargs["value_cache"], ValueCache)
+    assert (kwargs["value_cache"].path, kwargs["value_cache"].max_entries) == (
+        "values.db", 100)
+
+
+@mock.patch.object(__main__, "run")
+def test_main_value_cache_requires_secret(mocked_run, capsys):
+    with pytest.raises(SystemExit):
+        __main__.main(["SANI", "--value-cache", "values.db", "some://url"])
+    assert "--value-cache: requires --secret-file" in capsys.readouterr().err
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import gzip
+import io
+
+import pytest
+
+from ..compress import CompressedStream, get_codec_for_filename, get_compressor
+
+DATA = b"".join(b"%d\tuser%d@example.com\n" % (i, i) for i in range(20000))
+
+
+@pytest.mark.parametrize("filename,expected", [
+    ("dump.sql.gz", "gzip"),
+    ("dump.SQL.GZ", "gzip"),
+    ("dump.sql.zst", "zstd"),
+    ("dump.sql.lz4", "lz4"),
+    ("dump.sql", None),
+    (None, None),
+])
+def test_get_codec_for_filename(filename, expected):
+    assert get_codec_for_filename(filename) == expected
+
+
+def test_get_compressor_invalid():
+    with pytest.raises(ValueError):
+        get_compressor("bzip2")
+    with pytest.raises(ValueError):
+        get_compressor("gzip", 10)
+
+
+def compress(codec, block_size, threads=2):
+    output = io.BytesIO()
+    stream = CompressedStream(
+        output, codec, threads=threads, block_size=block_size)
+    for start in range(0, len(DATA), 1000):
+        stream.writelines([memoryview(DATA)[start:start + 1000]])
+    stream.close()
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("block_size", [4096, 1024 * 1024])
+def test_gzip(block_size):
+    compressed = compress("gzip", block_size)
+    assert gzip.GzipFile(fileobj=io.BytesIO(compressed)).read() == DATA
+
+
+def test_zstd():
+    zstandard = pytest.importorskip("zstandard")
+    compressed = compress("zstd", 4096)
+    reader = zstandard.ZstdDecompressor().stream_reader(
+        io.BytesIO(compressed), read_across_frames=True)
+    assert reader.read() == DATA
+
+
+def test_lz4():
+    lz4_frame = pytest.importorskip("lz4.frame")
+    compressed = compress("lz4", 4096)
+    # Frames are concatenated, decompress them one by one.
+    result = b""
+    while compressed:
+        decompressor = lz4_frame.LZ4FrameDecompressor()
+        result += decompressor.decompress(compressed)
+        compressed = decompressor.unused_data
+    assert result == DATA
+
+
+def test_flush_keeps_stream_valid():
+    output = io.BytesIO()
+    stream = CompressedStream(output, "gzip", threads=1)
+    stream.write(b"first\n")
+    stream.flush()
+    assert gzip.GzipFile(fileobj=io.BytesIO(output.getvalue())).read() == (
+        b"first\n")
+    stream.write(b"second\n")
+    stream.close()
+    assert gzip.GzipFile(fileobj=io.BytesIO(output.getvalue())).read() == (
+        b"first\nsecond\n")
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        CompressedStream(io.BytesIO(), "gzip", threads=0)
+    with pytest.raises(ValueError):
+        CompressedStream(io.BytesIO(), "gzip", block_size=0)
@@ -104,6 +104,71 @@ def test_load_addon_packages():
     assert config.addon_packages == ["test1", "test2", "test3"]
 
 
+def test_load_expensive_columns():
+    config = Configuration()
+
+    config.load_expensive_columns({})
+    assert config.expensive_columns == set()
+
+    with pytest.raises(ConfigurationError):
+        config.load_expensive_columns({"config": "test"})
+
+    with pytest.raises(ConfigurationError):
+        config.load_expensive_columns({"config": {"expensive_columns": "a.b"}})
+
+    with pytest.raises(ConfigurationError):
+        config.load_expensive_columns({"config": {"expensive_columns": ["a"]}})
+
+    config.load_expensive_columns({"config": {
+        "expensive_columns": ["user.email", "user.address"],
+    }})
+    assert config.expensive_columns == {"user.email", "user.address"}
+
+
+def test_load_cached_columns():
+    config = Configuration()
+
+    config.load_cached_columns({"config": {}})
+    assert config.cached_columns == set()
+
+    with pytest.raises(ConfigurationError):
+        config.load_cached_columns({"config": {"cached_columns": ["a"]}})
+
+    config.load_cached_columns({"config": {
+        "cached_columns": ["user.address"],
+    }})
+    assert config.cached_columns == {"user.address"}
+
+
+def test_load_subset():
+    config = Configuration()
+
+    config.load_subset({})
+    assert config.subset_tables == {}
+
+    config.load_subset({"subset": {
+        "users": {"percent": 10},
+        "orders": {"where": "created_at > '2020-01-01'", "percent": 0.5},
+    }})
+    assert config.subset_tables == {
+        "users": {"percent": 10, "where": None},
+        "orders": {"where": "created_at > '2020-01-01'", "percent": 0.5},
+    }
+
+    for subset in (
+        "users",
+        {"users": 10},
+        {"users": {}},
+        {"users": {"limit": 10}},
+        {"users": {"percent": 101}},
+        {"users": {"percent": "10"}},
+        {"users": {"percent": True}},
+        {"users": {"where": 1}},
+    ):
+        with pytest.raises(ConfigurationError):
+            config.load_subset({"subset": subset})
+
+
 def test_load_sanitizers():
     config = Configuration()
 
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import gzip
+import io
+
+import mock
+import pytest
+import six
+from six.moves.urllib import parse as urlparse
+
+from .. import dump, session
+from ..config import Configuration
+from ..dump import files
+from ..dump import mysql as dump_mysql
+from ..dump import postgres as dump_postgres
+from ..engine import SerialEngine
+from ..engine.hybrid import HybridEngine
+from .test_engine_process import MOCK_MYSQLDUMP_OUTPUT, MOCK_PG_DUMP_OUTPUT
+
+DUMPS = {
+    "postgres": (dump_postgres, MOCK_PG_DUMP_OUTPUT),
+    "mysql": (dump_mysql, MOCK_MYSQLDUMP_OUTPUT),
+}
+
+
+def setup_module():
+    session.reset(b"not-so-secret-key")
+
+
+def get_config():
+    config = Configuration()
+    config.sanitizers["test.email"] = lambda value: "someone@example.com"
+    return config
+
+
+def get_expected_output(backend, data, config):
+    return "".join(
+        line + "\n"
+        for line in backend.sanitize_from_stream(io.BytesIO(data), config)
+    )
+
+
+def sanitize_file(path, config, engine=None):
+    url = urlparse.urlparse("file://%s" % (path,))
+    return "".join(text + "\n" for text in files.sanitize(url, config, engine))
+
+
+@pytest.mark.parametrize("dump_format", sorted(DUMPS))
+@pytest.mark.parametrize("engine", [None, HybridEngine(workers=2)])
+def test_sanitize(tmpdir, dump_format, engine):
+    (backend, data) = DUMPS[dump_format]
+    path = tmpdir.join("dump.sql")
+    path.write_binary(data)
+    config = get_config()
+
+    assert sanitize_file(str(path), config, engine) == get_expected_output(
+        backend, data, config)
+
+
+@pytest.mark.parametrize("dump_format", sorted(DUMPS))
+def test_sanitize_compressed(tmpdir, dump_format):
+    (backend, data) = DUMPS[dump_format]
+    path = tmpdir.join("dump.sql.gz")
+    with gzip.open(str(path), "wb") as stream:
+        stream.write(data)
+    config = get_config()
+
+    assert sanitize_file(str(path), config) == get_expected_output(
+        backend, data, config)
+
+
+@pytest.mark.parametrize("dump_format", sorted(DUMPS))
+def test_skip_rows(tmpdir, dump_format):
+    (backend, data) = DUMPS[dump_format]
+    path = tmpdir.join("dump.sql")
+    path.write_binary(data)
+    config = get_config()
+    config.skip_rows_for_tables.append("test")
+
+    output = sanitize_file(str(path), config)
+    assert output == get_expected_output(backend, data, config)
+    assert "example.com" not in output
+
+
+@pytest.mark.parametrize("dump_format", sorted(DUMPS))
+@pytest.mark.parametrize("block_size", [1, 100, 4096])
+def test_iter_blocks(dump_format, block_size):
+    (backend, data) = DUMPS[dump_format]
+    config = get_config()
+    sections = list(files.scan(data, backend))
+    blocks = list(files.iter_blocks(
+        data, sections, config, backend, block_size))
+
+    # Blocks cover the whole dump in order, and end at line boundaries.
+    assert blocks[0].offset == 0
+    for (block, next_block) in zip(blocks, blocks[1:]):
+        assert block.offset + block.length == next_block.offset
+        assert data[next_block.offset - 1:next_block.offset] == b"\n"
+    assert blocks[-1].offset + blocks[-1].length == len(data)
+
+    line_sanitizers = files.LineSanitizerCache(backend.__name__, config)
+    output = "".join(
+        files.process_block(data, block, line_sanitizers) + "\n"
+        for block in blocks
+    )
+    assert output == get_expected_output(backend, data, config)
+
+
+def test_scan_postgres():
+    sections = list(files.scan(MOCK_PG_DUMP_OUTPUT, dump_postgres))
+    assert [(section.table, section.columns) for section in sections] == [
+        ("test", ("id", "email", "notes")),
+        ("other", ("id",)),
+    ]
+    other = sections[1]
+    assert MOCK_PG_DUMP_OUTPUT[other.start:other.data_start] == (
+        b'COPY "public"."other" ("id") FROM stdin;\n')
+    assert MOCK_PG_DUMP_OUTPUT[other.data_start:other.data_end] == b"1\n"
+    assert MOCK_PG_DUMP_OUTPUT[other.data_end:other.end] == b"\\.\n"
+
+
+def test_scan_postgres_terminator_at_end():
+    data = b'COPY "public"."test" ("id") FROM stdin;\n1\n\\.'
+    (section,) = files.scan(data, dump_postgres)
+    assert (section.data_start, section.data_end, section.end) == (
+        data.index(b"1"), len(data) - 2, len(data))
+
+
+def test_scan_mysql():
+    sections = list(files.scan(MOCK_MYSQLDUMP_OUTPUT, dump_mysql))
+    assert len(sections) == 1
+    section = sections[0]
+    assert section.table == "test"
+    assert section.columns == ("id", "email", "notes")
+    assert section.start == MOCK_MYSQLDUMP_OUTPUT.index(b"INSERT")
+    assert MOCK_MYSQLDUMP_OUTPUT[section.end:] == b"\n--- Final line"
+
+
+def test_scan_mysql_without_column_names():
+    data = b"\n".join([
+        b"INSERT INTO `test` VALUES (1,'x) VALUES (y');",
+        b"INSERT INTO `test` (`id`) VALUES (2);",
+        b"",
+    ])
+    (section,) = files.scan(data, dump_mysql)
+    assert (section.table, section.columns) == ("test", ("id",))
+    assert section.start == data.index(b"INSERT INTO `test` (")
+
+
+@pytest.mark.parametrize("data,dump_format,expected", [
+    (b"-- MySQL dump 10.13\n", None, dump_mysql),
+    (b"--\n-- PostgreSQL database dump\n", None, dump_postgres),
+    (b"\nCOPY x", None, dump_postgres),
+    (b"anything", "mysql", dump_mysql),
+])
+def test_get_backend(data, dump_format, expected):
+    assert files.get_backend(data, dump_format) is expected
+
+
+@pytest.mark.parametrize("data,dump_format", [
+    (b"anything", None),
+    (b"-- MySQL dump", "oracle"),
+])
+def test_get_backend_invalid(data, dump_format):
+    with pytest.raises(ValueError):
+        files.get_backend(data, dump_format)
+
+
+def test_format_parameter(tmpdir):
+    path = tmpdir.join("dump.sql")
+    path.write_binary(b"plain text\n")
+    url = urlparse.urlparse("file://%s?format=postgres" % (path,))
+    assert list(files.sanitize(url, None)) == ["plain text"]
+
+
+def test_run(tmpdir):
+    path = tmpdir.join("dump.sql")
+    path.write_binary(MOCK_PG_DUMP_OUTPUT)
+    config = get_config()
+    output = six.StringIO()
+    dump.run("file://%s" % (path,), output, config, engine=SerialEngine())
+    assert output.getvalue() == get_expected_output(
+        dump_postgres, MOCK_PG_DUMP_OUTPUT, config)
+
+
+def test_run_table_mode_not_supported():
+    with pytest.raises(ValueError):
+        dump.run("file:///dump.sql", six.StringIO(), None, jobs=2)
+
+
+@pytest.mark.parametrize("dump_format", sorted(DUMPS))
+def test_build_index(tmpdir, dump_format):
+    (backend, data) = DUMPS[dump_format]
+    path = tmpdir.join("dump.sql")
+    path.write_binary(data)
+
+    index = files.build_index(str(path))
+    assert index.format == dump_format
+    assert index.sections == list(files.scan(data, backend))
+    assert files.load_index(str(path) + ".index", str(path)) == index
+
+
+def test_load_index_missing(tmpdir):
+    path = tmpdir.join("dump.sql")
+    path.write_binary(MOCK_PG_DUMP_OUTPUT)
+    index_path = str(tmpdir.join("missing.index"))
+    assert files.load_index(index_path, str(path)) is None
+
+
+def test_load_index_outdated(tmpdir):
+    path = tmpdir.join("dump.sql")
+    path.write_binary(MOCK_PG_DUMP_OUTPUT)
+    files.build_index(str(path))
+    path.write_binary(MOCK_PG_DUMP_OUTPUT + b"\n")
+    assert files.load_index(str(path) + ".index", str(path)) is None
+
+
+def test_sanitize_with_index(tmpdir):
+    path = tmpdir.join("dump.sql")
+    path.write_binary(MOCK_PG_DUMP_OUTPUT)
+    files.build_index(str(path))
+    config = get_config()
+    expected = get_expected_output(dump_postgres, MOCK_PG_DUMP_OUTPUT, config)
+
+    with mock.patch.object(files, "scan") as mocked_scan:
+        assert sanitize_file(str(path), config) == expected
+    assert not mocked_scan.called
+
+
+def test_sanitize_writes_index(tmpdir):
+    path = tmpdir.join("dump.sql.gz")
+    with gzip.open(str(path), "wb") as stream:
+        stream.write(MOCK_MYSQLDUMP_OUTPUT)
+    index_path = tmpdir.join("custom.index")
+    config = get_config()
+    url = urlparse.urlparse("file://%s?index=%s" % (path, index_path))
+
+    output = "".join(text + "\n" for text in files.sanitize(url, config))
+    assert output == get_expected_output(
+        dump_mysql, MOCK_MYSQLDUMP_OUTPUT, config)
+    index = files.load_index(str(index_path), str(path))
+    assert index.format == "mysql"
+    assert index.sections == list(
+        files.scan(MOCK_MYSQLDUMP_OUTPUT, dump_mysql))
@@ -2,18 +2,25 @@
 
 from __future__ import unicode_literals
 
+import datetime
 import io
 
+import mock
 import pytest
 from six.moves.urllib import parse as urlparse
 
 from ..config import Configuration
+from ..dump import mysql as dump_mysql
 from ..dump.mysql import (
+    convert_load_data_line,
+    get_load_data_statement,
     parse_column_names,
     parse_values,
     sanitize,
     sanitize_from_stream,
 )
+from ..dump.subset import ForeignKey
+from ..scheduler import TableSize, Task
 
 MOCK_MYSQLDUMP_OUTPUT = b"""
 --- Fake MySQL database dump
@@ -161,6 +168,29 @@ def test_parse_values(text, expected_values):
     assert tuple(parse_values(text)) == expected_values
 
 
+def test_convert_load_data_line():
+    assert convert_load_data_line("-- Comment") is None
+    assert convert_load_data_line(
+        "INSERT INTO `test` (`id`, `notes`) VALUES "
+        "(1,'tab\\there'),(2,NULL),(-3,'back\\\\slash');"
+    ) == (
+        "test",
+        ("id", "notes"),
+        "1\ttab\\there\n2\t\\N\n-3\tback\\\\slash\n",
+    )
+    with pytest.raises(ValueError):
+        convert_load_data_line(
+            "INSERT INTO `test` (`id`, `notes`) VALUES (1);")
+
+
+def test_get_load_data_statement():
+    assert get_load_data_statement("te`st", ("id", "notes"), "it's.tsv") == (
+        "LOAD DATA LOCAL INFILE 'it\\'s.tsv' INTO TABLE `te``st` "
+        "CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+        "LINES TERMINATED BY '\\n' (`id`, `notes`);"
+    )
+
+
 @pytest.mark.parametrize('config_type', [
     'no-config', 'empty-config', 'single-column-config'])
 @pytest.mark.parametrize('data_label', ['ok', 'invalid'])
@@ -194,3 +224,169 @@ def test_optimizations(config_type, data_label):
         expected_output = data.decode('utf-8').splitlines()
         result = list(sanitize_from_stream(dump_stream, config))
         assert result == expected_output
+
+
+def create_mock_connection(*results):
+    connection = mock.MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchall.side_effect = list(results)
+    cursor.fetchone.side_effect = list(results)
+    return connection
+
+
+def test_get_table_sizes():
+    url = urlparse.urlparse("mysql://localhost/test")
+    config = Configuration()
+    config.mysqldump_params = ["--ignore-table=test.ignored"]
+    connection = create_mock_connection(
+        [("test", "id", "int"), ("pairs", "a", "int"), ("pairs", "b", "int")],
+        [("test", 16384, 3), ("pairs", 1024, 1), ("ignored", 10, 1)],
+    )
+    with mock.patch.object(dump_mysql, "connect", return_value=connection):
+        tables = dump_mysql.get_table_sizes(url, config)
+
+    assert tables == [
+        TableSize(None, "test", 16384, 3, "id"),
+        TableSize(None, "pairs", 1024, 1, None),
+    ]
+
+
+def test_get_table_fingerprints():
+    url = urlparse.urlparse("mysql://localhost/test")
+    now = datetime.datetime(2020, 1, 1, 12, 0, 0)
+    created = datetime.datetime(2019, 1, 1)
+    connection = create_mock_connection(
+        [("information_schema_stats_expiry", "86400")],
+        [
+            ("test", created, now - datetime.timedelta(hours=1), now, "abc"),
+            ("recent", created, now, now, "def"),
+            ("unknown", created, None, now, "ghi"),
+        ],
+    )
+    with mock.patch.object(dump_mysql, "connect", return_value=connection):
+        fingerprints = dump_mysql.get_table_fingerprints(url)
+
+    assert fingerprints == {
+        (None, "test"): "2019-01-01 00:00:00|2020-01-01 11:00:00|abc",
+        (None, "recent"): None,
+        (None, "unknown"): None,
+    }
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.execute.assert_any_call(
+        "SET SESSION information_schema_stats_expiry = 0")
+
+
+def test_list_databases():
+    url = urlparse.urlparse("mysql://localhost/test")
+    connection = create_mock_connection([
+        ("information_schema",), ("tenant_b",), ("mysql",), ("tenant_a",),
+        ("performance_schema",), ("sys",),
+    ])
+    with mock.patch.object(
+        dump_mysql, "connect", return_value=connection,
+    ) as connect:
+        databases = dump_mysql.list_databases(url)
+
+    assert databases == ["tenant_a", "tenant_b"]
+    assert connect.call_args[0][0].path == "/information_schema"
+    assert connection.close.called
+
+
+def test_get_foreign_keys():
+    connection = create_mock_connection([
+        ("items", "items_order", "order_id", "orders", "id"),
+        ("items", "items_order", "line", "orders", "line"),
+        ("orders", "orders_user", "user_id", "users", "id"),
+    ])
+    with mock.patch.object(dump_mysql, "connect", return_value=connection):
+        foreign_keys = dump_mysql.get_foreign_keys(None)
+
+    assert foreign_keys == [
+        ForeignKey(
+            None, "items", ("order_id", "line"),
+            None, "orders", ("id", "line"),
+        ),
+        ForeignKey(None, "orders", ("user_id",), None, "users", ("id",)),
+    ]
+
+
+def test_get_sample_condition():
+    connection = create_mock_connection([("id",), ("line",)])
+    with mock.patch.object(dump_mysql, "connect", return_value=connection):
+        assert dump_mysql.get_sample_condition(None, None, "items", 5) == (
+            "CRC32(CONCAT_WS(',', `id`, `line`)) % 10000 < 500")
+
+    connection = create_mock_connection([])
+    with mock.patch.object(dump_mysql, "connect", return_value=connection):
+        with pytest.raises(ValueError):
+            dump_mysql.get_sample_condition(None, None, "items", 5)
+
+
+def test_get_semijoin_condition():
+    assert dump_mysql.get_semijoin_condition(
+        ("user_id",), None, "users", ("id",), "TRUE",
+    ) == "(`user_id`) IN (SELECT `id` FROM `users` WHERE TRUE)"
+
+
+def test_get_part_conditions():
+    url = urlparse.urlparse("mysql://localhost/test")
+    table = TableSize(None, "test", 0, 0, "id")
+    assert dump_mysql.get_part_conditions(url, table, 1) == [None]
+
+    connection = create_mock_connection((1, 9))
+    with mock.patch.object(dump_mysql, "connect", return_value=connection):
+        assert dump_mysql.get_part_conditions(url, table, 3) == [
+            "`id` < 4",
+            "`id` >= 4 AND `id` < 7",
+            "`id` >= 7",
+        ]
+
+    connection = create_mock_connection((None, None))
+    with mock.patch.object(dump_mysql, "connect", return_value=connection):
+        assert dump_mysql.get_part_conditions(url, table, 2) == [None, "FALSE"]
+
+
+def test_sanitize_table():
+    url = urlparse.urlparse("mysql://localhost/test")
+    config = Configuration()
+    config.sanitizers["test.notes"] = lambda value: "Sanitized"
+    config.mysqldump_params = ["--single-transaction"]
+    task = Task(
+        table=TableSize(None, "test", 0, 0, "id"),
+        part=0,
+        parts=2,
+        size=0,
+        condition="`id` < 4",
+    )
+    mocked_process = mock.Mock(stdout=io.BytesIO(MOCK_MYSQLDUMP_OUTPUT))
+    mocked_process.wait.return_value = 0
+    with mock.patch("subprocess.Popen", return_value=mocked_process) as popen:
+        output = list(dump_mysql.sanitize_table(url, config, task, None))
+
+    assert (
+        "INSERT INTO `test` (`id`, `created_at`, `notes`) VALUES "
+        "(1,'2018-01-01','Sanitized'),(2,'2018-01-02','Sanitized'),"
+        "(3,'2018-01-03','Sanitized');"
+    ) in output
+    args = popen.call_args[1]["args"]
+    assert args[-5:] == [
+        "test",
+        "--single-transaction",
+        "--no-create-info",
+        "--skip-triggers",
+        "--where=`id` < 4",
+    ]
+
+
+def test_sanitize_section():
+    url = urlparse.urlparse("mysql://localhost/test")
+    assert list(dump_mysql.sanitize_section(url, None, "data", [], None)) == []
+
+    mocked_process = mock.Mock(stdout=io.BytesIO(b"-- Schema\n"))
+    mocked_process.wait.return_value = 0
+    with mock.patch("subprocess.Popen", return_value=mocked_process) as popen:
+        output = list(dump_mysql.sanitize_section(
+            url, None, "pre-data", [], None))
+
+    assert output == ["-- Schema"]
+    assert popen.call_args[1]["args"][-2:] == ["--no-data", "--skip-triggers"]
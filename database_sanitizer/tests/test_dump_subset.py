@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import sys
+
+import mock
+import pytest
+import six
+
+from .. import __main__
+from ..config import Configuration
+from ..dump import run
+from ..dump.subset import ForeignKey, get_subset_conditions
+from ..scheduler import TableSize
+
+#: Foreign keys of the fake backend implemented by this module.
+FAKE_FOREIGN_KEYS = [
+    ForeignKey("public", "orders", ("user_id",), "public", "users", ("id",)),
+    ForeignKey(
+        "public", "order_items", ("order_id",), "public", "orders", ("id",)),
+    ForeignKey(
+        "public", "order_items", ("product_id",),
+        "public", "products", ("id",),
+    ),
+    ForeignKey(
+        "public", "products", ("category_id",),
+        "public", "categories", ("id",),
+    ),
+]
+
+
+def get_foreign_keys(url):
+    return list(FAKE_FOREIGN_KEYS)
+
+
+def get_sample_condition(url, schema, table, percent):
+    return "sample(%s, %s)" % (table, percent)
+
+
+def get_semijoin_condition(columns, schema, table, table_columns, condition):
+    return "%s IN %s.%s[%s]" % (
+        ",".join(columns), table, ",".join(table_columns), condition)
+
+
+def get_tables(*names):
+    return [TableSize("public", name, 0, 0, None) for name in names]
+
+
+def get_conditions(subset, tables, foreign_keys=()):
+    config = Configuration()
+    config.load_subset({"subset": subset})
+    with mock.patch.object(
+        sys.modules[__name__],
+        "FAKE_FOREIGN_KEYS",
+        FAKE_FOREIGN_KEYS + list(foreign_keys),
+    ):
+        return get_subset_conditions(
+            sys.modules[__name__], None, config, get_tables(*tables))
+
+
+def test_get_subset_conditions():
+    conditions = get_conditions(
+        {"users": {"percent": 10, "where": "active"}},
+        ["categories", "logs", "order_items", "orders", "products", "users"],
+    )
+
+    users = "(active) AND sample(users, 10)"
+    orders = "user_id IN users.id[%s]" % (users,)
+    order_items = "order_id IN orders.id[%s]" % (orders,)
+    products = "id IN order_items.product_id[%s]" % (order_items,)
+    assert conditions == {
+        # Rows referencing the selected rows.
+        ("public", "users"): users,
+        ("public", "orders"): orders,
+        ("public", "order_items"): order_items,
+        # Rows referenced by the selected rows.
+        ("public", "products"): products,
+        ("public", "categories"): (
+            "id IN products.category_id[%s]" % (products,)),
+    }
+
+
+def test_get_subset_conditions_referenced_by_whole_table():
+    reviews = ForeignKey(
+        "public", "reviews", ("product_id",), "public", "products", ("id",))
+    conditions = get_conditions(
+        {"users": {"percent": 10}},
+        [
+            "categories", "order_items", "orders", "products", "reviews",
+            "users",
+        ],
+        [reviews],
+    )
+    # Unrelated reviews are dumped as a whole, and so are the products and
+    # the categories they reference.
+    assert sorted(conditions) == [
+        ("public", "order_items"), ("public", "orders"), ("public", "users")]
+
+
+def test_get_subset_conditions_multiple_parents():
+    conditions = get_conditions(
+        {"users": {"where": "active"}, "products": {"where": "visible"}},
+        ["categories", "order_items", "orders", "products", "users"],
+    )
+    orders = "user_id IN users.id[(active)]"
+    order_items = (
+        "(order_id IN orders.id[%s]) "
+        "OR (product_id IN products.id[(visible)])" % (orders,)
+    )
+    # Orders of the selected order items which reference other products.
+    assert conditions[("public", "orders")] == (
+        "(%s) OR (id IN order_items.order_id[%s])" % (orders, order_items))
+    assert conditions[("public", "products")] == (
+        "((visible)) OR (id IN order_items.product_id[%s])" % (order_items,))
+
+
+def test_get_subset_conditions_cycles():
+    managers = ForeignKey(
+        "public", "employees", ("manager_id",), "public", "employees", ("id",))
+    users = ForeignKey(
+        "public", "employees", ("user_id",), "public", "users", ("id",))
+    conditions = get_conditions(
+        {"orders": {"where": "recent"}},
+        ["employees", "orders", "users"],
+        [managers, users],
+    )
+    # Employees are dumped as a whole, and so are the users they reference.
+    assert conditions == {("public", "orders"): "(recent)"}
+
+    with pytest.raises(ValueError) as excinfo:
+        get_conditions(
+            {"employees": {"percent": 1}}, ["employees", "users"], [managers])
+    assert "cycle of foreign keys" in str(excinfo.value)
+
+    addresses = ForeignKey(
+        "public", "users", ("address_id",), "public", "addresses", ("id",))
+    residents = ForeignKey(
+        "public", "addresses", ("resident_id",), "public", "users", ("id",))
+    with pytest.raises(ValueError):
+        get_conditions(
+            {"users": {"percent": 1}}, ["addresses", "users"],
+            [addresses, residents])
+
+
+def test_get_subset_conditions_skipped_tables():
+    config = Configuration()
+    config.load_subset({"subset": {"users": {"where": "active"}}})
+    config.skip_rows_for_tables.append("orders")
+    conditions = get_subset_conditions(
+        sys.modules[__name__], None, config,
+        get_tables("order_items", "orders", "users"))
+    assert conditions == {("public", "users"): "(active)"}
+
+
+def test_get_subset_conditions_without_subset():
+    assert get_subset_conditions(None, None, None, get_tables("users")) == {}
+    assert get_subset_conditions(
+        None, None, Configuration(), get_tables("users")) == {}
+
+
+@pytest.mark.parametrize("args,error", [
+    (["--engine", "process"], "--engine: cannot be combined with a subset"),
+    (["--jobs", "2", "--incremental", "cache"],
+     "--incremental: cannot be combined with a subset"),
+])
+@mock.patch.object(__main__, "run")
+def test_main_with_invalid_subset(mocked_run, tmpdir, capsys, args, error):
+    config_path = tmpdir.join("config.yml")
+    config_path.write("subset:\n  users:\n    percent: 10\n")
+    with pytest.raises(SystemExit):
+        __main__.main(
+            ["SANI", "-c", str(config_path)] + args
+            + ["postgres://localhost/test"])
+    assert error in capsys.readouterr().err
+    assert not mocked_run.called
+
+
+def test_run_subset_of_dump_file(tmpdir):
+    config = Configuration()
+    config.load_subset({"subset": {"users": {"percent": 10}}})
+    with pytest.raises(ValueError) as excinfo:
+        run("file://%s" % (tmpdir.join("dump.sql"),), six.StringIO(), config)
+    assert "Subsetting is not supported with 'file' URLs" in str(excinfo.value)
@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import binascii
+import contextlib
+import functools
+import json
+import sys
+
+import mock
+import pytest
+import six
+from six.moves.urllib import parse as urlparse
+
+from .. import session
+from ..config import Configuration
+from ..dump import CHUNK_DATA, CHUNK_DATA_END, CHUNK_DATA_START, Chunk
+from ..dump import tables as dump_tables
+from ..dump.tables import assign_conditions, run_tables
+from ..scheduler import TableSize, load_statistics, plan
+from ..stats import RunStatistics, track_chunks
+
+#: Tables of the fake backend implemented by this module.
+FAKE_TABLES = [
+    TableSize("public", "alpha", 100, 2, None),
+    TableSize("public", "beta", 5000, 6, 6),
+    TableSize("public", "gamma", 50, 1, None),
+]
+
+FAKE_ROWS = {
+    "alpha": ["a1", "a2"],
+    "beta": ["b1", "b2", "b3", "b4", "b5", "b6"],
+    "gamma": ["g1"],
+}
+
+
+FAKE_FINGERPRINTS = {
+    ("public", "alpha"): "alpha-1",
+    ("public", "beta"): "beta-1",
+    ("public", "gamma"): None,
+}
+
+
+@contextlib.contextmanager
+def export_snapshot(url):
+    yield "snapshot-1"
+
+
+def get_table_sizes(url, config):
+    return list(FAKE_TABLES)
+
+
+def get_table_fingerprints(url):
+    return dict(FAKE_FINGERPRINTS)
+
+
+def get_part_conditions(url, table, parts):
+    step = -(-table.split // parts)
+    return [
+        "%d:%d" % (part * step, (part + 1) * step) for part in range(parts)
+    ]
+
+
+def sanitize_section(url, config, section, tables, snapshot):
+    assert snapshot == "snapshot-1"
+    return ["-- %s" % (section,)]
+
+
+def sanitize_table(url, config, task, snapshot):
+    assert snapshot == "snapshot-1"
+    rows = FAKE_ROWS[task.table.table]
+    if task.condition:
+        (start, end) = [int(bound) for bound in task.condition.split(":")]
+        rows = rows[start:end]
+    sanitizer = config.get_sanitizer_for(task.table.table, "value")
+    table = task.table.table
+    chunks = [
+        Chunk(CHUNK_DATA_START, table, None, []),
+        Chunk(CHUNK_DATA, table, None, rows),
+        Chunk(CHUNK_DATA_END, table, None, []),
+    ]
+    for chunk in track_chunks(chunks, __name__):
+        for row in chunk.lines:
+            yield sanitizer(row) if sanitizer else row
+
+
+def count_rows(lines):
+    return len(lines)
+
+
+def convert_load_data_line(line):
+    return ("table", ("value",), line + "\n")
+
+
+class FakeDataDirectory(object):
+    def __init__(self, directory):
+        self.directory = directory
+        self.lines = []
+        self.data_files = []
+
+    def write(self, text):
+        self.lines.extend(text.splitlines())
+
+    def add_data_file(self, table, columns, path):
+        with open(path) as stream:
+            self.data_files.append((table, columns, stream.read()))
+
+
+class FakeResumedDirectory(object):
+    def __init__(self, completed):
+        self.completed = completed
+        self.fingerprints = None
+        self.lines = []
+
+    def write(self, text):
+        self.lines.extend(text.splitlines())
+
+    def get_completed_tables(self, fingerprints):
+        self.fingerprints = fingerprints
+        return self.completed
+
+    def add_completed_table(self, schema, table):
+        self.lines.append("-- resumed %s.%s" % (schema, table))
+
+
+def run_fake_tables(config, jobs, **kwargs):
+    output = six.StringIO()
+    run_tables(
+        db_module=sys.modules[__name__],
+        url=urlparse.urlparse("postgres://localhost/test"),
+        output=output,
+        config=config,
+        jobs=jobs,
+        **kwargs
+    )
+    return output.getvalue().splitlines()
+
+
+def test_run_tables():
+    config = Configuration()
+    config.sanitizers["beta.value"] = lambda value: value.upper()
+
+    # Make the parts small enough for the beta table to be split.
+    small_plan = functools.partial(plan, min_part_size=1)
+    assert any(task.parts > 1 for task in small_plan(FAKE_TABLES, 3).tasks)
+    with mock.patch.object(dump_tables, "plan", side_effect=small_plan):
+        output = run_fake_tables(config, jobs=3)
+
+    assert output == [
+        "-- pre-data",
+        "a1", "a2",
+        "B1", "B2", "B3", "B4", "B5", "B6",
+        "g1",
+        "-- data",
+        "-- post-data",
+    ]
+
+
+def test_run_tables_temp_dir(tmpdir):
+    mkdtemp = dump_tables.tempfile.mkdtemp
+    with mock.patch.object(
+            dump_tables.tempfile, "mkdtemp", side_effect=mkdtemp) as mocked:
+        output = run_fake_tables(
+            Configuration(), jobs=2, temp_dir=str(tmpdir))
+
+    assert output[1:3] == ["a1", "a2"]
+    assert mocked.call_args[1]["dir"] == str(tmpdir)
+    # The temporary files are removed afterwards.
+    assert tmpdir.listdir() == []
+
+
+def test_run_tables_skip_rows():
+    config = Configuration()
+    config.skip_rows_for_tables.append("alpha")
+
+    output = run_fake_tables(config, jobs=2)
+
+    assert output == [
+        "-- pre-data",
+        "b1", "b2", "b3", "b4", "b5", "b6",
+        "g1",
+        "-- data",
+        "-- post-data",
+    ]
+
+
+def test_run_tables_plan():
+    output = run_fake_tables(Configuration(), jobs=2, dry_run=True)
+    assert output[0] == "Plan for 3 tasks with 2 jobs, largest first:"
+    assert "public.beta" in output[3]
+
+
+def test_run_tables_previous_stats(tmpdir):
+    path = tmpdir.join("stats.json")
+    path.write('{"tables": {"gamma": {"input_bytes": 999999, "rows": 1}}}')
+
+    output = run_fake_tables(
+        Configuration(), jobs=2, dry_run=True, previous_stats=str(path))
+    assert "public.gamma" in output[3]
+
+
+def test_run_tables_statistics(tmpdir):
+    config = Configuration()
+    config.sanitizers["beta.value"] = lambda value: value * 2
+    statistics = RunStatistics(sample_interval=None, profile_interval=None)
+    small_plan = functools.partial(plan, min_part_size=1)
+    with mock.patch.object(dump_tables, "plan", side_effect=small_plan), \
+            statistics.collect():
+        run_fake_tables(config, jobs=3)
+
+    # Statistics of the tasks are collected by the workers.
+    tables = statistics.get_tables()
+    assert sorted(tables) == ["alpha", "beta", "gamma"]
+    assert tables["beta"]["rows"] == 6
+    assert tables["beta"]["input_bytes"] == 18
+    assert tables["beta"]["output_bytes"] == 30
+    assert tables["alpha"]["rows"] == 2
+    assert all(table["wall_time"] > 0 for table in tables.values())
+
+    path = str(tmpdir.join("stats.json"))
+    statistics.save(path)
+    assert load_statistics(path)["beta"] == (18, 6)
+
+
+def test_assign_conditions():
+    tasks = plan(
+        FAKE_TABLES, jobs=1, min_part_size=1, parts_per_job=1000).tasks
+    tasks = assign_conditions(sys.modules[__name__], None, tasks)
+    beta_conditions = sorted(
+        (task.part, task.condition)
+        for task in tasks if task.table.table == "beta"
+    )
+    assert beta_conditions[0] == (0, "0:1")
+    assert all(
+        task.condition is None
+        for task in tasks if task.table.table != "beta"
+    )
+
+
+def test_assign_conditions_subset():
+    tasks = plan(
+        FAKE_TABLES, jobs=1, min_part_size=1, parts_per_job=1000).tasks
+    subset_conditions = {("public", "alpha"): "a", ("public", "beta"): "b"}
+    tasks = assign_conditions(
+        sys.modules[__name__], None, tasks, subset_conditions)
+    conditions = sorted(
+        (task.table.table, task.part, task.condition) for task in tasks)
+    assert conditions[0] == ("alpha", 0, "a")
+    assert conditions[1] == ("beta", 0, "(0:1) AND (b)")
+    assert conditions[-1] == ("gamma", 0, None)
+
+
+def test_run_tables_subset():
+    config = Configuration()
+    config.load_subset({"subset": {"alpha": {"where": "x"}}})
+    with mock.patch.object(
+        dump_tables,
+        "get_subset_conditions",
+        return_value={("public", "alpha"): "0:1"},
+    ) as mocked_get_subset_conditions:
+        output = run_fake_tables(config, jobs=2)
+    mocked_get_subset_conditions.assert_called_once_with(
+        sys.modules[__name__], mock.ANY, config, FAKE_TABLES)
+    assert output[:3] == ["-- pre-data", "a1", "b1"]
+
+    with pytest.raises(ValueError):
+        run_fake_tables(config, jobs=2, incremental="cache")
+
+
+def test_run_tables_incremental(tmpdir):
+    directory = str(tmpdir.join("cache"))
+    config = Configuration()
+    config.sanitizers["beta.value"] = lambda value: value.upper()
+    small_plan = functools.partial(plan, min_part_size=1)
+    expected = [
+        "-- pre-data",
+        "a1", "a2",
+        "B1", "B2", "B3", "B4", "B5", "B6",
+        "g1",
+        "-- data",
+        "-- post-data",
+    ]
+
+    with mock.patch.object(dump_tables, "plan", side_effect=small_plan):
+        output = run_fake_tables(config, jobs=3, incremental=directory)
+    assert output == expected
+    manifest = json.loads(tmpdir.join("cache", "manifest.json").read())
+    # Tables without fingerprints are not cached.
+    assert sorted(manifest["tables"]) == ["public.alpha", "public.beta"]
+    assert len(manifest["tables"]["public.beta"]["segments"]) > 1
+    secret = session.get_secret()
+    assert tmpdir.join("cache", "secret").read() == binascii.hexlify(
+        secret).decode("ascii")
+
+    # Unchanged tables are copied from the cache, even though their rows
+    # would be different now.
+    changed_rows = {"alpha": ["x1"], "beta": ["y1"], "gamma": ["z1"]}
+    changed_fingerprints = {("public", "beta"): "beta-2"}
+    with mock.patch.dict(FAKE_ROWS, changed_rows), \
+            mock.patch.dict(FAKE_FINGERPRINTS, changed_fingerprints):
+        session.reset()
+        assert run_fake_tables(config, jobs=2, incremental=directory) == [
+            "-- pre-data", "a1", "a2", "Y1", "z1", "-- data", "-- post-data"]
+        assert session.get_secret() == secret
+    manifest = json.loads(tmpdir.join("cache", "manifest.json").read())
+    assert manifest["tables"]["public.beta"]["fingerprint"] == "beta-2"
+    segments = set(
+        name
+        for entry in manifest["tables"].values()
+        for name in entry["segments"]
+    )
+    assert set(tmpdir.join("cache", "segments").listdir()) == set(
+        tmpdir.join("cache", "segments", name) for name in segments)
+
+    # Changing the configuration invalidates the cache.
+    config.sanitizers["alpha.value"] = lambda value: value.upper()
+    with mock.patch.dict(FAKE_ROWS, changed_rows):
+        assert run_fake_tables(config, jobs=2, incremental=directory) == [
+            "-- pre-data", "X1", "Y1", "z1", "-- data", "-- post-data"]
+
+
+def test_run_tables_load_data(tmpdir):
+    output = FakeDataDirectory(str(tmpdir))
+    config = Configuration()
+    config.sanitizers["beta.value"] = lambda value: value.upper()
+    small_plan = functools.partial(plan, min_part_size=1)
+    with mock.patch.object(dump_tables, "plan", side_effect=small_plan):
+        run_tables(
+            db_module=sys.modules[__name__],
+            url=urlparse.urlparse("postgres://localhost/test"),
+            output=output,
+            config=config,
+            jobs=3,
+        )
+
+    assert output.lines == ["-- pre-data", "-- data", "-- post-data"]
+    assert output.data_files[0] == ("alpha", ("value",), "a1\na2\n")
+    assert [table for (table, _columns, _data) in output.data_files[1:-1]] == [
+        "beta"] * (len(output.data_files) - 2)
+    assert "".join(
+        data for (_table, _columns, data) in output.data_files[1:-1]
+    ) == "B1\nB2\nB3\nB4\nB5\nB6\n"
+    # The data files are moved from a temporary directory of the output.
+    assert tmpdir.listdir() == []
+
+
+def test_run_tables_resume():
+    output = FakeResumedDirectory([("public", "beta")])
+    config = Configuration()
+    config.sanitizers["beta.value"] = lambda value: value.upper()
+    run_tables(
+        db_module=sys.modules[__name__],
+        url=urlparse.urlparse("postgres://localhost/test"),
+        output=output,
+        config=config,
+        jobs=2,
+    )
+
+    assert output.fingerprints == FAKE_FINGERPRINTS
+    # Completed tables are not dumped again, but take their place in the
+    # catalog order.
+    assert output.lines == [
+        "-- pre-data",
+        "a1", "a2",
+        "-- resumed public.beta",
+        "g1",
+        "-- data",
+        "-- post-data",
+    ]
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import pytest
+
+from ..config import Configuration
+from ..dump import CHUNK_DATA, CHUNK_TEXT, Chunk
+from ..engine import SerialEngine, get_engine, get_worker_count
+from ..engine.process import ProcessEngine
+
+CHUNKS = [
+    Chunk(CHUNK_TEXT, None, None, ["-- Header"]),
+    Chunk(CHUNK_DATA, "test", ("id", "notes"), ["1\tfoo", "2\tbar"]),
+    Chunk(CHUNK_DATA, "other", ("id", "notes"), ["3\tbaz"]),
+    Chunk(CHUNK_TEXT, None, None, ["-- Footer"]),
+]
+
+
+def test_get_engine():
+    assert isinstance(get_engine("serial"), SerialEngine)
+    engine = get_engine("process", workers=3)
+    assert isinstance(engine, ProcessEngine)
+    assert engine.workers == 3
+
+
+def test_get_engine_unknown():
+    with pytest.raises(ValueError) as excinfo:
+        get_engine("unknown")
+    assert str(excinfo.value) == "Unsupported engine: 'unknown'"
+
+
+def test_get_worker_count():
+    assert get_worker_count(2) == 2
+    assert get_worker_count() >= 1
+    with pytest.raises(ValueError):
+        get_worker_count(0)
+
+
+def test_serial_engine():
+    config = Configuration()
+    config.sanitizers["test.notes"] = lambda value: value.upper()
+
+    output = SerialEngine().sanitize(
+        backend="database_sanitizer.dump.postgres",
+        chunks=iter(CHUNKS),
+        config=config,
+    )
+
+    assert list(output) == [
+        "-- Header",
+        "1\tFOO",
+        "2\tBAR",
+        "3\tbaz",
+        "-- Footer",
+    ]
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+
+import pytest
+
+from .. import session
+from ..config import Configuration
+from ..dump import mysql as dump_mysql
+from ..dump import postgres as dump_postgres
+from ..engine.hybrid import CostClassifier, HybridEngine
+from ..sanitizers.string import sanitize_zfill
+from ..sanitizers.user import sanitize_email
+from .test_engine_process import MOCK_MYSQLDUMP_OUTPUT, MOCK_PG_DUMP_OUTPUT
+
+
+def setup_module():
+    session.reset(b'not-so-secret-key')
+
+
+def get_config(expensive_columns=()):
+    config = Configuration()
+    config.sanitizers["test.email"] = sanitize_email
+    config.sanitizers["test.notes"] = sanitize_zfill
+    config.expensive_columns = set(expensive_columns)
+    return config
+
+
+@pytest.mark.parametrize("expensive_columns,cost_threshold", [
+    (["test.email"], 1.0),  # Declared
+    ([], 0.0),  # Measured, everything is expensive
+    ([], 1.0),  # Measured, nothing is expensive
+])
+@pytest.mark.parametrize("backend,data", [
+    (dump_postgres, MOCK_PG_DUMP_OUTPUT),
+    (dump_mysql, MOCK_MYSQLDUMP_OUTPUT),
+])
+def test_output_matches_serial_engine(
+        backend, data, expensive_columns, cost_threshold):
+    config = get_config(expensive_columns)
+    expected = list(backend.sanitize_from_stream(io.BytesIO(data), config))
+
+    engine = HybridEngine(
+        workers=2, cost_threshold=cost_threshold, sample_size=10)
+    chunks = backend.iter_chunks(
+        (line.rstrip("\n") for line in data.decode("utf-8").splitlines()),
+        config,
+        chunk_size=100,
+    )
+    output = list(engine.sanitize(backend.__name__, chunks, config))
+
+    assert output == expected
+
+
+def test_worker_error_is_raised():
+    def failing_sanitizer(value):
+        raise ValueError("Sanitation failed")
+
+    config = Configuration()
+    config.sanitizers["test.notes"] = failing_sanitizer
+    config.expensive_columns = {"test.notes"}
+
+    engine = HybridEngine(workers=2)
+    with pytest.raises(ValueError) as excinfo:
+        list(dump_postgres.sanitize_from_stream(
+            io.BytesIO(MOCK_PG_DUMP_OUTPUT), config, engine=engine))
+    assert str(excinfo.value) == "Sanitation failed"
+
+
+def test_cost_classifier():
+    classifier = CostClassifier(
+        declared=["a.declared"], threshold=0.001, sample_size=10)
+
+    assert classifier.is_expensive("a.declared") is True
+    assert classifier.is_expensive("a.slow") is None
+
+    classifier.record("a.slow", 5, 0.1)
+    assert classifier.is_expensive("a.slow") is None
+    classifier.record("a.slow", 5, 0.1)
+    assert classifier.is_expensive("a.slow") is True
+
+    classifier.record("a.fast", 10, 0.001)
+    assert classifier.is_expensive("a.fast") is False
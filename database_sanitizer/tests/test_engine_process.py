@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+
+import pytest
+
+from .. import session
+from ..config import Configuration
+from ..dump import CHUNK_DATA, CHUNK_DATA_END, CHUNK_DATA_START, Chunk
+from ..dump import mysql as dump_mysql
+from ..dump import postgres as dump_postgres
+from ..engine import shm
+from ..engine.process import ProcessEngine
+from ..sanitizers.user import sanitize_email
+
+pytestmark = pytest.mark.skipif(
+    shm.shared_memory is None,
+    reason="Shared memory requires Python 3.8 or newer",
+)
+
+MOCK_PG_DUMP_OUTPUT = "\n".join(
+    ["--- Fake PostgreSQL database dump", ""] +
+    [
+        'COPY "public"."test" ("id", "email", "notes") FROM stdin;',
+    ] + [
+        "%d\tuser%d@example.com\tNotes \\\\ %d" % (i, i, i)
+        for i in range(500)
+    ] + [
+        "\\.",
+        "",
+        'COPY "public"."other" ("id") FROM stdin;',
+        "1",
+        "\\.",
+        "",
+        "--- Final line",
+    ]
+).encode("utf-8")
+
+MOCK_MYSQLDUMP_OUTPUT = "\n".join(
+    ["--- Fake MySQL database dump", ""] + [
+        "INSERT INTO `test` (`id`, `email`, `notes`) VALUES %s;" % (
+            ",".join(
+                "(%d,'user%d@example.com','Notes %d')" % (i, i, i)
+                for i in range(j * 50, (j + 1) * 50)
+            ),
+        )
+        for j in range(10)
+    ] + ["", "--- Final line"]
+).encode("utf-8")
+
+
+def setup_module():
+    session.reset(b'not-so-secret-key')
+
+
+def get_config():
+    config = Configuration()
+    config.sanitizers["test.email"] = sanitize_email
+    return config
+
+
+@pytest.mark.parametrize("slot_size", [1024 * 1024, 256, 16])
+@pytest.mark.parametrize("backend,data", [
+    (dump_postgres, MOCK_PG_DUMP_OUTPUT),
+    (dump_mysql, MOCK_MYSQLDUMP_OUTPUT),
+])
+def test_output_matches_serial_engine(backend, data, slot_size):
+    config = get_config()
+    expected = list(backend.sanitize_from_stream(io.BytesIO(data), config))
+
+    engine = ProcessEngine(workers=2, slot_size=slot_size)
+    output = list(backend.sanitize_from_stream(
+        io.BytesIO(data), config, engine=engine))
+
+    assert output == expected
+    assert output != data.decode("utf-8").splitlines()
+
+
+def test_worker_error_is_raised():
+    def failing_sanitizer(value):
+        raise ValueError("Sanitation failed")
+
+    config = Configuration()
+    config.sanitizers["test.notes"] = failing_sanitizer
+
+    engine = ProcessEngine(workers=2)
+    with pytest.raises(ValueError) as excinfo:
+        list(dump_postgres.sanitize_from_stream(
+            io.BytesIO(MOCK_PG_DUMP_OUTPUT), config, engine=engine))
+    assert str(excinfo.value) == "Sanitation failed"
+
+
+def test_empty_data_chunk_produces_no_lines():
+    table = "test"
+    columns = ("id", "email", "notes")
+    chunks = [
+        Chunk(CHUNK_DATA_START, table, columns, ["COPY ..."]),
+        Chunk(CHUNK_DATA, table, columns, []),
+        Chunk(CHUNK_DATA, table, columns, ["1\tuser@example.com\tNotes"]),
+        Chunk(CHUNK_DATA, table, columns, []),
+        Chunk(CHUNK_DATA_END, table, columns, ["\\."]),
+    ]
+
+    engine = ProcessEngine(workers=1)
+    output = list(engine.sanitize(
+        "database_sanitizer.dump.postgres", chunks, get_config()))
+
+    assert len(output) == 3
+    assert output[0] == "COPY ..."
+    assert output[1].startswith("1\t")
+    assert output[1] != "1\tuser@example.com\tNotes"
+    assert output[2] == "\\."
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import pickle
+
+import pytest
+
+from ..engine import shm
+from ..engine.shm import SharedRing
+
+pytestmark = pytest.mark.skipif(
+    shm.shared_memory is None,
+    reason="Shared memory requires Python 3.8 or newer",
+)
+
+
+def test_write_and_read():
+    ring = SharedRing(slot_count=3, slot_size=8)
+    try:
+        assert ring.write(0, b"first") == 5
+        assert ring.write(2, b"12345678") == 8
+        assert ring.read(0, 5) == b"first"
+        assert ring.read(2, 8) == b"12345678"
+        assert ring.read(1, 0) == b""
+    finally:
+        ring.close()
+
+
+def test_invalid_access():
+    ring = SharedRing(slot_count=2, slot_size=4)
+    try:
+        with pytest.raises(ValueError):
+            ring.write(0, b"too long")
+        with pytest.raises(IndexError):
+            ring.write(2, b"x")
+        with pytest.raises(ValueError):
+            ring.read(0, 5)
+    finally:
+        ring.close()
+
+
+def test_pickled_ring_attaches_to_same_memory():
+    ring = SharedRing(slot_count=2, slot_size=4)
+    try:
+        attached = pickle.loads(pickle.dumps(ring))
+        assert not attached.owner
+        attached.write(1, b"data")
+        assert ring.read(1, 4) == b"data"
+        attached.close()
+    finally:
+        ring.close()
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+
+import mock
+import pytest
+from six.moves.urllib import parse as urlparse
+
+from .. import __main__, governor
+from ..dump import mysql as dump_mysql
+from ..dump import postgres as dump_postgres
+from ..dump import run
+from ..engine import init_worker
+from ..governor import SourceGovernor, TokenBucket
+from ..scheduler import TableSize, Task
+
+PG_DUMP_OUTPUT = "\n".join([
+    "--- Fake PostgreSQL database dump",
+    'COPY "public"."test" ("id", "notes") FROM stdin;',
+    "1\tTest data 1",
+    "2\tTest data 2",
+    "\\.",
+    "--- Final line after `COPY` statement",
+])
+
+MYSQLDUMP_OUTPUT = "\n".join([
+    "--- Fake MySQL database dump",
+    "INSERT INTO `test` (`id`, `notes`) VALUES "
+    "(1,'Test data 1'),(2,'Test data 2');",
+    "INSERT INTO `test` (`id`, `notes`) VALUES (3,'Test data 3');",
+    "--- Final line",
+])
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(100, clock=clock, sleep=clock.sleep)
+    # A second of the rate is available at once.
+    assert bucket.consume(100) == 0
+    assert bucket.consume(50) == pytest.approx(0.5)
+    assert bucket.tokens == pytest.approx(-50)
+    # The debt is refilled by the time the sleep returns.
+    assert bucket.consume(25) == pytest.approx(0.25)
+    clock.now += 10
+    assert bucket.consume(100) == 0
+    # Tokens are refilled only up to the capacity.
+    assert bucket.tokens == pytest.approx(0)
+
+
+def test_token_bucket_factor():
+    clock = FakeClock()
+    bucket = TokenBucket(100, clock=clock, sleep=clock.sleep)
+    bucket.consume(100)
+    assert bucket.consume(10, factor=0.5) == pytest.approx(0.2)
+
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+def test_throttle_lines_postgres():
+    source = SourceGovernor(rows_per_second=1000, bytes_per_second=10000)
+    with mock.patch.object(source, "throttle") as throttle:
+        lines = list(source.throttle_lines(
+            PG_DUMP_OUTPUT.split("\n"), dump_postgres.__name__))
+    assert lines == PG_DUMP_OUTPUT.split("\n")
+    throttle.assert_called_once_with(2, len(PG_DUMP_OUTPUT) + 1)
+
+
+def test_throttle_lines_mysql():
+    source = SourceGovernor(rows_per_second=1000)
+    with mock.patch.object(source, "throttle") as throttle, \
+            mock.patch.object(governor, "THROTTLE_BATCH_SIZE", 1):
+        lines = list(source.throttle_lines(
+            MYSQLDUMP_OUTPUT.split("\n"), dump_mysql.__name__))
+    assert lines == MYSQLDUMP_OUTPUT.split("\n")
+    assert [call[0][0] for call in throttle.call_args_list] == [0, 2, 1, 0, 0]
+
+
+def test_throttle():
+    clock = FakeClock()
+    source = SourceGovernor(
+        rows_per_second=10, bytes_per_second=1000,
+        clock=clock, sleep=clock.sleep)
+    source.throttle(10, 100)
+    assert clock.sleeps == []
+    source.throttle(5, 0)
+    assert clock.sleeps == [pytest.approx(0.5)]
+    source.factor.value = 0.5
+    source.throttle(0, 1500)
+    assert clock.sleeps[1:] == [pytest.approx(2.0)]
+
+
+def test_wrap_command():
+    assert SourceGovernor().wrap_command(("pg_dump", "test")) == (
+        "pg_dump", "test")
+    assert SourceGovernor(nice=10, ionice="idle").wrap_command(
+        ("pg_dump", "test")) == [
+            "ionice", "-c", "3", "nice", "-n", "10", "pg_dump", "test"]
+    assert SourceGovernor(ionice="best-effort").wrap_command(
+        ["mysqldump"]) == ["ionice", "-c", "2", "-n", "7", "mysqldump"]
+
+
+def test_limit_connections():
+    assert SourceGovernor().limit_connections(8) == 8
+    assert SourceGovernor(max_connections=2).limit_connections(8) == 2
+    assert SourceGovernor(max_connections=2).limit_connections(1) == 1
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"max_connections": 0},
+    {"ionice": "realtime"},
+    {"probe": "echo 1", "rows_per_second": 10},
+    {"probe": "echo 1", "probe_threshold": 1},
+    {"probe_interval": 0},
+])
+def test_invalid_arguments(kwargs):
+    with pytest.raises(ValueError):
+        SourceGovernor(**kwargs)
+
+
+def test_probe_once():
+    source = SourceGovernor(
+        rows_per_second=10, probe="echo lag; echo 2.5", probe_threshold=1)
+    assert source.probe_once() == 2.5
+    assert source.factor.value == 0.5
+    source.probe = "echo 0.5"
+    assert source.probe_once() == 0.5
+    assert source.factor.value == pytest.approx(0.6)
+
+    # Failures of the probe are considered overload.
+    source.probe = "exit 1"
+    assert source.probe_once() is None
+    assert source.factor.value == pytest.approx(0.3)
+    source.probe = "echo fine"
+    for _attempt in range(10):
+        source.probe_once()
+    assert source.factor.value == governor.MIN_RATE_FACTOR
+
+    source.probe = "echo 0"
+    for _attempt in range(20):
+        source.probe_once()
+    assert source.factor.value == 1.0
+
+
+def test_govern():
+    source = SourceGovernor(
+        nice=5, rows_per_second=10, probe="echo 10", probe_threshold=1,
+        probe_interval=60)
+    assert governor.get_governor() is None
+    assert governor.throttle_lines(
+        ["line"], dump_postgres.__name__) == ["line"]
+    assert governor.wrap_command(["pg_dump"]) == ["pg_dump"]
+    assert governor.limit_connections(4) == 4
+    with source.govern():
+        assert governor.get_governor() is source
+        assert governor.wrap_command(["pg_dump"]) == [
+            "nice", "-n", "5", "pg_dump"]
+    # The probe is run immediately, and stopped at the end.
+    assert source.factor.value == 0.5
+    assert governor.get_governor() is None
+
+
+def test_init_worker():
+    source = SourceGovernor(max_connections=1)
+    try:
+        init_worker(None, b"secret", source)
+        assert governor.get_governor() is source
+    finally:
+        governor.use_governor(None)
+
+
+def test_sanitize_table_governed():
+    url = urlparse.urlparse("postgres://localhost/test")
+    task = Task(
+        table=TableSize("public", "test", 0, 0, 1),
+        part=0,
+        parts=1,
+        size=0,
+        condition=None,
+    )
+    mocked_process = mock.Mock(stdout=io.BytesIO(b"1\ta\n2\tb\n"))
+    mocked_process.wait.return_value = 0
+    source = SourceGovernor(ionice="idle", rows_per_second=1000)
+    columns = [("id",), ("notes",)]
+    with mock.patch.object(
+        dump_postgres, "run_psql_query", return_value=columns,
+    ), mock.patch(
+        "subprocess.Popen", return_value=mocked_process,
+    ) as popen, mock.patch.object(
+        source, "throttle",
+    ) as throttle, source.govern():
+        output = list(dump_postgres.sanitize_table(url, None, task, None))
+
+    assert len(output) == 4
+    assert popen.call_args[0][0][:4] == ["ionice", "-c", "3", "psql"]
+    assert throttle.call_args[0][0] == 2
+
+
+def test_run_governed():
+    source = SourceGovernor(bytes_per_second=1000)
+    with mock.patch.object(dump_postgres, "sanitize") as sanitize:
+        sanitize.side_effect = lambda **kwargs: iter([governor.get_governor()])
+        with mock.patch("database_sanitizer.dump.write_lines") as write_lines:
+            run(
+                "postgres://localhost/test", io.StringIO(), None,
+                governor=source)
+    assert list(write_lines.call_args[0][1]) == [source]
+    assert governor.get_governor() is None
+
+
+@mock.patch.object(__main__, "run")
+def test_main_with_governor(mocked_run):
+    __main__.main([
+        "SANI", "--max-connections", "2", "--max-rows-per-second", "5000",
+        "--max-bytes-per-second", "1000000", "--probe", "echo 0",
+        "--probe-threshold", "10", "--probe-interval", "30",
+        "postgres://localhost/test",
+    ])
+    source = mocked_run.call_args[1]["governor"]
+    assert source.max_connections == 2
+    assert source.row_bucket.rate == 5000
+    assert source.byte_bucket.rate == 1000000
+    assert source.probe == "echo 0"
+    assert source.probe_threshold == 10
+    assert source.probe_interval == 30
+
+    __main__.main(["SANI", "postgres://localhost/test"])
+    assert mocked_run.call_args[1]["governor"] is None
+
+
+@pytest.mark.parametrize("args,error", [
+    (["--max-connections", "0"], "--max-connections: must be positive"),
+    (["--max-rows-per-second", "0"],
+     "--max-rows-per-second: must be positive"),
+    (["--max-bytes-per-second", "-1"],
+     "--max-bytes-per-second: must be positive"),
+    (["--nice", "20"], "--nice: must be between 0 and 19"),
+    (["--probe", "echo 0", "--max-rows-per-second", "10"],
+     "--probe: requires --probe-threshold"),
+    (["--probe", "echo 0", "--probe-threshold", "1"],
+     "--probe: requires --max-rows-per-second or --max-bytes-per-second"),
+    (["--probe-threshold", "1"], "--probe-threshold: requires --probe"),
+])
+@mock.patch.object(__main__, "run")
+def test_main_with_invalid_governor(mocked_run, capsys, args, error):
+    with pytest.raises(SystemExit):
+        __main__.main(["SANI"] + args + ["postgres://localhost/test"])
+    assert error in capsys.readouterr().err
+    assert not mocked_run.called
+
+
+@mock.patch.object(__main__, "run")
+def test_main_with_missing_command(mocked_run, capsys):
+    with mock.patch.object(
+        __main__, "is_command_available", return_value=False,
+    ):
+        with pytest.raises(SystemExit):
+            __main__.main([
+                "SANI", "--ionice", "idle", "postgres://localhost/test"])
+    assert "--ionice: command not found" in capsys.readouterr().err
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+
+import mock
+import pytest
+
+from .. import __main__
+from ..directory import load_manifest, verify_directory
+from ..load_data import LoadDataWriter
+
+MYSQLDUMP_OUTPUT = """
+/*!40101 SET NAMES utf8mb4 */;
+CREATE TABLE `test` (
+  `id` int(11) NOT NULL,
+  `notes` varchar(255) DEFAULT NULL
+);
+LOCK TABLES `test` WRITE;
+INSERT INTO `test` (`id`, `notes`) VALUES (1,'first\\tline\\nsecond'),(2,NULL);
+INSERT INTO `test` (`id`, `notes`) VALUES (3,'third');
+UNLOCK TABLES;
+/*!50003 SET @saved_sql_mode       = @@sql_mode */ ;
+/*!50003 SET sql_mode              = 'STRICT_TRANS_TABLES' */ ;
+DELIMITER ;;
+/*!50003 CREATE*/ /*!50003 TRIGGER `test_insert` BEFORE INSERT ON `test` FOR EACH ROW BEGIN
+SET NEW.notes = 'x';
+END */;;
+DELIMITER ;
+/*!50003 SET sql_mode              = @saved_sql_mode */ ;
+CREATE TABLE `test 2` (`id` int(11) NOT NULL);
+INSERT INTO `test 2` (`id`) VALUES (4);
+DELIMITER ;;
+CREATE PROCEDURE `noop`() BEGIN
+SELECT 1;
+END ;;
+DELIMITER ;
+""".lstrip()
+
+
+def test_load_data_writer(tmpdir):
+    directory = tmpdir.join("output")
+    writer = LoadDataWriter(str(directory))
+    writer.write_lines(MYSQLDUMP_OUTPUT.splitlines())
+    writer.close()
+
+    assert sorted(path.basename for path in directory.listdir()) == [
+        "load.sql", "manifest.json", "post-data.sql", "schema.sql",
+        "test.tsv", "test_2.tsv"]
+    assert directory.join("test.tsv").read() == (
+        "1\tfirst\\tline\\nsecond\n2\t\\N\n3\tthird\n")
+    assert directory.join("test_2.tsv").read() == "4\n"
+
+    schema = directory.join("schema.sql").read()
+    assert "CREATE TABLE `test 2`" in schema
+    assert "CREATE PROCEDURE `noop`" in schema
+    assert "INSERT INTO" not in schema
+    assert "TRIGGER" not in schema
+    post_data = directory.join("post-data.sql").read().splitlines()
+    assert post_data[0] == MYSQLDUMP_OUTPUT.splitlines()[9]
+    assert post_data[3].startswith("/*!50003 CREATE*/ /*!50003 TRIGGER")
+    assert post_data[-1] == (
+        "/*!50003 SET sql_mode              = @saved_sql_mode */ ;")
+
+    load_script = directory.join("load.sql").read().splitlines()
+    assert load_script[2] == "SOURCE schema.sql;"
+    assert load_script[5] == (
+        "LOAD DATA LOCAL INFILE 'test.tsv' INTO TABLE `test` CHARACTER SET "
+        "utf8mb4 FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES "
+        "TERMINATED BY '\\n' (`id`, `notes`);")
+    assert load_script[6].startswith(
+        "LOAD DATA LOCAL INFILE 'test_2.tsv' INTO TABLE `test 2`")
+    assert load_script[-1] == "SOURCE post-data.sql;"
+
+    manifest = load_manifest(str(directory))
+    assert (manifest["format"], manifest["dialect"]) == ("tsv", "mysql")
+    assert manifest["pre_data"]["file"] == "schema.sql"
+    assert [
+        (table["table"], table["columns"]) for table in manifest["tables"]
+    ] == [("test", ["id", "notes"]), ("test 2", ["id"])]
+    assert manifest["tables"][0]["files"][0]["rows"] == 3
+    verify_directory(str(directory), manifest)
+
+
+def test_load_data_writer_shards(tmpdir):
+    directory = tmpdir.join("output")
+    writer = LoadDataWriter(str(directory), shard_size=1)
+    writer.write_lines(MYSQLDUMP_OUTPUT.splitlines())
+    writer.close()
+
+    assert directory.join("test.tsv").read() == (
+        "1\tfirst\\tline\\nsecond\n2\t\\N\n")
+    assert directory.join("test.2.tsv").read() == "3\tthird\n"
+    assert "'test.2.tsv'" in directory.join("load.sql").read()
+
+
+def test_load_data_writer_partial_lines(tmpdir):
+    directory = tmpdir.join("output")
+    writer = LoadDataWriter(str(directory))
+    for position in range(0, len(MYSQLDUMP_OUTPUT), 5):
+        writer.write(MYSQLDUMP_OUTPUT[position:position + 5])
+    writer.close()
+    assert directory.join("test.tsv").read() == (
+        "1\tfirst\\tline\\nsecond\n2\t\\N\n3\tthird\n")
+
+
+def test_load_data_writer_add_data_file(tmpdir):
+    directory = tmpdir.join("output")
+    writer = LoadDataWriter(str(directory))
+    for (number, columns) in ((1, ("id",)), (2, None), (3, ("id",))):
+        path = directory.join("part-%d" % (number,))
+        path.write("%d\n" % (number,))
+        writer.add_data_file("test", columns, str(path))
+    writer.close()
+
+    assert sorted(path.basename for path in directory.listdir()) == [
+        "load.sql", "manifest.json", "post-data.sql", "schema.sql",
+        "test.2.tsv", "test.tsv"]
+    assert directory.join("test.2.tsv").read() == "3\n"
+    manifest = load_manifest(str(directory))
+    assert [
+        data_file["rows"] for data_file in manifest["tables"][0]["files"]
+    ] == [1, 1]
+    verify_directory(str(directory), manifest)
+    assert "'test.2.tsv'" in directory.join("load.sql").read()
+
+
+def test_load_data_writer_non_empty_directory(tmpdir):
+    tmpdir.join("existing").write("")
+    with pytest.raises(ValueError):
+        LoadDataWriter(str(tmpdir))
+
+
+def test_main_with_tsv_output(tmpdir):
+    directory = tmpdir.join("output")
+    process = mock.Mock(stdout=io.BytesIO(MYSQLDUMP_OUTPUT.encode("utf-8")))
+    with mock.patch("subprocess.Popen", return_value=process):
+        __main__.main([
+            "SANI", "--output-format", "tsv", "-o", str(directory),
+            "mysql://localhost/test",
+        ])
+    assert directory.join("test_2.tsv").read() == "4\n"
+    assert directory.join("load.sql").check()
+
+
+@pytest.mark.parametrize("args,error", [
+    (["mysql://localhost/test"], "tsv requires --output"),
+    (["-o", "output", "postgres://localhost/test"],
+     "supported only with MySQL"),
+    (["-o", "output", "--compress", "gzip", "mysql://localhost/test"],
+     "cannot be combined"),
+    (["-o", "output", "--incremental", "cache", "mysql://localhost/test"],
+     "cannot be combined"),
+])
+@mock.patch.object(__main__, "run")
+def test_main_with_invalid_tsv_output(mocked_run, capsys, args, error):
+    with pytest.raises(SystemExit):
+        __main__.main(["SANI", "--output-format", "tsv"] + args)
+    assert error in capsys.readouterr().err
+    assert not mocked_run.called
+
+
+def test_load_data_writer_resume(tmpdir):
+    identity = {
+        "source": "mysql://localhost/test",
+        "config": "c",
+        "secret": "s",
+    }
+    expected = tmpdir.join("expected")
+    writer = LoadDataWriter(str(expected), identity=identity)
+    writer.write_lines(MYSQLDUMP_OUTPUT.splitlines())
+    writer.close()
+
+    directory = tmpdir.join("output")
+    writer = LoadDataWriter(str(directory), identity=identity)
+    writer.write_lines(MYSQLDUMP_OUTPUT.splitlines()[:19])
+    writer.abort()
+
+    writer = LoadDataWriter(str(directory), identity=identity, resume=True)
+    assert writer.get_completed_tables(None) == [(None, "test")]
+    writer.write_lines(
+        line.replace("third", "unsanitized")
+        for line in MYSQLDUMP_OUTPUT.splitlines())
+    writer.close()
+    assert sorted(path.basename for path in directory.listdir()) == sorted(
+        path.basename for path in expected.listdir())
+    for path in expected.listdir():
+        assert directory.join(path.basename).read() == path.read()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import subprocess
+import threading
+
+import mock
+import pytest
+from six.moves.urllib import parse as urlparse
+
+from .. import __main__
+from ..loader import PostgresLoader
+
+TARGET_URL = urlparse.urlparse("postgres://localhost/target")
+
+DUMP = """
+SET statement_timeout = 0;
+SET client_encoding = 'UTF8';
+SELECT pg_catalog.set_config('search_path', '', false);
+SET default_tablespace = '';
+CREATE TABLE "public"."a" ("id" integer);
+SET default_tablespace = 'other';
+CREATE TABLE "public"."b" ("id" integer);
+COPY "public"."a" ("id") FROM stdin;
+1
+2
+\\.
+SELECT pg_catalog.setval('"public"."a_id_seq"', 2, true);
+COPY "public"."b" ("id") FROM stdin;
+3
+\\.
+CREATE INDEX "a_id" ON "public"."a" USING "btree" ("id");
+""".strip()
+
+SETTINGS = (
+    "SET statement_timeout = 0;\n"
+    "SET client_encoding = 'UTF8';\n"
+    "SELECT pg_catalog.set_config('search_path', '', false);\n"
+)
+
+
+class FakeStdin(object):
+    def __init__(self, process):
+        self.process = process
+        self.chunks = []
+
+    def write(self, data):
+        if self.process.broken:
+            raise IOError("Broken pipe")
+        self.chunks.append(data)
+
+    def close(self):
+        self.process.events.append(("close", self.process.index))
+
+
+class FakeProcess(object):
+    def __init__(self, events, index, returncode=0):
+        self.events = events
+        self.index = index
+        self.returncode = returncode
+        self.broken = False
+        self.killed = False
+        self.stdin = FakeStdin(self)
+
+    @property
+    def data(self):
+        return b"".join(self.stdin.chunks).decode("utf-8")
+
+    def poll(self):
+        return None
+
+    def kill(self):
+        self.killed = True
+        self.broken = True
+
+    def wait(self):
+        return -9 if self.killed else self.returncode
+
+
+def patch_psql(returncodes=None):
+    processes = []
+    events = []
+    lock = threading.Lock()
+
+    def popen(args, **kwargs):
+        assert args[0] == "psql"
+        assert "postgres://localhost/target" in args
+        with lock:
+            index = len(processes)
+            events.append(("popen", index))
+            process = FakeProcess(
+                events, index, (returncodes or {}).get(index, 0))
+            processes.append(process)
+        return process
+
+    return (
+        mock.patch("subprocess.Popen", side_effect=popen), processes, events)
+
+
+def test_loader():
+    (patcher, processes, events) = patch_psql()
+    with patcher:
+        loader = PostgresLoader(
+            TARGET_URL, jobs=1, buffer_size=1, buffer_count=1)
+        loader.write_lines(DUMP.splitlines())
+        loader.close()
+
+    assert len(processes) == 4
+    (schema, load_a, load_b, post_data) = processes
+    assert schema.data == "\n".join(DUMP.splitlines()[:7]) + "\n"
+    assert load_a.data == (
+        SETTINGS + "SET default_tablespace = 'other';\n"
+        'COPY "public"."a" ("id") FROM stdin;\n1\n2\n\\.\n')
+    assert load_b.data.endswith(
+        'COPY "public"."b" ("id") FROM stdin;\n3\n\\.\n')
+    assert post_data.data == (
+        SETTINGS + "SET default_tablespace = 'other';\n"
+        "SELECT pg_catalog.setval('\"public\".\"a_id_seq\"', 2, true);\n"
+        'CREATE INDEX "a_id" ON "public"."a" USING "btree" ("id");\n')
+
+    # Schema is created before the data is loaded, the loads wait for a free
+    # loader and the indexes are created after all of the data is loaded.
+    assert events == [
+        ("popen", 0), ("close", 0),
+        ("popen", 1), ("close", 1),
+        ("popen", 2), ("close", 2),
+        ("popen", 3), ("close", 3),
+    ]
+
+
+def test_loader_write_partial_lines():
+    (patcher, processes, events) = patch_psql()
+    with patcher:
+        loader = PostgresLoader(TARGET_URL)
+        text = DUMP + "\n"
+        for position in range(0, len(text), 7):
+            loader.write(text[position:position + 7])
+        loader.close()
+    assert processes[1].data.endswith(
+        'COPY "public"."a" ("id") FROM stdin;\n1\n2\n\\.\n')
+    assert processes[-1].data.endswith(
+        'CREATE INDEX "a_id" ON "public"."a" USING "btree" ("id");\n')
+
+
+def test_loader_write_blocks_of_lines():
+    (patcher, processes, events) = patch_psql()
+    with patcher:
+        # A single loader keeps the order of the processes deterministic.
+        loader = PostgresLoader(TARGET_URL, jobs=1)
+        loader.write_lines(["\n".join(DUMP.splitlines()[:8]), "\n".join(
+            DUMP.splitlines()[8:])])
+        loader.close()
+    assert processes[1].data.endswith(
+        'COPY "public"."a" ("id") FROM stdin;\n1\n2\n\\.\n')
+    assert len(processes) == 4
+
+
+def test_loader_without_data():
+    (patcher, processes, events) = patch_psql()
+    with patcher:
+        loader = PostgresLoader(TARGET_URL)
+        loader.write_lines(["CREATE SCHEMA \"test\";"])
+        loader.close()
+    assert [process.data for process in processes] == [
+        "CREATE SCHEMA \"test\";\n"]
+
+
+def test_loader_failure():
+    (patcher, processes, events) = patch_psql(returncodes={1: 1})
+    with patcher:
+        loader = PostgresLoader(TARGET_URL, jobs=1)
+        loader.write_lines(DUMP.splitlines()[:11])
+        with pytest.raises(subprocess.CalledProcessError):
+            loader.write_lines(DUMP.splitlines()[11:])
+            loader.close()
+    # Indexes are not created after a failure.
+    assert not any("CREATE INDEX" in process.data for process in processes)
+
+
+def test_loader_abort():
+    (patcher, processes, events) = patch_psql()
+    with patcher:
+        loader = PostgresLoader(TARGET_URL)
+        loader.write_lines(DUMP.splitlines()[:9])
+        loader.abort()
+        loader.close()
+    # Table data is not committed.
+    assert not any(process.data.endswith("\\.\n") for process in processes)
+    assert not any(
+        process.index > 0 and not process.killed for process in processes)
+
+
+def test_invalid_loader():
+    with pytest.raises(ValueError):
+        PostgresLoader(TARGET_URL, jobs=0)
+
+
+@mock.patch.object(__main__, "run")
+@mock.patch.object(__main__, "PostgresLoader")
+def test_main_with_target(mocked_loader, mocked_run):
+    __main__.main([
+        "SANI",
+        "--target", "postgres://localhost/target",
+        "--target-jobs", "2",
+        "postgres://localhost/source",
+    ])
+    (loader_args, loader_kwargs) = mocked_loader.call_args
+    assert loader_args == (TARGET_URL,)
+    assert loader_kwargs["jobs"] == 2
+    assert mocked_run.call_args[1]["output"] == mocked_loader.return_value
+    assert mocked_loader.return_value.close.called
+    assert not mocked_loader.return_value.abort.called
+
+
+@mock.patch.object(__main__, "run", side_effect=RuntimeError("failed"))
+@mock.patch.object(__main__, "PostgresLoader")
+def test_main_with_target_failure(mocked_loader, mocked_run):
+    with pytest.raises(RuntimeError):
+        __main__.main([
+            "SANI", "--target", "postgres://localhost/target",
+            "postgres://localhost/source",
+        ])
+    assert mocked_loader.return_value.abort.called
+
+
+@pytest.mark.parametrize("args,error", [
+    (["--target", "postgres://t", "-o", "dump.sql", "postgres://s"],
+     "cannot be combined"),
+    (["--target", "mysql://t", "postgres://s"], "only PostgreSQL"),
+    (["--target", "postgres://t", "mysql://s"], "cannot load a MySQL dump"),
+    (["--target", "postgres://t", "--target-jobs", "0", "postgres://s"],
+     "must be positive"),
+])
+@mock.patch.object(__main__, "run")
+def test_main_with_invalid_target(mocked_run, capsys, args, error):
+    with pytest.raises(SystemExit):
+        __main__.main(["SANI"] + args)
+    assert error in capsys.readouterr().err
+    assert not mocked_run.called
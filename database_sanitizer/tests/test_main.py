@@ -1,13 +1,21 @@
 from __future__ import unicode_literals
 
+import gzip
+
 import mock
 import pytest
 import six
 
 from database_sanitizer import __main__
+from database_sanitizer.writer import BackgroundWriter
 
 main = __main__.main
 
+RUN_KWARGS = {
+    'config', 'engine', 'governor', 'incremental', 'jobs', 'metrics',
+    'output', 'plan', 'previous_stats', 'profiler', 'progress', 'secret_key',
+    'stats', 'temp_dir', 'url', 'value_cache'}
+
 
 @mock.patch.object(__main__, 'run')
 def test_main_without_args(mocked_run, capsys):
@@ -18,13 +26,49 @@ def test_main_without_args(mocked_run, capsys):
     captured = capsys.readouterr()
     assert captured.out == ''
     assert captured.err.splitlines() == [
-        'usage: SANI [-h] [--config CONFIG] [--output OUTPUT] url',
+        'usage: SANI [-h] [--config CONFIG] [--output OUTPUT]',
+        '            [--output-format {sql,dir,tsv}] [--shard-size BYTES]'
+        ' [--resume]',
+        '            [--target URL] [--target-jobs TARGET_JOBS]',
+        '            [--engine {hybrid,process,serial}] [--workers WORKERS]',
+        '            [--jobs JOBS] [--plan] [--previous-stats PREVIOUS_STATS]',
+        '            [--incremental DIRECTORY] [--temp-dir DIRECTORY]',
+        '            [--max-connections CONNECTIONS]'
+        ' [--max-rows-per-second ROWS]',
+        '            [--max-bytes-per-second BYTES] [--nice NICE]',
+        '            [--ionice {idle,best-effort}] [--probe COMMAND]',
+        '            [--probe-threshold VALUE] [--probe-interval SECONDS]',
+        '            [--secret-file SECRET_FILE] [--value-cache VALUE_CACHE]',
+        '            [--value-cache-size VALUE_CACHE_SIZE] [--stats STATS]',
+        '            [--progress [{auto,bar,json}]]',
+        '            [--progress-interval PROGRESS_INTERVAL]'
+        ' [--metrics METRICS]',
+        '            [--metrics-format {openmetrics,prometheus}]',
+        '            [--metrics-interval METRICS_INTERVAL]',
+        '            [--profile [{timing,sample,cprofile}]]'
+        ' [--profile-top PROFILE_TOP]',
+        '            [--profile-output PROFILE_OUTPUT]'
+        ' [--buffer-size BUFFER_SIZE]',
+        '            [--buffers BUFFERS] [--compress {gzip,lz4,zstd}]',
+        '            [--compress-level COMPRESS_LEVEL]',
+        '            [--compress-threads COMPRESS_THREADS]',
+        '            url',
         'SANI: error: the following arguments are required: url' if six.PY3
         else 'SANI: error: too few arguments',
     ]
     assert not mocked_run.called
 
 
+@mock.patch.object(__main__, 'run')
+def test_main_with_temp_dir(mocked_run, tmpdir, capsys):
+    main(['SANI', '-j', '2', '--temp-dir', str(tmpdir), 'some://url'])
+    assert mocked_run.call_args[1]['temp_dir'] == str(tmpdir)
+
+    with pytest.raises(SystemExit):
+        main(['SANI', '--temp-dir', str(tmpdir.join('missing')), 'some://url'])
+    assert 'argument --temp-dir: not a directory' in capsys.readouterr().err
+
+
 @mock.patch.object(__main__, 'run')
 def test_main_with_url(mocked_run, capsys):
     main(['SANI', 'some://url'])
@@ -37,7 +81,7 @@ def test_main_with_url(mocked_run, capsys):
     # The run function should have been called with the URL
     (run_call_args, run_call_kwargs) = mocked_run.call_args
     assert run_call_args == ()
-    assert set(run_call_kwargs.keys()) == {'config', 'output', 'url'}
+    assert set(run_call_kwargs.keys()) == RUN_KWARGS
     assert run_call_kwargs['config'] is None
     assert run_call_kwargs['url'] == 'some://url'
 
@@ -61,7 +105,7 @@ def test_main_with_config(mocked_conf, mocked_run, capsys, optname):
     # The run function should have been called with the config and URL
     (run_call_args, run_call_kwargs) = mocked_run.call_args
     assert run_call_args == ()
-    assert set(run_call_kwargs.keys()) == {'config', 'output', 'url'}
+    assert set(run_call_kwargs.keys()) == RUN_KWARGS
     assert run_call_kwargs['config'] == mocked_conf.from_file.return_value
     assert run_call_kwargs['url'] == 'some://url'
 
@@ -79,13 +123,128 @@ def test_main_with_output(mocked_open, mocked_run, capsys, optname):
 
     # Output file should have been opened
     (open_args, open_kwargs) = mocked_open.call_args
-    assert open_args == ('output_file.sql', 'w')
+    assert open_args == ('output_file.sql', 'wb')
     assert open_kwargs == {}
 
     # The run function should have been called with the output and URL
     (run_call_args, run_call_kwargs) = mocked_run.call_args
     assert run_call_args == ()
-    assert set(run_call_kwargs.keys()) == {'config', 'output', 'url'}
+    assert set(run_call_kwargs.keys()) == RUN_KWARGS
     assert run_call_kwargs['config'] is None
-    assert run_call_kwargs['output'] == mocked_open.return_value
+    assert isinstance(run_call_kwargs['output'], BackgroundWriter)
+    assert run_call_kwargs['output'].stream == mocked_open.return_value
+    assert mocked_open.return_value.close.called
     assert run_call_kwargs['url'] == 'some://url'
+
+
+@pytest.mark.parametrize('optname', ['-e', '--engine'])
+@mock.patch.object(__main__, 'run')
+@mock.patch.object(__main__, 'get_engine')
+def test_main_with_engine(mocked_get_engine, mocked_run, capsys, optname):
+    main(['SANI', optname, 'process', '--workers', '3', 'some://url'])
+
+    # Output should be empty
+    captured = capsys.readouterr()
+    assert captured.out == ''
+    assert captured.err == ''
+
+    # The engine should have been constructed with the worker count
+    (engine_args, engine_kwargs) = mocked_get_engine.call_args
+    assert engine_args == ('process',)
+    assert engine_kwargs == {'workers': 3}
+
+    # The run function should have been called with the engine
+    (run_call_args, run_call_kwargs) = mocked_run.call_args
+    assert run_call_kwargs['engine'] == mocked_get_engine.return_value
+
+
+@mock.patch.object(__main__, 'run')
+def test_main_with_jobs(mocked_run, capsys):
+    main([
+        'SANI', '-j', '4', '--plan', '--previous-stats', 'stats.json',
+        'some://url',
+    ])
+
+    captured = capsys.readouterr()
+    assert captured.out == ''
+    assert captured.err == ''
+
+    (run_call_args, run_call_kwargs) = mocked_run.call_args
+    assert run_call_kwargs['jobs'] == 4
+    assert run_call_kwargs['plan'] is True
+    assert run_call_kwargs['previous_stats'] == 'stats.json'
+
+
+@mock.patch.object(__main__, 'run')
+def test_main_with_jobs_and_engine(mocked_run, capsys):
+    with pytest.raises(SystemExit) as excinfo:
+        main(['SANI', '-j', '4', '-e', 'process', 'some://url'])
+    assert excinfo.value.code == 2
+
+    captured = capsys.readouterr()
+    assert captured.err.splitlines()[-1] == (
+        'SANI: error: argument --engine: cannot be combined with --jobs, '
+        '--plan or --incremental')
+    assert not mocked_run.called
+
+
+@mock.patch.object(__main__, 'run')
+@mock.patch.object(__main__, 'BackgroundWriter')
+def test_main_with_buffers(mocked_writer, mocked_run, capsys):
+    main(['SANI', '--buffer-size', '4096', '--buffers', '2', 'some://url'])
+
+    (writer_args, writer_kwargs) = mocked_writer.call_args
+    assert writer_kwargs == {'buffer_size': 4096, 'buffer_count': 2}
+    assert mocked_run.call_args[1]['output'] == mocked_writer.return_value
+    assert mocked_writer.return_value.close.called
+
+
+@pytest.mark.parametrize('args', [
+    ['--buffer-size', '0'],
+    ['--buffers', '1'],
+])
+@mock.patch.object(__main__, 'run')
+def test_main_with_invalid_buffers(mocked_run, capsys, args):
+    with pytest.raises(SystemExit) as excinfo:
+        main(['SANI'] + args + ['some://url'])
+    assert excinfo.value.code == 2
+    assert not mocked_run.called
+
+
+def write_mock_dump(url, output, **kwargs):
+    output.write_lines(['-- Dump of %s' % (url,)] * 1000)
+
+
+@pytest.mark.parametrize('args,filename', [
+    ([], 'dump.sql.gz'),
+    (['--compress', 'gzip', '--compress-level', '1'], 'dump.sql'),
+])
+@mock.patch.object(__main__, 'run', side_effect=write_mock_dump)
+def test_main_with_compression(mocked_run, tmpdir, args, filename):
+    path = str(tmpdir.join(filename))
+    main(['SANI', '-o', path] + args + ['some://url'])
+
+    with gzip.open(path, 'rb') as stream:
+        assert stream.read() == b'-- Dump of some://url\n' * 1000
+
+
+@mock.patch.object(__main__, 'run')
+def test_main_with_invalid_compression_level(mocked_run, capsys):
+    with pytest.raises(SystemExit) as excinfo:
+        main(['SANI', '--compress', 'gzip', '--compress-level', '99', 'x://'])
+    assert excinfo.value.code == 2
+    assert 'Invalid gzip compression level' in capsys.readouterr().err
+    assert not mocked_run.called
+
+
+@mock.patch.object(__main__, 'build_index')
+@mock.patch.object(__main__, 'run')
+def test_main_index(mocked_run, mocked_build_index, capsys):
+    main(['SANI', 'index', '--format', 'mysql', '-o', 'dump.idx', 'dump.sql'])
+
+    captured = capsys.readouterr()
+    assert captured.out == ''
+    assert captured.err == ''
+    mocked_build_index.assert_called_once_with(
+        'dump.sql', dump_format='mysql', index_path='dump.idx')
+    assert not mocked_run.called
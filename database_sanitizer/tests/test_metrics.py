@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+from collections import deque
+
+import mock
+import pytest
+
+from .. import __main__
+from ..metrics import (
+    MetricsWriter,
+    escape_label_value,
+    format_metrics,
+    format_value,
+)
+from ..stats import ColumnStatistics, RunStatistics, TableStatistics
+
+
+def get_statistics():
+    statistics = RunStatistics(profile_interval=None)
+    table = statistics.tables["test"] = TableStatistics()
+    table.rows = 3
+    table.input_bytes = 120
+    column = statistics.columns["test.notes"] = ColumnStatistics()
+    column.calls = 32
+    column.errors = 1
+    column.timed_calls = 2
+    column.timed_time = 0.25
+    column.buckets[0] = 1
+    column.buckets[-1] = 1
+    statistics.watch_queue("process", deque([1, 2]))
+    return statistics
+
+
+def test_format_openmetrics():
+    lines = format_metrics(get_statistics()).splitlines()
+    assert lines[-1] == "# EOF"
+    assert "# TYPE database_sanitizer_rows counter" in lines
+    assert 'database_sanitizer_rows_total{table="test"} 3' in lines
+    assert (
+        'database_sanitizer_sanitizer_calls_total'
+        '{table="test",column="notes"} 32'
+    ) in lines
+    assert (
+        'database_sanitizer_sanitizer_errors_total'
+        '{table="test",column="notes"} 1'
+    ) in lines
+    assert 'database_sanitizer_queue_depth{queue="process"} 2' in lines
+
+    # The histogram buckets are cumulative.
+    prefix = 'database_sanitizer_sanitizer_latency_seconds'
+    labels = 'table="test",column="notes"'
+    assert '%s_bucket{%s,le="1e-06"} 1' % (prefix, labels) in lines
+    assert '%s_bucket{%s,le="0.1"} 1' % (prefix, labels) in lines
+    assert '%s_bucket{%s,le="+Inf"} 2' % (prefix, labels) in lines
+    assert '%s_count{%s} 2' % (prefix, labels) in lines
+    assert '%s_sum{%s} 0.25' % (prefix, labels) in lines
+
+
+def test_format_prometheus():
+    lines = format_metrics(get_statistics(), "prometheus").splitlines()
+    assert "# EOF" not in lines
+    assert "# TYPE database_sanitizer_rows_total counter" in lines
+    assert "# TYPE database_sanitizer_queue_depth gauge" in lines
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("plain", "plain"),
+    ('a"b', 'a\\"b'),
+    ("a\\b\nc", "a\\\\b\\nc"),
+])
+def test_escape_label_value(value, expected):
+    assert escape_label_value(value) == expected
+
+
+def test_format_value():
+    assert format_value(3) == "3"
+    assert format_value(0.5) == "0.5"
+
+
+def test_invalid_format():
+    with pytest.raises(ValueError):
+        MetricsWriter(RunStatistics(), "metrics.prom", metrics_format="json")
+
+
+def test_report(tmpdir):
+    path = str(tmpdir.join("metrics.prom"))
+    writer = MetricsWriter(get_statistics(), path, interval=60)
+    with writer.report():
+        assert not os.path.exists(path)
+    with open(path) as stream:
+        content = stream.read()
+    assert 'database_sanitizer_rows_total{table="test"} 3\n' in content
+    assert os.listdir(str(tmpdir)) == ["metrics.prom"]
+
+
+@mock.patch.object(__main__, "run")
+def test_main_with_metrics(mocked_run):
+    __main__.main([
+        "SANI", "--metrics", "metrics.prom", "--metrics-format", "prometheus",
+        "--metrics-interval", "5", "some://url",
+    ])
+    writer = mocked_run.call_args[1]["metrics"]
+    assert isinstance(writer, MetricsWriter)
+    assert (writer.path, writer.metrics_format, writer.interval) == (
+        "metrics.prom", "prometheus", 5.0)
+    assert writer.statistics is mocked_run.call_args[1]["stats"]
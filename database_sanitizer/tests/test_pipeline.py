@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import subprocess
+import sys
+import time
+
+import mock
+import pytest
+import six
+
+from .. import pipeline, session
+from ..config import Configuration
+from ..dump import postgres as dump_postgres
+from .test_engine_process import MOCK_PG_DUMP_OUTPUT
+
+URL = "postgres://localhost/test"
+
+
+def get_mock_dump_command(data, exit_code=0):
+    script = (
+        "import sys; sys.stdout.buffer.write(%r); sys.stdout.flush(); "
+        "sys.exit(%d)" % (data, exit_code))
+
+    def get_dump_command(url, config):
+        return [sys.executable, "-c", script], None
+    return get_dump_command
+
+
+def get_config():
+    config = Configuration()
+    config.sanitizers["test.email"] = lambda value: "user@example.com"
+    return config
+
+
+def get_expected_output(config):
+    return "".join(
+        line + "\n"
+        for line in dump_postgres.sanitize_lines(
+            MOCK_PG_DUMP_OUTPUT.decode("utf-8").split("\n"),
+            config,
+        )
+    )
+
+
+@pytest.mark.parametrize("batch_size,queue_size,read_size", [
+    (pipeline.DEFAULT_CHUNK_SIZE, pipeline.DEFAULT_QUEUE_SIZE, 64 * 1024),
+    (100, 1, 7),
+])
+def test_pipeline(batch_size, queue_size, read_size):
+    config = get_config()
+    output = six.StringIO()
+    with mock.patch.object(
+        dump_postgres,
+        "get_dump_command",
+        side_effect=get_mock_dump_command(MOCK_PG_DUMP_OUTPUT),
+    ), mock.patch.object(pipeline, "READ_SIZE", read_size):
+        instance = pipeline.Pipeline(
+            url=URL,
+            output=output,
+            config=config,
+            queue_size=queue_size,
+            batch_size=batch_size,
+        )
+        pipeline._run_until_complete(instance.run())
+
+    assert output.getvalue() == get_expected_output(config)
+    assert instance.get_queue_depths() == {"sanitize": 0, "write": 0}
+
+
+def test_run_many():
+    config = get_config()
+    outputs = {
+        URL: six.StringIO(),
+        "postgres://localhost/other": six.StringIO(),
+    }
+    with mock.patch.object(
+        dump_postgres,
+        "get_dump_command",
+        side_effect=get_mock_dump_command(MOCK_PG_DUMP_OUTPUT),
+    ):
+        pipeline.run_many(outputs, config)
+
+    for output in outputs.values():
+        assert output.getvalue() == get_expected_output(config)
+
+
+def get_hashing_config():
+    config = Configuration()
+    config.sanitizers["test.email"] = session.hash_text
+    return config
+
+
+def run_with_secret(run, **kwargs):
+    with mock.patch.object(
+        dump_postgres,
+        "get_dump_command",
+        side_effect=get_mock_dump_command(MOCK_PG_DUMP_OUTPUT),
+    ):
+        return run(config=get_hashing_config(), **kwargs)
+
+
+def test_pipeline_secret_key():
+    def run(**kwargs):
+        output = six.StringIO()
+        pipeline.run(URL, output, **kwargs)
+        return output.getvalue()
+
+    # The secret is used by the executor thread sanitizing the values.
+    session.reset(b"main-thread-secret")
+    first = run_with_secret(run, secret_key=b"secret")
+    assert run_with_secret(run, secret_key=b"secret") == first
+    assert run_with_secret(run, secret_key=b"other") != first
+    session.reset(b"secret")
+    assert session.hash_text("user1@example.com") in first
+
+
+def test_run_many_secret_key():
+    def run(**kwargs):
+        outputs = {
+            URL: six.StringIO(),
+            "postgres://localhost/other": six.StringIO(),
+        }
+        pipeline.run_many(outputs, **kwargs)
+        return [output.getvalue() for output in outputs.values()]
+
+    # The databases are hashed with the same secret.
+    (first, other) = run_with_secret(run)
+    assert first == other
+    assert run_with_secret(run, secret_key=b"secret") == run_with_secret(
+        run, secret_key=b"secret")
+
+
+def test_pipeline_sanitizer_failure():
+    config = Configuration()
+    config.sanitizers["test.email"] = mock.Mock(side_effect=KeyError("boom"))
+    with mock.patch.object(
+        dump_postgres,
+        "get_dump_command",
+        side_effect=get_mock_dump_command(MOCK_PG_DUMP_OUTPUT),
+    ):
+        with pytest.raises(KeyError):
+            pipeline.run(URL, six.StringIO(), config)
+
+
+def test_pipeline_dump_failure():
+    with mock.patch.object(
+        dump_postgres,
+        "get_dump_command",
+        side_effect=get_mock_dump_command(b"", exit_code=3),
+    ):
+        with pytest.raises(subprocess.CalledProcessError):
+            pipeline.run(URL, six.StringIO(), get_config())
+
+
+def test_pipeline_failure_waits_for_sanitizer():
+    config = Configuration()
+    # Slow enough for the dump to fail while the sanitizer is running.
+    config.sanitizers["test.email"] = lambda value: time.sleep(0.001) or value
+    finished = []
+    sanitize = pipeline.Pipeline._sanitize
+
+    def record_sanitize(self, *args):
+        try:
+            sanitize(self, *args)
+        finally:
+            finished.append(True)
+
+    with mock.patch.object(
+        dump_postgres,
+        "get_dump_command",
+        side_effect=get_mock_dump_command(MOCK_PG_DUMP_OUTPUT, exit_code=3),
+    ), mock.patch.object(pipeline.Pipeline, "_sanitize", record_sanitize):
+        with pytest.raises(subprocess.CalledProcessError):
+            pipeline.run(URL, six.StringIO(), config)
+    # The sanitizer thread has stopped before the event loop was closed.
+    assert finished == [True]
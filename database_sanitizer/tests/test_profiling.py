@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+import pstats
+import time
+
+import mock
+import pytest
+
+from .. import __main__
+from ..config import Configuration
+from ..dump import run
+from ..profiling import SanitizerProfiler, get_function_name
+from ..sanitizers.string import sanitize_zfill
+
+PG_DUMP_OUTPUT = b"""
+COPY "public"."test" ("id", "notes", "email") FROM stdin;
+1\tTest data 1\tone@example.com
+2\tfail\ttwo@example.com
+\\.
+""".strip()
+
+
+def sanitize_slowly(value):
+    time.sleep(0.01)
+    return value
+
+
+def sanitize_failing(value):
+    if value == "fail":
+        raise ValueError(value)
+    return value
+
+
+def get_config():
+    config = Configuration()
+    config.sanitizers["test.notes"] = sanitize_slowly
+    config.sanitizers["test.email"] = sanitize_zfill
+    return config
+
+
+def test_get_function_name():
+    assert get_function_name(sanitize_zfill) == (
+        "database_sanitizer.sanitizers.string.sanitize_zfill")
+
+
+def test_invalid_mode():
+    with pytest.raises(ValueError):
+        SanitizerProfiler(mode="perf")
+
+
+def test_timing():
+    config = get_config()
+    config.sanitizers["test.fail"] = sanitize_failing
+    profiler = SanitizerProfiler(mode="timing")
+    profiler.instrument_config(config)
+    for _ in range(3):
+        config.get_sanitizer_for("test", "notes")("value")
+        config.get_sanitizer_for("test", "email")("value")
+    with pytest.raises(ValueError):
+        config.get_sanitizer_for("test", "fail")("fail")
+
+    top = profiler.get_top_columns(1)
+    assert [key for (key, _column) in top] == ["test.notes"]
+    assert top[0][1].calls == 3
+    assert profiler.columns["test.email"].calls == 3
+    assert top[0][1].time >= 0.03
+    assert profiler.columns["test.fail"].errors == 1
+
+    lines = profiler.format_report(1)
+    assert len(lines) == 2
+    assert lines[1].startswith(
+        "test.notes  database_sanitizer.tests.test_profiling.sanitize_slowly")
+
+
+def test_sample(tmpdir):
+    config = get_config()
+    profiler = SanitizerProfiler(mode="sample", interval=0.001)
+    output = io.StringIO()
+    process = mock.Mock(stdout=io.BytesIO(PG_DUMP_OUTPUT))
+    with mock.patch("subprocess.Popen", return_value=process):
+        run("postgres://localhost/test", output, config, profiler=profiler)
+
+    assert profiler.columns["test.notes"].calls == 2
+    # Time spent in the sanitizer is attributed to the column.
+    assert any(
+        stack.endswith(
+            ";[test.notes]"
+            ";database_sanitizer.tests.test_profiling.sanitize_slowly")
+        for stack in profiler.stacks)
+
+    path = tmpdir.join("stacks.txt")
+    profiler.save(str(path))
+    for line in path.read().splitlines():
+        (stack, count) = line.rsplit(" ", 1)
+        assert int(count) > 0
+
+
+def test_cprofile(tmpdir):
+    config = get_config()
+    profiler = SanitizerProfiler(mode="cprofile")
+    profiler.instrument_config(config)
+    with profiler.report():
+        config.get_sanitizer_for("test", "email")("value")
+
+    path = str(tmpdir.join("profile.prof"))
+    profiler.save(path)
+    functions = {name for (_file, _line, name) in pstats.Stats(path).stats}
+    assert "sanitize_zfill" in functions
+
+
+@mock.patch.object(__main__, "run")
+def test_main_with_profile(mocked_run, tmpdir, capsys):
+    path = str(tmpdir.join("stacks.txt"))
+    __main__.main([
+        "SANI", "--profile", "--profile-top", "3", "--profile-output", path,
+        "some://url",
+    ])
+    profiler = mocked_run.call_args[1]["profiler"]
+    assert profiler.mode == "sample"
+    assert capsys.readouterr().err.startswith("Column ")
+    assert tmpdir.join("stacks.txt").check()
+
+
+@mock.patch.object(__main__, "run")
+def test_main_with_profile_output_without_stacks(mocked_run, capsys):
+    with pytest.raises(SystemExit):
+        __main__.main([
+            "SANI",
+            "--profile", "timing",
+            "--profile-output", "x",
+            "some://url",
+        ])
+    assert "requires --profile sample or cprofile" in capsys.readouterr().err
+    assert not mocked_run.called
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+import json
+
+import mock
+import pytest
+
+from .. import __main__
+from ..config import Configuration
+from ..dump import postgres as dump_postgres
+from ..dump import run
+from ..progress import (
+    ProgressReporter,
+    format_bar,
+    format_json,
+    format_time,
+)
+from ..scheduler import TableSize
+from ..stats import RunStatistics, TableStatistics
+
+PG_DUMP_OUTPUT = b"""
+COPY "public"."test" ("id", "notes") FROM stdin;
+1\tTest data 1
+2\tTest data 2
+\\.
+
+COPY "public"."other" ("id") FROM stdin;
+1
+2
+\\.
+""".strip()
+
+
+class TtyStream(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def get_reporter(tables, estimates=None, current=None, elapsed=10.0):
+    statistics = RunStatistics(sample_interval=None, profile_interval=None)
+    for (name, rows) in tables.items():
+        statistics.tables[name] = TableStatistics()
+        statistics.tables[name].rows = rows
+    statistics.current_table_name = current
+    reporter = ProgressReporter(statistics, io.StringIO())
+    reporter.set_estimates([
+        TableSize(schema="public", table=name, size=0, rows=rows, split=None)
+        for (name, rows) in (estimates or {}).items()
+    ])
+    # The tests freeze the timer at zero.
+    reporter._start = -elapsed
+    return reporter
+
+
+def test_get_progress():
+    reporter = get_reporter(
+        {"done": 400, "current": 100},
+        estimates={"done": 300, "current": 200, "pending": 500},
+        current="current",
+    )
+    with mock.patch("timeit.default_timer", return_value=0.0):
+        progress = reporter.get_progress()
+    assert progress.table == "current"
+    assert progress.rows == 500
+    assert progress.rows_per_second == 50.0
+    # Tables exceeding their estimates have no rows remaining.
+    assert progress.estimated_rows == 500 + 100 + 500
+    assert progress.eta == pytest.approx(12.0)
+
+
+def test_get_progress_without_estimates():
+    reporter = get_reporter({"test": 10})
+    with mock.patch("timeit.default_timer", return_value=0.0):
+        progress = reporter.get_progress()
+    assert (progress.estimated_rows, progress.eta) == (None, None)
+    assert format_bar(progress).startswith(
+        "[%s] 10 rows 1 rows/s ETA --:--:--" % ("?" * 30,))
+
+
+def test_output_format():
+    statistics = RunStatistics()
+    assert ProgressReporter(statistics, io.StringIO()).output_format == "json"
+    assert ProgressReporter(statistics, TtyStream()).output_format == "bar"
+    assert ProgressReporter(
+        statistics, TtyStream(), output_format="json").output_format == "json"
+    with pytest.raises(ValueError):
+        ProgressReporter(statistics, io.StringIO(), output_format="xml")
+
+
+def test_format_bar():
+    reporter = get_reporter(
+        {"test": 50}, estimates={"test": 200}, current="test")
+    with mock.patch("timeit.default_timer", return_value=0.0):
+        line = format_bar(reporter.get_progress())
+    assert line.startswith(
+        "[%s%s]  25.0%% 50/200 rows 5 rows/s ETA 0:00:30 test" % (
+            "#" * 7, "." * 23))
+    # Fixed width, so that shorter lines overwrite longer ones.
+    assert len(line) == len(format_bar(reporter.get_progress()._replace(
+        table="a")))
+
+
+def test_format_json():
+    reporter = get_reporter(
+        {"test": 50}, estimates={"test": 200}, current="test")
+    with mock.patch("timeit.default_timer", return_value=0.0):
+        data = json.loads(format_json(reporter.get_progress()))
+    assert data["rows"] == 50
+    assert data["estimated_rows"] == 200
+    assert data["eta"] == pytest.approx(30.0)
+
+
+@pytest.mark.parametrize("seconds,expected", [
+    (None, "--:--:--"),
+    (59.9, "0:00:59"),
+    (3725, "1:02:05"),
+])
+def test_format_time(seconds, expected):
+    assert format_time(seconds) == expected
+
+
+def test_report_bar():
+    stream = TtyStream()
+    reporter = ProgressReporter(RunStatistics(), stream, interval=60)
+    with reporter.report():
+        pass
+    assert stream.getvalue().startswith("\r[")
+    assert stream.getvalue().endswith("\n")
+
+
+def test_run_with_progress():
+    config = Configuration()
+    config.sanitizers["test.notes"] = lambda value: value
+    stream = io.StringIO()
+    reporter = ProgressReporter(
+        RunStatistics(sample_interval=None, profile_interval=None),
+        stream,
+        interval=60,
+    )
+    tables = [
+        TableSize(schema="public", table="test", size=0, rows=2, split=None),
+        TableSize(schema="public", table="other", size=0, rows=8, split=None),
+    ]
+    output = io.StringIO()
+    process = mock.Mock(stdout=io.BytesIO(PG_DUMP_OUTPUT))
+    with mock.patch("subprocess.Popen", return_value=process), \
+            mock.patch.object(
+                dump_postgres, "get_table_sizes", return_value=tables):
+        run("postgres://localhost/test", output, config, progress=reporter)
+
+    (line,) = stream.getvalue().splitlines()
+    data = json.loads(line)
+    assert data["rows"] == 4
+    assert data["estimated_rows"] == 10
+    assert data["table"] is None
+    assert "2\tTest data 2\n" in output.getvalue()
+
+
+
+def test_run_with_progress_without_estimates():
+    config = Configuration()
+    config.sanitizers["test.notes"] = lambda value: value
+    stream = io.StringIO()
+    reporter = ProgressReporter(
+        RunStatistics(sample_interval=None, profile_interval=None),
+        stream,
+        interval=60,
+    )
+    output = io.StringIO()
+    process = mock.Mock(stdout=io.BytesIO(PG_DUMP_OUTPUT))
+    error = OSError(2, "No such file or directory: 'psql'")
+    with mock.patch("subprocess.Popen", return_value=process), \
+            mock.patch.object(
+                dump_postgres, "get_table_sizes", side_effect=error):
+        run("postgres://localhost/test", output, config, progress=reporter)
+
+    (warning, line) = stream.getvalue().splitlines()
+    assert warning.startswith(
+        "Warning: Cannot read the row estimates of the tables: ")
+    assert "psql" in warning
+    data = json.loads(line)
+    assert data["rows"] == 4
+    assert data["estimated_rows"] is None
+    assert data["eta"] is None
+    assert "2\tTest data 2\n" in output.getvalue()
+
+
+@mock.patch.object(__main__, "run")
+def test_main_with_progress(mocked_run):
+    __main__.main([
+        "SANI",
+        "--progress", "json",
+        "--progress-interval", "5",
+        "some://url",
+    ])
+    reporter = mocked_run.call_args[1]["progress"]
+    assert isinstance(reporter, ProgressReporter)
+    assert (reporter.output_format, reporter.interval) == ("json", 5.0)
+    assert reporter.statistics.sample_interval is None
+    assert mocked_run.call_args[1]["stats"] is None
+
+
+@mock.patch.object(__main__, "run")
+def test_main_with_invalid_progress_interval(mocked_run, capsys):
+    with pytest.raises(SystemExit):
+        __main__.main(["SANI", "--progress-interval", "0", "some://url"])
+    assert "--progress-interval: must be positive" in capsys.readouterr().err
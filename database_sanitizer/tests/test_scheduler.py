@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+
+import pytest
+
+from ..scheduler import (
+    TableSize,
+    apply_statistics,
+    format_plan,
+    format_size,
+    load_statistics,
+    plan,
+)
+
+MiB = 1024 * 1024
+
+TABLES = [
+    TableSize("public", "small", 10 * MiB, 100, 10),
+    TableSize("public", "huge", 1000 * MiB, 10000, 1000),
+    TableSize("public", "medium", 300 * MiB, 3000, None),
+    TableSize("public", "tiny", 1 * MiB, 10, 1),
+]
+
+
+def test_plan_orders_largest_first():
+    result = plan(TABLES, jobs=2, min_part_size=400 * MiB)
+
+    assert [
+        (task.table.table, task.part, task.parts) for task in result.tasks
+    ] == [
+        ("huge", 0, 3),
+        ("huge", 1, 3),
+        ("huge", 2, 3),
+        ("medium", 0, 1),
+        ("small", 0, 1),
+        ("tiny", 0, 1),
+    ]
+    assert sum(task.size for task in result.tasks) == sum(
+        table.size for table in TABLES)
+    assert all(task.condition is None for task in result.tasks)
+
+
+def test_plan_does_not_split_unsplittable_tables():
+    result = plan(TABLES, jobs=8, min_part_size=MiB)
+    medium_tasks = [
+        task for task in result.tasks if task.table.table == "medium"]
+    huge_tasks = [task for task in result.tasks if task.table.table == "huge"]
+    assert len(medium_tasks) == 1
+    assert len(huge_tasks) > 1
+
+
+def test_plan_assignments():
+    result = plan(TABLES, jobs=2, min_part_size=400 * MiB)
+    assert [
+        [(task.table.table, task.part) for task in tasks]
+        for tasks in result.assignments
+    ] == [
+        [("huge", 0), ("medium", 0), ("small", 0), ("tiny", 0)],
+        [("huge", 1), ("huge", 2)],
+    ]
+
+
+def test_plan_invalid_jobs():
+    with pytest.raises(ValueError):
+        plan(TABLES, jobs=0)
+
+
+def test_format_plan():
+    lines = format_plan(plan(TABLES[:1], jobs=1))
+    assert lines == [
+        "Plan for 1 tasks with 1 jobs, largest first:",
+        "",
+        "  Order  Table            Part        Size          Rows",
+        "      1  public.small      1/1    10.0 MiB           100",
+        "",
+        "Estimated load per job:",
+        "  Job 1: 10.0 MiB in 1 tasks",
+    ]
+
+
+@pytest.mark.parametrize("size,expected", [
+    (0, "0 B"),
+    (1023, "1023 B"),
+    (1536, "1.5 KiB"),
+    (5 * MiB, "5.0 MiB"),
+    (2 * 1024 * 1024 * MiB, "2.0 TiB"),
+])
+def test_format_size(size, expected):
+    assert format_size(size) == expected
+
+
+def test_statistics(tmpdir):
+    path = tmpdir.join("stats.json")
+    path.write(json.dumps({
+        "tables": {
+            "small": {"input_bytes": 5000, "rows": 50},
+        },
+    }))
+
+    statistics = load_statistics(str(path))
+    assert statistics == {"small": (5000, 50)}
+
+    tables = apply_statistics(TABLES, statistics)
+    assert tables[0] == TableSize("public", "small", 5000, 50, 10)
+    assert tables[1:] == TABLES[1:]
+
+
+def test_statistics_invalid(tmpdir):
+    path = tmpdir.join("stats.json")
+    path.write("[]")
+    with pytest.raises(ValueError):
+        load_statistics(str(path))
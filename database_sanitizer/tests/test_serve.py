@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import contextlib
+import json
+import os
+import stat
+import threading
+import time
+
+import mock
+import pytest
+
+from .. import __main__
+from ..serve import (
+    ConfigurationCache,
+    SanitizerServer,
+    _UnixServer,
+    send_request,
+)
+
+PG_DUMP = "\n".join([
+    'COPY "public"."test" ("id", "notes") FROM stdin;',
+    "1\tSecret",
+    "\\.",
+    "",
+])
+
+CONFIG = "\n".join([
+    "strategy:",
+    "  test:",
+    "    notes: string.empty",
+    "",
+])
+
+
+def succeed(args, resources):
+    os.write(2, ("progress of %s\n" % (" ".join(args),)).encode("utf-8"))
+
+
+def fail(args, resources):
+    os.write(2, b"failing\n")
+    return 3
+
+
+def crash(args, resources):
+    raise RuntimeError("crash")
+
+
+def wait_for_file(args, resources):
+    while not os.path.exists(args[0]):
+        time.sleep(0.01)
+
+
+def write_resources(args, resources):
+    os.write(2, ("resources %s\n" % (resources,)).encode("utf-8"))
+
+
+@contextlib.contextmanager
+def running_server(tmpdir, run_job, **kwargs):
+    server = SanitizerServer(str(tmpdir.join("sock")), run_job, **kwargs)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        while server.server is None or not tmpdir.join("sock").exists():
+            time.sleep(0.01)
+        yield server
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def submit(server, args, **kwargs):
+    request = {"command": "submit", "args": args, "cwd": os.getcwd()}
+    request.update(kwargs)
+    return list(send_request(server.path, request))
+
+
+def test_configuration_cache(tmpdir):
+    path = tmpdir.join("config.yml")
+    path.write("first")
+    loader = mock.Mock(side_effect=lambda path: open(path).read())
+    cache = ConfigurationCache(loader)
+    assert cache.get(str(path)) == "first"
+    assert cache.get(os.path.relpath(str(path))) == "first"
+    assert loader.call_count == 1
+
+    path.write("second, changed")
+    assert cache.get(str(path)) == "second, changed"
+    assert loader.call_count == 2
+
+
+def test_configuration_cache_loads_without_lock(tmpdir):
+    # Jobs forked while a configuration is being loaded must not inherit
+    # the lock in its locked state.
+    path = tmpdir.join("config.yml")
+    path.write("config")
+    cache = ConfigurationCache(lambda path: cache.lock.locked())
+    assert cache.get(str(path)) is False
+
+
+def test_submit(tmpdir):
+    with running_server(tmpdir, succeed) as server:
+        events = submit(server, ["-o", "output.sql", "file:///dump.sql"])
+
+    assert [event["event"] for event in events] == [
+        "queued", "started", "log", "finished"]
+    assert events[2]["line"] == "progress of -o output.sql file:///dump.sql"
+    assert events[-1]["state"] == "succeeded"
+    assert events[-1]["returncode"] == 0
+    assert events[-1]["log"] == [events[2]["line"]]
+    assert not tmpdir.join("sock").exists()
+
+
+@pytest.mark.parametrize("run_job,returncode", [(fail, 3), (crash, 1)])
+def test_submit_failure(tmpdir, run_job, returncode):
+    with running_server(tmpdir, run_job) as server:
+        events = submit(server, ["url"])
+        # Failures do not affect the following jobs.
+        assert submit(server, ["url"])[-1]["returncode"] == returncode
+
+    assert events[-1]["state"] == "failed"
+    assert events[-1]["returncode"] == returncode
+
+
+def test_submit_rejected(tmpdir):
+    def prepare_job(args, cwd):
+        if "--invalid" in args:
+            raise ValueError("unrecognized arguments: --invalid")
+
+    with running_server(tmpdir, succeed, prepare_job=prepare_job) as server:
+        assert submit(server, ["--invalid"]) == [{
+            "event": "rejected",
+            "message": "unrecognized arguments: --invalid",
+        }]
+        assert submit(server, "url")[0]["event"] == "rejected"
+        events = submit(server, ["url"], cwd="relative")
+        assert events[0]["event"] == "rejected"
+        assert server.get_status()["jobs"] == []
+
+
+def test_submit_resources(tmpdir):
+    prepared = []
+
+    def prepare_job(args, cwd):
+        prepared.append(args)
+        return "for %s" % (args[0],)
+
+    with running_server(
+        tmpdir, write_resources, prepare_job=prepare_job,
+    ) as server:
+        events = submit(server, ["url"])
+
+    assert events[-1]["log"] == ["resources for url"]
+    # Resources are obtained again before forking the job.
+    assert prepared == [["url"], ["url"]]
+
+
+def test_concurrency_and_status(tmpdir):
+    flag = str(tmpdir.join("flag"))
+    with running_server(tmpdir, wait_for_file, concurrency=1) as server:
+        for _job in range(2):
+            [event] = submit(server, [flag], wait=False)
+            assert event["event"] == "queued"
+        while server.get_status()["running"] != 1:
+            time.sleep(0.01)
+
+        [status] = list(send_request(server.path, {"command": "status"}))
+        assert status["concurrency"] == 1
+        assert status["running"] == 1
+        assert status["queued"] == 1
+        assert [job["state"] for job in status["jobs"]] == [
+            "running", "queued"]
+
+        watched = send_request(server.path, {"command": "watch", "job": 2})
+        assert next(watched)["event"] == "state"
+        tmpdir.join("flag").write("")
+        assert [event["event"] for event in watched] == ["started", "finished"]
+
+        events = list(send_request(
+            server.path, {"command": "watch", "job": 1}))
+        assert [event["event"] for event in events] == ["state"]
+        assert events[0]["state"] == "succeeded"
+
+
+def test_invalid_requests(tmpdir):
+    with running_server(tmpdir, succeed) as server:
+        [event] = list(send_request(
+            server.path, {"command": "watch", "job": 5}))
+        assert event == {"event": "error", "message": "Unknown job: 5"}
+        [event] = list(send_request(server.path, {"command": "stop"}))
+        assert event == {"event": "error", "message": "Unknown command: stop"}
+        [event] = list(send_request(server.path, ["status"]))
+        assert event["event"] == "error"
+
+
+def test_shutdown_cancels_queued_jobs(tmpdir):
+    flag = str(tmpdir.join("flag"))
+    with running_server(tmpdir, wait_for_file, concurrency=1) as server:
+        submit(server, [flag], wait=False)
+        submit(server, [flag], wait=False)
+        while server.get_status()["running"] != 1:
+            time.sleep(0.01)
+    jobs = server.get_status()["jobs"]
+    # The running job is terminated.
+    assert [job["returncode"] for job in jobs] == [-15, 1]
+    assert jobs[1]["log"] == ["Cancelled, as the sanitizer daemon stopped"]
+
+
+def test_socket_mode(tmpdir):
+    modes = []
+    server_activate = _UnixServer.server_activate
+
+    def record_mode(server):
+        modes.append(stat.S_IMODE(os.stat(server.server_address).st_mode))
+        server_activate(server)
+
+    umask = os.umask(0)
+    try:
+        with mock.patch.object(_UnixServer, "server_activate", record_mode):
+            with running_server(tmpdir, succeed) as server:
+                mode = stat.S_IMODE(os.stat(server.path).st_mode)
+    finally:
+        os.umask(umask)
+    # The socket is never accessible by the other users, even before the
+    # server starts listening.
+    assert modes == [0o600]
+    assert mode == 0o600
+
+
+def test_already_listening(tmpdir):
+    with running_server(tmpdir, succeed) as server:
+        with pytest.raises(ValueError):
+            SanitizerServer(server.path, succeed).serve_forever()
+    tmpdir.join("sock").write("")
+    with pytest.raises(ValueError):
+        SanitizerServer(str(tmpdir.join("sock")), succeed).serve_forever()
+    with pytest.raises(ValueError):
+        SanitizerServer(str(tmpdir.join("sock")), succeed, concurrency=0)
+
+
+def test_main_serve(tmpdir):
+    tmpdir.join("dump.sql").write(PG_DUMP)
+    tmpdir.join("config.yml").write(CONFIG)
+    with mock.patch.object(__main__, "SanitizerServer") as server_class, \
+            mock.patch("signal.signal"):
+        __main__.main(["SANI", "serve", "--concurrency", "3", "sock"])
+    (args, kwargs) = server_class.call_args
+    assert args[0] == "sock"
+    assert kwargs["concurrency"] == 3
+    prepare_job = kwargs["prepare_job"]
+    run_job = args[1]
+    assert prepare_job(["-o", "out", "url"], str(tmpdir)) is None
+
+    job_args = [
+        "-c", "config.yml", "-o", str(tmpdir.join("output.sql")),
+        "file://%s?format=postgres" % (tmpdir.join("dump.sql"),),
+    ]
+    with mock.patch(
+        "database_sanitizer.config.Configuration.from_file",
+    ) as from_file:
+        from_file.return_value = __main__.Configuration()
+        from_file.return_value.load({
+            "strategy": {"test": {"notes": "string.empty"}},
+        })
+        config = prepare_job(job_args, str(tmpdir))
+        with tmpdir.as_cwd():
+            run_job(job_args, config)
+    # The configuration is loaded once.
+    assert from_file.call_count == 1
+    assert tmpdir.join("output.sql").read() == PG_DUMP.replace("Secret", "")
+
+    for (invalid_args, message) in [
+        (["restore", "dir", "url"], "cannot run the restore command"),
+        (["file:///dump.sql"], "require --output or --target"),
+        (["--unknown", "-o", "out", "url"], "unrecognized arguments"),
+        (["--help"], "cannot show the help"),
+        (["-c", "missing.yml", "-o", "out", "url"],
+         "Cannot load configuration"),
+    ]:
+        with pytest.raises(ValueError) as excinfo:
+            prepare_job(invalid_args, str(tmpdir))
+        assert message in str(excinfo.value)
+
+
+@pytest.mark.parametrize("events,exit_code", [
+    ([{"event": "queued"}, {"event": "finished", "state": "succeeded"}], None),
+    ([{"event": "queued"}, {"event": "finished", "state": "failed"}], 1),
+    ([{"event": "rejected", "message": "Invalid"}], 1),
+])
+def test_main_submit(capsys, events, exit_code):
+    args = ["SANI", "submit", "-s", "sock", "--", "-o", "out", "url"]
+    with mock.patch.object(
+        __main__, "send_request", return_value=iter(events),
+    ) as send:
+        if exit_code is None:
+            __main__.main(args)
+        else:
+            with pytest.raises(SystemExit) as excinfo:
+                __main__.main(args)
+            assert excinfo.value.code == exit_code
+    (path, request) = send.call_args[0]
+    assert path == "sock"
+    assert request == {
+        "command": "submit",
+        "args": ["-o", "out", "url"],
+        "cwd": os.getcwd(),
+        "wait": True,
+    }
+    assert [
+        json.loads(line) for line in capsys.readouterr().out.splitlines()
+    ] == events
+
+
+def test_main_status(tmpdir, capsys):
+    with pytest.raises(SystemExit):
+        __main__.main(["SANI", "status", "-s", str(tmpdir.join("missing"))])
+    assert "cannot connect to the daemon" in capsys.readouterr().err
+
+    with running_server(tmpdir, succeed) as server:
+        __main__.main(["SANI", "status", "-s", server.path])
+    assert json.loads(capsys.readouterr().out)["event"] == "status"
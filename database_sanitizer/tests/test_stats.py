@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import codecs
+import io
+import json
+import time
+from collections import deque
+from multiprocessing.pool import ApplyResult
+
+import mock
+import pytest
+from six.moves.urllib import parse as urlparse
+
+from .. import stats as stats_module
+from .. import writer
+from ..__main__ import main
+from ..config import Configuration
+from ..dump import files as dump_files
+from ..dump import mysql as dump_mysql
+from ..dump import postgres as dump_postgres
+from ..sanitizers import string as string_sanitizers
+from ..scheduler import load_statistics
+from ..stats import RunStatistics
+
+PG_DUMP_LINES = [
+    "--- Fake PostgreSQL database dump",
+    "",
+    "COPY \"public\".\"test\" (\"id\", \"notes\") FROM stdin;",
+    "1\tTest data 1",
+    "2\tTest data 2",
+    "3\t\\N",
+    "\\.",
+    "",
+    "COPY \"public\".\"other\" (\"id\") FROM stdin;",
+    "1",
+    "\\.",
+]
+
+
+def get_config(sanitizer):
+    config = Configuration()
+    config.sanitizers["test.notes"] = sanitizer
+    return config
+
+
+def test_instrument_config():
+    def sanitize_notes(value):
+        if value == "fail":
+            raise ValueError(value)
+        return value.upper()
+
+    config = get_config(sanitize_notes)
+    statistics = RunStatistics(sample_interval=2)
+    statistics.instrument_config(config)
+    sanitizer = config.get_sanitizer_for("test", "notes")
+    # The instrumented sanitizers keep the names of the original ones.
+    assert sanitizer.__name__ == "sanitize_notes"
+    assert [sanitizer(value) for value in ("a", "b", "c")] == ["A", "B", "C"]
+    with pytest.raises(ValueError):
+        sanitizer("fail")
+
+    column = statistics.columns["test.notes"]
+    assert (column.calls, column.errors, column.timed_calls) == (4, 1, 2)
+    assert column.time == pytest.approx(column.timed_time * 2)
+    assert statistics.as_dict()["columns"]["test.notes"]["calls"] == 4
+
+
+def test_track_postgres_dump():
+    config = get_config(lambda value: value and "X")
+    statistics = RunStatistics(profile_interval=None)
+    statistics.instrument_config(config)
+    with statistics.collect():
+        output = list(statistics.track_output(
+            dump_postgres.sanitize_lines(PG_DUMP_LINES, config)))
+    assert output[3:6] == ["1\tX", "2\tX", "3\t\\N"]
+
+    data = statistics.as_dict()
+    assert sorted(data["tables"]) == ["other", "test"]
+    test_table = data["tables"]["test"]
+    assert test_table["rows"] == 3
+    assert test_table["input_bytes"] == len("1\tTest data 1\n") * 2 + 5
+    assert test_table["output_bytes"] == sum(
+        len(line) + 1 for line in output[2:7])
+    assert test_table["wall_time"] >= 0
+    assert data["tables"]["other"]["rows"] == 1
+    assert data["columns"]["test.notes"]["calls"] == 3
+    assert data["wall_time"] >= test_table["wall_time"]
+
+
+def test_track_chunks_inactive():
+    chunks = dump_postgres.iter_chunks(PG_DUMP_LINES, Configuration())
+    assert stats_module.track_chunks(chunks, dump_postgres.__name__) is chunks
+
+
+def test_count_rows():
+    assert dump_postgres.count_rows(["1\ta", "2\tb"]) == 2
+    assert dump_mysql.count_rows([
+        "INSERT INTO `test` (`id`) VALUES (1),(2),(3);",
+        "INSERT INTO `test` (`id`) VALUES (4);",
+    ]) == 4
+
+
+@pytest.mark.parametrize("data,rows", [
+    (b"", 0),
+    (b"1\ta\n2\tb\n", 2),
+    (b"1\ta\n2\tb", 2),
+])
+def test_count_block_rows_postgres(data, rows):
+    assert dump_postgres.count_block_rows(data) == rows
+
+
+@pytest.mark.parametrize("data,rows", [
+    (b"", 0),
+    (b"INSERT INTO `test` (`id`) VALUES (1),(2),(3);\n"
+     b"INSERT INTO `test` (`id`) VALUES (4);\n", 4),
+    (b"INSERT INTO `test` (`id`) VALUES (1),(2);", 2),
+])
+def test_count_block_rows_mysql(data, rows):
+    assert dump_mysql.count_block_rows(data) == rows
+
+
+def test_get_code_phase():
+    get_code_phase = stats_module._get_code_phase
+    assert get_code_phase(
+        string_sanitizers.sanitize_zfill.__code__) == "sanitize"
+    assert get_code_phase(writer.write_lines.__code__) == "write"
+    assert get_code_phase(dump_postgres.iter_chunks.__code__) == "parse"
+    assert get_code_phase(codecs.StreamReader.read.__code__) == "dump"
+    assert get_code_phase(ApplyResult.get.__code__) == "sanitize"
+    assert get_code_phase(json.dumps.__code__) is None
+
+
+def test_phase_times():
+    statistics = RunStatistics()
+    statistics.wall_time = 10.0
+    statistics.phase_samples.update({"parse": 3, "sanitize": 1})
+    phases = statistics.get_phase_times()
+    assert phases["parse"] == pytest.approx(7.5)
+    assert phases["sanitize"] == pytest.approx(2.5)
+    assert phases["dump"] == 0.0
+
+
+def test_main_with_stats(tmpdir):
+    config_path = tmpdir.join("config.yml")
+    config_path.write(
+        "strategy:\n"
+        "  test:\n"
+        "    notes: string.zfill\n"
+    )
+    stats_path = str(tmpdir.join("stats.json"))
+    process = mock.Mock(
+        stdout=io.BytesIO(("\n".join(PG_DUMP_LINES) + "\n").encode("utf-8")))
+
+    with mock.patch("subprocess.Popen", return_value=process):
+        main([
+            "SANI", "-c", str(config_path), "-o", str(tmpdir.join("out.sql")),
+            "--stats", stats_path, "postgres://localhost/test",
+        ])
+
+    with open(stats_path) as stream:
+        data = json.load(stream)
+    assert data["version"] == stats_module.STATISTICS_VERSION
+    assert sorted(data["phases"]) == sorted(stats_module.PHASES)
+    assert data["columns"]["test.notes"]["calls"] == 3
+    assert data["tables"]["test"]["rows"] == 3
+    assert load_statistics(stats_path)["test"] == (
+        data["tables"]["test"]["input_bytes"], 3)
+
+
+def test_track_dump_file(tmpdir):
+    dump_path = tmpdir.join("dump.sql")
+    dump_path.write("\n".join(PG_DUMP_LINES) + "\n")
+    config = get_config(lambda value: value)
+    statistics = RunStatistics(profile_interval=None)
+    url = urlparse.urlparse("file://%s" % (dump_path,))
+    with statistics.collect():
+        list(statistics.track_output(dump_files.sanitize(url, config)))
+
+    test_table = statistics.tables["test"]
+    assert test_table.rows == 3
+    assert test_table.input_bytes == len("1\tTest data 1\n") * 2 + 5
+    # Data of tables without sanitizers is copied as-is, untracked.
+    assert sorted(statistics.tables) == ["test"]
+
+
+def test_watch_queue():
+    queue = deque([1, 2, 3])
+    statistics = RunStatistics(profile_interval=0.001)
+    stats_module.watch_queue("inactive", queue)
+    with statistics.collect():
+        stats_module.watch_queue("test", queue)
+        while not statistics.queues["test"].samples:
+            time.sleep(0.001)
+    assert "inactive" not in statistics.queues
+    assert statistics.as_dict()["queues"]["test"] == {
+        "max_depth": 3, "mean_depth": 3.0}
+
+
+def test_latency_buckets():
+    config = get_config(lambda value: value)
+    statistics = RunStatistics(sample_interval=1)
+    statistics.instrument_config(config)
+    for value in range(5):
+        config.get_sanitizer_for("test", "notes")(value)
+    column = statistics.columns["test.notes"]
+    assert sum(column.buckets) == column.timed_calls == 5
@@ -2,13 +2,18 @@
 
 from __future__ import unicode_literals
 
+import mock
 import pytest
+from six.moves.urllib import parse as urlparse
 
 from ..utils.postgres import (
     DECODE_MAP,
     POSTGRES_COPY_NULL_VALUE,
+    PSQL_FIELD_SEPARATOR,
+    PSQL_RECORD_SEPARATOR,
     decode_copy_value,
     encode_copy_value,
+    run_psql_query,
 )
 
 
@@ -84,3 +89,17 @@ def test_decode_map_contents():
     assert '\\z' not in DECODE_MAP,  "Invalid escape sequences are not mapped"
 
     assert len(DECODE_MAP) == 1097
+
+
+def test_run_psql_query():
+    url = urlparse.urlparse("postgres://localhost/test")
+    output = (
+        "public" + PSQL_FIELD_SEPARATOR + "t\u00e4st" + PSQL_RECORD_SEPARATOR
+        + "other" + PSQL_FIELD_SEPARATOR + "" + PSQL_RECORD_SEPARATOR + "\n"
+    ).encode("utf-8")
+    with mock.patch("subprocess.check_output", return_value=output) as psql:
+        rows = run_psql_query(url, "SELECT 1")
+
+    assert rows == [("public", "t\u00e4st"), ("other", "")]
+    # The output is decoded as UTF-8, whatever the locale of the client.
+    assert psql.call_args[1]["env"]["PGCLIENTENCODING"] == "UTF8"
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+
+import mock
+import pytest
+import six
+
+from ..writer import BackgroundWriter, write_lines
+
+LINES = ["first", "Ääkköset", "", "x" * 50, "last"]
+EXPECTED = "".join(line + "\n" for line in LINES).encode("utf-8")
+
+
+@pytest.mark.parametrize("buffer_size", [1, 7, 16, 1024])
+def test_write_lines_into_bytes_io(buffer_size):
+    stream = io.BytesIO()
+    writer = BackgroundWriter(stream, buffer_size=buffer_size, buffer_count=2)
+    writer.write_lines(LINES)
+    writer.write("tail")
+    writer.close()
+    assert stream.getvalue() == EXPECTED + b"tail"
+
+
+@pytest.mark.parametrize("buffer_size", [7, 1024])
+def test_write_lines_into_file(tmpdir, buffer_size):
+    path = tmpdir.join("output.sql")
+    with open(str(path), "wb") as stream:
+        stream.write(b"-- header\n")
+        writer = BackgroundWriter(stream, buffer_size=buffer_size)
+        writer.write_lines(LINES * 100)
+        writer.close()
+    assert path.read_binary() == b"-- header\n" + EXPECTED * 100
+
+
+def test_flush():
+    stream = io.BytesIO()
+    writer = BackgroundWriter(stream)
+    writer.write_lines(["one"])
+    assert stream.getvalue() == b""
+    writer.flush()
+    assert stream.getvalue() == b"one\n"
+    writer.close()
+    writer.close()
+
+
+def test_write_error():
+    stream = mock.Mock()
+    stream.fileno.side_effect = io.UnsupportedOperation()
+    stream.writelines.side_effect = IOError("Disk full")
+    writer = BackgroundWriter(stream, buffer_size=4, buffer_count=2)
+    with pytest.raises(IOError):
+        writer.write_lines(["line"] * 100)
+        writer.flush()
+    with pytest.raises(IOError):
+        writer.close()
+
+
+@pytest.mark.parametrize("buffer_size,buffer_count", [(0, 2), (10, 1)])
+def test_invalid_arguments(buffer_size, buffer_count):
+    with pytest.raises(ValueError):
+        BackgroundWriter(io.BytesIO(), buffer_size, buffer_count)
+
+
+def test_write_lines_into_text_stream():
+    output = six.StringIO()
+    write_lines(output, LINES)
+    assert output.getvalue() == EXPECTED.decode("utf-8")
@@ -2,6 +2,7 @@
 
 from __future__ import unicode_literals
 
+import os
 import re
 
 import pymysql
@@ -36,13 +37,33 @@ def get_mysqldump_args_and_env_from_url(url):
         # This makes the `mysqldump` to attempt to limit size of a single line
         # into 10 megabytes. We use it to reduce memory consumption.
         "--net_buffer_length=10240",
+    ]
+    (connection_args, env) = get_mysql_args_and_env_from_url(url)
+    return args + connection_args, env
+
 
+def get_mysql_args_and_env_from_url(url):
+    """
+    Constructs list of command line arguments and dictionary of environment
+    variables that connect MySQL client executables, such as `mysql` or
+    `mysqldump`, into the database described in given URL.
+
+    :param url: Parsed database URL.
+    :type url: urllib.urlparse.ParseResult
+
+    :return: List of command line arguments, ending with name of the
+             database, as well as dictionary of environment variables.
+    :rtype: tuple[list[str],dict[str,str]]
+    """
+    args = [
         # Hostname of the database to connect into, should be always present in
         # the parsed database URL.
         "-h",
         url.hostname,
     ]
-    env = {}
+    # The environment of the client is otherwise left empty, but it should
+    # be looked up from the same PATH as other executables.
+    env = {"PATH": os.environ.get("PATH", os.defpath)}
 
     if url.port is not None:
         args.extend(("-P", six.text_type(url.port)))
@@ -61,6 +82,38 @@ def get_mysqldump_args_and_env_from_url(url):
     return args, env
 
 
+def connect(url):
+    """
+    Opens connection into the MySQL database described in given URL.
+
+    :param url: Parsed database URL.
+    :type url: urllib.urlparse.ParseResult
+
+    :rtype: pymysql.connections.Connection
+    """
+    if len(url.path) < 2 or not url.path.startswith("/"):
+        raise ValueError("Name of the database is missing from the URL")
+
+    return pymysql.connect(
+        host=url.hostname,
+        port=url.port or 3306,
+        user=url.username,
+        password=url.password or "",
+        database=url.path[1:],
+        charset="utf8mb4",
+    )
+
+
+def quote_identifier(name):
+    """
+    Quotes given name to be used as an identifier in SQL.
+
+    :type name: str
+    :rtype: str
+    """
+    return "`%s`" % (name.replace("`", "``"),)
+
+
 MYSQL_NULL_PATTERN = re.compile(r"^NULL$", re.IGNORECASE)
 MYSQL_BOOLEAN_PATTERN = re.compile(r"^(TRUE|FALSE)$", re.IGNORECASE)
 MYSQL_FLOAT_PATTERN = re.compile(r"^[+-]?\d*\.\d+([eE][+-]?\d+)?$")
@@ -159,3 +212,46 @@ def encode_mysql_literal(value):
     :rtype: str
     """
     return pymysql.converters.escape_item(value, "utf-8")
+
+
+#: Escape sequences of the characters which cannot appear as such in data
+#: files read with `LOAD DATA` using its default field and line separators.
+LOAD_DATA_ESCAPE_MAP = {
+    ord("\\"): "\\\\",
+    ord("\t"): "\\t",
+    ord("\n"): "\\n",
+    ord("\r"): "\\r",
+    ord("\0"): "\\0",
+}
+
+#: Representation of NULL value in data files read with `LOAD DATA`.
+LOAD_DATA_NULL_VALUE = "\\N"
+
+MYSQL_NUMBER_PATTERN = re.compile(r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$")
+
+
+def encode_load_data_literal(text):
+    """
+    Converts given MySQL literal into a field of a data file read with
+    `LOAD DATA`. Numbers are passed through as they are, so that decimal
+    values keep their precision.
+
+    :param text: MySQL literal, as found in `INSERT INTO` statements.
+    :type text: str
+
+    :rtype: str
+    """
+    if MYSQL_STRING_PATTERN.match(text):
+        return decode_mysql_string_literal(text).translate(
+            LOAD_DATA_ESCAPE_MAP)
+
+    if MYSQL_NUMBER_PATTERN.match(text):
+        return text
+
+    if MYSQL_NULL_PATTERN.match(text):
+        return LOAD_DATA_NULL_VALUE
+
+    if MYSQL_BOOLEAN_PATTERN.match(text):
+        return "1" if text.lower() == "true" else "0"
+
+    raise ValueError("Unable to convert given value: %r" % (text,))
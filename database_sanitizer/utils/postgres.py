@@ -15,12 +15,16 @@ lookups faster.
 For encoding we use a string translation table `ENCODE_TRANSLATE_TABLE`,
 which maps the "forbidden" characters to escape sequences.  This is used
 with `str.translate`, which is very fast way to escape characters.
+
+There are also helpers for querying the database catalog with `psql`.
 """
 
 from __future__ import unicode_literals
 
 import itertools
+import os
 import re
+import subprocess
 
 import six
 
@@ -143,3 +147,92 @@ def _generate_decode_map():
 
 
 DECODE_MAP = _generate_decode_map()
+
+
+#: Separators used in `psql` output of catalog queries. These are unlikely
+#: to appear in names of database objects.
+PSQL_FIELD_SEPARATOR = "\x1f"
+PSQL_RECORD_SEPARATOR = "\x1e"
+
+
+def get_psql_args(url):
+    """
+    Constructs list of command line arguments for `psql` to connect into the
+    database described in given URL and to output query results without
+    any decoration.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :rtype: list[str]
+    """
+    return [
+        "psql",
+        "--no-psqlrc",
+        "--quiet",
+        "--no-align",
+        "--tuples-only",
+        "--set=ON_ERROR_STOP=1",
+        "--dbname",
+        url.geturl().replace("postgis://", "postgresql://"),
+    ]
+
+
+def get_psql_env():
+    """
+    Constructs environment variables for `psql`, so that it exchanges data
+    in UTF-8 regardless of the locale and the encoding of the database.
+
+    :rtype: dict[str,str]
+    """
+    env = dict(os.environ)
+    env["PGCLIENTENCODING"] = "UTF8"
+    return env
+
+
+def run_psql_query(url, sql):
+    """
+    Executes given SQL query with `psql` and returns the resulting rows.
+
+    :param url: Parsed database URL.
+    :type url: six.moves.urllib.parse.ParseResult
+
+    :param sql: The query to execute.
+    :type sql: str
+
+    :return: Rows returned by the query, with values as text. NULL values
+             are returned as empty strings.
+    :rtype: list[tuple[str]]
+    """
+    output = subprocess.check_output(get_psql_args(url) + [
+        "--field-separator=" + PSQL_FIELD_SEPARATOR,
+        "--record-separator=" + PSQL_RECORD_SEPARATOR,
+        "--command",
+        sql,
+    ], env=get_psql_env())
+    text = output.decode("utf-8").rstrip("\n")
+    return [
+        tuple(record.split(PSQL_FIELD_SEPARATOR))
+        for record in text.split(PSQL_RECORD_SEPARATOR)
+        if record
+    ]
+
+
+def quote_identifier(name):
+    """
+    Quotes given name to be used as an identifier in SQL.
+
+    :type name: str
+    :rtype: str
+    """
+    return '"%s"' % (name.replace('"', '""'),)
+
+
+def quote_literal(value):
+    """
+    Quotes given value to be used as string literal in SQL.
+
+    :type value: str
+    :rtype: str
+    """
+    return "'%s'" % (value.replace("'", "''"),)
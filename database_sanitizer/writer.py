@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Writer which encodes the sanitized dump into large preallocated buffers
+and writes full buffers into the output in a background thread.
+
+Sanitation can continue filling the next buffer while the previous one is
+being written, so a stalling output disk or pipe does not block it until
+all the buffers are full. Lines which do not fit into a buffer are written
+together with the preceding buffer with a single `os.writev` call where
+available.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import threading
+
+from six.moves import queue
+
+#: Default size of a single buffer in bytes.
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+#: Default number of buffers. With three buffers one can be filled while
+#: one is being written and one is waiting to be written.
+DEFAULT_BUFFER_COUNT = 3
+
+NEWLINE = ord("\n")
+
+
+class BackgroundWriter(object):
+    """
+    Writes text into a binary stream in a background thread, encoded in
+    UTF-8.
+    """
+    def __init__(
+        self,
+        stream,
+        buffer_size=DEFAULT_BUFFER_SIZE,
+        buffer_count=DEFAULT_BUFFER_COUNT,
+    ):
+        """
+        :param stream: Binary stream to write into. The writer takes over
+                       the stream, so it should not be written into
+                       directly until the writer has been closed.
+        :type stream: file
+
+        :param buffer_size: Size of a single buffer in bytes.
+        :type buffer_size: int
+
+        :param buffer_count: Number of buffers, at least two.
+        :type buffer_count: int
+        """
+        if buffer_size < 1:
+            raise ValueError("Buffer size must be positive")
+        if buffer_count < 2:
+            raise ValueError("At least two buffers are required")
+
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.free_buffers = queue.Queue()
+        self.full_buffers = queue.Queue()
+        for _ in range(buffer_count):
+            self.free_buffers.put(bytearray(buffer_size))
+        self.buffer = self.free_buffers.get()
+        self.position = 0
+        self.error = None
+        self.closed = False
+
+        # Anything buffered by the stream itself must be written before the
+        # file descriptor is written into directly.
+        self.stream.flush()
+        self.fileno = _get_fileno(stream)
+
+        self.thread = threading.Thread(
+            target=self._run,
+            name="database-sanitizer-writer",
+        )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, text):
+        """
+        Writes given text.
+
+        :type text: str
+        """
+        self._append(text.encode("utf-8"))
+
+    def write_lines(self, lines):
+        """
+        Writes given lines, appending a new line after each of them.
+
+        :type lines: collections.Iterable[str]
+        """
+        for line in lines:
+            data = line.encode("utf-8")
+            end = self.position + len(data)
+            if end < self.buffer_size:
+                self.buffer[self.position:end] = data
+                self.buffer[end] = NEWLINE
+                self.position = end + 1
+            else:
+                self._append(data)
+                self._append(b"\n")
+
+    def _append(self, data):
+        length = len(data)
+        end = self.position + length
+        if end <= self.buffer_size:
+            self.buffer[self.position:end] = data
+            self.position = end
+        elif length >= self.buffer_size:
+            # Copying large data would not save any system calls, so it
+            # is written along with the current buffer.
+            self._submit(extra=data)
+        else:
+            self._submit()
+            self.buffer[:length] = data
+            self.position = length
+
+    def _submit(self, extra=None):
+        """
+        Hands the current buffer over to the writer thread and takes a free
+        buffer, waiting for one if all of them are waiting to be written.
+        """
+        self._check_error()
+        if self.position or extra:
+            self.full_buffers.put((self.buffer, self.position, extra))
+            self.buffer = self.free_buffers.get()
+            self.position = 0
+
+    def _check_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def flush(self):
+        """
+        Waits until everything written so far has been written into the
+        stream.
+        """
+        self._submit()
+        self.full_buffers.join()
+        self._check_error()
+        self.stream.flush()
+
+    def close(self):
+        """
+        Flushes the written data and stops the writer thread. The stream is
+        left open.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.flush()
+        finally:
+            self.full_buffers.put(None)
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            item = self.full_buffers.get()
+            try:
+                if item is None:
+                    return
+                (buffer, length, extra) = item
+                segments = [memoryview(buffer)[:length]]
+                if extra:
+                    segments.append(memoryview(extra))
+                if self.error is None:
+                    try:
+                        self._write_segments(segments)
+                    except Exception as error:
+                        # Reported to the main thread, which then stops
+                        # writing. Later buffers are just recycled.
+                        self.error = error
+                self.free_buffers.put(buffer)
+            finally:
+                self.full_buffers.task_done()
+
+    def _write_segments(self, segments):
+        if self.fileno is None or not hasattr(os, "writev"):
+            self.stream.writelines(segments)
+            return
+        while segments:
+            written = os.writev(self.fileno, segments)
+            while segments and written >= len(segments[0]):
+                written -= len(segments[0])
+                segments.pop(0)
+            if segments and written:
+                segments[0] = segments[0][written:]
+
+
+def _get_fileno(stream):
+    try:
+        fileno = stream.fileno()
+    except Exception:
+        return None
+    return fileno if isinstance(fileno, int) else None
+
+
+def write_lines(output, lines):
+    """
+    Writes given lines into given output, appending a new line after each
+    of them.
+
+    :param output: Text stream, or an object writing lines on its own such
+                   as a `BackgroundWriter`.
+    :type output: file|BackgroundWriter|
+                  database_sanitizer.loader.PostgresLoader
+
+    :type lines: collections.Iterable[str]
+    """
+    if hasattr(output, "write_lines"):
+        output.write_lines(lines)
+        return
+    for line in lines:
+        output.write(line + "\n")